@@ -80,6 +80,8 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # خيوط السلاسل تكتب بالتوازي: المعاملة تحجز الكتابة من بدايتها وتنتظر القفل بدل SQLITE_BUSY الفوري
+        'OPTIONS': {'timeout': 20, 'transaction_mode': 'IMMEDIATE'},
     }
 }
 
@@ -145,3 +147,189 @@ CORS_ALLOWED_ORIGINS = [
 
 CORS_ALLOW_ALL_ORIGINS = True  # للتطوير فقط، قم بتعطيله في الإنتاج
 
+
+
+# إعدادات خط معالجة التوصيات (صورة ← Lens ← تنسيق)
+# الحد الأقصى لعدد الخيوط المشتركة في العملية الواحدة
+AI_PIPELINE_MAX_WORKERS = 16
+# الحد الأقصى للاستدعاءات المتزامنة لكل مرحلة
+AI_PIPELINE_STAGE_LIMITS = {
+    "image": 4,
+    "lens": 6,
+    "format": 4,
+}
+
+# طابور مهام توليد التوصيات (قاعدة البيانات هي الطابور، بدون وسيط خارجي)
+# عدد خيوط العمال داخل كل عملية ويب؛ اجعلها 0 عند تشغيل: python manage.py run_recommendation_workers
+RECOMMENDATION_JOB_LOCAL_WORKERS = 2
+RECOMMENDATION_JOB_POLL_INTERVAL = 1.0
+# مهمة قيد التنفيذ بلا نبض (تقدم) لهذه المدة بالثواني تعتبر متروكة (توقف عاملها) ويعاد جدولتها
+RECOMMENDATION_JOB_STALE_AFTER = 5 * 60
+# بعد هذا العدد من المحاولات تفشل المهمة بدلاً من إعادة جدولتها (مهمة توقف كل عامل يحاولها)
+RECOMMENDATION_JOB_MAX_ATTEMPTS = 3
+
+# التخزين المؤقت
+# "recommendations" مشترك بين عمليات gunicorn على نفس الجهاز (ملفات)؛ يمكن استبداله بـ
+# django.core.cache.backends.db.DatabaseCache (بعد: python manage.py createcachetable)
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "recommendations": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": BASE_DIR / "cache" / "recommendations",
+        "TIMEOUT": 60 * 60,
+        "OPTIONS": {"MAX_ENTRIES": 20000},
+    },
+}
+
+RECOMMENDATIONS_CACHE = {
+    "LOCAL_MAXSIZE": 1024,  # عدد الصفحات في الذاكرة المحلية لكل عملية
+    "LOCAL_TTL": 60,        # بالثواني، أقصر من TTL حتى لا تحتفظ كل عملية بالصفحات طويلًا
+    "SHARED_ALIAS": "recommendations",
+    "TTL": 60 * 60,
+}
+
+# سجل التوصيات الدائم في قاعدة البيانات (users/feed.py)
+RECOMMENDATION_FEED = {
+    "FRESH_FOR": 60 * 60,       # بعدها يولد POST توصيات جديدة؛ القراءة تعيد آخر تشغيل مهما كان قديمًا
+    "MAX_RUNS_PER_USER": 50,    # لكل مستخدم ونوع (توصيات / بحث متقدم)
+}
+
+# دمج الطلبات المتطابقة المتزامنة؛ القفل والنتيجة يُحفظان في المخزن المشترك
+RECOMMENDATIONS_SINGLE_FLIGHT = {
+    "SHARED_ALIAS": "recommendations",
+    "LOCK_TTL": 10 * 60,   # أقصى مدة متوقعة لخط المعالجة
+    "RESULT_TTL": 60,
+    "POLL_INTERVAL": 0.5,
+}
+
+# مخزن الصور المولدة المعنون ببصمة الوصف (MEDIA_ROOT/generated_images/<xx>/<digest>_<n>.jpg)
+GENERATED_IMAGE_STORE = {
+    "MODEL": "gemini-1.5-flash-image",
+    "VARIANTS": 3,          # أقصى عدد نسخ محفوظة لكل وصف
+    "MAX_PROMPTS": 5000,    # عند تجاوزه تحذف الأوصاف الأقدم استخدامًا (LRU)
+    "MAX_AGE_DAYS": 30,     # تحذف الأوصاف التي لم تستخدم منذ هذه المدة
+    "EVICT_INTERVAL": 300,  # أقل فاصل (بالثواني) بين عمليتي فحص للإخلاء في كل عملية
+    "CANDIDATES": False,    # النموذج يدعم candidate_count: كل نسخ الوصف في استدعاء واحد
+    "PARALLEL_CALLS": 8,    # وإلا تُطلب النسخ باستدعاءات متوازية بهذا الحد لكل عملية
+    "WRITER_THREADS": 2,    # خيوط حفظ الصور على القرص خلف الطلب
+    "MAX_BYTES": 5 * 1024 ** 3,  # عند تجاوزه تحذف الأوصاف الأقدم استخدامًا (None بلا حد)
+    "PROTECT_SECONDS": 60 * 60,  # لا يُحذف ما استُخدم خلالها (لا تقل عن RECOMMENDATION_CURSOR_STATE_TTL)
+}
+
+# تقديم ملفات MEDIA_ROOT (users/media.py)
+MEDIA_SERVING = {
+    "GENERATED_MAX_AGE": 30 * 24 * 60 * 60,  # Cache-Control للصور المولدة
+    "ACCEL_REDIRECT": None,                  # مثل "/protected-media/" ليرسل nginx الملفات بنفسه
+}
+
+# ذاكرة نتائج Google Lens الدائمة (حسب بصمة محتوى الصورة + hl/gl)
+LENS_RESULT_CACHE = {
+    "TTL": 7 * 24 * 60 * 60,
+    "STALE_WHILE_REVALIDATE": True,  # إعادة النتيجة القديمة فورًا وتحديثها في الخلفية
+    "STALE_TTL": 7 * 24 * 60 * 60,
+}
+
+# إعادة استخدام نتائج Lens للصور المولدة شبه المتطابقة (users/near_duplicates.py)
+NEAR_DUPLICATE_LENS = {
+    "ENABLED": True,
+    "MAX_DISTANCE": 4,          # أقصى مسافة Hamming بين بصمتي dHash (من 64 بت)
+    "MAX_COLOR_DISTANCE": 30,   # أقصى فرق بين متوسطي لون وسط الصورتين (RGB)
+    "CANDIDATES": 5,
+    "REFRESH_INTERVAL": 10,     # بالثواني، لالتقاط ما أضافته العمليات الأخرى
+}
+
+# تنسيق المنشورات المجمع: ميزانية الرموز لقائمة المنتجات في كل استدعاء وأقصى عدد استدعاءات لكل طلب
+AI_FORMAT_TOKEN_BUDGET = 6000
+AI_FORMAT_MAX_CALLS = 3
+
+# الحد الصارم للرموز المقدرة في كل وصف يُرسل إلى Gemini (users/prompts.py)؛ ما يتجاوزه يُقتطع
+# من آخر قائمة المنتجات ثم من النص الطويل
+PROMPT_BUDGET = {
+    "ANALYSIS": 1500,
+    "ADVANCED_ANALYSIS": 1800,
+    "FORMAT": 7000,
+    "MAX_TITLE_CHARS": 120,
+    "RECENT_CALLS": 50,     # آخر الاستدعاءات المعروضة في api/stats/
+}
+
+# فهرس المنتجات المحلي للبحث المتقدم (users/product_index.py): إذا طابق الفلاتر MIN_CANDIDATES
+# منتجًا على الأقل تُنسق مباشرة دون توليد صور ولا استدعاء Lens
+PRODUCT_INDEX = {
+    "ENABLED": True,
+    "MIN_CANDIDATES": 10,
+    "MAX_AGE": 30 * 24 * 60 * 60,   # المنتجات التي لم تظهر في Lens منذ هذه المدة لا تُقدم
+    "SCAN_LIMIT": 500,
+}
+
+# دمج نتائج Lens من كل الصور وترتيبها قبل التنسيق (users/ranking.py)
+PRODUCT_RANKING = {
+    "TOP_N": 20,                # أقصى عدد منتجات يمر إلى التنسيق في كل طلب
+    "MATCH_WEIGHT": 1.0,        # لكل صورة مولدة ظهر فيها المنتج
+    "BUDGET_WEIGHT": 1.5,       # ملاءمة السعر لميزانية المستخدم (0 إلى 1)
+    "PRICE_KNOWN_WEIGHT": 0.25, # مكافأة المنتجات ذات السعر المفهوم
+}
+
+# توليد الصفحات عند الطلب (api/recommendations/cursor/)
+RECOMMENDATION_CURSOR_CHAINS_PER_ROUND = 3   # سلاسل (صورة ← Lens) تُنفذ بالتوازي في كل جولة
+RECOMMENDATION_CURSOR_STATE_TTL = 60 * 60    # مدة الاحتفاظ بحالة التوليد بين الصفحات
+
+# ذاكرة تحليل Gemini المشتركة بين المستخدمين ذوي البيانات المتقاربة (users/analysis_cache.py)
+ANALYSIS_CACHE = {
+    "ENABLED": True,
+    "TTL": 7 * 24 * 60 * 60,
+    "VARIANTS": 3,          # عدد النسخ المختلفة لكل مجموعة، تُقدم بالتناوب
+    "HEIGHT_BUCKET_CM": 5,
+    "WEIGHT_BUCKET_KG": 5,
+}
+
+# ميزانية زمنية لكل طلب توصيات (users/deadlines.py). عند انتهائها يعود ما اكتمل مع partial: true
+REQUEST_DEADLINE = {
+    "BUDGET": 25,           # بالثواني، أقل من مهلة عامل gunicorn
+    "FORMAT_RESERVE": 6,    # ثوانٍ محجوزة للتنسيق من نهاية الميزانية
+    "STAGE_TIMEOUTS": {     # أقصى مدة لاستدعاء مزود واحد في كل مرحلة
+        "analysis": 10,
+        "image": 15,
+        "lens": 12,
+        "format": 10,
+    },
+}
+
+# محدد المعدل المشترك بين العمال لاستدعاءات Gemini و SerpApi (users/rate_limits.py)
+PROVIDER_RATE_LIMITS = {
+    "ENABLED": True,
+    "PATH": BASE_DIR / "cache" / "rate_limits.sqlite3",
+    "MAX_WAIT": 30,         # أقصى انتظار للدور بالثواني (ولا يتجاوز موعد الطلب)
+    "MAX_RETRIES": 2,       # إعادة المحاولة بعد 429
+    "DEFAULT_BACKOFF": 2,   # بالثواني عند غياب Retry-After، ويتضاعف مع كل محاولة
+    "PROVIDERS": {
+        # RATE استدعاء في الثانية حتى BURST، و CONCURRENCY استدعاءات متزامنة لكل العمال.
+        # طلب توصيات كامل = تحليل + 9 صور (3 أوصاف × 3 نسخ بدون CANDIDATES) + 9 بحث Lens + حتى 3 تنسيق،
+        # لذلك BURST لكل مستخدم يتسع لطلب كامل دون انتظار، و PER_USER_RATE يحد الطلبات المتتالية فقط.
+        # اضبط RATE و BURST على حصص حسابك الفعلية لدى Google و SerpApi.
+        "gemini": {"RATE": 2.0, "BURST": 10, "CONCURRENCY": 8, "PER_USER_RATE": 1.0, "PER_USER_BURST": 6},
+        "gemini_image": {"RATE": 0.5, "BURST": 9, "CONCURRENCY": 4, "PER_USER_RATE": 0.25, "PER_USER_BURST": 9},
+        "serpapi": {"RATE": 1.0, "BURST": 9, "CONCURRENCY": 6, "PER_USER_RATE": 0.5, "PER_USER_BURST": 9},
+    },
+}
+
+# مقاييس Prometheus لخط المعالجة (api/metrics/)؛ كل عامل يحفظ لقطة مقاييسه في DIR
+PIPELINE_METRICS = {
+    "ENABLED": True,
+    "DIR": BASE_DIR / "cache" / "metrics",
+    "FLUSH_INTERVAL": 5,    # بالثواني، أقصى تأخر لظهور مقاييس عامل في الواجهة
+    "PRUNE_INTERVAL": 300,  # بالثواني، ضم لقطات العمال المتوقفين إلى archive.json
+}
+
+# بدائل محلية لـ Gemini و SerpApi لقياس الأداء (users/fake_providers.py، أمر bench_pipeline).
+# تُفعل هنا أو بمتغير البيئة FASHION_FAKE_PROVIDERS=1؛ لا تُفعل في الإنتاج
+FAKE_PROVIDERS = {
+    "ENABLED": False,
+    "LATENCY": {"gemini": 1.5, "gemini_image": 4.0, "serpapi": 2.0},  # بالثواني لكل استدعاء
+    "JITTER": 0.25,         # تذبذب الزمن كنسبة منه
+    "ERROR_RATE": 0.0,      # نسبة الاستدعاءات التي تفشل
+    "THROTTLE_RATE": 0.0,   # نسبة الاستدعاءات التي ترد بـ 429
+    "SHOPPING_RESULTS": 20, # عدد نتائج Lens لكل صورة
+    "IMAGE_SIZE": 512,      # أبعاد الصورة المولدة بالبكسل
+}
@@ -14,16 +14,32 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
+from urllib.parse import urlsplit
+
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
 from django.conf.urls.static import static
 
+from users.image_store import GENERATED_IMAGES_DIR
+from users.media import serve_media
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('users.urls')),
 ]
 
+# الصور المولدة يجب أن تبقى متاحة لـ SerpApi في الإنتاج أيضًا، وليس مع DEBUG فقط (انظر users/media.py).
+# بقية MEDIA_ROOT (مثل صور الملف الشخصي) لا تُقدم إلا مع DEBUG كما كانت.
+if not urlsplit(settings.MEDIA_URL).netloc:
+    urlpatterns += [
+        re_path(
+            r"^%s(?P<path>%s/.*)$" % (re.escape(settings.MEDIA_URL.lstrip("/")), re.escape(GENERATED_IMAGES_DIR)),
+            serve_media,
+        ),
+    ]
+
 if settings.DEBUG:
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 
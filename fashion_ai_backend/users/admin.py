@@ -1,15 +1,40 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import CustomUser
+from .models import CustomUser, RecommendationJob, LensResultCache, AnalysisCacheEntry, IndexedProduct
 
 class CustomUserAdmin(UserAdmin):
     model = CustomUser
     fieldsets = UserAdmin.fieldsets + ( 
         (None, {"fields": ("height", "weight", "skin_color", "profile_picture")}),
+        ("Profile picture analysis", {"fields": ("picture_analysis", "picture_digest", "picture_analyzed_at")}),
     )
+    readonly_fields = ("picture_analysis", "picture_digest", "picture_analyzed_at")
     add_fieldsets = UserAdmin.add_fieldsets + (
         (None, {"fields": ("height", "weight", "skin_color", "profile_picture")}),
     )
 
 admin.site.register(CustomUser, CustomUserAdmin)
 
+
+class RecommendationJobAdmin(admin.ModelAdmin):
+    list_display = ("id", "user", "status", "completed_chains", "total_chains", "created_at", "finished_at")
+    list_filter = ("status",)
+
+admin.site.register(RecommendationJob, RecommendationJobAdmin)
+
+class LensResultCacheAdmin(admin.ModelAdmin):
+    list_display = ("image_digest", "hl", "gl", "fetched_at")
+
+admin.site.register(LensResultCache, LensResultCacheAdmin)
+
+class AnalysisCacheEntryAdmin(admin.ModelAdmin):
+    list_display = ("bucket_key", "kind", "variant", "served", "created_at")
+    list_filter = ("kind",)
+
+admin.site.register(AnalysisCacheEntry, AnalysisCacheEntryAdmin)
+
+class IndexedProductAdmin(admin.ModelAdmin):
+    list_display = ("product_key", "garment", "color", "fabric", "price", "source", "seen_count", "last_seen_at")
+    list_filter = ("garment", "color")
+
+admin.site.register(IndexedProduct, IndexedProductAdmin)
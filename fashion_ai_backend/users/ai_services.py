@@ -1,150 +1,361 @@
 
-import google.generativeai as genai
 import os
 import json
-import cv2
-import numpy as np
-from serpapi import GoogleSearch
-import requests
-from django.conf import settings
-import uuid
+import threading
 import base64
-
-# قراءة مفاتيح Gemini و SerpApi من متغيرات البيئة (بدلاً من قيم صريحة)
-GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
-SERPAPI_API_KEY = os.environ.get("SERPAPI_API_KEY")
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from google.api_core import exceptions as google_exceptions
+
+from .cache import build_recommendation_cache
+from .image_store import build_image_store
+from . import lens_cache, analysis_cache, deadlines, metrics, prompts, rate_limits
+from .deadlines import DeadlineExceeded, stage_timeout
+from .providers import (
+    SERPAPI_API_KEY,
+    agemini_model,
+    aserpapi_search,
+    gemini_model,
+    serpapi_search,
+)
+
+# مخزن الصور المولدة المعنون ببصمة الوصف (مشترك بين العمال وبين مرات التشغيل)
+generated_image_store = build_image_store()
 
 # مفاتيح Banana.dev يتم قراءتها من متغيرات البيئة
 BANANA_API_KEY = os.environ.get("BANANA_API_KEY")
 BANANA_MODEL_KEY = os.environ.get("BANANA_MODEL_KEY")
 
-# تهيئة Gemini إن كان المفتاح متوفرًا
-if GEMINI_API_KEY:
+def _clean_json_text(response):
+    return response.text.replace("```json", "").replace("```", "").strip()
+
+def _checked_analysis_text(response):
+    text = _clean_json_text(response)
     try:
-        genai.configure(api_key=GEMINI_API_KEY)
-    except Exception as e:
-        print(f"خطأ في تهيئة Gemini: {e}")
-else:
-    print("تحذير: لم يتم العثور على GEMINI_API_KEY في البيئة.")
+        json.loads(text)
+    except json.JSONDecodeError:
+        metrics.fallback("analysis_json")
+    return text
+
+def _generate_analysis(prompt_text):
+    model = gemini_model("gemini-1.5-flash")
+    with metrics.timed("analysis"):
+        response = rate_limits.call(
+            "gemini", lambda: model.generate_content(prompt_text, request_options={"timeout": stage_timeout("analysis")})
+        )
+    return _checked_analysis_text(response)
+
+async def _agenerate_analysis(prompt_text):
+    model = agemini_model("gemini-1.5-flash")
+    with metrics.timed("analysis"):
+        response = await rate_limits.acall(
+            "gemini",
+            lambda: model.generate_content_async(prompt_text, request_options={"timeout": stage_timeout("analysis")}),
+        )
+    return _checked_analysis_text(response)
 
 def analyze_user_and_generate_prompts(user, location_info):
     """
     يحلل بيانات المستخدم وصورته الشخصية لتوليد أوصاف (prompts) دقيقة للملابس.
+    النتيجة مشتركة بين المستخدمين ذوي البيانات المتقاربة (انظر analysis_cache.py).
     """
-    model = genai.GenerativeModel(model_name="gemini-1.5-flash")
-
-    analysis_prompt = f"""
-    تحليل شامل للمستخدم لتقديم توصيات أزياء:
-
-    **بيانات المستخدم:**
-    - الطول: {user.height} سم
-    - الوزن: {user.weight} كجم
-    - لون البشرة: {user.skin_color}
-    - الموقع الجغرافي: {location_info}
+    bucket = analysis_cache.profile_bucket(user, location_info)
+    key = analysis_cache.bucket_key("basic", bucket)
+    cached = analysis_cache.lookup(key)
+    if cached:
+        return cached
 
-    **المهمة:**
-    1.  بناءً على بيانات المستخدم، قم بتحليل نوع الجسم (نحيف، متوسط، رياضي، ممتلئ) ونظرية الألوان المناسبة للون بشرته.
-    2.  مع الأخذ في الاعتبار الموقع الجغرافي (الذي قد يؤثر على الطقس والثقافة)، اقترح 3 أنماط أزياء مختلفة قد تناسب هذا المستخدم (مثال: كلاسيكي، عصري، رياضي، بوهيمي).
-    3.  لكل نمط مقترح، قم بإنشاء وصف نصي دقيق ومفصل (prompt) لتوليد صورة لقطعة ملابس واحدة (بدون عارض أزياء) تمثل هذا النمط. يجب أن يكون الوصف جاهزًا للاستخدام في نموذج توليد الصور.
-
-    **شروط وصف الصورة (Prompt):**
-    - يجب أن يصف قطعة الملابس فقط (مثال: "قميص"، "بنطال"، "فستان").
-    - يجب أن تكون الخلفية بسيطة ومحايدة (مثال: "خلفية استوديو رمادية فاتحة").
-    - يجب أن تكون الصورة واقعية (photorealistic).
-    - يجب تحديد ألوان وأنواع أقمشة دقيقة.
-    - يجب أن تولد 3 أوصاف مختلفة لقطع ملابس مختلفة.
+    try:
+        response_text = _generate_analysis(prompts.analysis_prompt(analysis_cache.bucket_profile(bucket), location_info))
+    except Exception as e:
+        print(f"خطأ في تحليل استجابة Gemini: {e}")
+        return None
+    analysis_cache.store(key, "basic", bucket, response_text)
+    return response_text
 
-    **مثال على المخرجات المطلوبة (بتنسيق JSON):**
-    {{
-        "analysis": "المستخدم لديه بنية جسم متوسطة ويميل الطول. الألوان الدافئة مثل البيج والزيتي تناسب لون بشرته. موقعه في الرياض يقترح الحاجة لملابس صيفية خفيفة.",
-        "prompts": [
-            "صورة واقعية لبنطال تشينو رجالي بلون بيج، بقصة مستقيمة، مصنوع من القطن الخفيف، معروض على خلفية استوديو رمادية فاتحة.",
-            "صورة واقعية لقميص بولو أبيض اللون، بقصة ضيقة (slim-fit)، مصنوع من قماش البيكيه، معروض على خلفية استوديو رمادية فاتحة.",
-            "صورة واقعية لجاكيت خفيف (bomber jacket) بلون زيتي، مصنوع من النايلون، معروض على خلفية استوديو رمادية فاتحة."
-        ]
-    }}
+async def aanalyze_user_and_generate_prompts(user, location_info):
     """
-
-    response = model.generate_content(analysis_prompt)
+    النسخة غير المتزامنة من analyze_user_and_generate_prompts.
+    """
+    bucket = analysis_cache.profile_bucket(user, location_info)
+    key = analysis_cache.bucket_key("basic", bucket)
+    cached = await sync_to_async(analysis_cache.lookup)(key)
+    if cached:
+        return cached
 
     try:
-        cleaned_response = response.text.replace("```json", "").replace("```", "").strip()
-        return cleaned_response
+        response_text = await _agenerate_analysis(prompts.analysis_prompt(analysis_cache.bucket_profile(bucket), location_info))
     except Exception as e:
         print(f"خطأ في تحليل استجابة Gemini: {e}")
         return None
+    await sync_to_async(analysis_cache.store)(key, "basic", bucket, response_text)
+    return response_text
+
+def _public_media_url(request, relative_path):
+    return request.build_absolute_uri(settings.MEDIA_URL + relative_path.replace(os.sep, "/"))
+
+def _save_dummy_image(prompt, request):
+    print("فشل توليد الصورة، سيتم استخدام صورة بديلة.")
+    metrics.fallback("dummy_image")
+    # صورة بديلة واحدة مشتركة خارج مجلدات البصمات، حتى لا تُعاد بدلاً من صورة حقيقية لاحقًا
+    return [_public_media_url(request, generated_image_store.placeholder())] # إرجاع قائمة حتى لو كانت صورة واحدة
+
+def _stored_image_urls(request, relative_paths):
+    # الترتيب حسب رقم النسخة حتى تكون النتائج ثابتة
+    return [_public_media_url(request, path) for path in sorted(relative_paths)]
+
+_image_options = getattr(settings, "GENERATED_IMAGE_STORE", {})
+# النموذج يقبل candidate_count ويعيد عدة صور في استدعاء واحد؛ يُعطل تلقائيًا إذا رفضه
+_image_candidates_supported = _image_options.get("CANDIDATES", False)
+IMAGE_PARALLEL_CALLS = _image_options.get("PARALLEL_CALLS", 8)
+
+_image_call_executor = None
+_image_call_pid = None
+_image_call_lock = threading.Lock()
+
+def _image_executor():
+    global _image_call_executor, _image_call_pid
+    with _image_call_lock:
+        if _image_call_executor is None or _image_call_pid != os.getpid():
+            _image_call_executor = ThreadPoolExecutor(max_workers=IMAGE_PARALLEL_CALLS, thread_name_prefix="image-call")
+            _image_call_pid = os.getpid()
+        return _image_call_executor
+
+def _image_request_kwargs(candidates):
+    kwargs = {"request_options": {"timeout": stage_timeout("image")}}
+    if candidates > 1:
+        kwargs["generation_config"] = {"candidate_count": candidates}
+    return kwargs
+
+def _call_image_model(image_model, prompt, candidates=1):
+    response = rate_limits.call(
+        "gemini_image", lambda: image_model.generate_content(prompt, **_image_request_kwargs(candidates))
+    )
+    return list(response.images or [])
+
+async def _acall_image_model(image_model, prompt, candidates=1):
+    response = await rate_limits.acall(
+        "gemini_image", lambda: image_model.generate_content_async(prompt, **_image_request_kwargs(candidates))
+    )
+    return list(response.images or [])
+
+def _batched_images_result(images, wanted):
+    # نموذج يتجاهل candidate_count يعيد صورة واحدة؛ لا نطلب منه عدة مرشحين بعد ذلك
+    global _image_candidates_supported
+    if len(images) <= 1 < wanted:
+        _image_candidates_supported = False
+    return images[:wanted]
+
+def _unsupported_candidates(e):
+    global _image_candidates_supported
+    _image_candidates_supported = False
+    print(f"نموذج الصور لا يدعم عدة مرشحين، سيتم التوليد باستدعاءات متوازية: {e}")
+
+def _collect_images(images, outcomes):
+    """
+    يضيف أول صورة من كل استدعاء ناجح، ويعيد آخر خطأ إن وُجد.
+    """
+    error = None
+    for outcome in outcomes:
+        if isinstance(outcome, BaseException):
+            error = outcome
+        elif outcome:
+            images.append(outcome[0])
+    return error
+
+def _generate_images(image_model, prompt, wanted):
+    """
+    يطلب wanted صورة للوصف: استدعاء واحد بعدة مرشحين إن كان النموذج يدعم ذلك، وإلا (أو
+    للنسخ الناقصة) استدعاءات متوازية. يعيد (الصور، آخر خطأ).
+    """
+    images = []
+    if wanted > 1 and _image_candidates_supported:
+        try:
+            images = _batched_images_result(_call_image_model(image_model, prompt, wanted), wanted)
+        except google_exceptions.InvalidArgument as e:
+            _unsupported_candidates(e)
+        except Exception as e:
+            return images, e
+
+    remaining = wanted - len(images)
+    if remaining <= 0:
+        return images, None
+    # استدعاء في الخيط الحالي والباقي في مجمع الصور، مع نقل الموعد ونطاق المستخدم
+    futures = [
+        deadlines.submit(_image_executor(), _call_image_model, image_model, prompt) for _ in range(remaining - 1)
+    ]
+    outcomes = []
+    try:
+        outcomes.append(_call_image_model(image_model, prompt))
+    except Exception as e:
+        outcomes.append(e)
+    for future in futures:
+        try:
+            outcomes.append(future.result())
+        except Exception as e:
+            outcomes.append(e)
+    return images, _collect_images(images, outcomes)
+
+async def _agenerate_images(image_model, prompt, wanted):
+    images = []
+    if wanted > 1 and _image_candidates_supported:
+        try:
+            images = _batched_images_result(await _acall_image_model(image_model, prompt, wanted), wanted)
+        except google_exceptions.InvalidArgument as e:
+            _unsupported_candidates(e)
+        except Exception as e:
+            return images, e
+
+    remaining = wanted - len(images)
+    if remaining <= 0:
+        return images, None
+    outcomes = await asyncio.gather(
+        *(_acall_image_model(image_model, prompt) for _ in range(remaining)), return_exceptions=True
+    )
+    return images, _collect_images(images, outcomes)
+
+def _store_generated(digest, missing, existing, images, error):
+    """
+    يجدول حفظ الصور المولدة (بأرقام النسخ الناقصة) ويعالج خطأ التوليد إن وُجد.
+    """
+    # الحفظ باسم مشتق من بصمة الوصف، في الخلفية؛ المسار صالح فورًا
+    for i, image in zip(missing, images):
+        existing.append(generated_image_store.save_variant_in_background(digest, i, image))
+    if len(images) < len(missing) and error is None:
+        print(f"لم يتم توليد {len(missing) - len(images)} من {len(missing)} صور من Gemini.")
+    if isinstance(error, DeadlineExceeded):
+        # لا فائدة من صورة بديلة إذا انتهى موعد الطلب؛ نعيد ما اكتمل فقط
+        if not existing:
+            raise error
+    elif error is not None:
+        print(f"خطأ في استدعاء Gemini لتوليد الصورة: {error}")
 
 def generate_image_from_prompt(prompt, request, count=1):
     """
-    يولد صورة فعلية للوصف النصي باستخدام Banana.dev إذا توفرت المفاتيح،
-    وإلا يعود لصورة بديلة.
+    يعيد صور الوصف من المخزن المعنون بالمحتوى، ويولد النسخ الناقصة فقط عبر Gemini
+    (معًا وليس بالتتابع)، وإلا يعود لصورة بديلة.
     """
-    print(f"توليد صورة للوصف عبر Gemini API: {prompt}")
+    digest, existing, missing = generated_image_store.lookup(prompt, count)
+    metrics.cache_result("generated_images", not missing)
+    if not missing:
+        return _stored_image_urls(request, existing)
 
-    output_dir = os.path.join(settings.MEDIA_ROOT, "generated_images")
-    os.makedirs(output_dir, exist_ok=True)
-    image_filename = f"generated_image_{abs(hash(prompt))}_{uuid.uuid4().hex[:6]}.jpg"
-    output_path = os.path.join(output_dir, image_filename)
+    print(f"توليد صورة للوصف عبر Gemini API: {prompt}")
+    with generated_image_store.lock_for(digest):
+        # ربما أكمل خيط آخر توليد نفس الوصف أثناء انتظار القفل
+        digest, existing, missing = generated_image_store.lookup(prompt, count, record=False)
+        if missing:
+            try:
+                image_model = gemini_model(generated_image_store.model_name)
+                images, error = _generate_images(image_model, prompt, len(missing))
+            except Exception as e:
+                images, error = [], e
+            _store_generated(digest, missing, existing, images, error)
+
+    generated_image_store.evict_if_needed()
+    if existing:
+        return _stored_image_urls(request, existing)
+
+    return _save_dummy_image(prompt, request)
+
+async def agenerate_image_from_prompt(prompt, request, count=1):
+    """
+    النسخة غير المتزامنة من generate_image_from_prompt.
+    """
+    digest, existing, missing = await asyncio.to_thread(generated_image_store.lookup, prompt, count)
+    metrics.cache_result("generated_images", not missing)
+    if not missing:
+        return _stored_image_urls(request, existing)
 
-    saved = False
+    print(f"توليد صورة للوصف عبر Gemini API: {prompt}")
     try:
-        # 1. استخدام Gemini API لتوليد الصورة
-        image_model = genai.GenerativeModel(model_name="gemini-1.5-flash-image")
-        
-        image_urls = []
-        
-        for i in range(count):
-            response = image_model.generate_content(prompt)
-            
-            # 2. حفظ الصورة محليًا
-            if response.images:
-                image = response.images[0]
-                
-                # إنشاء اسم ملف فريد لكل صورة
-                image_filename = f"generated_image_{abs(hash(prompt))}_{uuid.uuid4().hex[:6]}_{i}.jpg"
-                output_path = os.path.join(output_dir, image_filename)
-                
-                image.save(output_path)
-                
-                relative_path = os.path.join("generated_images", image_filename)
-                public_url = request.build_absolute_uri(settings.MEDIA_URL + relative_path)
-                image_urls.append(public_url)
-            else:
-                print(f"لم يتم توليد صورة {i+1} من Gemini.")
-
-        return image_urls
-
+        image_model = agemini_model(generated_image_store.model_name)
+        images, error = await _agenerate_images(image_model, prompt, len(missing))
     except Exception as e:
-        print(f"خطأ في استدعاء Gemini لتوليد الصورة: {e}")
+        images, error = [], e
+    _store_generated(digest, missing, existing, images, error)
+
+    await asyncio.to_thread(generated_image_store.evict_if_needed)
+    if existing:
+        return _stored_image_urls(request, existing)
+
+    return await asyncio.to_thread(_save_dummy_image, prompt, request)
 
-    # 3. إذا فشل التوليد، نستخدم صورة بديلة (Dummy Image)
-    if not saved:
-        print("فشل توليد الصورة، سيتم استخدام صورة بديلة.")
-        dummy_image = np.zeros((512, 512, 3), dtype=np.uint8)
-        dummy_image.fill(200)
-        cv2.imwrite(output_path, dummy_image)
+LENS_HL = "ar"
+LENS_GL = "us"
 
-    # 4. بناء وإرجاع الرابط العام
-    relative_path = os.path.join("generated_images", image_filename)
-    public_url = request.build_absolute_uri(settings.MEDIA_URL + relative_path)
-    return [public_url] # إرجاع قائمة حتى لو كانت صورة واحدة
+def _fetch_lens_results(image_url):
+    results, status_code = rate_limits.call(
+        "serpapi", lambda: serpapi_search(_lens_params(image_url), stage_timeout("lens"))
+    )
+    # لا نخزن استجابات الأخطاء (مثل تجاوز الحصة) في الذاكرة الدائمة
+    return _parse_shopping_results(results), status_code == 200 and "error" not in results
+
+async def _afetch_lens_results(image_url):
+    results, status_code = await rate_limits.acall(
+        "serpapi", lambda: aserpapi_search(_lens_params(image_url), stage_timeout("lens"))
+    )
+    return _parse_shopping_results(results), status_code == 200 and "error" not in results
 
 def search_products_by_image(image_url, user_location):
     """
-    يبحث عن منتجات مشابهة بصريًا باستخدام SerpApi Google Lens API.
+    يبحث عن منتجات مشابهة بصريًا باستخدام SerpApi Google Lens API،
+    مع ذاكرة دائمة حسب بصمة محتوى الصورة، ثم حسب الصور شبه المتطابقة.
     """
+    image_digest = lens_cache.image_digest_for_url(image_url)
+    state, cached_results = lens_cache.lookup(image_digest, LENS_HL, LENS_GL)
+    if state == lens_cache.FRESH:
+        return cached_results
+    if state == lens_cache.STALE:
+        lens_cache.refresh_in_background(image_digest, LENS_HL, LENS_GL, lambda: _fetch_lens_results(image_url))
+        return cached_results
+
+    signature = lens_cache.perceptual_signature(image_url)
+    similar_results = lens_cache.lookup_similar(image_digest, LENS_HL, LENS_GL, signature)
+    if similar_results is not None:
+        return similar_results
+
     print(f"البحث عن منتجات مشابهة للصورة: {image_url} في {user_location}")
-    params = {
+    shopping_results, cacheable = _fetch_lens_results(image_url)
+    if cacheable:
+        lens_cache.store(image_digest, LENS_HL, LENS_GL, shopping_results, signature)
+    return shopping_results
+
+async def asearch_products_by_image(image_url, user_location):
+    """
+    النسخة غير المتزامنة من search_products_by_image عبر عميل HTTP غير حاجب.
+    """
+    image_digest = await asyncio.to_thread(lens_cache.image_digest_for_url, image_url)
+    state, cached_results = await sync_to_async(lens_cache.lookup)(image_digest, LENS_HL, LENS_GL)
+    if state == lens_cache.FRESH:
+        return cached_results
+    if state == lens_cache.STALE:
+        lens_cache.refresh_in_background(image_digest, LENS_HL, LENS_GL, lambda: _fetch_lens_results(image_url))
+        return cached_results
+
+    signature = await asyncio.to_thread(lens_cache.perceptual_signature, image_url)
+    similar_results = await sync_to_async(lens_cache.lookup_similar)(image_digest, LENS_HL, LENS_GL, signature)
+    if similar_results is not None:
+        return similar_results
+
+    print(f"البحث عن منتجات مشابهة للصورة: {image_url} في {user_location}")
+    shopping_results, cacheable = await _afetch_lens_results(image_url)
+    if cacheable:
+        await sync_to_async(lens_cache.store)(image_digest, LENS_HL, LENS_GL, shopping_results, signature)
+    return shopping_results
+
+def _lens_params(image_url):
+    return {
         "engine": "google_lens",
         "url": image_url,
         "api_key": SERPAPI_API_KEY,
-        "hl": "ar",
-        "gl": "us"
+        "hl": LENS_HL,
+        "gl": LENS_GL
     }
 
-    search = GoogleSearch(params)
-    results = search.get_dict()
-
+def _parse_shopping_results(results):
     shopping_results = []
     if "shopping_results" in results:
         for item in results["shopping_results"]:
@@ -159,67 +370,58 @@ def search_products_by_image(image_url, user_location):
 
     return shopping_results
 
-recommendations_cache = {}
+# ذاكرة التوصيات المؤقتة: مستوى محلي (LRU + TTL) ومستوى مشترك بين العمليات.
+# تحفظ صفحات المؤشر فقط (cursor_pages.py)؛ الواجهات لا تقرأ منها مباشرة.
+recommendations_cache = build_recommendation_cache()
 
 def get_cached_recommendations(user_id, page_key):
-    return recommendations_cache.get(f"{user_id}_{page_key}")
+    data = recommendations_cache.get(user_id, page_key)
+    metrics.cache_result("recommendations", data is not None)
+    return data
 
 def set_cached_recommendations(user_id, page_key, data):
-    recommendations_cache[f"{user_id}_{page_key}"] = data
+    with metrics.timed("cache_write"):
+        recommendations_cache.set(user_id, page_key, data)
 
-def clear_user_cache(user_id):
-    keys_to_delete = [key for key in recommendations_cache if key.startswith(f"{user_id}_")]
-    for key in keys_to_delete:
-        del recommendations_cache[key]
+def recommendations_cache_stats():
+    return recommendations_cache.stats()
 
 def analyze_user_and_generate_advanced_prompts(user, location_info, search_filters):
     """
     يحلل بيانات المستخدم، موقعه، وفلاتر البحث لتوليد أوصاف (prompts) دقيقة للملابس.
     """
-    model = genai.GenerativeModel(model_name="gemini-1.5-flash")
-
-    filter_description = ", ".join([f"{k}: {v}" for k, v in search_filters.items()])
-
-    analysis_prompt = f"""
-    تحليل شامل للمستخدم وفلاتر البحث لتقديم توصيات أزياء دقيقة:
-
-    **بيانات المستخدم:**
-    - الطول: {user.height} سم
-    - الوزن: {user.weight} كجم
-    - لون البشرة: {user.skin_color}
-    - الموقع الجغرافي: {location_info}
-
-    **فلاتر البحث المطلوبة من المستخدم:**
-    {filter_description}
-
-    **المهمة:**
-    1.  بناءً على بيانات المستخدم، قم بتحليل نوع الجسم ونظرية الألوان المناسبة للون بشرته.
-    2.  دمج فلاتر البحث المطلوبة مع تحليل المستخدم لإنشاء 3 أوصاف نصية دقيقة ومفصلة (prompts) لتوليد صور لقطع ملابس واحدة (بدون عارض أزياء) تمثل هذه المتطلبات.
-    3.  يجب أن تكون الأوصاف متنوعة قدر الإمكان ضمن الفلاتر المحددة، مع التركيز على الجودة والواقعية.
+    bucket = analysis_cache.profile_bucket(user, location_info, search_filters)
+    key = analysis_cache.bucket_key("advanced", bucket)
+    cached = analysis_cache.lookup(key)
+    if cached:
+        return cached
 
-    **شروط وصف الصورة (Prompt):**
-    - يجب أن يصف قطعة الملابس فقط (مثال: "قميص"، "بنطال"، "فستان").
-    - يجب أن تكون الخلفية بسيطة ومحايدة (مثال: "خلفية استوديو رمادية فاتحة").
-    - يجب أن تكون الصورة واقعية (photorealistic).
-    - يجب تحديد ألوان وأنواع أقمشة دقيقة.
-    - يجب أن تولد 3 أوصاف مختلفة لقطع ملابس مختلفة.
+    try:
+        response_text = _generate_analysis(
+            prompts.analysis_prompt(analysis_cache.bucket_profile(bucket), location_info, search_filters)
+        )
+    except Exception as e:
+        print(f"خطأ في تحليل استجابة Gemini للبحث المتقدم: {e}")
+        return None
+    analysis_cache.store(key, "advanced", bucket, response_text)
+    return response_text
 
-    **مثال على المخرجات المطلوبة (بتنسيق JSON):**
-    {{
-        "analysis": "المستخدم لديه بنية جسم متوسطة ويميل الطول. الألوان الدافئة مثل البيج والزيتي تناسب لون بشرته. موقعه في الرياض يقترح الحاجة لملابس صيفية خفيفة.",
-        "prompts": [
-            "صورة واقعية لبنطال تشينو رجالي بلون بيج، بقصة مستقيمة، مصنوع من القطن الخفيف، معروض على خلفية استوديو رمادية فاتحة.",
-            "صورة واقعية لقميص بولو أبيض اللون، بقصة ضيقة (slim-fit)، مصنوع من قماش البيكيه، معروض على خلفية استوديو رمادية فاتحة.",
-            "صورة واقعية لجاكيت خفيف (bomber jacket) بلون زيتي، مصنوع من النايلون، معروض على خلفية استوديو رمادية فاتحة."
-        ]
-    }}
+async def aanalyze_user_and_generate_advanced_prompts(user, location_info, search_filters):
     """
-
-    response = model.generate_content(analysis_prompt)
+    النسخة غير المتزامنة من analyze_user_and_generate_advanced_prompts.
+    """
+    bucket = analysis_cache.profile_bucket(user, location_info, search_filters)
+    key = analysis_cache.bucket_key("advanced", bucket)
+    cached = await sync_to_async(analysis_cache.lookup)(key)
+    if cached:
+        return cached
 
     try:
-        cleaned_response = response.text.replace("```json", "").replace("```", "").strip()
-        return cleaned_response
+        response_text = await _agenerate_analysis(
+            prompts.analysis_prompt(analysis_cache.bucket_profile(bucket), location_info, search_filters)
+        )
     except Exception as e:
         print(f"خطأ في تحليل استجابة Gemini للبحث المتقدم: {e}")
         return None
+    await sync_to_async(analysis_cache.store)(key, "advanced", bucket, response_text)
+    return response_text
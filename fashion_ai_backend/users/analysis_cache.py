@@ -0,0 +1,192 @@
+"""
+ذاكرة تحليل Gemini المشتركة بين المستخدمين.
+
+مدخلات التحليل هي فقط الطول والوزن ولون البشرة والموقع (والفلاتر في البحث المتقدم)،
+وكثير من المستخدمين يتشاركون قيمًا متقاربة. لذلك تُوحد هذه القيم في مجموعة (bucket):
+الطول والوزن في فئات بعرض ثابت، ولون البشرة إلى تصنيف موحد، والموقع والفلاتر إلى نص
+موحد بمفاتيح مرتبة. التحليل يُطلب من Gemini بقيم المجموعة نفسها (وليس بقيم المستخدم)،
+لذلك يصلح لأي مستخدم فيها.
+
+لكل مجموعة حتى VARIANTS نسخة: ما دامت النسخ أقل من ذلك يُستدعى Gemini وتُضاف نسخة جديدة،
+وبعدها تُقدم النسخ بالتناوب (الأقل تقديمًا أولًا). النسخة التي تتجاوز TTL يُعاد توليدها.
+"""
+import hashlib
+import json
+import re
+import unicodedata
+from datetime import timedelta
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import F
+from django.utils import timezone
+
+from . import metrics
+from .models import AnalysisCacheEntry
+from .ranking import normalize_text
+
+_options = getattr(settings, "ANALYSIS_CACHE", {})
+ANALYSIS_CACHE_ENABLED = _options.get("ENABLED", True)
+ANALYSIS_CACHE_TTL = _options.get("TTL", 7 * 24 * 60 * 60)
+ANALYSIS_CACHE_VARIANTS = _options.get("VARIANTS", 3)
+HEIGHT_BUCKET_CM = _options.get("HEIGHT_BUCKET_CM", 5)
+WEIGHT_BUCKET_KG = _options.get("WEIGHT_BUCKET_KG", 5)
+
+# الكلمات الأطول أولًا حتى لا تطابق "فاتح" قبل "فاتح جدا"
+_SKIN_COLOR_SYNONYMS = (
+    ("very_light", ("فاتح جدا", "فاتحة جدا", "very fair", "very light", "pale", "porcelain")),
+    ("tan", ("أسمر فاتح", "سمراء فاتحة", "light brown", "tan")),
+    ("dark", ("أسمر غامق", "داكن", "داكنة", "غامق", "غامقة", "أسود", "سوداء", "dark", "black", "deep")),
+    ("olive", ("زيتوني", "زيتونية", "olive")),
+    ("medium", ("حنطي", "حنطية", "قمحي", "قمحية", "متوسط", "متوسطة", "medium", "wheat", "beige")),
+    ("brown", ("أسمر", "سمراء", "brown")),
+    ("light", ("فاتح", "فاتحة", "أبيض", "بيضاء", "fair", "light", "white")),
+)
+
+_diacritics_re = re.compile(r"[\u064B-\u065F\u0670]")
+
+stats = {"hits": 0, "misses": 0, "stored": 0}
+
+
+def canonical_skin_color(skin_color):
+    # حذف التشكيل العربي ("جدًا" ← "جدا")
+    text = normalize_text(_diacritics_re.sub("", skin_color or ""))
+    if not text:
+        return ""
+    for canonical, synonyms in _SKIN_COLOR_SYNONYMS:
+        if any(normalize_text(synonym) in text for synonym in synonyms):
+            return canonical
+    return text
+
+
+def canonical_location(location_info):
+    text = normalize_text(location_info)
+    return "" if text == "not provided" else text
+
+
+def canonical_filters(search_filters):
+    """
+    فلاتر بمفاتيح مرتبة وقيم موحدة؛ القوائم تُرتب والقيم الفارغة تُحذف.
+    """
+    canonical = {}
+    for key in sorted(search_filters or {}, key=lambda k: normalize_text(str(k))):
+        value = search_filters[key]
+        if isinstance(value, (list, tuple)):
+            value = sorted(normalize_text(str(v)) for v in value if str(v).strip())
+        elif value is not None:
+            value = normalize_text(str(value))
+        if value:
+            canonical[normalize_text(str(key))] = value
+    return canonical
+
+
+def _bucket_range(value, width):
+    if value in (None, ""):
+        return ""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return ""
+    low = int(value // width * width)
+    return f"{low}-{low + width}"
+
+
+def _picture_skin_tone(user):
+    analysis = getattr(user, "picture_analysis", None) or {}
+    return (analysis.get("skin_tone") or {}).get("category", "")
+
+
+def profile_bucket(user, location_info, search_filters=None):
+    bucket = {
+        "height": _bucket_range(user.height, HEIGHT_BUCKET_CM),
+        "weight": _bucket_range(user.weight, WEIGHT_BUCKET_KG),
+        "skin_color": canonical_skin_color(user.skin_color),
+        "picture_skin_tone": _picture_skin_tone(user),
+        "location": canonical_location(location_info),
+    }
+    if search_filters is not None:
+        bucket["filters"] = canonical_filters(search_filters)
+    return bucket
+
+
+def bucket_profile(bucket):
+    """
+    كائن بنفس حقول المستخدم التي تستخدمها أوصاف التحليل، لكن بقيم المجموعة.
+    """
+    skin_tone = bucket["picture_skin_tone"]
+    return SimpleNamespace(
+        height=bucket["height"] or None,
+        weight=bucket["weight"] or None,
+        skin_color=bucket["skin_color"] or None,
+        picture_analysis={"skin_tone": {"category": skin_tone}} if skin_tone else None,
+    )
+
+
+def bucket_key(kind, bucket):
+    payload = json.dumps({"kind": kind, **bucket}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(unicodedata.normalize("NFKC", payload).encode("utf-8")).hexdigest()
+
+
+def _is_valid_response(response):
+    try:
+        data = json.loads(response)
+    except (TypeError, json.JSONDecodeError):
+        return False
+    return isinstance(data, dict) and bool(data.get("prompts"))
+
+
+def lookup(key):
+    """
+    يعيد نسخة صالحة بالتناوب إذا اكتمل عدد النسخ للمجموعة، وإلا None.
+    """
+    if not ANALYSIS_CACHE_ENABLED:
+        return None
+    fresh = list(
+        AnalysisCacheEntry.objects
+        .filter(bucket_key=key, created_at__gte=timezone.now() - timedelta(seconds=ANALYSIS_CACHE_TTL))
+        .order_by("served", "variant")
+    )
+    if len(fresh) < ANALYSIS_CACHE_VARIANTS:
+        stats["misses"] += 1
+        metrics.cache_result("analysis", False)
+        return None
+    entry = fresh[0]
+    AnalysisCacheEntry.objects.filter(id=entry.id).update(served=F("served") + 1)
+    stats["hits"] += 1
+    metrics.cache_result("analysis", True)
+    return entry.response
+
+
+def store(key, kind, bucket, response):
+    """
+    يحفظ استجابة صالحة في أول نسخة فارغة أو منتهية الصلاحية للمجموعة.
+    """
+    if not ANALYSIS_CACHE_ENABLED or not _is_valid_response(response):
+        return
+    now = timezone.now()
+    fresh_variants = set(
+        AnalysisCacheEntry.objects
+        .filter(bucket_key=key, created_at__gte=now - timedelta(seconds=ANALYSIS_CACHE_TTL))
+        .values_list("variant", flat=True)
+    )
+    free = [variant for variant in range(ANALYSIS_CACHE_VARIANTS) if variant not in fresh_variants]
+    if not free:
+        return
+    try:
+        AnalysisCacheEntry.objects.update_or_create(
+            bucket_key=key,
+            variant=free[0],
+            defaults={"kind": kind, "bucket": bucket, "response": response, "served": 1, "created_at": now},
+        )
+        stats["stored"] += 1
+    except IntegrityError:
+        # طلب آخر حفظ نفس النسخة في الوقت نفسه
+        pass
+
+
+def purge_expired():
+    deleted, _ = AnalysisCacheEntry.objects.filter(
+        created_at__lt=timezone.now() - timedelta(seconds=ANALYSIS_CACHE_TTL)
+    ).delete()
+    return deleted
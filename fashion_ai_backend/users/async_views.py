@@ -0,0 +1,181 @@
+"""
+نسخ غير متزامنة (async) من واجهات التوصيات تعمل تحت ASGI (uvicorn).
+
+DRF لا يدعم الواجهات غير المتزامنة، لذلك تعتمد هذه الواجهات على View من Django
+مباشرةً وتعيد JsonResponse بنفس شكل استجابات الواجهات المتزامنة.
+تحت WSGI تعمل هذه الواجهات أيضًا، لكن Django يشغل كل طلب في حلقة أحداث خاصة به.
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+
+from .models import CustomUser
+from .ai_services import (
+    aanalyze_user_and_generate_prompts,
+    aanalyze_user_and_generate_advanced_prompts,
+)
+from . import feed
+from .deadlines import deadline_scope
+from .rate_limits import user_scope
+from .pipeline import arun_prompt_chains, paginate_recommendations, complete_in_background, empty_page
+from .singleflight import recommendation_flights, request_signature
+
+
+def _request_data(request):
+    if request.content_type == "application/json":
+        try:
+            return json.loads(request.body or b"{}")
+        except json.JSONDecodeError:
+            return {}
+    return request.POST
+
+
+def _result_response(result, page):
+    if "body" in result:
+        return JsonResponse(result["body"], status=result["status"])
+    pages = result["pages"]
+    if page > len(pages) or page < 1:
+        return JsonResponse(empty_page(result["user_analysis"], page, len(pages)), status=200)
+    return JsonResponse(pages[page - 1], status=200)
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class AsyncRecommendationsView(View):
+    async def get(self, request, *args, **kwargs):
+        user_id = request.GET.get("user_id")
+        cursor = request.GET.get("cursor")
+        page = int(request.GET.get("page", 1))
+
+        if cursor:
+            try:
+                return JsonResponse(await sync_to_async(feed.get_page_after)(user_id, cursor), status=200)
+            except ValueError:
+                return JsonResponse({"error": "Invalid cursor"}, status=400)
+
+        cached_data = await sync_to_async(feed.get_page)(user_id, page)
+        if cached_data:
+            return JsonResponse(cached_data, status=200)
+
+        return JsonResponse({"error": "No cached recommendations found. Please trigger generation via POST request."}, status=404)
+
+    async def post(self, request, *args, **kwargs):
+        data = _request_data(request)
+        user_id = data.get("user_id")
+        location_info = data.get("location", "Not provided")
+        page = int(data.get("page", 1))
+
+        try:
+            user = await CustomUser.objects.aget(id=user_id)
+        except CustomUser.DoesNotExist:
+            return JsonResponse({"error": "User not found"}, status=404)
+
+        signature = request_signature(user.id, location_info)
+        cached_data = await sync_to_async(feed.get_page)(
+            user.id, page, signature=signature, fresh_for=feed.FEED_FRESH_FOR
+        )
+        if cached_data:
+            return JsonResponse(cached_data, status=200)
+
+        async def generate():
+            with deadline_scope() as deadline, user_scope(user.id):
+                return await generate_within(deadline)
+
+        async def generate_within(deadline):
+            ai_response_str = await aanalyze_user_and_generate_prompts(user, location_info)
+            if not ai_response_str:
+                return {"body": {"error": "Failed to get analysis from AI model."}, "status": 500}
+
+            try:
+                ai_response_json = json.loads(ai_response_str)
+                user_analysis_text = ai_response_json.get("analysis", "")
+                prompts = ai_response_json.get("prompts", [])
+            except json.JSONDecodeError:
+                return {"body": {"error": "Failed to parse AI model response.", "raw_response": ai_response_str}, "status": 500}
+
+            all_recommendations = await arun_prompt_chains(prompts, request, location_info, user_analysis_text, budget=user.budget)
+
+            def store_results(recommendations):
+                return feed.store_run(
+                    user.id, feed.KIND_RECOMMENDATIONS, signature, location_info, user_analysis_text, recommendations,
+                )
+
+            if deadline.partial:
+                pages = paginate_recommendations(user_analysis_text, all_recommendations, partial=True)
+                complete_in_background(
+                    prompts, request.build_absolute_uri("/"), location_info, user_analysis_text,
+                    store_results, budget=user.budget,
+                )
+            else:
+                run = await sync_to_async(store_results)(all_recommendations)
+                pages = feed.paginate_run(run, all_recommendations)
+            return {"user_analysis": user_analysis_text, "pages": pages}
+
+        result = await recommendation_flights.ado(signature, generate)
+        return _result_response(result, page)
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class AsyncAdvancedSearchView(View):
+    async def post(self, request, *args, **kwargs):
+        data = _request_data(request)
+        user_id = data.get("user_id")
+        location_info = data.get("location", "Not provided")
+        search_filters = data.get("filters", {})
+        page = int(data.get("page", 1))
+
+        try:
+            user = await CustomUser.objects.aget(id=user_id)
+        except CustomUser.DoesNotExist:
+            return JsonResponse({"error": "User not found"}, status=404)
+
+        signature = request_signature(user.id, location_info, search_filters)
+        cached_data = await sync_to_async(feed.get_page)(
+            user.id, page, kind=feed.KIND_ADVANCED, signature=signature, fresh_for=feed.FEED_FRESH_FOR
+        )
+        if cached_data:
+            return JsonResponse(cached_data, status=200)
+
+        async def generate():
+            with deadline_scope() as deadline, user_scope(user.id):
+                return await generate_within(deadline)
+
+        async def generate_within(deadline):
+            ai_response_str = await aanalyze_user_and_generate_advanced_prompts(user, location_info, search_filters)
+            if not ai_response_str:
+                return {"body": {"error": "Failed to get analysis from AI model for advanced search."}, "status": 500}
+
+            try:
+                ai_response_json = json.loads(ai_response_str)
+                user_analysis_text = ai_response_json.get("analysis", "")
+                prompts = ai_response_json.get("prompts", [])
+            except json.JSONDecodeError:
+                return {"body": {"error": "Failed to parse AI model response for advanced search.", "raw_response": ai_response_str}, "status": 500}
+
+            budget = search_filters.get("budget") or user.budget
+            all_recommendations = await arun_prompt_chains(
+                prompts, request, location_info, user_analysis_text, search_filters, budget,
+            )
+
+            def store_results(recommendations):
+                return feed.store_run(
+                    user.id, feed.KIND_ADVANCED, signature, location_info, user_analysis_text,
+                    recommendations, search_filters,
+                )
+
+            if deadline.partial:
+                pages = paginate_recommendations(user_analysis_text, all_recommendations, partial=True)
+                complete_in_background(
+                    prompts, request.build_absolute_uri("/"), location_info, user_analysis_text,
+                    store_results, search_filters, budget,
+                )
+            else:
+                run = await sync_to_async(store_results)(all_recommendations)
+                pages = feed.paginate_run(run, all_recommendations)
+            return {"user_analysis": user_analysis_text, "pages": pages}
+
+        result = await recommendation_flights.ado(signature, generate)
+        return _result_response(result, page)
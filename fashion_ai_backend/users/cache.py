@@ -0,0 +1,139 @@
+"""
+طبقة التخزين المؤقت لصفحات التوصيات.
+
+مستويان:
+- محلي داخل العملية: LRU بحجم أقصى ومدة صلاحية (TTL)، سريع جدًا لكنه غير مشترك.
+- مشترك بين العمليات: إطار التخزين المؤقت في Django (ملفات أو قاعدة بيانات)، بحيث
+  يجد طلب GET الصفحات حتى لو وصل إلى عامل gunicorn مختلف عن الذي نفذ POST.
+
+لا يوجد حذف لكل مستخدم: الصفحات المحفوظة هنا صفحات المؤشر (cursor_pages.py) بمفتاح حالة
+فريد لكل تشغيل، فلا تصبح قديمة، وتنتهي بمدة الصلاحية. لذلك لا يُحفظ فهرس مفاتيح مشترك بين
+العمليات (قراءة ثم كتابة بلا قفل مشترك تضيع التحديثات، وينمو بلا حد).
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class LRUTTLCache:
+    """
+    ذاكرة مؤقتة داخل العملية بسياسة LRU ومدة صلاحية لكل عنصر.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class RecommendationCache:
+    """
+    ذاكرة التوصيات بمستويين (محلي + مشترك).
+    """
+
+    KEY_PREFIX = "recs"
+
+    def __init__(self, local_maxsize=1024, local_ttl=60, shared_alias="recommendations", ttl=3600):
+        self.local = LRUTTLCache(maxsize=local_maxsize, ttl=min(local_ttl, ttl))
+        self.shared_alias = shared_alias
+        self.ttl = ttl
+        self.shared_hits = 0
+        self.shared_misses = 0
+
+    @property
+    def shared(self):
+        # caches[...] يعيد كائنًا خاصًا بكل خيط، لذلك لا نحتفظ به
+        return caches[self.shared_alias] if self.shared_alias else None
+
+    def _key(self, user_id, page_key):
+        return f"{self.KEY_PREFIX}:{user_id}:{page_key}"
+
+    def get(self, user_id, page_key):
+        key = self._key(user_id, page_key)
+        value = self.local.get(key)
+        if value is not None or self.shared is None:
+            return value
+
+        value = self.shared.get(key)
+        if value is None:
+            self.shared_misses += 1
+            return None
+        self.shared_hits += 1
+        self.local.set(key, value)
+        return value
+
+    def set(self, user_id, page_key, data):
+        key = self._key(user_id, page_key)
+        self.local.set(key, data)
+        if self.shared is not None:
+            self.shared.set(key, data, self.ttl)
+
+    def stats(self):
+        return {
+            "local": self.local.stats(),
+            "shared": {
+                "backend": self.shared_alias,
+                "hits": self.shared_hits,
+                "misses": self.shared_misses,
+            },
+        }
+
+
+def build_recommendation_cache():
+    options = getattr(settings, "RECOMMENDATIONS_CACHE", {})
+    return RecommendationCache(
+        local_maxsize=options.get("LOCAL_MAXSIZE", 1024),
+        local_ttl=options.get("LOCAL_TTL", 60),
+        shared_alias=options.get("SHARED_ALIAS", "recommendations"),
+        ttl=options.get("TTL", 3600),
+    )
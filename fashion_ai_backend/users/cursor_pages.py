@@ -0,0 +1,237 @@
+"""
+توليد الصفحات عند الطلب باستخدام مؤشر (cursor) بدلاً من حساب كل الصفحات مقدمًا.
+
+كل طلب صفحة ينفذ فقط عدد السلاسل (صورة ← Lens) اللازم لملء تلك الصفحة، ثم ينسق
+منتجاتها في استدعاء واحد. حالة التوليد لكل (مستخدم، موقع) محفوظة في المخزن المشترك:
+الأوصاف، الصور المولدة، رقم السلسلة التالية، المنتجات التي وُجدت ولم تُعرض بعد،
+وبصمات المنتجات المعروضة (لعدم تكرارها في الصفحات التالية). لذلك يستأنف طلب الصفحة
+التالية من حيث توقف السابق، حتى لو وصل إلى عامل آخر.
+
+المؤشر نصي بالشكل "<معرف الحالة>.<رقم الصفحة>"، والصفحات المولدة تُحفظ في ذاكرة
+التوصيات حتى يعيد نفس المؤشر نفس الصفحة.
+
+كل طلب صفحة له موعد (deadlines.py). السلاسل التي قطعها الموعد تُحفظ في deferred وتُنفذ
+أولًا في الصفحة التالية، والأوصاف التي لم تكتمل صورها لا تُحفظ صورها حتى يعاد توليدها؛
+لذلك الصفحة الجزئية (partial: true) لا تفقد أي منتج، بل تؤجله.
+"""
+import json
+
+from django.conf import settings
+
+from .deadlines import DeadlineExceeded, current_deadline, deadline_scope
+from .rate_limits import user_scope
+from . import lens_cache
+from .ai_services import (
+    analyze_user_and_generate_prompts,
+    generated_image_store,
+    get_cached_recommendations,
+    recommendations_cache,
+    set_cached_recommendations,
+)
+from .pipeline import (
+    IMAGES_PER_PROMPT,
+    RESULTS_PER_PAGE,
+    format_products,
+    generate_prompt_images,
+    search_image_chains,
+)
+from .ranking import ProductDeduper, rank_products
+from .singleflight import recommendation_flights, request_signature
+
+# عدد السلاسل التي تُنفذ بالتوازي في كل جولة أثناء ملء صفحة
+CURSOR_CHAINS_PER_ROUND = getattr(settings, "RECOMMENDATION_CURSOR_CHAINS_PER_ROUND", IMAGES_PER_PROMPT)
+CURSOR_STATE_TTL = getattr(settings, "RECOMMENDATION_CURSOR_STATE_TTL", 60 * 60)
+
+
+class CursorError(Exception):
+    """مؤشر غير صالح أو منتهي الصلاحية."""
+
+
+def _state_key(state_id):
+    return f"recs:cursor:{state_id}"
+
+
+def _page_key(state_id, page):
+    return f"cursor_{state_id}_{page}"
+
+
+def make_cursor(state_id, page):
+    return f"{state_id}.{page}"
+
+
+def parse_cursor(cursor):
+    state_id, _, page = str(cursor).rpartition(".")
+    if not state_id or not page.isdigit() or int(page) < 1:
+        raise CursorError("Invalid cursor.")
+    return state_id, int(page)
+
+
+def _state_store():
+    # الحالة تتغير مع كل صفحة، لذلك تُقرأ من المخزن المشترك مباشرةً وليس من المستوى المحلي
+    return recommendations_cache.shared or recommendations_cache.local
+
+
+def load_state(state_id):
+    return _state_store().get(_state_key(state_id))
+
+
+def save_state(state):
+    _state_store().set(_state_key(state["id"]), state, CURSOR_STATE_TTL)
+    # صور الحالة تُبحث في صفحات لاحقة؛ تحديث آخر استخدامها يحميها من إخلاء المخزن
+    generated_image_store.touch(
+        lens_cache.local_media_path(url) for urls in state["images"].values() for url in urls
+    )
+
+
+def _new_state(user, location_info):
+    ai_response_str = analyze_user_and_generate_prompts(user, location_info)
+    if not ai_response_str:
+        return {"body": {"error": "Failed to get analysis from AI model."}, "status": 500}
+
+    try:
+        ai_response_json = json.loads(ai_response_str)
+    except json.JSONDecodeError:
+        return {"body": {"error": "Failed to parse AI model response.", "raw_response": ai_response_str}, "status": 500}
+
+    return {
+        "id": request_signature(user.id, location_info)[:32],
+        "user_id": user.id,
+        "location": location_info,
+        "budget": user.budget,
+        "user_analysis": ai_response_json.get("analysis", ""),
+        "prompts": ai_response_json.get("prompts", []),
+        "images": {},
+        "next_chain": 0,
+        "pending": [],
+        "deferred": [],
+        "seen": [],
+        "pages": 0,
+    }
+
+
+def _total_chains(state):
+    return len(state["prompts"]) * IMAGES_PER_PROMPT
+
+
+def _has_more_chains(state):
+    return bool(state["deferred"]) or state["next_chain"] < _total_chains(state)
+
+
+def _next_chains(state, request, count):
+    """
+    يعيد السلاسل التالية (الوصف، رابط الصورة) ويولد صور الأوصاف التي لم تُولد بعد.
+    """
+    positions = range(state["next_chain"], min(state["next_chain"] + count, _total_chains(state)))
+    prompt_indexes = sorted({position // IMAGES_PER_PROMPT for position in positions})
+    missing = [index for index in prompt_indexes if str(index) not in state["images"]]
+    if missing:
+        generated = generate_prompt_images([state["prompts"][index] for index in missing], request)
+        for index, image_urls in zip(missing, generated):
+            if isinstance(image_urls, DeadlineExceeded):
+                continue # يعاد توليدها في الصفحة التالية
+            state["images"][str(index)] = image_urls if isinstance(image_urls, list) else []
+
+    chains = []
+    next_chain = positions.stop if positions else state["next_chain"]
+    for position in positions:
+        prompt_index, image_index = divmod(position, IMAGES_PER_PROMPT)
+        image_urls = state["images"].get(str(prompt_index))
+        if image_urls is None:
+            # الموعد قطع توليد صور هذا الوصف؛ نتوقف عنده ونستأنف منه لاحقًا
+            next_chain = position
+            break
+        if image_index < len(image_urls):
+            chains.append((state["prompts"][prompt_index], image_urls[image_index]))
+    state["next_chain"] = next_chain
+    return chains
+
+
+def _fill_page(state, request):
+    """
+    ينفذ جولات من السلاسل حتى تتوفر منتجات كافية لصفحة أو تنفد السلاسل.
+    """
+    deduper = ProductDeduper(state["seen"])
+    deadline = current_deadline()
+    while len(state["pending"]) < RESULTS_PER_PAGE and _has_more_chains(state):
+        if deadline is not None and deadline.partial:
+            break
+        # السلاسل المؤجلة من الصفحة السابقة أولًا
+        chains = [tuple(chain) for chain in state["deferred"][:CURSOR_CHAINS_PER_ROUND]]
+        state["deferred"] = state["deferred"][CURSOR_CHAINS_PER_ROUND:]
+        if len(chains) < CURSOR_CHAINS_PER_ROUND and state["next_chain"] < _total_chains(state):
+            chains += _next_chains(state, request, CURSOR_CHAINS_PER_ROUND - len(chains))
+        if not chains:
+            continue
+        chain_results = search_image_chains(chains, state["location"])
+        state["deferred"] += [
+            list(chain) for chain, (_, result) in zip(chains, chain_results) if isinstance(result, DeadlineExceeded)
+        ]
+        state["pending"].extend(deduper.filter(rank_products(chain_results, state["budget"], top_n=0)))
+    state["seen"] = deduper.seen
+
+    products = state["pending"][:RESULTS_PER_PAGE]
+    state["pending"] = state["pending"][RESULTS_PER_PAGE:]
+    return products
+
+
+def _generate_page(state, page, request):
+    products = _fill_page(state, request)
+    recommendations = format_products(state["user_analysis"], products, len(products)) if products else []
+    has_next_page = bool(state["pending"]) or _has_more_chains(state)
+    deadline = current_deadline()
+    state["pages"] = page
+    save_state(state)
+
+    page_data = {
+        "user_analysis": state["user_analysis"],
+        "recommendations": recommendations,
+        "current_page": page,
+        "total_pages": None, # غير معروف قبل تنفيذ كل السلاسل
+        "has_next_page": has_next_page,
+        "next_cursor": make_cursor(state["id"], page + 1) if has_next_page else None,
+        "partial": bool(deadline and deadline.partial),
+    }
+    set_cached_recommendations(state["user_id"], _page_key(state["id"], page), page_data)
+    return page_data
+
+
+def first_page(user, location_info, request):
+    """
+    يعيد الصفحة الأولى، ويبدأ حالة توليد جديدة إذا لم تكن الصفحة محفوظة.
+    """
+    state_id = request_signature(user.id, location_info)[:32]
+    cached_data = get_cached_recommendations(user.id, _page_key(state_id, 1))
+    if cached_data:
+        return cached_data
+
+    def generate():
+        with deadline_scope(), user_scope(user.id):
+            state = _new_state(user, location_info)
+            if "body" in state:
+                return state
+            return _generate_page(state, 1, request)
+
+    return recommendation_flights.do(f"cursor:{state_id}:1", generate)
+
+
+def next_page(user, cursor, request):
+    """
+    يعيد الصفحة التي يشير إليها المؤشر، ويولدها إذا كانت الصفحة التالية للحالة.
+    """
+    state_id, page = parse_cursor(cursor)
+    cached_data = get_cached_recommendations(user.id, _page_key(state_id, page))
+    if cached_data:
+        return cached_data
+
+    def generate():
+        state = load_state(state_id)
+        if state is None or str(state["user_id"]) != str(user.id):
+            raise CursorError("Cursor expired. Please request the first page again.")
+        if page != state["pages"] + 1:
+            # الصفحات السابقة انتهت صلاحيتها، أو المؤشر لصفحة لم يصل إليها المستخدم بعد
+            raise CursorError("Cursor expired. Please request the first page again.")
+        state.setdefault("deferred", [])
+        with deadline_scope(), user_scope(user.id):
+            return _generate_page(state, page, request)
+
+    return recommendation_flights.do(f"cursor:{state_id}:{page}", generate)
@@ -0,0 +1,146 @@
+"""
+ميزانية زمنية لكل طلب (deadline) تنتقل إلى كل استدعاء لمزود خارجي.
+
+الواجهة تفتح نطاقًا بـ deadline_scope()، وكل استدعاء لـ Gemini أو SerpApi يأخذ مهلته
+من stage_timeout(stage): الأقل بين مهلة المرحلة والوقت المتبقي من الميزانية. الموعد
+محفوظ في ContextVar، لذلك ينتقل تلقائيًا إلى المهام غير المتزامنة، وينتقل إلى خيوط
+المجمع عبر submit() الذي ينسخ السياق.
+
+عند انتهاء الميزانية تتوقف مراحل خط المعالجة عن انتظار العمل المتبقي وتلغي ما لم يبدأ،
+ويُعلَّم الموعد بأنه جزئي (partial) حتى تعيد الواجهة ما اكتمل فقط مع partial: true.
+خارج أي نطاق (مثل عمال الخلفية) لا توجد ميزانية، لكن مهل المراحل تبقى سارية.
+"""
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import metrics
+
+_options = getattr(settings, "REQUEST_DEADLINE", {})
+# أقل من مهلة gunicorn الافتراضية (30 ثانية) حتى يعود الرد قبل قتل العامل
+REQUEST_BUDGET = _options.get("BUDGET", 25)
+STAGE_TIMEOUTS = {
+    "analysis": 10,
+    "image": 15,
+    "lens": 12,
+    "format": 10,
+    **_options.get("STAGE_TIMEOUTS", {}),
+}
+
+stats = {"requests": 0, "partial": 0, "cancelled": 0}
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline:
+    def __init__(self, budget):
+        self.budget = budget
+        self.expires_at = time.monotonic() + budget
+        self.partial = False
+
+    def remaining(self):
+        return self.expires_at - time.monotonic()
+
+    @property
+    def expired(self):
+        return self.remaining() <= 0
+
+    def mark_partial(self, cancelled=0):
+        if not self.partial:
+            stats["partial"] += 1
+            metrics.inc("fashion_partial_responses_total")
+        self.partial = True
+        stats["cancelled"] += cancelled
+
+
+_current = contextvars.ContextVar("request_deadline", default=None)
+
+
+def current_deadline():
+    return _current.get()
+
+
+@contextmanager
+def deadline_scope(budget=None):
+    deadline = Deadline(REQUEST_BUDGET if budget is None else budget)
+    stats["requests"] += 1
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+
+def stage_timeout(stage):
+    """
+    مهلة استدعاء واحد في المرحلة. ترفع DeadlineExceeded إذا انتهت ميزانية الطلب.
+    """
+    cap = STAGE_TIMEOUTS.get(stage)
+    deadline = _current.get()
+    if deadline is None:
+        return cap
+    remaining = deadline.remaining()
+    if remaining <= 0:
+        deadline.mark_partial()
+        raise DeadlineExceeded(f"Request deadline exceeded before {stage}.")
+    return min(cap, remaining) if cap else remaining
+
+
+def wait_timeout():
+    """
+    أقصى مدة انتظار لنتائج المجمع: الوقت المتبقي، أو None بدون ميزانية.
+    """
+    deadline = _current.get()
+    return None if deadline is None else max(0.0, deadline.remaining())
+
+
+def submit(executor, fn, *args):
+    # نسخ السياق حتى يرى الخيط نفس الموعد
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+def cancel_pending(futures):
+    """
+    يلغي العمل الذي لم يبدأ بعد ويعلّم الموعد الحالي بأنه جزئي.
+    """
+    cancelled = sum(1 for future in futures if future.cancel())
+    deadline = _current.get()
+    if deadline is not None:
+        deadline.mark_partial(cancelled)
+    return cancelled
+
+
+_background_executor = None
+_background_pid = None
+_background_lock = threading.Lock()
+
+
+def continue_in_background(fn, *args):
+    """
+    يكمل عملًا قطعته الميزانية خارج الطلب (بدون ميزانية) حتى تُحفظ نتائجه الكاملة.
+    """
+    global _background_executor, _background_pid
+    with _background_lock:
+        if _background_executor is None or _background_pid != os.getpid():
+            _background_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="deadline-continue")
+            _background_pid = os.getpid()
+        executor = _background_executor
+
+    def run():
+        try:
+            fn(*args)
+        except Exception as e:
+            print(f"خطأ أثناء إكمال الطلب في الخلفية: {e}")
+        finally:
+            close_old_connections()
+
+    # الخيط الجديد يبدأ بسياق فارغ، أي بدون الموعد المنتهي
+    return executor.submit(contextvars.Context().run, run)
@@ -0,0 +1,213 @@
+"""
+بدائل محلية لـ Gemini و SerpApi لقياس الأداء بدون شبكة ولا مفاتيح ولا تكلفة.
+
+تُفعل بـ FAKE_PROVIDERS["ENABLED"] أو متغير البيئة FASHION_FAKE_PROVIDERS=1، وعندها تعيد
+دوال providers.py هذه البدائل بدلاً من العملاء الحقيقيين. كل ما بعدها (محدد المعدل،
+المواعيد، الذاكرات المؤقتة، المقاييس) يعمل كما هو، لذلك القياس يشمل مسار الكود الحقيقي.
+
+لكل مزود زمن استجابة (LATENCY بالثواني، مع تذبذب JITTER كنسبة منه) ونسبة أخطاء
+(ERROR_RATE) ونسبة ردود 429 (THROTTLE_RATE). حجم الردود يتحدد بعدد نتائج Lens
+(SHOPPING_RESULTS) وأبعاد الصور المولدة (IMAGE_SIZE). الاستجابة أطول من مهلة الاستدعاء
+تنتظر المهلة ثم ترفع خطأ انتهاء المهلة كما يفعل العميل الحقيقي.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+import httpx
+import requests
+from django.conf import settings
+from google.api_core import exceptions as google_exceptions
+from PIL import Image
+
+from . import providers
+
+_options = getattr(settings, "FAKE_PROVIDERS", {})
+
+# قابلة للتعديل أثناء التشغيل (أمر bench_pipeline يضبطها من خياراته)
+config = {
+    "ENABLED": _options.get("ENABLED") or os.environ.get("FASHION_FAKE_PROVIDERS") == "1",
+    "LATENCY": {"gemini": 1.5, "gemini_image": 4.0, "serpapi": 2.0, **_options.get("LATENCY", {})},
+    "JITTER": _options.get("JITTER", 0.25),
+    "ERROR_RATE": _options.get("ERROR_RATE", 0.0),
+    "THROTTLE_RATE": _options.get("THROTTLE_RATE", 0.0),
+    "SHOPPING_RESULTS": _options.get("SHOPPING_RESULTS", 20),
+    "IMAGE_SIZE": _options.get("IMAGE_SIZE", 512),
+    # أوصاف فريدة في كل تحليل، فلا تصيب ذاكرة الصور ولا ذاكرة Lens
+    "UNIQUE_PROMPTS": _options.get("UNIQUE_PROMPTS", False),
+    "SEED": _options.get("SEED"),
+}
+
+_GARMENTS = ("قميص", "بنطال", "فستان", "جاكيت", "تنورة", "سترة", "معطف", "بلوزة")
+_COLORS = ("بيج", "أبيض", "زيتي", "كحلي", "أسود", "رمادي", "عنابي", "أزرق فاتح")
+_FABRICS = ("قطن", "كتان", "صوف", "حرير", "جينز", "نايلون")
+_STORES = ("Zara", "H&M", "Mango", "Namshi", "Ounass", "Noon")
+
+_posts_wanted_re = re.compile(r"قم بصياغة (\d+) منشورات")
+# سطور المنتجات في وصف التنسيق: "p1 | العنوان | ..." (prompts.encode_product)
+_product_id_re = re.compile(r"^(p\d+) \|", re.MULTILINE)
+
+_lock = threading.Lock()
+_rng = random.Random(config["SEED"])
+calls = {"gemini": 0, "gemini_image": 0, "serpapi": 0, "errors": 0, "throttled": 0, "timeouts": 0}
+
+
+def enabled():
+    return config["ENABLED"]
+
+
+def _stable_rng(*parts):
+    # نتائج ثابتة لنفس المدخلات (مثل رابط الصورة) حتى تتصرف الذاكرات المؤقتة كما مع المزود الحقيقي
+    digest = hashlib.sha256("|".join(str(part) for part in parts).encode("utf-8")).digest()
+    return random.Random(int.from_bytes(digest[:8], "big") ^ (config["SEED"] or 0))
+
+
+def _plan(provider, timeout):
+    """
+    يقرر نتيجة الاستدعاء: (مدة الانتظار، الخطأ الذي يُرفع بعدها أو None).
+    """
+    with _lock:
+        calls[provider] += 1
+        latency = config["LATENCY"].get(provider, 0)
+        delay = max(0.0, latency * (1 + _rng.uniform(-config["JITTER"], config["JITTER"])))
+        roll = _rng.random()
+        if timeout is not None and delay > timeout:
+            calls["timeouts"] += 1
+            return timeout, "timeout"
+        if roll < config["THROTTLE_RATE"]:
+            calls["throttled"] += 1
+            return delay, "throttled"
+        if roll < config["THROTTLE_RATE"] + config["ERROR_RATE"]:
+            calls["errors"] += 1
+            return delay, "error"
+    return delay, None
+
+
+def _gemini_error(outcome):
+    if outcome == "timeout":
+        return google_exceptions.DeadlineExceeded("Fake Gemini call timed out.")
+    if outcome == "throttled":
+        return google_exceptions.TooManyRequests("Fake Gemini rate limit exceeded.")
+    return google_exceptions.ServiceUnavailable("Fake Gemini is unavailable.")
+
+
+def _analysis_text(prompt):
+    rng = _stable_rng(prompt) if not config["UNIQUE_PROMPTS"] else random.Random()
+    prompts = []
+    for garment in rng.sample(_GARMENTS, 3):
+        prompt_text = (
+            f"صورة واقعية لـ{garment} بلون {rng.choice(_COLORS)}، مصنوع من {rng.choice(_FABRICS)}، "
+            "معروض على خلفية استوديو رمادية فاتحة."
+        )
+        if config["UNIQUE_PROMPTS"]:
+            prompt_text += f" ({rng.getrandbits(32):08x})"
+        prompts.append(prompt_text)
+    return json.dumps({
+        "analysis": "تحليل تجريبي: بنية جسم متوسطة، والألوان الدافئة تناسب لون البشرة.",
+        "prompts": prompts,
+    }, ensure_ascii=False)
+
+
+def _format_text(prompt):
+    product_ids = _product_id_re.findall(prompt)
+    match = _posts_wanted_re.search(prompt)
+    posts_wanted = int(match.group(1)) if match else len(product_ids)
+    posts = [
+        {"product_id": product_id, "text": f"منشور تجريبي للمنتج {product_id}: قطعة تناسب أسلوبك ولون بشرتك."}
+        for product_id in product_ids[:posts_wanted]
+    ]
+    return "```json\n" + json.dumps({"posts": posts}, ensure_ascii=False) + "\n```"
+
+
+def _image(prompt, candidate):
+    rng = _stable_rng(prompt, candidate)
+    size = config["IMAGE_SIZE"]
+    return Image.new("RGB", (size, size), tuple(rng.randrange(256) for _ in range(3)))
+
+
+class FakeGenerativeModel:
+    """
+    بديل GenerativeModel: نوع الرد يتحدد من اسم النموذج ومحتوى الوصف.
+    """
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+        # نماذج توليد الصور في Gemini تحمل "image" في اسمها (GENERATED_IMAGE_STORE["MODEL"])
+        self.is_image_model = "image" in model_name
+        self.provider = "gemini_image" if self.is_image_model else "gemini"
+
+    def _response(self, prompt, generation_config):
+        if self.is_image_model:
+            # candidate_count يعيد عدة صور في استدعاء واحد، كما في النماذج التي تدعم المرشحين
+            candidates = (generation_config or {}).get("candidate_count", 1)
+            return SimpleNamespace(text="", images=[_image(prompt, i) for i in range(candidates)])
+        # وصف التنسيق وحده يطلب حقل posts
+        text = _format_text(prompt) if '"posts"' in prompt else _analysis_text(prompt)
+        return SimpleNamespace(text=text, images=[])
+
+    def generate_content(self, prompt, generation_config=None, request_options=None):
+        delay, outcome = _plan(self.provider, (request_options or {}).get("timeout"))
+        time.sleep(delay)
+        if outcome:
+            raise _gemini_error(outcome)
+        return self._response(prompt, generation_config)
+
+    async def generate_content_async(self, prompt, generation_config=None, request_options=None):
+        delay, outcome = _plan(self.provider, (request_options or {}).get("timeout"))
+        await asyncio.sleep(delay)
+        if outcome:
+            raise _gemini_error(outcome)
+        return self._response(prompt, generation_config)
+
+
+def _shopping_results(params):
+    rng = _stable_rng(params.get("engine"), params.get("url"), params.get("hl"), params.get("gl"))
+    results = []
+    for position in range(config["SHOPPING_RESULTS"]):
+        garment = rng.choice(_GARMENTS)
+        product_id = f"{rng.getrandbits(48):012x}"
+        results.append({
+            "position": position + 1,
+            "title": f"{garment} {rng.choice(_COLORS)} من {rng.choice(_FABRICS)}",
+            "link": f"https://shop.example.com/p/{product_id}",
+            "source": rng.choice(_STORES),
+            "price": f"${rng.randint(9, 199)}.99",
+            "thumbnail": f"https://shop.example.com/img/{product_id}.jpg",
+            "tag": rng.choice(("", "تخفيض", "جديد")),
+        })
+    return {"search_metadata": {"status": "Success"}, "shopping_results": results}
+
+
+def _serpapi_result(params, outcome):
+    if outcome == "throttled":
+        raise providers.ProviderThrottled("SerpApi rate limit exceeded.", 1.0)
+    if outcome == "error":
+        return {"error": "Fake SerpApi failure."}, 500
+    return _shopping_results(params), 200
+
+
+def serpapi_search(params, timeout):
+    delay, outcome = _plan("serpapi", timeout)
+    time.sleep(delay)
+    if outcome == "timeout":
+        raise requests.Timeout("Fake SerpApi call timed out.")
+    return _serpapi_result(params, outcome)
+
+
+async def aserpapi_search(params, timeout):
+    delay, outcome = _plan("serpapi", timeout)
+    await asyncio.sleep(delay)
+    if outcome == "timeout":
+        raise httpx.ReadTimeout("Fake SerpApi call timed out.")
+    return _serpapi_result(params, outcome)
+
+
+def stats():
+    with _lock:
+        return {"enabled": config["ENABLED"], **calls}
@@ -0,0 +1,182 @@
+"""
+سجل التوصيات الدائم (feed) في قاعدة البيانات.
+
+كل تشغيل مكتمل لخط المعالجة يُحفظ كـ RecommendationRun، وكل منشور كـ RecommendationItem
+برقم ترتيبه (position) في التشغيل. لذلك لا تضيع النتائج بإعادة التشغيل أو النشر، ويجدها
+أي عامل.
+
+- الصفحة رقم N من آخر تشغيل: استعلام واحد على نطاق position في التشغيل (الفهرس الفريد
+  run + position)، والتشغيل نفسه يُختار باستعلام فرعي في نفس الاستعلام.
+- التمرير عبر كل التشغيلات (next_cursor): keyset على (run تنازليًا، position) بفهرس
+  item_feed_keyset_idx، فلا يتباطأ مع تراكم آلاف العناصر كما يحدث مع OFFSET.
+
+قراءة صفحة قديمة لا تعيد التوليد أبدًا؛ إعادة التوليد يقررها POST فقط إذا كان آخر تشغيل
+أقدم من FRESH_FOR. لكل مستخدم ونوع يُحتفظ بآخر MAX_RUNS_PER_USER تشغيلًا فقط.
+"""
+import base64
+import binascii
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q, Subquery
+from django.utils import timezone
+
+from . import metrics
+from .models import RecommendationItem, RecommendationRun
+from .pipeline import RESULTS_PER_PAGE
+
+_options = getattr(settings, "RECOMMENDATION_FEED", {})
+# نفس مدة ذاكرة الصفحات السابقة: بعدها يولد POST توصيات جديدة
+FEED_FRESH_FOR = _options.get("FRESH_FOR", 60 * 60)
+FEED_MAX_RUNS_PER_USER = _options.get("MAX_RUNS_PER_USER", 50)
+
+KIND_RECOMMENDATIONS = RecommendationRun.KIND_RECOMMENDATIONS
+KIND_ADVANCED = RecommendationRun.KIND_ADVANCED
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def store_run(user_id, kind, signature, location_info, user_analysis_text, recommendations, search_filters=None):
+    """
+    يحفظ نتائج تشغيل مكتمل كتشغيل جديد، ويحذف التشغيلات الأقدم من الحد.
+    """
+    with metrics.timed("feed_write"), transaction.atomic():
+        run = RecommendationRun.objects.create(
+            user_id=user_id,
+            kind=kind,
+            signature=signature,
+            location=location_info,
+            filters=search_filters,
+            user_analysis=user_analysis_text or "",
+            total_items=len(recommendations),
+        )
+        RecommendationItem.objects.bulk_create(
+            [
+                RecommendationItem(
+                    run=run,
+                    user_id=user_id,
+                    signature=signature,
+                    position=position,
+                    product_link=(entry.get("product_link") or "")[:2048],
+                    entry=entry,
+                )
+                for position, entry in enumerate(recommendations)
+            ],
+            batch_size=500,
+        )
+        if FEED_MAX_RUNS_PER_USER:
+            old_runs = (
+                RecommendationRun.objects.filter(user_id=user_id, kind=kind)
+                .order_by("-created_at", "-id")
+                .values_list("id", flat=True)[FEED_MAX_RUNS_PER_USER:]
+            )
+            RecommendationRun.objects.filter(id__in=list(old_runs)).delete()
+    return run
+
+
+def _runs(user_id, kind, signature=None, fresh_for=None):
+    runs = RecommendationRun.objects.filter(user_id=user_id, kind=kind)
+    if signature is not None:
+        runs = runs.filter(signature=signature)
+    if fresh_for is not None:
+        runs = runs.filter(created_at__gte=timezone.now() - timedelta(seconds=fresh_for))
+    return runs.order_by("-created_at", "-id")
+
+
+def latest_run(user_id, kind=KIND_RECOMMENDATIONS, signature=None, fresh_for=None):
+    return _runs(user_id, kind, signature, fresh_for).first()
+
+
+def encode_cursor(signature, run_id, position):
+    payload = json.dumps({"s": signature, "r": run_id, "p": position}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return str(data["s"]), int(data["r"]), int(data["p"])
+    except (binascii.Error, UnicodeError, ValueError, TypeError, KeyError) as e:
+        raise InvalidCursor("Invalid cursor.") from e
+
+
+def _page_data(run, page, entries):
+    total_pages = (run.total_items + RESULTS_PER_PAGE - 1) // RESULTS_PER_PAGE
+    end = (page - 1) * RESULTS_PER_PAGE + len(entries)
+    return {
+        "user_analysis": run.user_analysis,
+        "recommendations": entries,
+        "current_page": page,
+        "total_pages": total_pages,
+        "has_next_page": page < total_pages,
+        "partial": False,
+        # يكمل التمرير بعد هذه الصفحة إلى التشغيلات الأقدم لنفس الطلب
+        "next_cursor": encode_cursor(run.signature, run.id, end - 1) if entries else None,
+    }
+
+
+def get_page(user_id, page, kind=KIND_RECOMMENDATIONS, signature=None, fresh_for=None):
+    """
+    الصفحة رقم page من آخر تشغيل مطابق (بنفس شكل paginate_recommendations)، أو None إذا
+    لم يوجد تشغيل. الصفحة خارج النطاق تعاد فارغة.
+    """
+    start = (page - 1) * RESULTS_PER_PAGE
+    latest = _runs(user_id, kind, signature, fresh_for).values("id")[:1]
+    items = list(
+        RecommendationItem.objects
+        .filter(run_id=Subquery(latest), position__gte=start, position__lt=start + RESULTS_PER_PAGE)
+        .select_related("run")
+        .order_by("position")
+    )
+    run = items[0].run if items else latest_run(user_id, kind, signature, fresh_for)
+    metrics.cache_result("feed", run is not None)
+    if run is None:
+        return None
+    return _page_data(run, page, [item.entry for item in items])
+
+
+def get_page_after(user_id, cursor):
+    """
+    الصفحة التالية بعد cursor عبر كل تشغيلات نفس بصمة الطلب (الأحدث أولًا).
+    """
+    signature, run_id, position = decode_cursor(cursor)
+    items = list(
+        RecommendationItem.objects
+        .filter(user_id=user_id, signature=signature)
+        .filter(Q(run_id__lt=run_id) | Q(run_id=run_id, position__gt=position))
+        .select_related("run")
+        .order_by("-run_id", "position")[:RESULTS_PER_PAGE + 1]
+    )
+    has_next = len(items) > RESULTS_PER_PAGE
+    items = items[:RESULTS_PER_PAGE]
+    return {
+        "user_analysis": items[0].run.user_analysis if items else "",
+        "recommendations": [item.entry for item in items],
+        "current_page": None,
+        "total_pages": None,
+        "has_next_page": has_next,
+        "partial": False,
+        "next_cursor": encode_cursor(signature, items[-1].run_id, items[-1].position) if has_next else None,
+    }
+
+
+def paginate_run(run, recommendations):
+    """
+    صفحات تشغيل محفوظ من نتائجه الموجودة في الذاكرة (مثل paginate_recommendations مع next_cursor).
+    """
+    return [
+        _page_data(run, page, recommendations[(page - 1) * RESULTS_PER_PAGE:page * RESULTS_PER_PAGE])
+        for page in range(1, (len(recommendations) + RESULTS_PER_PAGE - 1) // RESULTS_PER_PAGE + 1)
+    ]
+
+
+def run_pages(run):
+    """
+    كل صفحات تشغيل واحد، باستعلام واحد مرتب على الفهرس.
+    """
+    return paginate_run(run, list(run.items.order_by("position").values_list("entry", flat=True)))
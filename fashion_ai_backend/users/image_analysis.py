@@ -0,0 +1,203 @@
+"""
+تحليل ألوان صورة الملف الشخصي بتكلفة محدودة لا تعتمد على دقة الصورة.
+
+1. فك ترميز الصورة بدقة مخفضة (JPEG يُفك مباشرةً بمقياس 1/2 أو 1/4 أو 1/8)، ثم
+   تصغيرها بحيث لا يتجاوز أطول ضلع ANALYSIS_MAX_SIDE.
+2. تحديد منطقة الوجه (Haar cascade على الصورة المصغرة)، وإلا منتصف الصورة.
+3. لوحة ألوان من k لون بتكميم كل قناة إلى 4 بت وعدّ التكرارات بـ np.bincount،
+   مع دمج الألوان المتقاربة.
+4. تقدير لون البشرة من بكسلات المنطقة التي تقع في نطاق البشرة في فضاء YCrCb،
+   وتصنيفه حسب زاوية ITA في فضاء CIELAB.
+"""
+import math
+import threading
+
+import cv2
+import numpy as np
+from PIL import Image
+
+ANALYSIS_MAX_SIDE = 256
+PALETTE_SIZE = 5
+
+# كل قناة تُكمم إلى 16 مستوى، أي 4096 خانة لونية
+_QUANT_SHIFT = 4
+_QUANT_LEVELS = 256 >> _QUANT_SHIFT
+# الألوان التي تبعد أقل من هذه المسافة (RGB) عن لون مختار تُدمج معه
+_MERGE_DISTANCE = 24.0
+_MIN_SKIN_PIXELS = 64
+
+_REDUCED_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+# CascadeClassifier ليس آمنًا للاستخدام من عدة خيوط، لذلك نسخة لكل خيط
+_local = threading.local()
+
+
+def _face_detector():
+    # بعض إصدارات OpenCV لا تتضمن CascadeClassifier؛ عندها نكتفي بمنتصف الصورة
+    if not hasattr(_local, "face_detector"):
+        detector = None
+        if hasattr(cv2, "CascadeClassifier"):
+            detector = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+            if detector.empty():
+                detector = None
+        _local.face_detector = detector
+    return _local.face_detector
+
+
+def load_reduced(image_path, max_side=ANALYSIS_MAX_SIDE):
+    """
+    يقرأ الصورة بأقل دقة تكفي لـ max_side. يعيد مصفوفة BGR أو None إذا تعذرت القراءة.
+    """
+    try:
+        with Image.open(image_path) as image:
+            longest = max(image.size)
+    except Exception:
+        longest = 0
+
+    flag = cv2.IMREAD_COLOR
+    for factor, reduced_flag in _REDUCED_FLAGS:
+        if longest and longest // factor >= max_side:
+            flag = reduced_flag
+            break
+
+    img = cv2.imread(image_path, flag)
+    if img is None:
+        return None
+
+    height, width = img.shape[:2]
+    scale = max_side / max(height, width)
+    if scale < 1:
+        img = cv2.resize(img, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+    return img
+
+
+def analysis_region(img):
+    """
+    يعيد (منطقة التحليل، نوعها): داخل أكبر وجه إن وُجد، وإلا منتصف الصورة.
+    """
+    height, width = img.shape[:2]
+    detector = _face_detector()
+    faces = ()
+    if detector is not None:
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        faces = detector.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(24, 24))
+    if len(faces):
+        x, y, w, h = max(faces, key=lambda face: face[2] * face[3])
+        # الجزء الداخلي من الوجه فقط لتجنب الشعر والخلفية
+        return img[y + h // 5: y + h * 4 // 5, x + w // 5: x + w * 4 // 5], "face"
+    return img[height // 4: height * 3 // 4, width // 4: width * 3 // 4], "center"
+
+
+def extract_palette(pixels, k=PALETTE_SIZE):
+    """
+    pixels: مصفوفة (N، 3) بترتيب BGR. يعيد قائمة من (لون RGB، النسبة) مرتبة تنازليًا.
+    """
+    if not len(pixels):
+        return []
+    pixels = pixels.astype(np.int64)
+    quantized = pixels >> _QUANT_SHIFT
+    bins = (quantized[:, 0] * _QUANT_LEVELS + quantized[:, 1]) * _QUANT_LEVELS + quantized[:, 2]
+    size = _QUANT_LEVELS ** 3
+    counts = np.bincount(bins, minlength=size)
+    sums = np.stack([np.bincount(bins, weights=pixels[:, c], minlength=size) for c in range(3)], axis=1)
+
+    occupied = np.flatnonzero(counts)
+    occupied = occupied[np.argsort(counts[occupied])[::-1]]
+    means = sums[occupied] / counts[occupied, None]
+
+    chosen = []
+    for color, count in zip(means, counts[occupied]):
+        for entry in chosen:
+            if np.linalg.norm(entry["color"] - color) < _MERGE_DISTANCE:
+                entry["sum"] += color * count
+                entry["count"] += count
+                break
+        else:
+            if len(chosen) < k:
+                chosen.append({"color": color, "sum": color * count, "count": int(count)})
+
+    total = len(pixels)
+    palette = []
+    for entry in sorted(chosen, key=lambda e: -e["count"]):
+        bgr = entry["sum"] / entry["count"]
+        palette.append((bgr[::-1].round().astype(int).tolist(), entry["count"] / total))
+    return palette
+
+
+def _skin_mask(region):
+    ycrcb = cv2.cvtColor(region, cv2.COLOR_BGR2YCrCb)
+    cr = ycrcb[..., 1]
+    cb = ycrcb[..., 2]
+    return (cr >= 133) & (cr <= 173) & (cb >= 77) & (cb <= 127)
+
+
+def skin_tone_category(ita):
+    if ita > 55:
+        return "very_light"
+    if ita > 41:
+        return "light"
+    if ita > 28:
+        return "intermediate"
+    if ita > 10:
+        return "tan"
+    if ita > -30:
+        return "brown"
+    return "dark"
+
+
+def estimate_skin_tone(region):
+    """
+    يعيد لون البشرة (الوسيط) وزاوية ITA وتصنيفها، أو None إذا لم توجد بكسلات بشرة كافية.
+    """
+    skin = region[_skin_mask(region)]
+    if len(skin) < _MIN_SKIN_PIXELS:
+        return None
+    bgr = np.median(skin, axis=0).astype(np.uint8)
+    lab = cv2.cvtColor(bgr.reshape(1, 1, 3).astype(np.float32) / 255.0, cv2.COLOR_BGR2Lab)[0, 0]
+    lightness, _, b = (float(v) for v in lab)
+    ita = math.degrees(math.atan2(lightness - 50.0, b))
+    rgb = bgr[::-1].astype(int).tolist()
+    return {
+        "rgb": rgb,
+        "hex": _hex(rgb),
+        "ita": round(ita, 1),
+        "category": skin_tone_category(ita),
+        "coverage": round(len(skin) / (region.shape[0] * region.shape[1]), 3),
+    }
+
+
+def _hex(rgb):
+    return "#{:02x}{:02x}{:02x}".format(*rgb)
+
+
+def analyze_image(img, k=PALETTE_SIZE):
+    """
+    يحلل صورة BGR مصغرة مسبقًا ويعيد لوحة الألوان وتقدير لون البشرة.
+    """
+    region, region_kind = analysis_region(img)
+    if region.size == 0:
+        region, region_kind = img, "full"
+    palette = extract_palette(region.reshape(-1, 3), k)
+    return {
+        "dominant_color_rgb": palette[0][0] if palette else None,
+        "palette": [
+            {"rgb": rgb, "hex": _hex(rgb), "proportion": round(proportion, 4)}
+            for rgb, proportion in palette
+        ],
+        "skin_tone": estimate_skin_tone(region),
+        "region": region_kind,
+    }
+
+
+def analyze_profile_picture(image_path, k=PALETTE_SIZE):
+    """
+    يعيد نتيجة analyze_image لصورة على القرص، أو None إذا تعذرت قراءتها.
+    """
+    img = load_reduced(image_path)
+    if img is None:
+        return None
+    return analyze_image(img, k)
@@ -0,0 +1,325 @@
+"""
+مخزن الصور المولدة المعنون بالمحتوى (content-addressed).
+
+اسم كل صورة مشتق من بصمة ثابتة (sha256) للوصف بعد توحيده واسم النموذج، لذلك
+يعيد أي عامل أو أي تشغيل لاحق استخدام الصور الموجودة لنفس الوصف بدلاً من استدعاء
+نموذج توليد الصور مرة أخرى. (hash() في بايثون عشوائي لكل عملية ولا يصلح لذلك.)
+
+التخطيط على القرص: generated_images/<أول حرفين من البصمة>/<البصمة>_<رقم النسخة>.jpg
+الإخلاء: عند تجاوز MAX_PROMPTS وصفًا أو MAX_BYTES بايت، أو تجاوز عمر MAX_AGE_DAYS، تحذف
+الأوصاف الأقدم استخدامًا (يتم تحديث وقت التعديل عند كل إعادة استخدام، وعند حفظ حالة المؤشر
+التي تشير إليها). ما استُخدم خلال PROTECT_SECONDS لا يُحذف أبدًا.
+
+الحفظ على القرص يتم في خيوط كتابة خلف الطلب (save_variant_in_background)؛ المسار يُعاد
+فورًا، والنسخة قيد الكتابة تُعد موجودة، ومن يحتاج الملف نفسه (مثل بصمة Lens) ينتظره
+عبر wait_for_write. الصورة البديلة ملف واحد ثابت يُنشأ مرة واحدة ويُعاد استخدامه.
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+import unicodedata
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from PIL import Image
+
+from . import metrics
+
+GENERATED_IMAGES_DIR = "generated_images"
+# في جذر المجلد وليس في مجلد بصمة، لذلك لا يشمله الإخلاء
+PLACEHOLDER_PATH = os.path.join(GENERATED_IMAGES_DIR, "placeholder.jpg")
+# أقصى انتظار لكتابة نسخة قبل استخدام ملفها
+WRITE_WAIT_TIMEOUT = 10
+
+_writer = None
+_writer_pid = None
+_pending = {}
+_pending_lock = threading.Lock()
+
+
+def _writer_executor(threads):
+    # مجمع لكل عملية: خيوط العملية الأم لا تنتقل إلى العامل بعد التفرع
+    global _writer, _writer_pid
+    if _writer is None or _writer_pid != os.getpid():
+        _writer = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="image-writer")
+        _writer_pid = os.getpid()
+        _pending.clear()
+    return _writer
+
+
+def _forget_pending(absolute_path, future):
+    with _pending_lock:
+        if _pending.get(absolute_path) is future:
+            del _pending[absolute_path]
+    error = future.exception()
+    if error is not None:
+        print(f"خطأ في حفظ الصورة المولدة: {error}")
+
+
+def is_pending(absolute_path):
+    return absolute_path in _pending
+
+
+def wait_for_write(absolute_path, timeout=WRITE_WAIT_TIMEOUT):
+    """
+    ينتظر اكتمال كتابة الملف إن كانت جارية في الخلفية.
+    """
+    future = _pending.get(absolute_path)
+    if future is None:
+        return
+    try:
+        future.result(timeout=timeout)
+    except Exception:
+        # الخطأ سُجل عند انتهاء الكتابة؛ المستدعي يتحقق من وجود الملف بنفسه
+        pass
+
+_whitespace_re = re.compile(r"\s+")
+
+
+def normalize_prompt(prompt):
+    prompt = unicodedata.normalize("NFKC", prompt or "")
+    return _whitespace_re.sub(" ", prompt).strip().casefold()
+
+
+def prompt_digest(prompt, model_name):
+    payload = f"{model_name}\n{normalize_prompt(prompt)}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class GeneratedImageStore:
+    def __init__(self, root, model_name, variants=3, max_prompts=5000, max_age_days=30, evict_interval=300,
+                 writer_threads=2, max_bytes=None, protect_for=3600):
+        self.root = root
+        self.model_name = model_name
+        self.variants = variants
+        self.max_prompts = max_prompts
+        self.max_age = max_age_days * 24 * 60 * 60 if max_age_days else None
+        self.max_bytes = max_bytes
+        self.protect_for = protect_for
+        self.evict_interval = evict_interval
+        self.writer_threads = writer_threads
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self._last_eviction = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+        self._usage = None
+        self._last_scan = 0.0
+
+    @property
+    def base_dir(self):
+        return os.path.join(self.root, GENERATED_IMAGES_DIR)
+
+    def digest(self, prompt):
+        return prompt_digest(prompt, self.model_name)
+
+    def relative_path(self, digest, index):
+        return os.path.join(GENERATED_IMAGES_DIR, digest[:2], f"{digest}_{index}.jpg")
+
+    def _absolute(self, relative_path):
+        return os.path.join(self.root, relative_path)
+
+    def lock_for(self, digest):
+        """
+        قفل لكل بصمة داخل العملية حتى لا تولد عدة خيوط نفس الوصف في الوقت نفسه.
+        """
+        with self._locks_guard:
+            lock = self._locks.get(digest)
+            if lock is None:
+                lock = self._locks[digest] = threading.Lock()
+            return lock
+
+    def lookup(self, prompt, count, record=True):
+        """
+        يعيد (البصمة، المسارات النسبية الموجودة، أرقام النسخ الناقصة) لأول count نسخة.
+        """
+        count = min(count, self.variants)
+        digest = self.digest(prompt)
+        existing = []
+        missing = []
+        now = time.time()
+        for index in range(count):
+            relative_path = self.relative_path(digest, index)
+            absolute_path = self._absolute(relative_path)
+            if is_pending(absolute_path):
+                existing.append(relative_path)
+            elif os.path.exists(absolute_path):
+                existing.append(relative_path)
+                try:
+                    os.utime(absolute_path, (now, now)) # تحديث ترتيب LRU
+                except OSError:
+                    pass
+            else:
+                missing.append(index)
+        if record:
+            if missing:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return digest, existing, missing
+
+    def save_variant(self, digest, index, image):
+        """
+        يحفظ نسخة بشكل ذري (ملف مؤقت ثم إعادة تسمية) حتى لا يرى عامل آخر ملفًا ناقصًا.
+        """
+        relative_path = self.relative_path(digest, index)
+        absolute_path = self._absolute(relative_path)
+        os.makedirs(os.path.dirname(absolute_path), exist_ok=True)
+        temp_path = f"{absolute_path[:-4]}.{uuid.uuid4().hex[:8]}.tmp.jpg"
+        image.save(temp_path)
+        os.replace(temp_path, absolute_path)
+        return relative_path
+
+    def save_variant_in_background(self, digest, index, image):
+        """
+        يجدول حفظ النسخة في خيط كتابة ويعيد مسارها النسبي فورًا.
+        """
+        relative_path = self.relative_path(digest, index)
+        absolute_path = self._absolute(relative_path)
+        with _pending_lock:
+            future = _writer_executor(self.writer_threads).submit(self.save_variant, digest, index, image)
+            _pending[absolute_path] = future
+        future.add_done_callback(lambda done: _forget_pending(absolute_path, done))
+        return relative_path
+
+    def placeholder(self):
+        """
+        المسار النسبي للصورة البديلة المشتركة، ويُنشئ الملف عند أول استخدام فقط.
+        """
+        absolute_path = self._absolute(PLACEHOLDER_PATH)
+        if not os.path.exists(absolute_path):
+            os.makedirs(os.path.dirname(absolute_path), exist_ok=True)
+            temp_path = f"{absolute_path[:-4]}.{uuid.uuid4().hex[:8]}.tmp.jpg"
+            Image.new("RGB", (512, 512), (200, 200, 200)).save(temp_path)
+            os.replace(temp_path, absolute_path)
+        return PLACEHOLDER_PATH
+
+    def touch(self, absolute_paths):
+        """
+        يحدّث وقت آخر استخدام لصور ما زالت مرجعًا (مثل صور حالة التوليد بالمؤشر)، فلا يحذفها الإخلاء.
+        """
+        now = time.time()
+        for path in absolute_paths:
+            if path and path.startswith(self.base_dir + os.sep):
+                try:
+                    os.utime(path, (now, now))
+                except OSError:
+                    pass
+
+    def _scan(self):
+        """
+        {البصمة: [آخر استخدام، الحجم بالبايت، المسارات]} لكل نسخ المخزن على القرص.
+        """
+        entries = {}
+        for dirpath, _, filenames in os.walk(self.base_dir):
+            if dirpath == self.base_dir:
+                continue # الصور البديلة القديمة في الجذر ليست جزءًا من المخزن
+            for filename in filenames:
+                if not filename.endswith(".jpg") or ".tmp." in filename or "_" not in filename:
+                    continue
+                digest = filename.rsplit("_", 1)[0]
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entry = entries.setdefault(digest, [0, 0, []])
+                entry[0] = max(entry[0], stat.st_mtime)
+                entry[1] += stat.st_size
+                entry[2].append(path)
+        self._usage = {
+            "bytes": sum(entry[1] for entry in entries.values()),
+            "files": sum(len(entry[2]) for entry in entries.values()),
+            "prompts": len(entries),
+        }
+        self._last_scan = time.time()
+        return entries
+
+    def disk_usage(self):
+        """
+        استخدام القرص من آخر فحص، ويُعاد الفحص إذا مر عليه أكثر من evict_interval.
+        """
+        if self._usage is None or time.time() - self._last_scan > self.evict_interval:
+            self._scan()
+        return dict(self._usage)
+
+    def evict_if_needed(self, force=False):
+        """
+        يحذف الأوصاف الأقدم من max_age، ثم الأقدم استخدامًا حتى يعود العدد تحت max_prompts والحجم
+        تحت max_bytes. الأوصاف المستخدمة خلال protect_for ثانية لا تُحذف لأي حد، لأن روابطها قد
+        تكون في صفحات محفوظة أو في استدعاء Lens جارٍ (SerpApi يجلب الصورة من رابطها العام).
+        """
+        now = time.time()
+        if not force and now - self._last_eviction < self.evict_interval:
+            return 0
+        self._last_eviction = now
+
+        entries = self._scan()
+        ordered = sorted(entries, key=lambda digest: entries[digest][0])
+        protected_since = now - self.protect_for
+        to_evict = []
+        if self.max_age:
+            to_evict.extend((d, "age") for d in ordered if now - entries[d][0] > self.max_age)
+        expired = {d for d, _ in to_evict}
+        remaining = [d for d in ordered if d not in expired]
+        remaining_bytes = sum(entries[d][1] for d in remaining)
+        excess_prompts = len(remaining) - self.max_prompts if self.max_prompts else 0
+        for digest in remaining:
+            over_size = self.max_bytes and remaining_bytes > self.max_bytes
+            if excess_prompts <= 0 and not over_size:
+                break
+            if entries[digest][0] >= protected_since:
+                break # الباقي أحدث استخدامًا
+            if any(is_pending(path) for path in entries[digest][2]):
+                continue
+            to_evict.append((digest, "count" if excess_prompts > 0 else "size"))
+            excess_prompts -= 1
+            remaining_bytes -= entries[digest][1]
+
+        for digest, reason in to_evict:
+            for path in entries[digest][2]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._usage["bytes"] -= entries[digest][1]
+            self._usage["files"] -= len(entries[digest][2])
+            self._usage["prompts"] -= 1
+            self.evicted_bytes += entries[digest][1]
+            metrics.inc("fashion_media_evictions_total", reason=reason)
+            metrics.inc("fashion_media_evicted_bytes_total", entries[digest][1], reason=reason)
+        self.evictions += len(to_evict)
+        return len(to_evict)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evicted_prompts": self.evictions,
+            "evicted_bytes": self.evicted_bytes,
+            "variants_per_prompt": self.variants,
+            "disk": self._usage,
+        }
+
+
+def build_image_store():
+    options = getattr(settings, "GENERATED_IMAGE_STORE", {})
+    store = GeneratedImageStore(
+        root=str(settings.MEDIA_ROOT),
+        model_name=options.get("MODEL", "gemini-1.5-flash-image"),
+        variants=options.get("VARIANTS", 3),
+        max_prompts=options.get("MAX_PROMPTS", 5000),
+        max_age_days=options.get("MAX_AGE_DAYS", 30),
+        evict_interval=options.get("EVICT_INTERVAL", 300),
+        writer_threads=options.get("WRITER_THREADS", 2),
+        max_bytes=options.get("MAX_BYTES"),
+        protect_for=options.get("PROTECT_SECONDS", 60 * 60),
+    )
+    metrics.register_gauge("fashion_media_disk_bytes", lambda: store.disk_usage()["bytes"])
+    metrics.register_gauge("fashion_media_files", lambda: store.disk_usage()["files"])
+    return store
@@ -0,0 +1,291 @@
+"""
+طابور مهام توليد التوصيات المعتمد على قاعدة البيانات.
+
+طلب POST ينشئ مهمة ويعود فورًا، ويقوم مجمع عمال محلي بتنفيذها:
+- خيوط داخل عملية الويب نفسها (RECOMMENDATION_JOB_LOCAL_WORKERS)، أو
+- عملية منفصلة عبر: python manage.py run_recommendation_workers
+حتى يمكن توسيع عمال التوليد بشكل مستقل عن عمال خدمة الطلبات.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F
+from django.utils import timezone
+
+from .models import RecommendationJob
+from .rate_limits import user_scope
+from .singleflight import request_signature
+from . import feed
+from .ai_services import analyze_user_and_generate_prompts
+from .pipeline import (
+    IMAGES_PER_PROMPT,
+    RESULTS_PER_PAGE,
+    collect_products,
+    empty_result_entries,
+    iter_formatted_chunks,
+    merge_shopping_results,
+    paginate_recommendations,
+    target_post_count,
+)
+
+JOB_LOCAL_WORKERS = getattr(settings, "RECOMMENDATION_JOB_LOCAL_WORKERS", 2)
+JOB_POLL_INTERVAL = getattr(settings, "RECOMMENDATION_JOB_POLL_INTERVAL", 1.0)
+# المهام قيد التنفيذ التي لم يتحدث نبضها (updated_at) هذه المدة تعتبر متروكة (عامل توقف)
+JOB_STALE_AFTER = getattr(settings, "RECOMMENDATION_JOB_STALE_AFTER", 5 * 60)
+# مهمة متروكة بعد هذا العدد من المحاولات تفشل ولا يعاد حجزها
+JOB_MAX_ATTEMPTS = getattr(settings, "RECOMMENDATION_JOB_MAX_ATTEMPTS", 3)
+
+ACTIVE_STATUSES = (RecommendationJob.STATUS_PENDING, RecommendationJob.STATUS_RUNNING)
+
+
+class JobRequest:
+    """
+    بديل بسيط عن كائن الطلب يكفي لبناء الروابط العامة للصور المولدة داخل العامل.
+    """
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+
+    def build_absolute_uri(self, location):
+        return f"{self.base_url}/{str(location).lstrip('/')}"
+
+
+def enqueue_recommendation_job(user, location_info, base_url):
+    """
+    ينشئ مهمة توليد جديدة، أو يعيد المهمة الجارية لنفس المستخدم والموقع إن وجدت.
+    """
+    job = (
+        RecommendationJob.objects.filter(user=user, location=location_info, status__in=ACTIVE_STATUSES)
+        .order_by("-created_at")
+        .first()
+    )
+    if job is None:
+        job = RecommendationJob.objects.create(user=user, location=location_info, base_url=base_url)
+    ensure_local_workers()
+    return job
+
+
+def get_job(job_id, user_id):
+    """
+    المهمة بمعرفها لنفس المستخدم فقط، حتى لا تُقرأ نتائج مستخدم آخر بتخمين معرف متسلسل.
+    """
+    try:
+        return RecommendationJob.objects.filter(id=job_id, user_id=user_id).first()
+    except (ValueError, TypeError):
+        return None
+
+
+def get_active_job(user_id):
+    return (
+        RecommendationJob.objects.filter(user_id=user_id, status__in=ACTIVE_STATUSES)
+        .order_by("-created_at")
+        .first()
+    )
+
+
+def job_status_payload(job, page=None):
+    """
+    يبني استجابة حالة المهمة، مع الصفحة المطلوبة إن كانت قد امتلأت.
+    """
+    total_chains = max(job.total_chains, job.completed_chains)
+    payload = {
+        "job_id": job.id,
+        "status": job.status,
+        "progress": {
+            "completed_chains": job.completed_chains,
+            "total_chains": total_chains,
+            "percent": int(100 * job.completed_chains / total_chains) if total_chains else 0,
+        },
+        "available_results": len(job.recommendations),
+    }
+    if job.error:
+        payload["error"] = job.error
+
+    if page is not None:
+        finished = job.status == RecommendationJob.STATUS_DONE
+        end_index = page * RESULTS_PER_PAGE
+        # الصفحة جاهزة إذا امتلأت بالكامل، أو إذا انتهت المهمة (قد تكون الصفحة الأخيرة ناقصة)
+        if page >= 1 and (len(job.recommendations) >= end_index or finished):
+            pages = paginate_recommendations(job.user_analysis, job.recommendations)
+            if page <= len(pages):
+                page_data = dict(pages[page - 1])
+                if not finished:
+                    page_data["total_pages"] = None
+                    page_data["has_next_page"] = True
+                payload["page"] = page_data
+        payload["page_ready"] = "page" in payload
+        payload["requested_page"] = page
+    return payload
+
+
+def claim_next_job(worker_id):
+    """
+    يحجز أقدم مهمة معلقة بتحديث ذري (compare-and-set) يعمل على SQLite و PostgreSQL.
+    """
+    now = timezone.now()
+    stale = RecommendationJob.objects.filter(
+        status=RecommendationJob.STATUS_RUNNING, updated_at__lt=now - timedelta(seconds=JOB_STALE_AFTER)
+    )
+    # مهمة تُسقط عاملها في كل محاولة تفشل بدلاً من إعادة حجزها إلى الأبد
+    stale.filter(attempts__gte=JOB_MAX_ATTEMPTS).update(
+        status=RecommendationJob.STATUS_FAILED,
+        error=f"Job abandoned by its worker {JOB_MAX_ATTEMPTS} times.",
+        finished_at=now,
+    )
+    stale.update(status=RecommendationJob.STATUS_PENDING, worker="")
+
+    while True:
+        job_id = (
+            RecommendationJob.objects.filter(status=RecommendationJob.STATUS_PENDING)
+            .order_by("created_at")
+            .values_list("id", flat=True)
+            .first()
+        )
+        if job_id is None:
+            return None
+        now = timezone.now()
+        claimed = RecommendationJob.objects.filter(
+            id=job_id, status=RecommendationJob.STATUS_PENDING
+        ).update(
+            status=RecommendationJob.STATUS_RUNNING, worker=worker_id, started_at=now, updated_at=now,
+            attempts=F("attempts") + 1,
+        )
+        if claimed:
+            return RecommendationJob.objects.select_related("user").get(id=job_id)
+
+
+def run_job(job):
+    """
+    ينفذ خط المعالجة لمهمة واحدة ويحدّث تقدمها بعد كل سلسلة.
+    """
+    ai_response_str = analyze_user_and_generate_prompts(job.user, job.location)
+    if not ai_response_str:
+        _fail(job, "Failed to get analysis from AI model.")
+        return
+
+    try:
+        ai_response_json = json.loads(ai_response_str)
+        user_analysis_text = ai_response_json.get("analysis", "")
+        prompts = ai_response_json.get("prompts", [])
+    except json.JSONDecodeError:
+        _fail(job, "Failed to parse AI model response.")
+        return
+
+    # إعادة التهيئة ضرورية إذا أعيدت جدولة مهمة متروكة
+    job.user_analysis = user_analysis_text
+    job.recommendations = []
+    job.completed_chains = 0
+    job.total_chains = len(prompts) * IMAGES_PER_PROMPT
+    _save_progress(job, "user_analysis", "recommendations", "completed_chains", "total_chains")
+
+    request = JobRequest(job.base_url)
+
+    def chain_done(position):
+        job.completed_chains += 1
+        _save_progress(job, "completed_chains")
+
+    chain_results = collect_products(prompts, request, job.location, on_chain_done=chain_done)
+
+    # المنشورات تُضاف بترتيب انتهاء دفعات التنسيق حتى لا تتغير الصفحات التي تم تقديمها مسبقًا
+    products = merge_shopping_results(chain_results, job.user.budget)
+    if not products:
+        job.recommendations = empty_result_entries(chain_results)
+        _save_progress(job, "recommendations")
+    for _, posts in iter_formatted_chunks(user_analysis_text, products, target_post_count(chain_results, products)):
+        job.recommendations.extend(posts)
+        _save_progress(job, "recommendations")
+
+    feed.store_run(
+        job.user_id, feed.KIND_RECOMMENDATIONS, request_signature(job.user_id, job.location),
+        job.location, user_analysis_text, job.recommendations,
+    )
+
+    job.status = RecommendationJob.STATUS_DONE
+    job.total_chains = job.completed_chains
+    job.finished_at = timezone.now()
+    job.save(update_fields=["status", "total_chains", "finished_at"])
+
+
+def _save_progress(job, *fields):
+    # كل تقدم يحدّث النبض، فلا تُعاد جدولة مهمة ما زالت تعمل مهما طالت
+    job.updated_at = timezone.now()
+    job.save(update_fields=[*fields, "updated_at"])
+
+
+def _fail(job, message):
+    job.status = RecommendationJob.STATUS_FAILED
+    job.error = message
+    job.finished_at = timezone.now()
+    job.save(update_fields=["status", "error", "finished_at"])
+
+
+def worker_loop(worker_id=None, stop_event=None, once=False):
+    """
+    حلقة العامل: تحجز المهام وتنفذها، وتنتظر JOB_POLL_INTERVAL عند فراغ الطابور.
+    """
+    worker_id = worker_id or f"{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    while stop_event is None or not stop_event.is_set():
+        close_old_connections()
+        job = claim_next_job(worker_id)
+        if job is None:
+            if once:
+                return
+            time.sleep(JOB_POLL_INTERVAL)
+            continue
+        try:
+            with user_scope(job.user_id):
+                run_job(job)
+        except Exception as e:
+            print(f"خطأ أثناء تنفيذ مهمة التوصيات {job.id}: {e}")
+            _fail(job, str(e))
+
+
+_local_workers = []
+_local_workers_pid = None
+_local_workers_lock = threading.Lock()
+_local_workers_stop = threading.Event()
+
+
+def ensure_local_workers():
+    """
+    يشغل عمال الخيوط المحليين مرة واحدة لكل عملية (بعد تفرع gunicorn).
+    """
+    global _local_workers_pid
+    if JOB_LOCAL_WORKERS <= 0:
+        return
+    with _local_workers_lock:
+        if _local_workers_pid == os.getpid():
+            return
+        _local_workers.clear()
+        _local_workers_pid = os.getpid()
+        _local_workers_stop.clear()
+        for index in range(JOB_LOCAL_WORKERS):
+            thread = threading.Thread(
+                target=worker_loop,
+                kwargs={"worker_id": f"{os.getpid()}-local-{index}", "stop_event": _local_workers_stop},
+                name=f"recommendation-worker-{index}",
+                daemon=True,
+            )
+            thread.start()
+            _local_workers.append(thread)
+
+
+def stop_local_workers(timeout=None):
+    """
+    يوقف عمال الخيوط المحليين بعد المهمة الجارية (مثلًا قبل حذف قاعدة بيانات مؤقتة)؛
+    ensure_local_workers يشغلهم من جديد عند الحاجة.
+    """
+    global _local_workers_pid
+    with _local_workers_lock:
+        _local_workers_stop.set()
+        threads = list(_local_workers)
+        _local_workers.clear()
+        _local_workers_pid = None
+    for thread in threads:
+        thread.join(timeout)
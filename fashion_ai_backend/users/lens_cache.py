@@ -0,0 +1,217 @@
+"""
+ذاكرة نتائج Google Lens الدائمة (في قاعدة البيانات).
+
+المفتاح هو بصمة محتوى الصورة (sha256) مع hl و gl، وليس رابط الصورة، لأن الرابط قد يتغير
+بينما الصورة نفسها لا تتغير. النتيجة صالحة لمدة TTL؛ بعدها، إذا كان وضع
+stale-while-revalidate مفعلاً، تعاد النتيجة القديمة فورًا ويتم تحديثها في الخلفية
+طالما لم يتجاوز عمرها TTL + STALE_TTL.
+
+إذا لم توجد نتيجة للصورة نفسها، تُستخدم نتيجة صالحة لصورة شبه متطابقة (near_duplicates.py).
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from urllib.parse import unquote, urlparse
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+from django.utils import timezone
+
+from . import image_store, metrics, near_duplicates, product_index
+from .models import LensResultCache
+
+_options = getattr(settings, "LENS_RESULT_CACHE", {})
+LENS_CACHE_TTL = _options.get("TTL", 7 * 24 * 60 * 60)
+LENS_CACHE_STALE_WHILE_REVALIDATE = _options.get("STALE_WHILE_REVALIDATE", True)
+LENS_CACHE_STALE_TTL = _options.get("STALE_TTL", 7 * 24 * 60 * 60)
+
+FRESH = "fresh"
+STALE = "stale"
+MISS = "miss"
+
+# بصمات الملفات المحلية محفوظة حسب (المسار، وقت التعديل، الحجم) لتجنب إعادة قراءة الملف
+_file_digests = OrderedDict()
+_file_digests_lock = threading.Lock()
+_FILE_DIGESTS_MAX = 4096
+
+_refresh_executor = None
+_refreshing = set()
+_refresh_lock = threading.Lock()
+
+stats = {"fresh_hits": 0, "stale_hits": 0, "similar_hits": 0, "misses": 0, "refreshes": 0}
+
+
+def local_media_path(image_url):
+    """
+    يحول رابط صورة تحت MEDIA_URL إلى مسارها المحلي، أو None إذا لم تكن صورة محلية.
+    """
+    path = unquote(urlparse(image_url).path)
+    media_url = "/" + settings.MEDIA_URL.strip("/") + "/"
+    if not path.startswith(media_url):
+        return None
+    relative_path = os.path.normpath(path[len(media_url):])
+    if relative_path.startswith(".."):
+        return None
+    return os.path.join(str(settings.MEDIA_ROOT), relative_path)
+
+
+def file_digest(path):
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    with _file_digests_lock:
+        digest = _file_digests.get(key)
+        if digest is not None:
+            _file_digests.move_to_end(key)
+            return digest
+
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+
+    with _file_digests_lock:
+        _file_digests[key] = digest
+        while len(_file_digests) > _FILE_DIGESTS_MAX:
+            _file_digests.popitem(last=False)
+    return digest
+
+
+def image_digest_for_url(image_url):
+    """
+    بصمة محتوى الصورة إذا كانت محلية، وإلا بصمة الرابط نفسه.
+    """
+    path = local_media_path(image_url)
+    if path:
+        # الصورة المولدة قد تكون ما زالت قيد الكتابة في الخلفية
+        image_store.wait_for_write(path)
+    if path and os.path.exists(path):
+        return file_digest(path)
+    return hashlib.sha256(image_url.encode("utf-8")).hexdigest()
+
+
+def lookup(image_digest, hl, gl):
+    """
+    يعيد (الحالة، النتائج) حيث الحالة fresh أو stale أو miss.
+    """
+    entry = LensResultCache.objects.filter(image_digest=image_digest, hl=hl, gl=gl).first()
+    if entry is None:
+        stats["misses"] += 1
+        metrics.cache_result("lens", False)
+        return MISS, None
+
+    age = (timezone.now() - entry.fetched_at).total_seconds()
+    if age <= LENS_CACHE_TTL:
+        stats["fresh_hits"] += 1
+        metrics.cache_result("lens", True)
+        return FRESH, entry.shopping_results
+    if LENS_CACHE_STALE_WHILE_REVALIDATE and age <= LENS_CACHE_TTL + LENS_CACHE_STALE_TTL:
+        stats["stale_hits"] += 1
+        metrics.cache_result("lens", True)
+        return STALE, entry.shopping_results
+    stats["misses"] += 1
+    metrics.cache_result("lens", False)
+    return MISS, None
+
+
+def perceptual_signature(image_url):
+    """
+    البصمة الإدراكية للصورة إذا كانت محلية، وإلا None.
+    """
+    if not near_duplicates.NEAR_DUPLICATES_ENABLED:
+        return None
+    path = local_media_path(image_url)
+    if not path or not os.path.exists(path):
+        return None
+    return near_duplicates.signature_for_path(path)
+
+
+def lookup_similar(image_digest, hl, gl, signature):
+    """
+    نتائج صالحة (غير منتهية) لأقرب صورة شبه متطابقة، أو None.
+    """
+    digests = [digest for digest in near_duplicates.neighbors(signature, hl, gl) if digest != image_digest]
+    if not digests:
+        return None
+    entries = {
+        entry.image_digest: entry.shopping_results
+        for entry in LensResultCache.objects.filter(
+            image_digest__in=digests, hl=hl, gl=gl,
+            fetched_at__gte=timezone.now() - timedelta(seconds=LENS_CACHE_TTL),
+        )
+    }
+    for digest in digests:
+        if digest in entries:
+            stats["similar_hits"] += 1
+            metrics.cache_result("lens_similar", True)
+            return entries[digest]
+    metrics.cache_result("lens_similar", False)
+    return None
+
+
+def store(image_digest, hl, gl, shopping_results, signature=None):
+    defaults = {"shopping_results": shopping_results, "fetched_at": timezone.now()}
+    if signature:
+        defaults["phash"] = near_duplicates.to_signed(signature[0])
+        defaults["color"] = signature[1]
+    # الحفظ اختياري: فشله (مثل database is locked تحت الضغط) لا يجب أن يضيع نتيجة دُفع ثمنها
+    try:
+        LensResultCache.objects.update_or_create(
+            image_digest=image_digest,
+            hl=hl,
+            gl=gl,
+            defaults=defaults,
+        )
+    except DatabaseError as e:
+        print(f"خطأ في حفظ نتائج Google Lens: {e}")
+        metrics.fallback("lens_cache_write")
+    else:
+        near_duplicates.remember(image_digest, hl, gl, signature)
+    try:
+        product_index.index_products(shopping_results, hl, gl)
+    except Exception as e:
+        print(f"خطأ في فهرسة منتجات Google Lens: {e}")
+
+
+def refresh_in_background(image_digest, hl, gl, fetch):
+    """
+    يحدّث نتيجة قديمة في الخلفية مرة واحدة فقط لكل بصمة في العملية.
+    fetch تعيد (النتائج، هل يمكن تخزينها).
+    """
+    global _refresh_executor
+    refresh_key = (image_digest, hl, gl)
+    with _refresh_lock:
+        if refresh_key in _refreshing:
+            return
+        _refreshing.add(refresh_key)
+        if _refresh_executor is None:
+            _refresh_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="lens-refresh")
+
+    def refresh():
+        try:
+            shopping_results, cacheable = fetch()
+            if cacheable:
+                store(image_digest, hl, gl, shopping_results)
+                stats["refreshes"] += 1
+        except Exception as e:
+            print(f"خطأ في تحديث نتائج Google Lens في الخلفية: {e}")
+        finally:
+            with _refresh_lock:
+                _refreshing.discard(refresh_key)
+            close_old_connections()
+
+    _refresh_executor.submit(refresh)
+
+
+def purge_expired():
+    """
+    يحذف النتائج التي تجاوزت مدة الصلاحية ومدة السماح بالنتائج القديمة.
+    """
+    max_age = LENS_CACHE_TTL + (LENS_CACHE_STALE_TTL if LENS_CACHE_STALE_WHILE_REVALIDATE else 0)
+    deleted, _ = LensResultCache.objects.filter(
+        fetched_at__lt=timezone.now() - timedelta(seconds=max_age)
+    ).delete()
+    return deleted
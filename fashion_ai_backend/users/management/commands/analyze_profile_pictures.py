@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from users.models import CustomUser
+from users.profile_analysis import analyze_user_picture
+
+
+class Command(BaseCommand):
+    help = "Compute and store profile-picture analysis for users that have a picture but no stored analysis."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="Re-check every user with a picture (unchanged pictures are skipped by digest).")
+
+    def handle(self, *args, **options):
+        users = CustomUser.objects.exclude(profile_picture="").exclude(profile_picture__isnull=True)
+        if not options["all"]:
+            users = users.filter(picture_analysis__isnull=True)
+        analyzed = 0
+        for user_id in users.values_list("id", flat=True).iterator():
+            if analyze_user_picture(user_id) is not None:
+                analyzed += 1
+        self.stdout.write(f"Analyzed {analyzed} profile picture(s).")
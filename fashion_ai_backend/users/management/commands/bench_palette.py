@@ -0,0 +1,67 @@
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from users.image_analysis import analyze_profile_picture
+
+DEFAULT_SIZES = ["640x480", "1920x1080", "4032x3024"]
+
+
+def _legacy_analysis(image_path):
+    # التحليل القديم: kmeans على كل بكسلات الصورة بدقتها الكاملة
+    img = cv2.imread(image_path)
+    pixels = np.float32(img.reshape(-1, 3))
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 200, 0.1)
+    _, _, palette = cv2.kmeans(pixels, 1, None, criteria, 10, cv2.KMEANS_RANDOM_CENTERS)
+    return palette[0].astype(int)[::-1].tolist()
+
+
+def _synthetic_photo(width, height, seed=0):
+    # خلفية متدرجة مع شكل بيضاوي بلون بشرة وضوضاء، لتقريب صورة شخصية حقيقية
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    img = np.empty((height, width, 3), dtype=np.uint8)
+    img[..., 0] = (120 + 80 * x / width).astype(np.uint8)
+    img[..., 1] = (90 + 60 * y / height).astype(np.uint8)
+    img[..., 2] = 70
+    cv2.ellipse(img, (width // 2, height // 2), (width // 6, height // 4), 0, 0, 360, (120, 150, 200), -1)
+    noise = rng.integers(-12, 12, size=img.shape, dtype=np.int16)
+    return np.clip(img.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+
+class Command(BaseCommand):
+    help = "Benchmark profile-picture color analysis across image sizes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", nargs="+", default=DEFAULT_SIZES, help="Image sizes as WIDTHxHEIGHT.")
+        parser.add_argument("--repeat", type=int, default=5, help="Runs per size (median is reported).")
+        parser.add_argument("--legacy", action="store_true", help="Also time the old full-resolution kmeans analysis.")
+
+    def handle(self, *args, **options):
+        repeat = max(1, options["repeat"])
+        with tempfile.TemporaryDirectory() as tmp:
+            for size in options["sizes"]:
+                width, height = (int(v) for v in size.lower().split("x"))
+                path = os.path.join(tmp, f"{size}.jpg")
+                cv2.imwrite(path, _synthetic_photo(width, height), [cv2.IMWRITE_JPEG_QUALITY, 90])
+
+                timings = []
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    result = analyze_profile_picture(path)
+                    timings.append(time.perf_counter() - started)
+                line = (
+                    f"{size:>10}  {os.path.getsize(path) / 1024:8.0f} KiB  "
+                    f"palette: {np.median(timings) * 1000:8.1f} ms  "
+                    f"(region={result['region']}, skin={result['skin_tone'] and result['skin_tone']['category']})"
+                )
+
+                if options["legacy"]:
+                    started = time.perf_counter()
+                    _legacy_analysis(path)
+                    line += f"  legacy kmeans: {(time.perf_counter() - started) * 1000:8.1f} ms"
+                self.stdout.write(line)
@@ -0,0 +1,438 @@
+import json
+import math
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import cv2
+import requests
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.test import Client
+from django.test.utils import override_settings
+
+from users import (
+    deadlines, fake_providers, image_store, jobs, metrics, near_duplicates, pipeline, product_index, profile_analysis,
+    rate_limits,
+)
+from users.ai_services import generated_image_store
+from users.management.commands.bench_palette import _synthetic_photo
+
+ENDPOINTS = ["register", "analyze-profile-picture", "recommendations", "advanced-search"]
+PROVIDERS = ("gemini", "gemini_image", "serpapi")
+LOCATIONS = ["الرياض", "جدة", "دبي", "القاهرة"]
+SKIN_COLORS = ["حنطي", "فاتح", "أسمر", "زيتوني"]
+SEARCH_FILTERS = [
+    {"color": "أزرق", "style": "كاجوال"},
+    {"color": "أسود", "style": "رسمي"},
+    {"color": "بيج", "occasion": "صيف"},
+]
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class _ClientTransport:
+    """
+    Django test client داخل نفس العملية (عميل لكل خيط لأن Client ليس آمنًا بين الخيوط).
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _client(self):
+        if not hasattr(self._local, "client"):
+            # أخطاء الواجهات تُحسب كردود 500 بدلاً من إيقاف القياس
+            self._local.client = Client(raise_request_exception=False)
+        return self._local.client
+
+    def post(self, path, data, files=None):
+        if files:
+            response = self._client().post(path, {**data, **files})
+        else:
+            response = self._client().post(path, json.dumps(data), content_type="application/json")
+        return response.status_code, _json(response.content)
+
+    def get(self, path, params=None):
+        response = self._client().get(path, params or {})
+        return response.status_code, response.content
+
+
+class _HttpTransport:
+    """
+    طلبات HTTP حقيقية إلى خادم يعمل (داخل العملية أو عبر --url).
+    """
+
+    def __init__(self, base_url, pool_size):
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def post(self, path, data, files=None):
+        if files:
+            files = {name: (f.name, f.read(), f.content_type) for name, f in files.items()}
+            response = self.session.post(self.base_url + path, data=data, files=files, timeout=120)
+        else:
+            response = self.session.post(self.base_url + path, json=data, timeout=120)
+        return response.status_code, _json(response.content)
+
+    def get(self, path, params=None):
+        response = self.session.get(self.base_url + path, params=params, timeout=120)
+        return response.status_code, response.content
+
+
+def _json(content):
+    try:
+        return json.loads(content)
+    except ValueError:
+        return {}
+
+
+def _drain_background_work():
+    """
+    ينتظر العمل الذي يستمر بعد الرد (تحليل الصورة، إكمال الطلبات الجزئية، حفظ الصور المولدة)
+    قبل حذف قاعدة البيانات و MEDIA_ROOT المؤقتين. كل مجمع يُنشأ من جديد عند أول استخدام لاحق.
+    """
+    for module, attribute in (
+        (pipeline, "_executor"),
+        (deadlines, "_background_executor"),
+        (profile_analysis, "_executor"),
+        (image_store, "_writer"),
+    ):
+        executor = getattr(module, attribute)
+        if executor is not None:
+            setattr(module, attribute, None)
+            executor.shutdown(wait=True)
+
+
+@contextmanager
+def _scratch_environment(keep):
+    """
+    قاعدة بيانات اختبار، و MEDIA_ROOT، وذاكرة التوصيات، وحالة محدد المعدل، ولقطات المقاييس،
+    كلها في مجلد مؤقت؛ فلا يلمس القياس المحلي db.sqlite3 ولا media ولا cache الحقيقية.
+    يُحذف كل ذلك بعد القياس إلا مع keep.
+    """
+    scratch = tempfile.mkdtemp(prefix="bench_pipeline-")
+    media_root = os.path.join(scratch, "media")
+    database = settings.DATABASES[DEFAULT_DB_ALIAS]
+    old_test_settings = database.get("TEST", {})
+    if database["ENGINE"].endswith("sqlite3"):
+        # ملف وليس ذاكرة مشتركة، لأن الخيوط والخادم المحلي يفتحون اتصالاتهم الخاصة
+        database["TEST"] = {**old_test_settings, "NAME": os.path.join(scratch, "db.sqlite3")}
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    saved = (generated_image_store.root, rate_limits.RATE_LIMITS_PATH, rate_limits._local, metrics.METRICS_DIR)
+    scratch_caches = {
+        **settings.CACHES,
+        "recommendations": {**settings.CACHES["recommendations"], "LOCATION": os.path.join(scratch, "recommendations")},
+    }
+    try:
+        with override_settings(MEDIA_ROOT=media_root, CACHES=scratch_caches):
+            generated_image_store.root = media_root
+            rate_limits.RATE_LIMITS_PATH = os.path.join(scratch, "rate_limits.sqlite3")
+            # اتصالات الخيوط المحفوظة تشير إلى الملف الحقيقي
+            rate_limits._local = threading.local()
+            metrics.METRICS_DIR = os.path.join(scratch, "metrics")
+            yield scratch
+    finally:
+        # عمال المهام المحليون يستعلمون قاعدة البيانات باستمرار
+        jobs.stop_local_workers(timeout=30)
+        _drain_background_work()
+        generated_image_store.root, rate_limits.RATE_LIMITS_PATH, rate_limits._local, metrics.METRICS_DIR = saved
+        connections.close_all()
+        if keep:
+            settings.DATABASES[DEFAULT_DB_ALIAS]["NAME"] = old_name
+            connection.settings_dict["NAME"] = old_name
+        else:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            shutil.rmtree(scratch, ignore_errors=True)
+        database["TEST"] = old_test_settings
+
+
+def _percentile(sorted_values, fraction):
+    # طريقة nearest-rank
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+
+def _provider_calls(transport):
+    """
+    مجموع fashion_provider_calls_total لكل مزود من واجهة المقاييس (كل النتائج، بما فيها الأخطاء).
+    """
+    status, content = transport.get("/api/metrics/")
+    totals = dict.fromkeys(PROVIDERS, 0)
+    if status != 200:
+        return totals
+    for line in content.decode("utf-8").splitlines():
+        if not line.startswith("fashion_provider_calls_total{"):
+            continue
+        labels, value = line.rsplit(" ", 1)
+        for provider in PROVIDERS:
+            if f'provider="{provider}"' in labels:
+                totals[provider] += float(value)
+    return totals
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark register/, analyze-profile-picture/, recommendations/ and advanced-search/ "
+        "against local fake providers, through the Django test client or a real HTTP server. "
+        "Reports throughput, p50/p95/p99 latency and provider calls per request."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=10, help="Simulated users (one request per endpoint each).")
+        parser.add_argument("--concurrency", type=int, default=4, help="Requests in flight at once.")
+        parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=ENDPOINTS,
+                            help="Endpoints to report (register always runs to create the users).")
+        parser.add_argument("--server", action="store_true",
+                            help="Serve the project on a local threaded WSGI server and send real HTTP requests.")
+        parser.add_argument("--url", help="Benchmark an already running server (e.g. started with "
+                                          "FASHION_FAKE_PROVIDERS=1); the fake provider options below do not apply "
+                                          "and the users are created in that server's database.")
+        parser.add_argument("--async-views", action="store_true",
+                            help="Send recommendations/ and advanced-search/ to their async/ variants "
+                                 "(answered inline; compare under ASGI and WSGI).")
+        parser.add_argument("--real-providers", action="store_true", help="Call the real Gemini and SerpApi APIs.")
+        parser.add_argument("--gemini-latency", type=float, help="Fake Gemini text latency in seconds.")
+        parser.add_argument("--image-latency", type=float, help="Fake Gemini image latency in seconds.")
+        parser.add_argument("--serpapi-latency", type=float, help="Fake SerpApi latency in seconds.")
+        parser.add_argument("--error-rate", type=float, help="Fraction of fake provider calls that fail.")
+        parser.add_argument("--throttle-rate", type=float, help="Fraction of fake provider calls answered with 429.")
+        parser.add_argument("--shopping-results", type=int, help="Fake Lens results per image.")
+        parser.add_argument("--image-size", type=int, help="Fake generated image size in pixels.")
+        parser.add_argument("--seed", type=int, help="Seed for fake latencies and failures.")
+        parser.add_argument("--cold", action="store_true",
+                            help="Unique locations and prompts per user, no product index and no near-duplicate "
+                                 "Lens reuse, so shared caches never hit.")
+        parser.add_argument("--no-rate-limits", action="store_true", help="Disable the provider rate limiter.")
+        parser.add_argument("--job-timeout", type=float, default=180, help="Give up on a recommendation job after N seconds.")
+        parser.add_argument("--poll-interval", type=float, default=0.2, help="Seconds between job status polls.")
+        parser.add_argument("--settle", type=float, default=0,
+                            help="Wait before reading metrics after each phase (use the metrics FLUSH_INTERVAL "
+                                 "when --url points at several workers).")
+        parser.add_argument("--keep-data", action="store_true",
+                            help="Keep the scratch database, media and cache directory afterwards.")
+        parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+
+    def handle(self, *args, **options):
+        if options["users"] < 1 or options["concurrency"] < 1:
+            raise CommandError("--users and --concurrency must be positive.")
+        local = not options["url"]
+        if local:
+            self._configure_providers(options)
+            if options["no_rate_limits"]:
+                rate_limits.RATE_LIMITS_ENABLED = False
+            if options["cold"]:
+                # فهرس المنتجات والصور شبه المتطابقة يعيدان نتائج سابقة، فلا يبقى القياس باردًا
+                product_index.PRODUCT_INDEX_ENABLED = False
+                near_duplicates.NEAR_DUPLICATES_ENABLED = False
+
+        run_id = uuid.uuid4().hex[:8]
+        if options["url"]:
+            report = self._run(_HttpTransport(options["url"], options["concurrency"]), run_id, options)
+        else:
+            with _scratch_environment(options["keep_data"]) as scratch:
+                report = self._run_local(run_id, options)
+            if options["keep_data"]:
+                self.stderr.write(f"Scratch data kept in {scratch}")
+
+        if options["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self._print_report(report, options)
+
+    def _run_local(self, run_id, options):
+        server = None
+        # الخادم المحلي يُستدعى عبر 127.0.0.1، والعميل الداخلي عبر testserver
+        with override_settings(ALLOWED_HOSTS=["*"]):
+            try:
+                if options["server"]:
+                    server = ThreadedWSGIServer(("127.0.0.1", 0), _QuietHandler)
+                    server.set_app(WSGIHandler())
+                    threading.Thread(target=server.serve_forever, daemon=True).start()
+                    transport = _HttpTransport(f"http://127.0.0.1:{server.server_address[1]}", options["concurrency"])
+                else:
+                    transport = _ClientTransport()
+                return self._run(transport, run_id, options)
+            finally:
+                if server is not None:
+                    server.shutdown()
+                    server.server_close()
+
+    def _configure_providers(self, options):
+        config = fake_providers.config
+        config["ENABLED"] = not options["real_providers"]
+        latencies = {
+            "gemini": options["gemini_latency"],
+            "gemini_image": options["image_latency"],
+            "serpapi": options["serpapi_latency"],
+        }
+        config["LATENCY"] = {**config["LATENCY"], **{k: v for k, v in latencies.items() if v is not None}}
+        for option, key in (
+            ("error_rate", "ERROR_RATE"),
+            ("throttle_rate", "THROTTLE_RATE"),
+            ("shopping_results", "SHOPPING_RESULTS"),
+            ("image_size", "IMAGE_SIZE"),
+            ("seed", "SEED"),
+        ):
+            if options[option] is not None:
+                config[key] = options[option]
+        if options["seed"] is not None:
+            fake_providers._rng.seed(options["seed"])
+        config["UNIQUE_PROMPTS"] = options["cold"]
+
+    def _run(self, transport, run_id, options):
+        _, picture = cv2.imencode(".jpg", _synthetic_photo(640, 800), [cv2.IMWRITE_JPEG_QUALITY, 90])
+        users = [self._user_fields(run_id, index, options["cold"]) for index in range(options["users"])]
+        phases = {}
+
+        def register(user):
+            upload = SimpleUploadedFile(f"{user['username']}.jpg", picture.tobytes(), "image/jpeg")
+            fields = {k: v for k, v in user.items() if k not in ("location", "filters")}
+            status, body = transport.post("/api/register/", fields, files={"profile_picture": upload})
+            user["id"] = body.get("id")
+            return status == 201 and user["id"] is not None
+
+        def analyze(user):
+            status, _ = transport.post("/api/analyze-profile-picture/", {"user_id": user["id"]})
+            return status == 200
+
+        def recommend(user):
+            return self._recommendations(transport, user, options)
+
+        def advanced_search(user):
+            status, _ = transport.post(f"/api/advanced-search/{'async/' if options['async_views'] else ''}", {
+                "user_id": user["id"], "location": user["location"], "filters": user["filters"],
+            })
+            return status == 200
+
+        steps = {
+            "register": register,
+            "analyze-profile-picture": analyze,
+            "recommendations": recommend,
+            "advanced-search": advanced_search,
+        }
+        for endpoint in ENDPOINTS:
+            if endpoint != "register" and endpoint not in options["endpoints"]:
+                continue
+            targets = users if endpoint == "register" else [user for user in users if user.get("id")]
+            phases[endpoint] = self._phase(transport, steps[endpoint], targets, options)
+        return {
+            "mode": "url" if options["url"] else "server" if options["server"] else "client",
+            "users": options["users"],
+            "concurrency": options["concurrency"],
+            "views": "async" if options["async_views"] else "sync",
+            "fake_providers": None if options["url"] else fake_providers.config["ENABLED"],
+            "endpoints": {name: phase for name, phase in phases.items() if name in options["endpoints"]},
+        }
+
+    def _user_fields(self, run_id, index, cold):
+        return {
+            "username": f"bench-{run_id}-{index}",
+            "email": f"bench-{run_id}-{index}@example.com",
+            "password": uuid.uuid4().hex,
+            "height": 155 + index * 7 % 40,
+            "weight": 50 + index * 11 % 45,
+            "skin_color": SKIN_COLORS[index % len(SKIN_COLORS)],
+            "location": f"{LOCATIONS[index % len(LOCATIONS)]} {run_id}-{index}" if cold else LOCATIONS[index % len(LOCATIONS)],
+            "filters": SEARCH_FILTERS[index % len(SEARCH_FILTERS)],
+        }
+
+    def _recommendations(self, transport, user, options):
+        """
+        POST يعيد مهمة (202)؛ الزمن المقاس حتى جاهزية الصفحة الأولى، ثم ننتظر اكتمال المهمة
+        خارج القياس حتى لا تتسرب استدعاءاتها إلى المرحلة التالية.
+        """
+        path = "/api/recommendations/async/" if options["async_views"] else "/api/recommendations/"
+        # النسخة غير المتزامنة ترد بالصفحة الأولى مباشرة (200) بدلاً من مهمة
+        status, body = transport.post(path, {"user_id": user["id"], "location": user["location"]})
+        if status == 200:
+            return True
+        if status != 202 or not body.get("job_id"):
+            return False
+        params = {"user_id": user["id"], "job_id": body["job_id"], "page": 1}
+        give_up_at = time.monotonic() + options["job_timeout"]
+        page_ready = None
+        while time.monotonic() < give_up_at:
+            status, content = transport.get("/api/recommendations/", params)
+            payload = _json(content)
+            if status == 500 or payload.get("status") == "failed":
+                return False if page_ready is None else page_ready
+            if page_ready is None and status == 200 and payload.get("page_ready"):
+                page_ready = time.perf_counter()
+            if payload.get("status") == "done":
+                return page_ready if page_ready is not None else False
+            time.sleep(options["poll_interval"])
+        return False if page_ready is None else page_ready
+
+    def _phase(self, transport, step, targets, options):
+        calls_before = _provider_calls(transport)
+        latencies = []
+        errors = 0
+
+        def timed(target):
+            started = time.perf_counter()
+            result = step(target)
+            # الخطوة تعيد True، أو وقت انتهاء القياس إذا استمرت بعده (انتظار اكتمال المهمة)
+            finished = result if isinstance(result, float) else time.perf_counter()
+            return bool(result), finished - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options["concurrency"]) as executor:
+            for ok, elapsed in executor.map(timed, targets):
+                latencies.append(elapsed)
+                errors += not ok
+        wall = time.perf_counter() - started
+
+        if options["settle"]:
+            time.sleep(options["settle"])
+        calls_after = _provider_calls(transport)
+        latencies.sort()
+        count = len(latencies)
+        return {
+            "requests": count,
+            "errors": errors,
+            "throughput": count / wall if wall else 0.0,
+            "p50_ms": _percentile(latencies, 0.50) * 1000,
+            "p95_ms": _percentile(latencies, 0.95) * 1000,
+            "p99_ms": _percentile(latencies, 0.99) * 1000,
+            "calls_per_request": {
+                provider: (calls_after[provider] - calls_before[provider]) / count if count else 0.0
+                for provider in PROVIDERS
+            },
+        }
+
+    def _print_report(self, report, options):
+        providers = "fake providers" if report["fake_providers"] else "real providers"
+        if report["fake_providers"] is None:
+            providers = "providers of the remote server"
+        self.stdout.write(
+            f"mode={report['mode']}  views={report['views']}  users={report['users']}  "
+            f"concurrency={report['concurrency']}  {providers}"
+            f"{'  cold caches' if options['cold'] else ''}"
+        )
+        self.stdout.write(
+            f"{'endpoint':<24}{'req':>5}{'err':>5}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+            f"  calls/req ({', '.join(PROVIDERS)})"
+        )
+        for name, phase in report["endpoints"].items():
+            calls = ", ".join(f"{phase['calls_per_request'][provider]:.2f}" for provider in PROVIDERS)
+            self.stdout.write(
+                f"{name:<24}{phase['requests']:>5}{phase['errors']:>5}{phase['throughput']:>8.2f}"
+                f"{phase['p50_ms']:>9.0f}{phase['p95_ms']:>9.0f}{phase['p99_ms']:>9.0f}  {calls}"
+            )
+
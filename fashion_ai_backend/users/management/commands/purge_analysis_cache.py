@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from users.analysis_cache import purge_expired
+
+
+class Command(BaseCommand):
+    help = "Delete cached Gemini profile analyses that are past their TTL."
+
+    def handle(self, *args, **options):
+        deleted = purge_expired()
+        self.stdout.write(f"Deleted {deleted} expired analysis variant(s).")
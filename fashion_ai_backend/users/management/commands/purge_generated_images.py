@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from users.ai_services import generated_image_store
+
+
+class Command(BaseCommand):
+    help = "Evict generated images past MAX_AGE_DAYS, MAX_PROMPTS or MAX_BYTES (least recently used first)."
+
+    def handle(self, *args, **options):
+        evicted = generated_image_store.evict_if_needed(force=True)
+        usage = generated_image_store.disk_usage()
+        self.stdout.write(
+            f"Evicted {evicted} prompt(s), {generated_image_store.evicted_bytes} byte(s). "
+            f"Now {usage['prompts']} prompt(s), {usage['files']} file(s), {usage['bytes']} byte(s)."
+        )
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from users.lens_cache import purge_expired
+
+
+class Command(BaseCommand):
+    help = "Delete cached Google Lens results that are past their TTL and stale window."
+
+    def handle(self, *args, **options):
+        deleted = purge_expired()
+        self.stdout.write(f"Deleted {deleted} expired Lens result(s).")
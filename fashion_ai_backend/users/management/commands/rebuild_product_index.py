@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from users.product_index import purge_expired, rebuild_from_lens_cache
+
+
+class Command(BaseCommand):
+    help = "Index products from stored Google Lens results and delete indexed products past MAX_AGE."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--purge-only", action="store_true", help="Only delete expired indexed products.")
+
+    def handle(self, *args, **options):
+        if not options["purge_only"]:
+            indexed = rebuild_from_lens_cache()
+            self.stdout.write(f"Indexed {indexed} product(s) from stored Lens results.")
+        deleted = purge_expired()
+        self.stdout.write(f"Deleted {deleted} expired indexed product(s).")
@@ -0,0 +1,25 @@
+import threading
+
+from django.core.management.base import BaseCommand
+
+from users.jobs import worker_loop
+
+
+class Command(BaseCommand):
+    help = "Run recommendation generation workers that consume the database-backed job queue."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=2, help="Number of worker threads.")
+        parser.add_argument("--once", action="store_true", help="Exit when the queue is empty.")
+
+    def handle(self, *args, **options):
+        workers = max(1, options["workers"])
+        self.stdout.write(f"Starting {workers} recommendation worker(s)...")
+        threads = [
+            threading.Thread(target=worker_loop, kwargs={"once": options["once"]}, name=f"recommendation-worker-{i}")
+            for i in range(workers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
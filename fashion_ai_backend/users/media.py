@@ -0,0 +1,153 @@
+"""
+تقديم الصور المولدة (MEDIA_ROOT/generated_images) في كل البيئات وليس مع DEBUG فقط.
+
+الصور المولدة يجب أن تبقى متاحة برابطها العام، لأن SerpApi يجلبها منه لبحث Google Lens.
+بقية MEDIA_ROOT (صور الملف الشخصي) ليست عامة: لا يقدمها هذا العرض أبدًا.
+- ETag قوي من بصمة محتوى الملف (lens_cache.file_digest، محفوظة في الذاكرة)، و Last-Modified،
+  والرد 304 على If-None-Match أو If-Modified-Since.
+- Cache-Control طويل (GENERATED_MAX_AGE)، لأن محتوى كل ملف ثابت لبصمة وصفه.
+- نطاق واحد في Range يُرد بـ 206 (مع If-Range)، والنطاق خارج الملف بـ 416. عدة نطاقات تُرسل الملف كاملًا.
+- الملف الكامل عبر FileResponse، فيستخدم الخادم wsgi.file_wrapper (sendfile) حيث يدعمه.
+  مع ACCEL_REDIRECT يرد العرض بالرؤوس فقط ويرسل nginx البايتات (ونطاقاتها) بنفسه، فلا يبقى
+  عامل بايثون مشغولًا طوال التنزيل.
+"""
+import mimetypes
+import os
+import re
+import stat
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+from . import image_store, lens_cache, metrics
+
+_options = getattr(settings, "MEDIA_SERVING", {})
+GENERATED_MAX_AGE = _options.get("GENERATED_MAX_AGE", 30 * 24 * 60 * 60)
+# بادئة location داخلية (internal) في nginx تشير إلى MEDIA_ROOT، مثل "/protected-media/"
+ACCEL_REDIRECT = _options.get("ACCEL_REDIRECT")
+CHUNK_SIZE = _options.get("CHUNK_SIZE", 64 * 1024)
+
+_range_re = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def parse_range(header, size):
+    """
+    (البداية، النهاية شاملة) لنطاق واحد، أو None إذا لم يكن نطاقًا واحدًا صالح الصيغة (فيُرسل
+    الملف كاملًا). يرفع ValueError إذا كان النطاق خارج الملف.
+    """
+    match = _range_re.match(header.strip()) if header else None
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        suffix = int(last)
+        if suffix == 0 or size == 0:
+            raise ValueError("Unsatisfiable range.")
+        return max(0, size - suffix), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise ValueError("Unsatisfiable range.")
+    return start, min(int(last), size - 1) if last else size - 1
+
+
+def _not_modified(request, etag, mtime):
+    # If-None-Match يتقدم على If-Modified-Since إذا وُجد الاثنان
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    since = parse_http_date_safe(request.headers.get("If-Modified-Since", ""))
+    return since is not None and int(mtime) <= since
+
+
+def _with_headers(response, etag, mtime):
+    response["Cache-Control"] = f"public, max-age={GENERATED_MAX_AGE}" if GENERATED_MAX_AGE else "no-cache"
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(mtime)
+    response["Accept-Ranges"] = "bytes"
+    metrics.inc("fashion_media_responses_total", status=str(response.status_code))
+    return response
+
+
+def _file_chunks(path, start, length):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+@require_safe
+def serve_media(request, path):
+    try:
+        absolute_path = safe_join(str(settings.MEDIA_ROOT), path)
+    except SuspiciousFileOperation:
+        raise Http404("Not found.")
+    relative_path = os.path.relpath(absolute_path, str(settings.MEDIA_ROOT)).replace(os.sep, "/")
+    # صور الملف الشخصي وغيرها ليست عامة، حتى لو وصل الطلب إلى هذا العرض بمسار آخر
+    if not relative_path.startswith(image_store.GENERATED_IMAGES_DIR + "/"):
+        raise Http404("Not found.")
+    if ".tmp." in os.path.basename(absolute_path):
+        raise Http404("Not found.")
+    # الصورة المولدة قد تُطلب (من SerpApi مثلًا) قبل انتهاء حفظها في الخلفية
+    image_store.wait_for_write(absolute_path)
+    try:
+        file_stat = os.stat(absolute_path)
+        if not stat.S_ISREG(file_stat.st_mode):
+            raise Http404("Not found.")
+        etag = f'"{lens_cache.file_digest(absolute_path)[:32]}"'
+    except OSError:
+        raise Http404("Not found.")
+    mtime = file_stat.st_mtime
+
+    if _not_modified(request, etag, mtime):
+        return _with_headers(HttpResponseNotModified(), etag, mtime)
+
+    content_type = mimetypes.guess_type(absolute_path)[0] or "application/octet-stream"
+    if ACCEL_REDIRECT:
+        # nginx يرسل الملف ويطبق Range بنفسه؛ الرؤوس هنا تصل كما هي
+        response = HttpResponse(content_type=content_type)
+        response["X-Accel-Redirect"] = ACCEL_REDIRECT.rstrip("/") + "/" + quote(relative_path)
+        return _with_headers(response, etag, mtime)
+
+    size = file_stat.st_size
+    byte_range = None
+    if_range = request.headers.get("If-Range")
+    if "Range" in request.headers and (if_range is None or if_range == etag):
+        try:
+            byte_range = parse_range(request.headers["Range"], size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return _with_headers(response, etag, mtime)
+
+    start, end = byte_range or (0, size - 1)
+    if request.method == "HEAD":
+        response = HttpResponse(content_type=content_type, status=206 if byte_range else 200)
+        response["Content-Length"] = str(end - start + 1)
+    elif byte_range:
+        response = StreamingHttpResponse(
+            _file_chunks(absolute_path, start, end - start + 1), status=206, content_type=content_type
+        )
+        response["Content-Length"] = str(end - start + 1)
+    else:
+        try:
+            response = FileResponse(open(absolute_path, "rb"), content_type=content_type)
+        except OSError:
+            # حُذف بالإخلاء بين الفحص والفتح
+            raise Http404("Not found.")
+    if byte_range:
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return _with_headers(response, etag, mtime)
@@ -0,0 +1,358 @@
+"""
+مقاييس خط معالجة التوصيات بصيغة Prometheus النصية (api/metrics/).
+
+التسجيل في المسار الساخن عملية على قاموس في الذاكرة تحت قفل واحد. كل عملية تكتب لقطة من
+مقاييسها إلى ملف <pid>-<وقت البدء>.json في METRICS_DIR كل FLUSH_INTERVAL ثانية على الأكثر
+(وعند طلب المقاييس)، والواجهة تجمع ملفات كل العمال؛ لذلك لا تعتمد القيم على العامل الذي
+استقبل طلب Prometheus. وقت البدء في الاسم يمنع عاملًا جديدًا أعيد له رقم pid قديم من الكتابة
+فوق لقطة العامل المتوقف.
+
+كل PRUNE_INTERVAL ثانية تُضم لقطات العمال المتوقفين (pid غير موجود، أو pid العامل الحالي بوقت
+بدء مختلف) إلى ملف archive.json وتُحذف، تحت قفل ملف، فلا تتراكم الملفات ولا تتراجع العدادات.
+الأرشيف يحفظ أسماء اللقطات التي ضمها حتى لا تُحسب مرتين إذا توقف الضم قبل حذفها.
+
+المقاييس:
+- fashion_stage_duration_seconds{stage}: زمن كل مرحلة (histogram)، بعد انتظار دورها.
+- fashion_stage_wait_seconds{stage}: انتظار مكان في حد التزامن للمرحلة.
+- fashion_stage_errors_total{stage}: المراحل التي انتهت باستثناء.
+- fashion_provider_calls_total{provider,outcome}: الاستدعاءات الخارجية (ok أو error أو throttled).
+- fashion_provider_call_duration_seconds{provider}: زمن الاستدعاء الخارجي.
+- fashion_fallbacks_total{kind}: صورة بديلة، فشل قراءة JSON، منشورات بدون تنسيق.
+- fashion_cache_requests_total{cache,result}: إصابات وإخفاقات كل ذاكرة مؤقتة.
+- fashion_partial_responses_total: الردود التي قطعها موعد الطلب.
+- fashion_prompt_tokens_total{kind,type}: الرموز المقدرة المرسلة إلى Gemini (sent) والموفرة (saved)، انظر prompts.py.
+- fashion_media_disk_bytes و fashion_media_files: حجم الصور المولدة على القرص وعدد ملفاتها (gauge).
+- fashion_media_evictions_total{reason} و fashion_media_evicted_bytes_total{reason}: الإخلاء (age أو count أو size).
+- fashion_media_responses_total{status}: ردود ملفات MEDIA_URL (200 أو 206 أو 304 أو 416)، انظر media.py.
+
+مقاييس gauge تُحسب عند القراءة بدالة مسجلة (register_gauge) ولا تُجمع من لقطات العمال،
+لأنها تصف موردًا مشتركًا مثل القرص.
+"""
+import fcntl
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+_options = getattr(settings, "PIPELINE_METRICS", {})
+METRICS_ENABLED = _options.get("ENABLED", True)
+METRICS_DIR = str(_options.get("DIR", os.path.join(settings.BASE_DIR, "cache", "metrics")))
+FLUSH_INTERVAL = _options.get("FLUSH_INTERVAL", 5)
+PRUNE_INTERVAL = _options.get("PRUNE_INTERVAL", 300)
+
+ARCHIVE_FILENAME = "archive.json"
+_snapshot_name_re = re.compile(r"^(\d+)(?:-(\d+))?\.json$")
+
+# حدود خانات الزمن بالثواني؛ مراحل هذا الخط تتراوح بين أجزاء من الثانية وعشرات الثواني
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+_HELP = {
+    "fashion_stage_duration_seconds": ("histogram", "Time spent in each pipeline stage."),
+    "fashion_stage_wait_seconds": ("histogram", "Time waiting for a pipeline stage concurrency slot."),
+    "fashion_stage_errors_total": ("counter", "Pipeline stages that raised an exception."),
+    "fashion_provider_calls_total": ("counter", "Outbound calls to Gemini and SerpApi."),
+    "fashion_provider_call_duration_seconds": ("histogram", "Duration of outbound provider calls."),
+    "fashion_fallbacks_total": ("counter", "Fallbacks such as dummy images or unparsed model output."),
+    "fashion_cache_requests_total": ("counter", "Cache lookups by cache and result."),
+    "fashion_partial_responses_total": ("counter", "Responses cut short by the request deadline."),
+    "fashion_prompt_tokens_total": ("counter", "Estimated prompt tokens sent to Gemini and saved by compact prompts."),
+    "fashion_media_disk_bytes": ("gauge", "Bytes used by generated images on disk."),
+    "fashion_media_files": ("gauge", "Generated image files on disk."),
+    "fashion_media_evictions_total": ("counter", "Generated image prompts evicted, by reason."),
+    "fashion_media_evicted_bytes_total": ("counter", "Bytes freed by generated image eviction, by reason."),
+    "fashion_media_responses_total": ("counter", "Media file responses by status code."),
+}
+
+_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_gauges = {}
+_last_flush = 0.0
+_last_prune = 0.0
+# (pid، وقت البدء بالمللي ثانية) للعملية الحالية؛ يتجدد بعد fork
+_worker = (None, None)
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, amount=1, **labels):
+    if not METRICS_ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+    _maybe_flush()
+
+
+def observe(name, value, **labels):
+    if not METRICS_ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            # عدادات الخانات (غير تراكمية)، ثم خانة +Inf، ثم المجموع
+            histogram = _histograms[key] = [0] * (len(DURATION_BUCKETS) + 1) + [0.0]
+        for index, bound in enumerate(DURATION_BUCKETS):
+            if value <= bound:
+                break
+        else:
+            index = len(DURATION_BUCKETS)
+        histogram[index] += 1
+        histogram[-1] += value
+    _maybe_flush()
+
+
+@contextmanager
+def timed(stage):
+    """
+    يسجل زمن المرحلة، ويعد الاستثناءات التي تخرج منها.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        inc("fashion_stage_errors_total", stage=stage)
+        raise
+    finally:
+        observe("fashion_stage_duration_seconds", time.perf_counter() - started, stage=stage)
+
+
+def register_gauge(name, callback):
+    _gauges[name] = callback
+
+
+def fallback(kind):
+    inc("fashion_fallbacks_total", kind=kind)
+
+
+def cache_result(cache, hit):
+    inc("fashion_cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+
+def _snapshot():
+    with _lock:
+        return {
+            "counters": [[name, list(labels), value] for (name, labels), value in _counters.items()],
+            "histograms": [[name, list(labels), list(values)] for (name, labels), values in _histograms.items()],
+        }
+
+
+def _snapshot_filename():
+    global _worker
+    pid = os.getpid()
+    if _worker[0] != pid:
+        _worker = (pid, int(time.time() * 1000))
+    return f"{_worker[0]}-{_worker[1]}.json"
+
+
+def _write_json(path, data):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def flush():
+    global _last_flush
+    with _flush_lock:
+        _last_flush = time.monotonic()
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        _write_json(os.path.join(METRICS_DIR, _snapshot_filename()), _snapshot())
+        if time.monotonic() - _last_prune >= PRUNE_INTERVAL:
+            prune()
+
+
+def _maybe_flush():
+    if time.monotonic() - _last_flush < FLUSH_INTERVAL or _flush_lock.locked():
+        return
+    try:
+        flush()
+    except OSError as e:
+        print(f"خطأ في حفظ المقاييس: {e}")
+
+
+def _merge(snapshot, counters, histograms):
+    for name, labels, value in snapshot.get("counters", []):
+        key = (name, tuple(tuple(pair) for pair in labels))
+        counters[key] = counters.get(key, 0) + value
+    for name, labels, values in snapshot.get("histograms", []):
+        key = (name, tuple(tuple(pair) for pair in labels))
+        total = histograms.setdefault(key, [0] * len(values))
+        for index, value in enumerate(values):
+            total[index] += value
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _is_dead(filename):
+    """
+    هل اللقطة لعامل توقف؟ pid لا يعمل، أو هو pid العملية الحالية لكن بوقت بدء مختلف.
+    إذا أعيد pid لعملية أخرى غير العامل تبقى لقطته حتى يتوقف ذلك pid، وقيمها صحيحة في الحالتين.
+    """
+    match = _snapshot_name_re.match(filename)
+    pid = int(match.group(1))
+    if pid == _worker[0]:
+        return filename != _snapshot_filename()
+    return not _pid_alive(pid)
+
+
+def prune():
+    """
+    يضم لقطات العمال المتوقفين إلى الأرشيف ويحذفها. القفل يمنع عاملين من ضم نفس اللقطة.
+    """
+    global _last_prune
+    _last_prune = time.monotonic()
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    with open(os.path.join(METRICS_DIR, ".lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        archive_path = os.path.join(METRICS_DIR, ARCHIVE_FILENAME)
+        try:
+            archive = _read_json(archive_path) or {}
+        except ValueError as e:
+            # لا يُستبدل أرشيف تالف بأرشيف فارغ فتضيع عداداته
+            print(f"خطأ في قراءة أرشيف المقاييس: {e}")
+            return 0
+        names = set(os.listdir(METRICS_DIR))
+        # لقطات ضُمت في مرة سابقة توقفت قبل حذفها: تُحذف الآن، وتُنسى في المرة التالية
+        folded = [name for name in archive.get("folded", []) if name in names]
+        dead = [
+            name for name in sorted(names)
+            if _snapshot_name_re.match(name) and name not in folded and _is_dead(name)
+        ]
+        if not dead and not folded and not archive.get("folded"):
+            return 0
+        counters, histograms = {}, {}
+        _merge(archive, counters, histograms)
+        for name in dead:
+            try:
+                snapshot = _read_json(os.path.join(METRICS_DIR, name))
+            except ValueError:
+                snapshot = None
+            if snapshot is not None:
+                _merge(snapshot, counters, histograms)
+                folded.append(name)
+        _write_json(archive_path, {
+            "counters": [[name, list(labels), value] for (name, labels), value in counters.items()],
+            "histograms": [[name, list(labels), values] for (name, labels), values in histograms.items()],
+            "folded": folded,
+        })
+        for name in folded:
+            try:
+                os.remove(os.path.join(METRICS_DIR, name))
+            except FileNotFoundError:
+                pass
+    return len(dead)
+
+
+def _collect():
+    """
+    يجمع لقطات كل العمال والأرشيف: العدادات والخانات تُجمع بالجمع.
+    """
+    counters = {}
+    histograms = {}
+    try:
+        names = os.listdir(METRICS_DIR)
+    except FileNotFoundError:
+        names = []
+    snapshots = []
+    for filename in names:
+        if filename != ARCHIVE_FILENAME and not _snapshot_name_re.match(filename):
+            continue
+        try:
+            snapshot = _read_json(os.path.join(METRICS_DIR, filename))
+        except (OSError, ValueError):
+            continue
+        if snapshot is not None:
+            snapshots.append((filename, snapshot))
+    folded = set()
+    for filename, snapshot in snapshots:
+        if filename == ARCHIVE_FILENAME:
+            folded.update(snapshot.get("folded", []))
+    for filename, snapshot in snapshots:
+        # لقطة ضُمت إلى الأرشيف ولم تُحذف بعد
+        if filename not in folded:
+            _merge(snapshot, counters, histograms)
+    return counters, histograms
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_number(value):
+    if isinstance(value, float) and not value.is_integer():
+        return repr(value)
+    return str(int(value))
+
+
+def render():
+    """
+    نص Prometheus (الإصدار 0.0.4) لمجموع مقاييس كل العمال.
+    """
+    if METRICS_ENABLED:
+        try:
+            flush()
+        except OSError as e:
+            print(f"خطأ في حفظ المقاييس: {e}")
+    counters, histograms = _collect()
+
+    lines = []
+    for metric, (kind, help_text) in _HELP.items():
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {kind}")
+        if kind == "gauge":
+            callback = _gauges.get(metric)
+            if callback is not None:
+                try:
+                    lines.append(f"{metric} {_format_number(callback())}")
+                except OSError as e:
+                    print(f"خطأ في قراءة المقياس {metric}: {e}")
+            continue
+        if kind == "counter":
+            for (name, labels), value in sorted(counters.items()):
+                if name == metric:
+                    lines.append(f"{metric}{_format_labels(labels)} {_format_number(value)}")
+            continue
+        for (name, labels), values in sorted(histograms.items()):
+            if name != metric:
+                continue
+            cumulative = 0
+            for bound, count in zip(DURATION_BUCKETS, values):
+                cumulative += count
+                lines.append(f"{metric}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+            cumulative += values[len(DURATION_BUCKETS)]
+            lines.append(f"{metric}_bucket{_format_labels(labels, [('le', '+Inf')])} {cumulative}")
+            lines.append(f"{metric}_sum{_format_labels(labels)} {_format_number(values[-1])}")
+            lines.append(f"{metric}_count{_format_labels(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.7 on 2026-10-17 17:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_recommendationjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LensResultCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('image_digest', models.CharField(max_length=64)),
+                ('hl', models.CharField(max_length=10)),
+                ('gl', models.CharField(max_length=10)),
+                ('shopping_results', models.JSONField(blank=True, default=list)),
+                ('fetched_at', models.DateTimeField()),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('image_digest', 'hl', 'gl'), name='unique_lens_result_per_image_locale')],
+            },
+        ),
+    ]
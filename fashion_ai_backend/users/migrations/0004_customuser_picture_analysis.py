@@ -0,0 +1,28 @@
+# Generated by Django 5.2.7 on 2026-10-17 17:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_lensresultcache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='picture_analysis',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='picture_analyzed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='picture_digest',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.7 on 2026-10-17 17:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_customuser_picture_analysis'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalysisCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket_key', models.CharField(max_length=64)),
+                ('kind', models.CharField(max_length=20)),
+                ('variant', models.PositiveSmallIntegerField(default=0)),
+                ('bucket', models.JSONField(blank=True, default=dict)),
+                ('response', models.TextField()),
+                ('served', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField()),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('bucket_key', 'variant'), name='unique_analysis_variant_per_bucket')],
+            },
+        ),
+    ]
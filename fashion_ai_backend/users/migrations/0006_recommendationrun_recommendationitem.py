@@ -0,0 +1,57 @@
+# Generated by Django 5.2.7 on 2026-10-17 17:55
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_analysiscacheentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecommendationRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('recommendations', 'Recommendations'), ('advanced', 'Advanced search')], default='recommendations', max_length=20)),
+                ('signature', models.CharField(max_length=64)),
+                ('location', models.CharField(default='Not provided', max_length=255)),
+                ('filters', models.JSONField(blank=True, null=True)),
+                ('user_analysis', models.TextField(blank=True, default='')),
+                ('total_items', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommendation_runs', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RecommendationItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('signature', models.CharField(max_length=64)),
+                ('position', models.PositiveIntegerField()),
+                ('product_link', models.CharField(blank=True, default='', max_length=2048)),
+                ('entry', models.JSONField(default=dict)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommendation_items', to=settings.AUTH_USER_MODEL)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='users.recommendationrun')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='recommendationrun',
+            index=models.Index(fields=['user', 'kind', '-created_at'], name='run_user_kind_latest_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recommendationrun',
+            index=models.Index(fields=['user', 'signature', '-created_at'], name='run_user_signature_latest_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recommendationitem',
+            index=models.Index(fields=['user', 'signature', '-run', 'position'], name='item_feed_keyset_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='recommendationitem',
+            constraint=models.UniqueConstraint(fields=('run', 'position'), name='unique_item_position_per_run'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.7 on 2026-10-17 18:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_recommendationrun_recommendationitem'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndexedProduct',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_key', models.CharField(max_length=64)),
+                ('hl', models.CharField(max_length=10)),
+                ('gl', models.CharField(max_length=10)),
+                ('product', models.JSONField(default=dict)),
+                ('garment', models.CharField(blank=True, default='', max_length=30)),
+                ('color', models.CharField(blank=True, default='', max_length=30)),
+                ('fabric', models.CharField(blank=True, default='', max_length=30)),
+                ('price', models.FloatField(blank=True, null=True)),
+                ('source', models.CharField(blank=True, default='', max_length=255)),
+                ('seen_count', models.PositiveIntegerField(default=1)),
+                ('last_seen_at', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['hl', 'gl', 'garment', 'color'], name='product_attributes_idx'), models.Index(fields=['last_seen_at'], name='product_last_seen_idx')],
+                'constraints': [models.UniqueConstraint(fields=('product_key', 'hl', 'gl'), name='unique_indexed_product_per_locale')],
+            },
+        ),
+    ]
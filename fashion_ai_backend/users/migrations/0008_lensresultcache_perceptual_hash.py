@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-17 18:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0007_indexedproduct'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lensresultcache',
+            name='color',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='lensresultcache',
+            name='phash',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-17 18:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0008_lensresultcache_perceptual_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recommendationjob',
+            name='attempts',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='recommendationjob',
+            name='updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -12,8 +12,197 @@ class CustomUser(AbstractUser):
     budget = models.CharField(max_length=50, null=True, blank=True)
     profile_picture = models.ImageField(upload_to=r'profile_pics/', null=True, blank=True)
     phone = models.CharField(max_length=20, null=True, blank=True)
+    # تحليل صورة الملف الشخصي (لوحة الألوان ولون البشرة) يُحسب مرة واحدة عند تغيير الصورة
+    picture_analysis = models.JSONField(null=True, blank=True)
+    picture_digest = models.CharField(max_length=64, null=True, blank=True)
+    picture_analyzed_at = models.DateTimeField(null=True, blank=True)
 
+    PICTURE_ANALYSIS_FIELDS = ("picture_analysis", "picture_digest", "picture_analyzed_at")
+
+    def save(self, *args, **kwargs):
+        # التحليل يكتبه خيط الخلفية بـ update()؛ حفظ لا يغير الصورة من نسخة حُملت قبله
+        # لا يعيد كتابة حقول التحليل (فيمسحها بقيم قديمة)
+        picture_name = self.profile_picture.name if self.profile_picture else ""
+        unchanged = picture_name == getattr(self, "_original_picture_name", picture_name)
+        if not self._state.adding and unchanged and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.PICTURE_ANALYSIS_FIELDS
+            ]
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.username
 
+
+class RecommendationJob(models.Model):
+    """
+    مهمة توليد توصيات في طابور داخل قاعدة البيانات (بدون وسيط خارجي).
+    """
+    STATUS_PENDING = "pending"
+    STATUS_RUNNING = "running"
+    STATUS_DONE = "done"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = (
+        (STATUS_PENDING, "Pending"),
+        (STATUS_RUNNING, "Running"),
+        (STATUS_DONE, "Done"),
+        (STATUS_FAILED, "Failed"),
+    )
+
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name="recommendation_jobs")
+    location = models.CharField(max_length=255, default="Not provided")
+    base_url = models.CharField(max_length=255) # لبناء الروابط العامة للصور المولدة خارج الطلب
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    user_analysis = models.TextField(blank=True, default="")
+    recommendations = models.JSONField(default=list, blank=True)
+    total_chains = models.IntegerField(default=0)
+    completed_chains = models.IntegerField(default=0)
+    error = models.TextField(blank=True, default="")
+    worker = models.CharField(max_length=100, blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # نبض العامل: يتحدث مع كل تقدم، والمهمة بلا نبض حديث تعتبر متروكة
+    updated_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.IntegerField(default=0)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "created_at"]),
+            models.Index(fields=["user", "status"]),
+        ]
+
+    def __str__(self):
+        return f"RecommendationJob {self.id} ({self.status})"
+
+class LensResultCache(models.Model):
+    """
+    نتائج Google Lens مخزنة حسب بصمة محتوى الصورة، حتى لا يتكرر استدعاء SerpApi لنفس الصورة.
+    """
+    image_digest = models.CharField(max_length=64)
+    hl = models.CharField(max_length=10)
+    gl = models.CharField(max_length=10)
+    shopping_results = models.JSONField(default=list, blank=True)
+    fetched_at = models.DateTimeField()
+    # بصمة الصورة الإدراكية (dHash في 64 بت بإشارة) ولونها الغالب (RGB مضغوط) لإعادة استخدام النتائج
+    # للصور شبه المتطابقة (users/near_duplicates.py)؛ فارغة للصور غير المحلية
+    phash = models.BigIntegerField(null=True, blank=True)
+    color = models.IntegerField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["image_digest", "hl", "gl"], name="unique_lens_result_per_image_locale"),
+        ]
+
+    def __str__(self):
+        return f"LensResultCache {self.image_digest[:12]} ({self.hl}/{self.gl})"
+
+
+class AnalysisCacheEntry(models.Model):
+    """
+    تحليل Gemini وأوصاف الصور لمجموعة (bucket) من المستخدمين ذوي البيانات المتقاربة.
+    لكل مجموعة عدة نسخ (variant) تُقدم بالتناوب حتى لا يحصل الجميع على نفس الأوصاف.
+    """
+    bucket_key = models.CharField(max_length=64)
+    kind = models.CharField(max_length=20) # basic أو advanced
+    variant = models.PositiveSmallIntegerField(default=0)
+    bucket = models.JSONField(default=dict, blank=True) # القيم الموحدة، للمراجعة فقط
+    response = models.TextField()
+    served = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["bucket_key", "variant"], name="unique_analysis_variant_per_bucket"),
+        ]
+
+    def __str__(self):
+        return f"AnalysisCacheEntry {self.kind} {self.bucket_key[:12]}#{self.variant}"
+
+
+class RecommendationRun(models.Model):
+    """
+    تشغيل واحد لخط المعالجة (توصيات أو بحث متقدم) ونتائجه المحفوظة في RecommendationItem.
+    signature هو بصمة الطلب (المستخدم والموقع والفلاتر) من request_signature.
+    """
+    KIND_RECOMMENDATIONS = "recommendations"
+    KIND_ADVANCED = "advanced"
+    KIND_CHOICES = (
+        (KIND_RECOMMENDATIONS, "Recommendations"),
+        (KIND_ADVANCED, "Advanced search"),
+    )
+
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name="recommendation_runs")
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default=KIND_RECOMMENDATIONS)
+    signature = models.CharField(max_length=64)
+    location = models.CharField(max_length=255, default="Not provided")
+    filters = models.JSONField(null=True, blank=True)
+    user_analysis = models.TextField(blank=True, default="")
+    total_items = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # آخر تشغيل للمستخدم من كل نوع، أو لبصمة طلب معينة
+            models.Index(fields=["user", "kind", "-created_at"], name="run_user_kind_latest_idx"),
+            models.Index(fields=["user", "signature", "-created_at"], name="run_user_signature_latest_idx"),
+        ]
+
+    def __str__(self):
+        return f"RecommendationRun {self.id} ({self.kind}, {self.total_items} items)"
+
+
+class RecommendationItem(models.Model):
+    """
+    عنصر واحد من نتائج التشغيل (منشور ومنتجه، أو رسالة توضيحية) بترتيبه في الصفحات.
+    """
+    run = models.ForeignKey(RecommendationRun, on_delete=models.CASCADE, related_name="items")
+    # user و signature منسوخان من التشغيل حتى يخدم فهرس واحد الصفحات عبر كل التشغيلات
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name="recommendation_items")
+    signature = models.CharField(max_length=64)
+    position = models.PositiveIntegerField()
+    product_link = models.CharField(max_length=2048, blank=True, default="")
+    entry = models.JSONField(default=dict) # المنشور كما يُعاد في الاستجابة
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["run", "position"], name="unique_item_position_per_run"),
+        ]
+        indexes = [
+            # keyset: الأحدث تشغيلًا أولًا، ثم بالترتيب داخل التشغيل
+            models.Index(fields=["user", "signature", "-run", "position"], name="item_feed_keyset_idx"),
+        ]
+
+    def __str__(self):
+        return f"RecommendationItem {self.run_id}#{self.position}"
+
+
+class IndexedProduct(models.Model):
+    """
+    منتج واحد من نتائج Google Lens السابقة مع الصفات المستخرجة من عنوانه (users/product_index.py)،
+    حتى يُجاب البحث المتقدم من المنتجات الموجودة قبل استدعاء المزودين.
+    """
+    product_key = models.CharField(max_length=64) # sha256 للرابط الموحد، أو للمتجر والعنوان
+    hl = models.CharField(max_length=10)
+    gl = models.CharField(max_length=10)
+    product = models.JSONField(default=dict) # كما في shopping_results
+    garment = models.CharField(max_length=30, blank=True, default="")
+    color = models.CharField(max_length=30, blank=True, default="")
+    fabric = models.CharField(max_length=30, blank=True, default="")
+    price = models.FloatField(null=True, blank=True)
+    source = models.CharField(max_length=255, blank=True, default="") # اسم المتجر الموحد
+    seen_count = models.PositiveIntegerField(default=1)
+    last_seen_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["product_key", "hl", "gl"], name="unique_indexed_product_per_locale"),
+        ]
+        indexes = [
+            models.Index(fields=["hl", "gl", "garment", "color"], name="product_attributes_idx"),
+            models.Index(fields=["last_seen_at"], name="product_last_seen_idx"),
+        ]
+
+    def __str__(self):
+        return f"IndexedProduct {self.product_key[:12]} ({self.garment or '-'}/{self.color or '-'})"
@@ -0,0 +1,206 @@
+"""
+فهرس البصمات الإدراكية للصور التي لها نتائج Google Lens محفوظة.
+
+الصور المولدة لأوصاف متقاربة تخرج كثيرًا شبه متطابقة (نفس القطعة ونفس الخلفية)، لكن
+بصمة المحتوى (sha256) تختلف بأي بكسل. لذلك تُحفظ لكل صورة محلية بصمة dHash من 64 بت
+(اتجاه التدرج بين البكسلات المتجاورة في صورة رمادية 9×8) مع متوسط لون وسط الصورة، لأن
+البصمة الرمادية وحدها لا تفرق بين نفس البنطال بلونين. dHash أثبت على الخلفيات المسطحة من
+pHash، الذي تتقلب بتاته مع ضغط JPEG عندما تتقارب معاملات DCT من الوسيط.
+قبل استدعاء Lens لصورة جديدة يُبحث عن أقرب الصور بمسافة Hamming لا تتجاوز
+MAX_DISTANCE وفرق لون لا يتجاوز MAX_COLOR_DISTANCE، وتُعاد نتائج أقربها الصالحة.
+
+الفهرس في الذاكرة لكل عملية (ولكل hl/gl): مصفوفات NumPy تُحسب عليها المسافات لكل الصور دفعة واحدة
+(XOR ثم bitwise_count)، فيبقى البحث أقل من ملّي ثانية تقريبًا حتى مع مئات الآلاف من الصور.
+يُحمّل من LensResultCache عند أول استخدام، ثم تُضاف الصفوف الجديدة كل REFRESH_INTERVAL.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from PIL import Image
+
+from .models import LensResultCache
+
+_options = getattr(settings, "NEAR_DUPLICATE_LENS", {})
+NEAR_DUPLICATES_ENABLED = _options.get("ENABLED", True)
+MAX_DISTANCE = _options.get("MAX_DISTANCE", 4)               # من 64 بت
+MAX_COLOR_DISTANCE = _options.get("MAX_COLOR_DISTANCE", 30)  # مسافة إقليدية في RGB
+CANDIDATES = _options.get("CANDIDATES", 5)
+REFRESH_INTERVAL = _options.get("REFRESH_INTERVAL", 10)
+
+# البصمات محفوظة حسب (المسار، وقت التعديل، الحجم) كما في lens_cache.file_digest
+_signatures = OrderedDict()
+_signatures_lock = threading.Lock()
+_SIGNATURES_MAX = 4096
+
+stats = {"lookups": 0, "neighbors_found": 0}
+
+
+def to_signed(value):
+    # BigIntegerField بإشارة؛ البصمة تُحفظ بنفس بتاتها
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def compute_signature(image):
+    """
+    (dHash كعدد بدون إشارة، متوسط لون وسط الصورة مضغوطًا في 24 بت).
+    """
+    gray = np.asarray(image.convert("L").resize((9, 8), Image.BOX), dtype=np.float32)
+    bits = (gray[:, 1:] > gray[:, :-1]).flatten()
+    phash = int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+    rgb = image.convert("RGB")
+    width, height = rgb.size
+    center = rgb.crop((width // 4, height // 4, width * 3 // 4, height * 3 // 4)).resize((16, 16))
+    r, g, b = (int(round(c)) for c in np.asarray(center, dtype=np.float32).reshape(-1, 3).mean(axis=0))
+    return phash, (r << 16) | (g << 8) | b
+
+
+def signature_for_path(path):
+    """
+    بصمة ملف صورة محلي، أو None إذا تعذرت قراءته.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    with _signatures_lock:
+        signature = _signatures.get(key)
+        if signature is not None:
+            _signatures.move_to_end(key)
+            return signature
+
+    try:
+        with Image.open(path) as image:
+            signature = compute_signature(image)
+    except (OSError, ValueError) as e:
+        print(f"خطأ في حساب البصمة الإدراكية للصورة {path}: {e}")
+        return None
+
+    with _signatures_lock:
+        _signatures[key] = signature
+        while len(_signatures) > _SIGNATURES_MAX:
+            _signatures.popitem(last=False)
+    return signature
+
+
+class HashIndex:
+    """
+    مصفوفتان متوازيتان (البصمة، اللون) لكل لغة/منطقة، تنموان بالمضاعفة. الإضافة تحت القفل،
+    والبحث يعمل على نسخة من المراجع فلا ينتظر الإضافات.
+    """
+
+    def __init__(self, capacity=1024):
+        self._lock = threading.Lock()
+        self._hashes = np.zeros(capacity, dtype=np.uint64)
+        self._colors = np.zeros((capacity, 3), dtype=np.int16)
+        self._digests = []
+        self._positions = {}
+
+    def __len__(self):
+        return len(self._digests)
+
+    def add(self, image_digest, phash, color):
+        with self._lock:
+            position = self._positions.get(image_digest)
+            if position is None:
+                position = len(self._digests)
+                if position == len(self._hashes):
+                    self._hashes = np.concatenate([self._hashes, np.zeros_like(self._hashes)])
+                    self._colors = np.concatenate([self._colors, np.zeros_like(self._colors)])
+                self._positions[image_digest] = position
+                self._digests.append(image_digest)
+            self._hashes[position] = np.uint64(phash & 0xFFFFFFFFFFFFFFFF)
+            self._colors[position] = ((color >> 16) & 0xFF, (color >> 8) & 0xFF, color & 0xFF)
+
+    def nearest(self, phash, color, max_distance, max_color_distance, limit):
+        """
+        بصمات محتوى أقرب الصور (الأقرب أولًا) ضمن حدي المسافة واللون.
+        """
+        with self._lock:
+            size = len(self._digests)
+            hashes, colors, digests = self._hashes, self._colors, self._digests
+        if not size:
+            return []
+
+        distances = np.bitwise_count(hashes[:size] ^ np.uint64(phash & 0xFFFFFFFFFFFFFFFF))
+        candidates = np.flatnonzero(distances <= max_distance)
+        if not candidates.size:
+            return []
+        rgb = np.array(((color >> 16) & 0xFF, (color >> 8) & 0xFF, color & 0xFF), dtype=np.int32)
+        color_distances = ((colors[candidates].astype(np.int32) - rgb) ** 2).sum(axis=1)
+        candidates = candidates[color_distances <= max_color_distance ** 2]
+        order = candidates[np.argsort(distances[candidates], kind="stable")][:limit]
+        return [digests[i] for i in order]
+
+
+# فهرس لكل (hl، gl) حتى لا تُقارن الصور بنتائج لغة أو منطقة أخرى
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def _index_for(hl, gl, create=False):
+    with _indexes_lock:
+        index = _indexes.get((hl, gl))
+        if index is None and create:
+            index = _indexes[(hl, gl)] = HashIndex()
+        return index
+
+
+_loaded_id = 0
+_loaded_at = None
+_load_lock = threading.Lock()
+
+
+def _refresh():
+    """
+    يضيف صفوف LensResultCache الجديدة (ذات البصمة) التي أضافتها عمليات أخرى.
+    """
+    global _loaded_id, _loaded_at
+    if _loaded_at is not None and time.monotonic() - _loaded_at < REFRESH_INTERVAL:
+        return
+    with _load_lock:
+        if _loaded_at is not None and time.monotonic() - _loaded_at < REFRESH_INTERVAL:
+            return
+        rows = (
+            LensResultCache.objects.filter(id__gt=_loaded_id, phash__isnull=False)
+            .order_by("id")
+            .values_list("id", "image_digest", "hl", "gl", "phash", "color")
+        )
+        for entry_id, image_digest, hl, gl, phash, color in rows.iterator(chunk_size=5000):
+            _index_for(hl, gl, create=True).add(image_digest, phash, color or 0)
+            _loaded_id = entry_id
+        _loaded_at = time.monotonic()
+
+
+def remember(image_digest, hl, gl, signature):
+    """
+    يضيف صورة خُزنت نتائجها للتو إلى فهرس هذه العملية دون انتظار التحديث.
+    """
+    if NEAR_DUPLICATES_ENABLED and signature:
+        _index_for(hl, gl, create=True).add(image_digest, signature[0], signature[1])
+
+
+def neighbors(signature, hl, gl):
+    """
+    بصمات محتوى أقرب CANDIDATES صورة شبه متطابقة لها نتائج Lens محفوظة.
+    """
+    if not NEAR_DUPLICATES_ENABLED or not signature:
+        return []
+    _refresh()
+    stats["lookups"] += 1
+    index = _index_for(hl, gl)
+    found = index.nearest(signature[0], signature[1], MAX_DISTANCE, MAX_COLOR_DISTANCE, CANDIDATES) if index else []
+    if found:
+        stats["neighbors_found"] += 1
+    return found
+
+
+def index_stats():
+    with _indexes_lock:
+        indexed_images = sum(len(index) for index in _indexes.values())
+    return {**stats, "indexed_images": indexed_images}
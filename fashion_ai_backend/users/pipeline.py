@@ -0,0 +1,692 @@
+"""
+خط معالجة التوصيات: وصف ← صور مولدة ← بحث Google Lens ← تنسيق المنشورات.
+
+كل سلسلة (صورة ← Lens ← تنسيق) مستقلة عن غيرها، لذلك يتم تنفيذ السلاسل
+بالتوازي داخل مجمع خيوط (thread pool) مع حد أقصى لعدد الاستدعاءات المتزامنة
+لكل مرحلة، بحيث يقترب زمن الطلب من زمن أبطأ سلسلة بدلاً من مجموع الأزمنة.
+ترتيب النتائج النهائي ثابت (حسب ترتيب الوصف ثم ترتيب الصورة).
+
+في المسار العادي لا تُنسق كل صورة وحدها: تُدمج منتجات كل الصور (بعد إزالة المكرر
+وترتيبها، انظر ranking.py) ثم تُنسق في استدعاء
+Gemini واحد (أو بضع دفعات إذا تجاوزت القائمة ميزانية الرموز)، ويشير كل منشور إلى منتجه
+بمعرف قصير بدلاً من إعادة كتابة الروابط. البث (SSE) وحده يبقي التنسيق لكل سلسلة
+لأن زمن أول نتيجة هو الأهم هناك.
+
+في البحث المتقدم تُقيّم الفلاتر أولًا على فهرس المنتجات المحلي (product_index.py)، وإذا
+طابقها عدد كافٍ من المنتجات تُنسق مباشرة دون توليد صور ولا استدعاء Lens.
+
+إذا كان هناك موعد للطلب (deadlines.py)، تتوقف كل مرحلة عن الانتظار عند انتهائه، وتحتفظ
+مرحلة البحث بهامش FORMAT_RESERVE ثانية للتنسيق حتى يعود ما اكتمل بدلاً من لا شيء.
+"""
+import asyncio
+import json
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import asynccontextmanager, contextmanager
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .ai_services import (
+    LENS_GL,
+    LENS_HL,
+    generate_image_from_prompt,
+    search_products_by_image,
+    agenerate_image_from_prompt,
+    asearch_products_by_image,
+)
+from . import metrics, product_index, rate_limits
+from .providers import agemini_model, gemini_model
+from .prompts import format_prompt, product_tokens
+from .ranking import ProductDeduper, rank_products
+from .deadlines import (
+    DeadlineExceeded,
+    cancel_pending,
+    continue_in_background,
+    current_deadline,
+    stage_timeout,
+    submit,
+    wait_timeout,
+)
+
+# عدد النتائج في كل صفحة
+RESULTS_PER_PAGE = 5
+
+# عدد الصور المولدة لكل وصف
+IMAGES_PER_PROMPT = 3
+
+PIPELINE_MAX_WORKERS = getattr(settings, "AI_PIPELINE_MAX_WORKERS", 16)
+PIPELINE_STAGE_LIMITS = {
+    "image": 4,
+    "lens": 6,
+    "format": 4,
+    **getattr(settings, "AI_PIPELINE_STAGE_LIMITS", {}),
+}
+
+# ميزانية الرموز التقريبية لقائمة المنتجات (بترميزها المختصر في prompts.py) في استدعاء تنسيق واحد،
+# وأقصى عدد استدعاءات لكل طلب. الحد الصارم للوصف كاملًا هو PROMPT_BUDGET["FORMAT"]
+FORMAT_TOKEN_BUDGET = getattr(settings, "AI_FORMAT_TOKEN_BUDGET", 6000)
+FORMAT_MAX_CALLS = getattr(settings, "AI_FORMAT_MAX_CALLS", 3)
+
+# الوقت المحجوز من موعد الطلب لمرحلة التنسيق بعد انتهاء البحث
+FORMAT_RESERVE = getattr(settings, "REQUEST_DEADLINE", {}).get("FORMAT_RESERVE", 6)
+
+_stage_semaphores = {
+    name: threading.BoundedSemaphore(limit) for name, limit in PIPELINE_STAGE_LIMITS.items()
+}
+
+# إشارات المراحل في الوضع غير المتزامن مرتبطة بحلقة الأحداث التي أُنشئت فيها
+_async_stage_semaphores = weakref.WeakKeyDictionary()
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    # يتم إنشاء المجمع عند أول استخدام فقط حتى لا تُنشأ خيوط قبل تفرع عمليات gunicorn
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=PIPELINE_MAX_WORKERS, thread_name_prefix="ai-pipeline"
+                )
+    return _executor
+
+
+@contextmanager
+def _stage(name):
+    """يحد عدد الاستدعاءات المتزامنة لمرحلة معينة على مستوى العملية، ويسجل زمنها."""
+    semaphore = _stage_semaphores[name]
+    waiting_since = time.perf_counter()
+    # انتظار دور المرحلة لا يتجاوز موعد الطلب
+    if not semaphore.acquire(timeout=wait_timeout()):
+        current_deadline().mark_partial()
+        raise DeadlineExceeded(f"Request deadline exceeded waiting for {name} slot.")
+    metrics.observe("fashion_stage_wait_seconds", time.perf_counter() - waiting_since, stage=name)
+    try:
+        with metrics.timed(name):
+            yield
+    finally:
+        semaphore.release()
+
+
+@asynccontextmanager
+async def _async_stage(name):
+    loop = asyncio.get_running_loop()
+    semaphores = _async_stage_semaphores.get(loop)
+    if semaphores is None:
+        semaphores = {
+            stage: asyncio.Semaphore(limit) for stage, limit in PIPELINE_STAGE_LIMITS.items()
+        }
+        _async_stage_semaphores[loop] = semaphores
+    waiting_since = time.perf_counter()
+    async with semaphores[name]:
+        metrics.observe("fashion_stage_wait_seconds", time.perf_counter() - waiting_since, stage=name)
+        with metrics.timed(name):
+            yield
+
+
+def _with_ids(products, start=1):
+    return [{"id": f"p{start + i}", **product} for i, product in enumerate(products)]
+
+
+def _parse_formatted_posts(formatted_response, products):
+    """
+    يحلل استجابة التنسيق ويعيد ربط كل منشور بمنتجه عبر product_id.
+    """
+    try:
+        cleaned_formatted_response = formatted_response.text.replace("```json", "").replace("```", "").strip()
+        raw_posts = json.loads(cleaned_formatted_response).get("posts", [])
+    except json.JSONDecodeError as e:
+        print(f"خطأ في تحليل استجابة Gemini لتنسيق المنشورات: {e}")
+        metrics.fallback("format_json")
+        return [{"error": "Failed to format posts", "raw_results": [
+            {k: v for k, v in product.items() if k != "id"} for product in products
+        ]}]
+
+    products_by_id = {product["id"]: product for product in products}
+    posts = []
+    for raw_post in raw_posts:
+        product = products_by_id.get(str(raw_post.get("product_id")))
+        if product is None:
+            # المنشور لا يشير إلى منتج معروف؛ نبقيه فقط إذا تضمن رابطًا
+            if raw_post.get("product_link"):
+                posts.append(raw_post)
+            continue
+        posts.append({
+            "text": raw_post.get("text", ""),
+            "product_link": product.get("link"),
+            "image_url": product.get("thumbnail"),
+        })
+    return posts
+
+
+def plan_format_chunks(products, posts_wanted):
+    """
+    يقسم المنتجات إلى دفعات لا تتجاوز ميزانية الرموز لكل استدعاء،
+    وبحد أقصى AI_FORMAT_MAX_CALLS استدعاء (المنتجات الزائدة في آخر القائمة تُهمل).
+
+    يعيد قائمة من (منتجات الدفعة مع المعرفات، عدد المنشورات المطلوبة منها).
+    """
+    products = _with_ids(products)
+    chunks = []
+    current = []
+    current_tokens = 0
+    for product in products:
+        tokens = product_tokens(product)
+        if current and current_tokens + tokens > FORMAT_TOKEN_BUDGET:
+            chunks.append(current)
+            if len(chunks) == FORMAT_MAX_CALLS:
+                current = []
+                break
+            current = []
+            current_tokens = 0
+        current.append(product)
+        current_tokens += tokens
+    if current:
+        chunks.append(current)
+
+    total = sum(len(chunk) for chunk in chunks)
+    posts_wanted = min(posts_wanted, total)
+    planned = []
+    remaining = posts_wanted
+    for index, chunk in enumerate(chunks):
+        if index == len(chunks) - 1:
+            wanted = remaining
+        else:
+            wanted = min(remaining, len(chunk), -(-posts_wanted * len(chunk) // total))
+        remaining -= wanted
+        if wanted > 0:
+            planned.append((chunk, wanted))
+    return planned
+
+
+def _format_chunk(user_analysis_text, products, posts_wanted, search_filters):
+    format_model = gemini_model("gemini-1.5-flash")
+    prompt, products = format_prompt(user_analysis_text, products, posts_wanted, search_filters)
+    formatted_response = rate_limits.call(
+        "gemini", lambda: format_model.generate_content(prompt, request_options={"timeout": stage_timeout("format")})
+    )
+    return _parse_formatted_posts(formatted_response, products)
+
+
+async def _aformat_chunk(user_analysis_text, products, posts_wanted, search_filters):
+    format_model = agemini_model("gemini-1.5-flash")
+    prompt, products = format_prompt(user_analysis_text, products, posts_wanted, search_filters)
+    formatted_response = await rate_limits.acall(
+        "gemini",
+        lambda: format_model.generate_content_async(prompt, request_options={"timeout": stage_timeout("format")}),
+    )
+    return _parse_formatted_posts(formatted_response, products)
+
+
+def _unformatted_posts(products, posts_wanted):
+    # عند انتهاء موعد الطلب قبل التنسيق نعيد المنتجات نفسها بدون تعليق بدلاً من حذفها
+    return [
+        {"text": product.get("title") or "", "product_link": product.get("link"), "image_url": product.get("thumbnail")}
+        for product in products[:posts_wanted]
+    ]
+
+
+def _format_failure(chunk, wanted, error):
+    deadline = current_deadline()
+    if isinstance(error, DeadlineExceeded) or (deadline is not None and deadline.expired):
+        if deadline is not None:
+            deadline.mark_partial()
+        metrics.fallback("unformatted_posts")
+        return _unformatted_posts(chunk, wanted)
+    print(f"خطأ في تنسيق المنشورات: {error}")
+    return [{"error": "Failed to format posts", "raw_results": chunk}]
+
+
+def format_shopping_results(user_analysis_text, shopping_results, search_filters=None):
+    """
+    يصيغ نتائج تسوق صورة واحدة في منشورات على طراز انستغرام باستخدام Gemini.
+    """
+    return _format_chunk(user_analysis_text, _with_ids(shopping_results), RESULTS_PER_PAGE, search_filters)
+
+
+async def aformat_shopping_results(user_analysis_text, shopping_results, search_filters=None):
+    """
+    النسخة غير المتزامنة من format_shopping_results.
+    """
+    return await _aformat_chunk(user_analysis_text, _with_ids(shopping_results), RESULTS_PER_PAGE, search_filters)
+
+
+def _generate_images(prompt, request):
+    with _stage("image"):
+        return generate_image_from_prompt(prompt, request, count=IMAGES_PER_PROMPT)
+
+
+def _search_products(prompt, image_url, location_info):
+    # image_url هو الرابط العام الذي يمكن لـ SerpAPI الوصول إليه
+    with _stage("lens"):
+        return search_products_by_image(image_url, location_info)
+
+
+def _search_and_format(prompt, image_url, location_info, user_analysis_text, search_filters, budget=None, deduper=None):
+    shopping_results = _search_products(prompt, image_url, location_info)
+    if shopping_results:
+        shopping_results = rank_products([(prompt, shopping_results)], budget)
+        if deduper is not None:
+            shopping_results = deduper.filter(shopping_results)
+
+    if not shopping_results:
+        return [{"message": "No shopping results found for this image.", "prompt": prompt}]
+
+    with _stage("format"):
+        return format_shopping_results(user_analysis_text, shopping_results, search_filters)
+
+
+class ImageGenerationError(Exception):
+    pass
+
+
+def _iter_chains(prompts, request, chain_fn, reserve=0):
+    """
+    يولد صور كل وصف بالتوازي، ثم يشغل chain_fn(prompt, image_url) لكل صورة فور جاهزيتها.
+
+    يعيد ((رقم الوصف، رقم الصورة)، الوصف، النتيجة أو الاستثناء) بترتيب الانتهاء.
+    عند انتهاء موعد الطلب (ناقص reserve ثانية) يتوقف ويلغي ما لم يبدأ.
+    """
+    executor = _get_executor()
+    image_futures = {
+        submit(executor, _generate_images, prompt, request): prompt_index
+        for prompt_index, prompt in enumerate(prompts)
+    }
+    chain_futures = {}
+    pending = set(image_futures)
+
+    # الخيط الرئيسي فقط ينتظر النتائج، لذلك لا يمكن أن ينحبس المجمع بانتظار نفسه
+    while pending:
+        timeout = wait_timeout()
+        done, pending = wait(
+            pending,
+            timeout=None if timeout is None else max(0.0, timeout - reserve),
+            return_when=FIRST_COMPLETED,
+        )
+        if not done:
+            cancel_pending(pending)
+            return
+        for future in done:
+            if future in image_futures:
+                prompt_index = image_futures[future]
+                prompt = prompts[prompt_index]
+                try:
+                    image_urls = future.result()
+                except Exception as e:
+                    print(f"خطأ في توليد صور الوصف: {e}")
+                    _note_failure(e)
+                    yield (prompt_index, 0), prompt, ImageGenerationError(str(e))
+                    continue
+                for image_index, image_url in enumerate(image_urls):
+                    chain_future = submit(executor, chain_fn, prompt, image_url)
+                    chain_futures[chain_future] = (prompt_index, image_index)
+                    pending.add(chain_future)
+            else:
+                position = chain_futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"خطأ في سلسلة البحث والتنسيق: {e}")
+                    _note_failure(e)
+                    result = e
+                yield position, prompts[position[0]], result
+
+
+def _note_failure(error):
+    # فشل سببه انتهاء موعد الطلب (مهلة المزود قُصّرت إلى الوقت المتبقي) يجعل النتيجة جزئية
+    deadline = current_deadline()
+    if deadline is not None and (isinstance(error, DeadlineExceeded) or deadline.expired):
+        deadline.mark_partial()
+
+
+def _failure_entry(prompt, error):
+    if isinstance(error, ImageGenerationError):
+        return {"error": "Failed to generate images", "prompt": prompt}
+    return {"error": "Failed to search products", "prompt": prompt}
+
+
+def iter_prompt_chains(prompts, request, location_info, user_analysis_text, search_filters=None, budget=None):
+    """
+    ينفذ سلاسل (صورة ← Lens ← تنسيق) بالتوازي ويعيد نتيجة كل سلسلة فور انتهائها.
+    كل سلسلة تُنسق وحدها، وهو الأنسب للبث حيث يهم زمن أول نتيجة؛ المنتجات التي
+    ظهرت في سلسلة سابقة لا تُنسق مرة أخرى.
+
+    كل عنصر مُعاد هو ((رقم الوصف، رقم الصورة)، قائمة العناصر)، بترتيب الانتهاء.
+    """
+    deduper = ProductDeduper()
+
+    def chain_fn(prompt, image_url):
+        return _search_and_format(
+            prompt, image_url, location_info, user_analysis_text, search_filters, budget, deduper
+        )
+
+    for position, prompt, result in _iter_chains(prompts, request, chain_fn):
+        if isinstance(result, Exception):
+            yield position, [_failure_entry(prompt, result)]
+        else:
+            yield position, result
+
+
+def collect_products(prompts, request, location_info, on_chain_done=None):
+    """
+    ينفذ سلاسل (صورة ← Lens) بالتوازي دون تنسيق، ويعيد نتائج كل صورة بترتيب ثابت:
+    قائمة من (الوصف، نتائج التسوق أو استثناء).
+    """
+    def chain_fn(prompt, image_url):
+        return _search_products(prompt, image_url, location_info)
+
+    results = {}
+    for position, prompt, result in _iter_chains(prompts, request, chain_fn, reserve=FORMAT_RESERVE):
+        results[position] = (prompt, result)
+        if on_chain_done:
+            on_chain_done(position)
+    return [results[position] for position in sorted(results)]
+
+
+def merge_shopping_results(chain_results, budget=None):
+    """
+    يدمج نتائج كل الصور في قائمة منتجات واحدة بلا تكرار، مرتبة، ومقصورة على أفضلها.
+    """
+    return rank_products(chain_results, budget)
+
+
+def target_post_count(chain_results, products=None):
+    # RESULTS_PER_PAGE لكل صورة لها نتائج، وبحد أقصى منشور واحد لكل منتج بعد إزالة المكرر
+    images_with_results = sum(
+        1 for _, shopping_results in chain_results if isinstance(shopping_results, list) and shopping_results
+    )
+    target = images_with_results * RESULTS_PER_PAGE
+    return target if products is None else min(target, len(products))
+
+
+def empty_result_entries(chain_results):
+    """
+    عناصر توضيحية تُعاد عندما لا توجد أي منتجات لتنسيقها.
+    """
+    entries = []
+    for prompt, shopping_results in chain_results:
+        if isinstance(shopping_results, Exception):
+            entries.append(_failure_entry(prompt, shopping_results))
+        else:
+            entries.append({"message": "No shopping results found for this image.", "prompt": prompt})
+    return entries
+
+
+def iter_formatted_chunks(user_analysis_text, products, posts_wanted, search_filters=None):
+    """
+    ينسق المنتجات في عدد صغير من الاستدعاءات المجمعة (بالتوازي)، ويعيد منشورات كل دفعة
+    فور انتهائها: (رقم الدفعة، المنشورات).
+    """
+    executor = _get_executor()
+
+    def format_chunk(chunk, wanted):
+        with _stage("format"):
+            return _format_chunk(user_analysis_text, chunk, wanted, search_filters)
+
+    futures = {
+        submit(executor, format_chunk, chunk, wanted): (index, chunk, wanted)
+        for index, (chunk, wanted) in enumerate(plan_format_chunks(products, posts_wanted))
+    }
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, timeout=wait_timeout(), return_when=FIRST_COMPLETED)
+        if not done:
+            cancel_pending(pending)
+            for future in pending:
+                index, chunk, wanted = futures[future]
+                yield index, _unformatted_posts(chunk, wanted)
+            return
+        for future in done:
+            index, chunk, wanted = futures[future]
+            try:
+                posts = future.result()
+            except Exception as e:
+                posts = _format_failure(chunk, wanted, e)
+            yield index, posts
+
+
+def format_products(user_analysis_text, products, posts_wanted, search_filters=None):
+    """
+    ينسق قائمة منتجات جاهزة ويعيد المنشورات بترتيب الدفعات.
+    """
+    chunk_posts = dict(iter_formatted_chunks(user_analysis_text, products, posts_wanted, search_filters))
+    all_recommendations = []
+    for index in sorted(chunk_posts):
+        all_recommendations.extend(chunk_posts[index])
+    return all_recommendations
+
+
+def format_products_batch(user_analysis_text, chain_results, search_filters=None, budget=None):
+    """
+    يدمج نتائج كل الصور وينسقها دفعة واحدة (أو دفعات قليلة) بدلاً من استدعاء لكل صورة.
+    """
+    products = merge_shopping_results(chain_results, budget)
+    if not products:
+        return empty_result_entries(chain_results)
+    return format_products(
+        user_analysis_text, products, target_post_count(chain_results, products), search_filters
+    )
+
+
+def _wait_all(futures, reserve=0):
+    """
+    ينتظر كل المهام حتى موعد الطلب، ويلغي ما لم يكتمل. يعيد مجموعة المهام غير المكتملة.
+    """
+    timeout = wait_timeout()
+    _, not_done = wait(futures, timeout=None if timeout is None else max(0.0, timeout - reserve))
+    if not_done:
+        cancel_pending(not_done)
+    return not_done
+
+
+def generate_prompt_images(prompts, request):
+    """
+    يولد صور عدة أوصاف بالتوازي، ويعيد لكل وصف قائمة روابط صوره أو الاستثناء، بنفس الترتيب.
+    الأوصاف التي قطعها موعد الطلب تعيد DeadlineExceeded.
+    """
+    futures = [submit(_get_executor(), _generate_images, prompt, request) for prompt in prompts]
+    not_done = _wait_all(futures, reserve=FORMAT_RESERVE)
+    results = []
+    for future in futures:
+        if future in not_done:
+            results.append(DeadlineExceeded("Request deadline exceeded during image generation."))
+            continue
+        try:
+            results.append(future.result())
+        except DeadlineExceeded as e:
+            results.append(e)
+        except Exception as e:
+            print(f"خطأ في توليد صور الوصف: {e}")
+            results.append(ImageGenerationError(str(e)))
+    return results
+
+
+def search_image_chains(chains, location_info):
+    """
+    يبحث عن منتجات عدة صور بالتوازي. chains قائمة من (الوصف، رابط الصورة)،
+    والنتيجة قائمة من (الوصف، نتائج التسوق أو الاستثناء) بنفس الترتيب.
+    """
+    futures = [
+        submit(_get_executor(), _search_products, prompt, image_url, location_info)
+        for prompt, image_url in chains
+    ]
+    not_done = _wait_all(futures, reserve=FORMAT_RESERVE)
+    results = []
+    for (prompt, _), future in zip(chains, futures):
+        if future in not_done:
+            results.append((prompt, DeadlineExceeded("Request deadline exceeded during product search.")))
+            continue
+        try:
+            results.append((prompt, future.result()))
+        except Exception as e:
+            print(f"خطأ في سلسلة البحث والتنسيق: {e}")
+            _note_failure(e)
+            results.append((prompt, e))
+    return results
+
+
+def indexed_products(search_filters, budget=None):
+    """
+    منتجات الفهرس المحلي المطابقة لفلاتر البحث المتقدم، أو None إذا لم تكفِ.
+    """
+    if not search_filters:
+        return None
+    try:
+        return product_index.find_products(search_filters, LENS_HL, LENS_GL, budget)
+    except Exception as e:
+        print(f"خطأ في البحث في فهرس المنتجات: {e}")
+        return None
+
+
+def run_prompt_chains(prompts, request, location_info, user_analysis_text, search_filters=None, budget=None):
+    """
+    ينفذ كل سلاسل (صورة ← Lens) بالتوازي، ثم ينسق كل المنتجات في استدعاءات مجمعة،
+    ويعيد قائمة التوصيات بترتيب ثابت.
+    """
+    products = indexed_products(search_filters, budget)
+    if products:
+        return format_products(user_analysis_text, products, len(products), search_filters)
+    chain_results = collect_products(prompts, request, location_info)
+    return format_products_batch(user_analysis_text, chain_results, search_filters, budget)
+
+
+async def _acollect_prompt_products(prompt, request, location_info):
+    async with _async_stage("image"):
+        image_urls = await agenerate_image_from_prompt(prompt, request, count=IMAGES_PER_PROMPT)
+
+    async def search(image_url):
+        async with _async_stage("lens"):
+            return await asearch_products_by_image(image_url, location_info)
+
+    search_results = await asyncio.gather(*(search(image_url) for image_url in image_urls), return_exceptions=True)
+    for result in search_results:
+        if isinstance(result, Exception):
+            print(f"خطأ في سلسلة البحث والتنسيق: {result}")
+    return [(prompt, result) for result in search_results]
+
+
+async def _await_until_deadline(coroutines, reserve=0):
+    """
+    يشغل المهام بالتوازي حتى موعد الطلب ويلغي ما لم يكتمل. يعيد النتائج بنفس الترتيب،
+    والمهام الملغاة تعيد DeadlineExceeded.
+    """
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    if not tasks:
+        return []
+    timeout = wait_timeout()
+    _, not_done = await asyncio.wait(tasks, timeout=None if timeout is None else max(0.0, timeout - reserve))
+    for task in not_done:
+        task.cancel()
+    if not_done:
+        current_deadline().mark_partial(len(not_done))
+    results = []
+    for task in tasks:
+        if task in not_done:
+            results.append(DeadlineExceeded("Request deadline exceeded."))
+        elif task.exception() is not None:
+            results.append(task.exception())
+        else:
+            results.append(task.result())
+    return results
+
+
+async def arun_prompt_chains(prompts, request, location_info, user_analysis_text, search_filters=None, budget=None):
+    """
+    النسخة غير المتزامنة من run_prompt_chains؛ تعمل كل السلاسل داخل حلقة الأحداث الحالية.
+    """
+    products = await sync_to_async(indexed_products)(search_filters, budget)
+    if products:
+        return await aformat_products(user_analysis_text, products, len(products), search_filters)
+
+    prompt_results = await _await_until_deadline(
+        (_acollect_prompt_products(prompt, request, location_info) for prompt in prompts),
+        reserve=FORMAT_RESERVE,
+    )
+    chain_results = []
+    for prompt, result in zip(prompts, prompt_results):
+        if isinstance(result, DeadlineExceeded):
+            chain_results.append((prompt, result))
+        elif isinstance(result, Exception):
+            print(f"خطأ في توليد صور الوصف: {result}")
+            chain_results.append((prompt, ImageGenerationError(str(result))))
+        else:
+            chain_results.extend(result)
+
+    products = merge_shopping_results(chain_results, budget)
+    if not products:
+        return empty_result_entries(chain_results)
+    return await aformat_products(
+        user_analysis_text, products, target_post_count(chain_results, products), search_filters
+    )
+
+
+async def aformat_products(user_analysis_text, products, posts_wanted, search_filters=None):
+    """
+    النسخة غير المتزامنة من format_products؛ الدفعات تعمل بالتوازي حتى موعد الطلب.
+    """
+    async def format_chunk(chunk, wanted):
+        async with _async_stage("format"):
+            return await _aformat_chunk(user_analysis_text, chunk, wanted, search_filters)
+
+    planned = plan_format_chunks(products, posts_wanted)
+    chunk_results = await _await_until_deadline(format_chunk(chunk, wanted) for chunk, wanted in planned)
+    all_recommendations = []
+    for (chunk, wanted), result in zip(planned, chunk_results):
+        if isinstance(result, Exception):
+            all_recommendations.extend(_format_failure(chunk, wanted, result))
+        else:
+            all_recommendations.extend(result)
+    return all_recommendations
+
+
+def paginate_recommendations(user_analysis_text, all_recommendations, partial=False):
+    """
+    يقسم التوصيات إلى صفحات بحجم RESULTS_PER_PAGE. partial=True يعني أن موعد الطلب
+    انتهى قبل اكتمال كل السلاسل، فتُعلَّم الصفحات بذلك.
+    """
+    total_results = len(all_recommendations)
+    total_pages = (total_results + RESULTS_PER_PAGE - 1) // RESULTS_PER_PAGE
+
+    pages = []
+    for i in range(total_pages):
+        start_index = i * RESULTS_PER_PAGE
+        end_index = min((i + 1) * RESULTS_PER_PAGE, total_results)
+        pages.append({
+            "user_analysis": user_analysis_text,
+            "recommendations": all_recommendations[start_index:end_index],
+            "current_page": i + 1,
+            "total_pages": total_pages,
+            "has_next_page": (i + 1) < total_pages,
+            "partial": partial,
+        })
+    return pages
+
+
+def complete_in_background(prompts, base_url, location_info, user_analysis_text, store_results, search_filters=None, budget=None):
+    """
+    بعد رد جزئي: يعيد تشغيل كل السلاسل بدون ميزانية ويحفظ النتائج الكاملة عبر store_results.
+    الصور المولدة ونتائج Lens المكتملة محفوظة مسبقًا، لذلك يُعاد فقط ما قطعه الموعد.
+    """
+    from .jobs import JobRequest
+
+    def run():
+        store_results(run_prompt_chains(
+            prompts, JobRequest(base_url), location_info, user_analysis_text, search_filters, budget
+        ))
+
+    return continue_in_background(run)
+
+
+def empty_page(user_analysis_text, page, total_pages):
+    return {
+        "user_analysis": user_analysis_text,
+        "recommendations": [],
+        "current_page": page,
+        "total_pages": total_pages,
+        "has_next_page": False
+    }
@@ -0,0 +1,266 @@
+"""
+فهرس محلي للمنتجات التي أعادتها Google Lens سابقًا (لأي مستخدم).
+
+كل نتيجة Lens تُخزن في lens_cache تُضاف هنا مع صفات مستخرجة من العنوان والمتجر والسعر:
+نوع القطعة، اللون، الخامة، السعر، والمتجر. البحث المتقدم يقيّم فلاتره على هذه الصفات
+أولًا، وإذا وجد MIN_CANDIDATES منتجًا مطابقًا على الأقل يكتفي بتنسيقها، دون توليد صور
+ولا استدعاء Lens. وإلا (أو إذا كان في الفلاتر ما لا يمكن تقييمه) يعمل خط المعالجة الكامل.
+
+الفلاتر التي لا تصف المنتج نفسه (مثل الأسلوب أو المناسبة) لا تقيّد الفهرس، لكنها تصل
+إلى وصف التنسيق كما هي. يلزم فلتر واحد على الأقل يمكن تقييمه حتى يُستخدم الفهرس.
+"""
+import hashlib
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from . import metrics
+from .models import IndexedProduct, LensResultCache
+from .ranking import normalize_link, normalize_text, parse_budget, parse_price, rank_products
+
+_options = getattr(settings, "PRODUCT_INDEX", {})
+PRODUCT_INDEX_ENABLED = _options.get("ENABLED", True)
+MIN_CANDIDATES = _options.get("MIN_CANDIDATES", 10)
+# الأسعار والتوفر تتغير؛ المنتجات التي لم تظهر في Lens منذ MAX_AGE لا تُقدم ويحذفها الأمر rebuild_product_index
+MAX_AGE = _options.get("MAX_AGE", 30 * 24 * 60 * 60)
+SCAN_LIMIT = _options.get("SCAN_LIMIT", 500)
+
+# الأكثر تحديدًا أولًا ("تي شيرت" قبل "شيرت"، والجاكيت قبل الجينز)
+_GARMENTS = (
+    ("tshirt", ("تي شيرت", "تيشيرت", "تيشرت", "t shirt", "tshirt", "tee")),
+    ("abaya", ("عباية", "عباءة", "abaya")),
+    ("dress", ("فستان", "فساتين", "dress", "gown")),
+    ("blouse", ("بلوزة", "blouse")),
+    ("shirt", ("قميص", "قمصان", "shirt")),
+    ("jacket", ("جاكيت", "جاكت", "سترة", "بليزر", "jacket", "blazer")),
+    ("coat", ("معطف", "كوت", "بالطو", "coat", "trench")),
+    ("sweater", ("كنزة", "بلوفر", "سويتر", "هودي", "كارديجان", "sweater", "pullover", "hoodie", "cardigan", "jumper")),
+    ("suit", ("بدلة", "suit")),
+    ("skirt", ("تنورة", "جيبة", "skirt")),
+    ("shorts", ("شورت", "shorts")),
+    ("jeans", ("جينز", "jeans")),
+    ("trousers", ("بنطال", "بنطلون", "سروال", "trousers", "pants", "chinos")),
+    ("shoes", ("حذاء", "أحذية", "صندل", "shoes", "sneakers", "boots", "heels", "sandals", "loafers")),
+    ("bag", ("حقيبة", "شنطة", "bag", "handbag", "backpack")),
+)
+_COLORS = (
+    ("black", ("أسود", "سوداء", "black")),
+    ("white", ("أبيض", "بيضاء", "white", "ivory")),
+    ("navy", ("كحلي", "navy")),
+    ("blue", ("أزرق", "زرقاء", "سماوي", "blue")),
+    ("beige", ("بيج", "كريمي", "beige", "cream", "camel")),
+    ("brown", ("بني", "بنية", "brown", "tan")),
+    ("grey", ("رمادي", "رمادية", "grey", "gray")),
+    ("olive", ("زيتي", "زيتون", "olive", "khaki")),
+    ("green", ("أخضر", "خضراء", "green")),
+    ("burgundy", ("عنابي", "خمري", "burgundy", "maroon", "wine")),
+    ("red", ("أحمر", "حمراء", "red")),
+    ("pink", ("وردي", "زهري", "pink")),
+    ("purple", ("بنفسجي", "موف", "purple", "lilac")),
+    ("yellow", ("أصفر", "صفراء", "yellow", "mustard")),
+    ("orange", ("برتقالي", "orange")),
+    ("gold", ("ذهبي", "gold")),
+    ("silver", ("فضي", "silver")),
+)
+_FABRICS = (
+    ("cotton", ("قطن", "قطني", "cotton")),
+    ("linen", ("كتان", "linen")),
+    ("wool", ("صوف", "wool", "cashmere", "كشمير")),
+    ("silk", ("حرير", "silk", "satin", "ساتان")),
+    ("denim", ("دنيم", "جينز", "denim", "jeans")),
+    ("leather", ("جلد", "جلدي", "leather")),
+    ("chiffon", ("شيفون", "chiffon")),
+    ("velvet", ("مخمل", "velvet")),
+    ("polyester", ("بوليستر", "polyester")),
+    ("nylon", ("نايلون", "nylon")),
+)
+_VOCABULARIES = {"garment": _GARMENTS, "color": _COLORS, "fabric": _FABRICS}
+
+# أسماء مفاتيح الفلاتر لكل صفة بعد التوحيد (normalize_text)
+_FILTER_FIELDS = {
+    "garment": ("type", "garment", "category", "item", "clothing", "clothing_type", "نوع", "النوع", "القطعة", "نوع الملابس"),
+    "color": ("color", "colour", "لون", "اللون"),
+    "fabric": ("fabric", "material", "خامة", "الخامة", "قماش", "القماش"),
+    "price": ("budget", "price", "max_price", "ميزانية", "الميزانية", "السعر"),
+    "source": ("store", "brand", "source", "shop", "متجر", "المتجر", "الماركة"),
+}
+_field_for_key = {key: field for field, keys in _FILTER_FIELDS.items() for key in keys}
+
+stats = {"hits": 0, "misses": 0, "unfilterable": 0, "indexed": 0}
+
+
+def _compile(vocabulary):
+    # الكلمات الإنجليزية تطابق ككلمة كاملة، والعربية كجزء من الكلمة (مع "ال" وحروف الجر)
+    compiled = []
+    for canonical, synonyms in vocabulary:
+        patterns = []
+        for synonym in synonyms:
+            synonym = re.escape(normalize_text(synonym))
+            patterns.append(rf"\b{synonym}\b" if synonym.isascii() else synonym)
+        compiled.append((canonical, re.compile("|".join(patterns))))
+    return compiled
+
+
+_compiled = {field: _compile(vocabulary) for field, vocabulary in _VOCABULARIES.items()}
+
+
+def extract_attribute(field, text):
+    normalized = normalize_text(text)
+    if normalized:
+        for canonical, pattern in _compiled[field]:
+            if pattern.search(normalized):
+                return canonical
+    return ""
+
+
+def extract_attributes(product):
+    title = product.get("title") or ""
+    return {
+        "garment": extract_attribute("garment", title),
+        "color": extract_attribute("color", title),
+        "fabric": extract_attribute("fabric", title),
+        "price": parse_price(product.get("price")),
+        "source": normalize_text(product.get("source")),
+    }
+
+
+def product_key(product):
+    link = normalize_link(product.get("link"))
+    identity = link or f"{normalize_text(product.get('source'))}|{normalize_text(product.get('title'))}"
+    return hashlib.sha256(identity.encode("utf-8")).hexdigest()
+
+
+def index_products(shopping_results, hl, gl, seen_at=None):
+    """
+    يضيف نتائج Lens إلى الفهرس أو يحدّث ظهورها (upsert واحد للدفعة).
+    """
+    if not PRODUCT_INDEX_ENABLED or not shopping_results:
+        return 0
+    seen_at = seen_at or timezone.now()
+    by_key = {}
+    for product in shopping_results:
+        if product.get("title") or product.get("link"):
+            by_key.setdefault(product_key(product), product)
+    if not by_key:
+        return 0
+    seen_counts = dict(
+        IndexedProduct.objects.filter(product_key__in=list(by_key), hl=hl, gl=gl)
+        .values_list("product_key", "seen_count")
+    )
+    rows = [
+        IndexedProduct(
+            product_key=key, hl=hl, gl=gl, product=product,
+            seen_count=seen_counts.get(key, 0) + 1, last_seen_at=seen_at,
+            **extract_attributes(product),
+        )
+        for key, product in by_key.items()
+    ]
+    with metrics.timed("product_index_write"):
+        IndexedProduct.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=["product_key", "hl", "gl"],
+            update_fields=[
+                "product", "garment", "color", "fabric", "price", "source",
+                "seen_count", "last_seen_at",
+            ],
+        )
+    stats["indexed"] += len(rows)
+    return len(rows)
+
+
+def _values(value):
+    values = value if isinstance(value, (list, tuple)) else [value]
+    return [str(v) for v in values if v is not None and str(v).strip()]
+
+
+def parse_filters(search_filters):
+    """
+    يحول فلاتر البحث إلى شروط على الفهرس: {الصفة: القيم المقبولة}، و price كنطاق.
+    يعيد None إذا كان في الفلاتر ما يصف المنتج لكن لا يمكن تقييمه (مثل لون غير معروف).
+    """
+    conditions = {}
+    for key, value in (search_filters or {}).items():
+        values = _values(value)
+        if not values:
+            continue
+        field = _field_for_key.get(normalize_text(str(key)))
+        if field == "price":
+            price_range = parse_budget(values[0])
+            if price_range is None:
+                return None
+            conditions["price"] = price_range
+        elif field == "source":
+            conditions["source"] = [normalize_text(v) for v in values]
+        elif field:
+            extracted = {extract_attribute(field, v) for v in values}
+            if "" in extracted:
+                return None
+            conditions[field] = extracted
+        else:
+            # فلتر بمفتاح آخر: يقيّد الفهرس فقط إذا ذكرت قيمته صفة معروفة ("style": "قميص كتان")
+            for v in values:
+                for attribute in _VOCABULARIES:
+                    extracted = extract_attribute(attribute, v)
+                    if extracted and attribute not in conditions:
+                        conditions[attribute] = {extracted}
+    return conditions
+
+
+def find_products(search_filters, hl, gl, budget=None):
+    """
+    المنتجات المطابقة للفلاتر مرتبة كما في rank_products، أو None إذا لم يكفِ الفهرس
+    (فلاتر لا يمكن تقييمها أو أقل من MIN_CANDIDATES منتجًا).
+    """
+    if not PRODUCT_INDEX_ENABLED:
+        return None
+    conditions = parse_filters(search_filters)
+    if not conditions:
+        stats["unfilterable"] += 1
+        metrics.cache_result("product_index", False)
+        return None
+
+    with metrics.timed("product_index_lookup"):
+        products = IndexedProduct.objects.filter(
+            hl=hl, gl=gl, last_seen_at__gte=timezone.now() - timedelta(seconds=MAX_AGE)
+        )
+        for field in ("garment", "color", "fabric"):
+            if field in conditions:
+                products = products.filter(**{f"{field}__in": conditions[field]})
+        if "price" in conditions:
+            low, high = conditions["price"]
+            products = products.filter(price__gte=low, price__lte=high)
+        if "source" in conditions:
+            source_match = Q()
+            for source in conditions["source"]:
+                source_match |= Q(source__contains=source)
+            products = products.filter(source_match)
+        candidates = list(
+            products.order_by("-seen_count", "-last_seen_at").values_list("product", flat=True)[:SCAN_LIMIT]
+        )
+        ranked = rank_products([(None, candidates)], budget)
+
+    found = len(ranked) >= MIN_CANDIDATES
+    stats["hits" if found else "misses"] += 1
+    metrics.cache_result("product_index", found)
+    return ranked if found else None
+
+
+def rebuild_from_lens_cache():
+    """
+    يفهرس كل نتائج Lens المحفوظة (للبيانات السابقة للفهرس) ويعيد عدد المنتجات.
+    """
+    indexed = 0
+    for entry in LensResultCache.objects.order_by("fetched_at").iterator(chunk_size=200):
+        indexed += index_products(entry.shopping_results, entry.hl, entry.gl, entry.fetched_at)
+    return indexed
+
+
+def purge_expired():
+    deleted, _ = IndexedProduct.objects.filter(
+        last_seen_at__lt=timezone.now() - timedelta(seconds=MAX_AGE)
+    ).delete()
+    return deleted
@@ -0,0 +1,98 @@
+"""
+تحليل صورة الملف الشخصي مرة واحدة عند رفعها أو تغييرها، وحفظه على المستخدم.
+
+يتم التحليل في خيط خلفي بعد تأكيد المعاملة، وليس داخل الطلب. إذا كانت بصمة محتوى
+الصورة (sha256) مطابقة للبصمة المحفوظة لا يعاد التحليل. عند تغيير الصورة يُمسح التحليل
+القديم فورًا حتى لا يُستخدم تحليل صورة سابقة.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .image_analysis import analyze_profile_picture
+from .lens_cache import file_digest
+from .models import CustomUser
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    # مجمع لكل عملية، لأن الخيوط لا تنتقل مع تفرع عمليات gunicorn
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="profile-analysis")
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def clear_picture_analysis(user_id):
+    CustomUser.objects.filter(id=user_id).update(
+        picture_analysis=None, picture_digest=None, picture_analyzed_at=None
+    )
+
+
+def analyze_user_picture(user_id):
+    """
+    يحلل صورة المستخدم الحالية ويحفظ النتيجة. يعيد التحليل أو None إذا لم توجد صورة صالحة.
+    """
+    user = CustomUser.objects.filter(id=user_id).first()
+    if user is None or not user.profile_picture:
+        return None
+
+    picture_name = user.profile_picture.name
+    image_path = user.profile_picture.path
+    if not os.path.exists(image_path):
+        return None
+
+    digest = file_digest(image_path)
+    if digest == user.picture_digest and user.picture_analysis:
+        return user.picture_analysis
+
+    analysis = analyze_profile_picture(image_path)
+    if analysis is None:
+        return None
+
+    # الشرط على اسم الصورة يمنع حفظ تحليل صورة استُبدلت أثناء التحليل
+    CustomUser.objects.filter(id=user_id, profile_picture=picture_name).update(
+        picture_analysis=analysis, picture_digest=digest, picture_analyzed_at=timezone.now()
+    )
+    return analysis
+
+
+def schedule_picture_analysis(user_id):
+    def run():
+        try:
+            analyze_user_picture(user_id)
+        except Exception as e:
+            print(f"خطأ في تحليل صورة الملف الشخصي للمستخدم {user_id}: {e}")
+        finally:
+            close_old_connections()
+
+    _get_executor().submit(run)
+
+
+def describe_picture_analysis(user):
+    """
+    وصف نصي قصير للتحليل المحفوظ لاستخدامه في أوصاف Gemini، أو "" إذا لم يتوفر.
+    """
+    analysis = user.picture_analysis
+    if not analysis:
+        return ""
+    parts = []
+    skin_tone = analysis.get("skin_tone")
+    if skin_tone:
+        if skin_tone.get("hex"):
+            parts.append(f"لون البشرة التقديري من الصورة: {skin_tone['hex']} ({skin_tone['category']})")
+        else:
+            parts.append(f"لون البشرة التقديري من الصورة: {skin_tone['category']}")
+    palette = analysis.get("palette") or []
+    if palette:
+        colors = "، ".join(f"{entry['hex']} ({round(entry['proportion'] * 100)}%)" for entry in palette)
+        parts.append(f"الألوان السائدة في الصورة: {colors}")
+    return "؛ ".join(parts)
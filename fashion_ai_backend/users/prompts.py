@@ -0,0 +1,280 @@
+"""
+بناء أوصاف Gemini (التحليل، التحليل المتقدم، تنسيق المنشورات) بميزانية رموز محددة.
+
+- القوالب هنا فقط، بدون المسافات البادئة التي كانت تُرسل مع كل سطر.
+- المنتجات تُرسل كسطور مختصرة "p1 | العنوان | المتجر | السعر | الوسم" بدلاً من JSON كامل
+  بالروابط والصور المصغرة؛ الروابط تُعاد للمنشورات بالمعرف بعد الرد (pipeline._parse_formatted_posts).
+- لكل نوع حد أقصى للرموز (PROMPT_BUDGET). إذا تجاوزه وصف التنسيق تُحذف المنتجات من آخر القائمة
+  (الأقل ترتيبًا) ثم يُختصر التحليل، وفي وصف التحليل تُختصر الحقول المتغيرة الطول.
+
+كل استدعاء يُسجل الرموز المرسلة والموفرة مقارنة بالحمولة السابقة (القوالب المطولة، و JSON بكل الحقول)،
+في fashion_prompt_tokens_total وفي report() الظاهر ضمن api/stats/.
+"""
+import json
+import threading
+from collections import deque
+
+from django.conf import settings
+
+from . import metrics
+from .profile_analysis import describe_picture_analysis
+
+_options = getattr(settings, "PROMPT_BUDGET", {})
+PROMPT_BUDGETS = {
+    "analysis": _options.get("ANALYSIS", 1500),
+    "advanced_analysis": _options.get("ADVANCED_ANALYSIS", 1800),
+    "format": _options.get("FORMAT", 7000),
+}
+MAX_TITLE_CHARS = _options.get("MAX_TITLE_CHARS", 120)
+RECENT_CALLS = _options.get("RECENT_CALLS", 50)
+
+_lock = threading.Lock()
+_totals = {}
+_recent = deque(maxlen=RECENT_CALLS)
+
+
+def estimate_tokens(text):
+    # تقدير تقريبي محافظ (حوالي 3 أحرف لكل رمز للنصوص العربية والإنجليزية المختلطة)
+    return len(text) // 3 + 1
+
+
+def _truncate(text, max_tokens):
+    max_chars = max(0, (max_tokens - 1) * 3)
+    return text if len(text) <= max_chars else text[:max(0, max_chars - 1)] + "…"
+
+
+def _record(kind, prompt, baseline_tokens, **details):
+    sent = estimate_tokens(prompt)
+    saved = max(0, baseline_tokens - sent)
+    metrics.inc("fashion_prompt_tokens_total", sent, kind=kind, type="sent")
+    metrics.inc("fashion_prompt_tokens_total", saved, kind=kind, type="saved")
+    with _lock:
+        totals = _totals.setdefault(kind, {"calls": 0, "sent": 0, "saved": 0})
+        totals["calls"] += 1
+        totals["sent"] += sent
+        totals["saved"] += saved
+        _recent.append({"kind": kind, "sent": sent, "saved": saved, **details})
+
+
+def report():
+    with _lock:
+        return {"totals": {kind: dict(values) for kind, values in _totals.items()}, "recent": list(_recent)}
+
+
+_IMAGE_PROMPT_RULES = """شروط كل وصف صورة (prompt):
+- قطعة ملابس واحدة فقط بدون عارض أزياء (مثال: قميص، بنطال، فستان).
+- خلفية استوديو بسيطة ومحايدة، وصورة واقعية (photorealistic).
+- ألوان وأقمشة محددة، و3 قطع مختلفة."""
+
+# بأقواس مضاعفة لأنها جزء من قوالب format
+_ANALYSIS_OUTPUT = """أعد JSON فقط بهذا الشكل:
+{{"analysis": "بنية جسم متوسطة؛ الألوان الدافئة كالبيج والزيتي تناسب البشرة؛ الرياض تقترح ملابس صيفية خفيفة.", "prompts": ["صورة واقعية لبنطال تشينو رجالي بيج بقصة مستقيمة من القطن الخفيف، على خلفية استوديو رمادية فاتحة.", "...", "..."]}}"""
+
+ANALYSIS_TEMPLATE = """حلل المستخدم لتقديم توصيات أزياء.
+المستخدم: الطول {height} سم، الوزن {weight} كجم، لون البشرة {skin_color}، الموقع {location}.{picture}
+المهمة:
+1. حلل نوع الجسم (نحيف، متوسط، رياضي، ممتلئ) والألوان المناسبة للون البشرة.
+2. مع مراعاة الموقع (الطقس والثقافة) اقترح 3 أنماط مختلفة تناسبه (كلاسيكي، عصري، رياضي، بوهيمي...).
+3. لكل نمط اكتب وصفًا دقيقًا (prompt) لتوليد صورة قطعة ملابس تمثله.
+""" + _IMAGE_PROMPT_RULES + "\n" + _ANALYSIS_OUTPUT
+
+ADVANCED_ANALYSIS_TEMPLATE = """حلل المستخدم وفلاتر البحث لتقديم توصيات أزياء دقيقة.
+المستخدم: الطول {height} سم، الوزن {weight} كجم، لون البشرة {skin_color}، الموقع {location}.{picture}
+الفلاتر المطلوبة: {filters}
+المهمة:
+1. حلل نوع الجسم والألوان المناسبة للون البشرة.
+2. ادمج الفلاتر مع التحليل في 3 أوصاف دقيقة ومتنوعة (prompts) لتوليد صور قطع ملابس تحقق الفلاتر.
+""" + _IMAGE_PROMPT_RULES + "\n" + _ANALYSIS_OUTPUT
+
+FORMAT_TEMPLATE = """تحليل المستخدم: {analysis}{filters}
+المنتجات (المعرف | العنوان | المتجر | السعر | الوسم):
+{products}
+قم بصياغة {posts_wanted} منشورات قصيرة على طراز انستغرام، كل منشور لمنتج مختلف من القائمة:
+- product_id: معرف المنتج كما في القائمة.
+- text: تعليق مقنع يوضح لماذا يناسب المستخدم (لون البشرة، نوع الجسم، الأسلوب{filters_hint}).
+- بدون روابط؛ تُرفق الروابط والصور تلقائيًا حسب المعرف.
+أعد JSON فقط بهذا الشكل: {{"posts": [{{"product_id": "p1", "text": "..."}}]}}"""
+
+
+# الأوصاف السابقة كما كانت تُرسل (بالمسافات البادئة والمثال الكامل)؛ تُستخدم فقط لحساب الرموز الموفرة
+_VERBOSE_RULES = """
+    **شروط وصف الصورة (Prompt):**
+    - يجب أن يصف قطعة الملابس فقط (مثال: "قميص"، "بنطال"، "فستان").
+    - يجب أن تكون الخلفية بسيطة ومحايدة (مثال: "خلفية استوديو رمادية فاتحة").
+    - يجب أن تكون الصورة واقعية (photorealistic).
+    - يجب تحديد ألوان وأنواع أقمشة دقيقة.
+    - يجب أن تولد 3 أوصاف مختلفة لقطع ملابس مختلفة.
+
+    **مثال على المخرجات المطلوبة (بتنسيق JSON):**
+    {{
+        "analysis": "المستخدم لديه بنية جسم متوسطة ويميل الطول. الألوان الدافئة مثل البيج والزيتي تناسب لون بشرته. موقعه في الرياض يقترح الحاجة لملابس صيفية خفيفة.",
+        "prompts": [
+            "صورة واقعية لبنطال تشينو رجالي بلون بيج، بقصة مستقيمة، مصنوع من القطن الخفيف، معروض على خلفية استوديو رمادية فاتحة.",
+            "صورة واقعية لقميص بولو أبيض اللون، بقصة ضيقة (slim-fit)، مصنوع من قماش البيكيه، معروض على خلفية استوديو رمادية فاتحة.",
+            "صورة واقعية لجاكيت خفيف (bomber jacket) بلون زيتي، مصنوع من النايلون، معروض على خلفية استوديو رمادية فاتحة."
+        ]
+    }}
+    """
+
+_VERBOSE_USER = """
+    **بيانات المستخدم:**
+    - الطول: {height} سم
+    - الوزن: {weight} كجم
+    - لون البشرة: {skin_color}
+    - الموقع الجغرافي: {location}{picture}
+"""
+
+_VERBOSE_ANALYSIS_TEMPLATE = """
+    تحليل شامل للمستخدم لتقديم توصيات أزياء:
+""" + _VERBOSE_USER + """
+    **المهمة:**
+    1.  بناءً على بيانات المستخدم، قم بتحليل نوع الجسم (نحيف، متوسط، رياضي، ممتلئ) ونظرية الألوان المناسبة للون بشرته.
+    2.  مع الأخذ في الاعتبار الموقع الجغرافي (الذي قد يؤثر على الطقس والثقافة)، اقترح 3 أنماط أزياء مختلفة قد تناسب هذا المستخدم (مثال: كلاسيكي، عصري، رياضي، بوهيمي).
+    3.  لكل نمط مقترح، قم بإنشاء وصف نصي دقيق ومفصل (prompt) لتوليد صورة لقطعة ملابس واحدة (بدون عارض أزياء) تمثل هذا النمط. يجب أن يكون الوصف جاهزًا للاستخدام في نموذج توليد الصور.
+""" + _VERBOSE_RULES
+
+_VERBOSE_ADVANCED_ANALYSIS_TEMPLATE = """
+    تحليل شامل للمستخدم وفلاتر البحث لتقديم توصيات أزياء دقيقة:
+""" + _VERBOSE_USER + """
+    **فلاتر البحث المطلوبة من المستخدم:**
+    {filters}
+
+    **المهمة:**
+    1.  بناءً على بيانات المستخدم، قم بتحليل نوع الجسم ونظرية الألوان المناسبة للون بشرته.
+    2.  دمج فلاتر البحث المطلوبة مع تحليل المستخدم لإنشاء 3 أوصاف نصية دقيقة ومفصلة (prompts) لتوليد صور لقطع ملابس واحدة (بدون عارض أزياء) تمثل هذه المتطلبات.
+    3.  يجب أن تكون الأوصاف متنوعة قدر الإمكان ضمن الفلاتر المحددة، مع التركيز على الجودة والواقعية.
+""" + _VERBOSE_RULES
+
+_VERBOSE_FORMAT_TEMPLATE = """
+    بناءً على تحليل المستخدم التالي: {analysis}
+    {filters}
+    وهذه قائمة بمنتجات التسوق التي تم العثور عليها، ولكل منتج معرف (id): {products}
+
+    قم بصياغة {posts_wanted} منشورات جذابة على طراز انستغرام. لكل منشور:
+    - اختر منتجًا واحدًا مختلفًا من القائمة واذكر معرفه في الحقل product_id.
+    - اكتب تعليقًا قصيرًا ومقنعًا يوضح لماذا هذا المنتج مناسب للمستخدم، مع الإشارة إلى صفاته الشخصية (مثل لون البشرة، نوع الجسم، الأسلوب المفضل){filters_hint}.
+    - لا تكتب روابط؛ سيتم إرفاق رابط المنتج وصورته تلقائيًا حسب المعرف.
+    - يجب أن تكون المخرجات بتنسيق JSON.
+
+    مثال على المخرجات المطلوبة:
+    {{
+        "posts": [
+            {{
+                "product_id": "p1",
+                "text": "وجدنا لك هذا! قميص أزرق أنيق من متجر X. قصته الضيقة ستبرز بنيتك الرياضية، ولونه يتناغم مع بشرتك. مثالي لإطلالة صيفية."
+            }}
+        ]
+    }}
+    """
+
+
+def _filters_text(search_filters):
+    return "، ".join(f"{key}: {value}" for key, value in (search_filters or {}).items())
+
+
+def _fit(template, fields, variable, budget):
+    """
+    يختصر الحقول المتغيرة (الأطول أولًا) حتى يصبح الوصف ضمن budget.
+    """
+    prompt = template.format(**fields)
+    while estimate_tokens(prompt) > budget:
+        longest = max(variable, key=lambda name: len(fields[name]))
+        text = fields[longest]
+        if not text:
+            break
+        shortened = _truncate(text, estimate_tokens(text) - (estimate_tokens(prompt) - budget))
+        fields[longest] = shortened if len(shortened) < len(text) else ""
+        prompt = template.format(**fields)
+    return prompt
+
+
+def analysis_prompt(user, location_info, search_filters=None):
+    """
+    وصف التحليل (أو التحليل المتقدم إذا أُعطيت فلاتر) ضمن ميزانيته. إذا تجاوزها تُختصر الحقول
+    المتغيرة الطول (الموقع، لون البشرة، وصف الصورة، الفلاتر)، الأطول أولًا.
+    """
+    kind = "analysis" if search_filters is None else "advanced_analysis"
+    # التحليل محفوظ على المستخدم مسبقًا، لذلك لا تُقرأ الصورة هنا
+    description = describe_picture_analysis(user)
+    fields = {
+        "height": user.height,
+        "weight": user.weight,
+        "skin_color": str(user.skin_color or ""),
+        "location": str(location_info or ""),
+    }
+    variable = ["skin_color", "location", "picture"]
+    if search_filters is not None:
+        fields["filters"] = _filters_text(search_filters)
+        variable.append("filters")
+    baseline = estimate_tokens(
+        (_VERBOSE_ANALYSIS_TEMPLATE if search_filters is None else _VERBOSE_ADVANCED_ANALYSIS_TEMPLATE).format(
+            picture=f"\n    - {description}" if description else "", **fields
+        )
+    )
+    fields["picture"] = f"\nمن الصورة الشخصية: {description}." if description else ""
+    template = ANALYSIS_TEMPLATE if search_filters is None else ADVANCED_ANALYSIS_TEMPLATE
+    prompt = _fit(template, fields, variable, PROMPT_BUDGETS[kind])
+    _record(kind, prompt, baseline)
+    return prompt
+
+
+def _cell(value):
+    text = " ".join(str(value).split()) if value not in (None, "") else "-"
+    return text.replace("|", "/")
+
+
+def encode_product(product):
+    """
+    سطر واحد للمنتج بدون الرابط والصورة المصغرة. product يحمل المعرف القصير في id.
+    """
+    title = _cell(product.get("title"))
+    if len(title) > MAX_TITLE_CHARS:
+        title = title[:MAX_TITLE_CHARS - 1] + "…"
+    price = product.get("price")
+    if isinstance(price, dict):
+        price = price.get("value") or price.get("extracted_value")
+    return " | ".join((product["id"], title, _cell(product.get("source")), _cell(price), _cell(product.get("tag"))))
+
+
+def product_tokens(product):
+    return estimate_tokens(encode_product(product)) + 1
+
+
+def format_prompt(user_analysis_text, products, posts_wanted, search_filters=None):
+    """
+    وصف تنسيق المنشورات ضمن ميزانيته. يعيد (الوصف، المنتجات المرسلة فعلًا)، والمنتجات
+    المحذوفة لتجاوز الميزانية هي الأخيرة في القائمة. إذا بقي الوصف أكبر من الميزانية بمنتج
+    واحد يُختصر التحليل والفلاتر، الأطول أولًا.
+    """
+    if search_filters is not None:
+        filters = f"\nفلاتر البحث: {_filters_text(search_filters)}"
+        filters_hint = " والفلاتر المختارة"
+    else:
+        filters = ""
+        filters_hint = ""
+    lines = [encode_product(product) for product in products]
+    fields = {"analysis": user_analysis_text, "filters": filters, "filters_hint": filters_hint}
+
+    def build(count):
+        return FORMAT_TEMPLATE.format(products="\n".join(lines[:count]), posts_wanted=min(posts_wanted, count), **fields)
+
+    # الحمولة السابقة: القالب المطول مع JSON كامل لكل منتج بكل حقوله وروابطه
+    baseline = estimate_tokens(_VERBOSE_FORMAT_TEMPLATE.format(
+        analysis=user_analysis_text,
+        filters=f"وفلاتر البحث المحددة: {json.dumps(search_filters, ensure_ascii=False)}" if search_filters is not None else "",
+        products=json.dumps(products, ensure_ascii=False),
+        posts_wanted=posts_wanted,
+        filters_hint=" والفلاتر التي اختارها" if search_filters is not None else "",
+    ))
+    budget = PROMPT_BUDGETS["format"]
+    count = len(products)
+    prompt = build(count)
+    while count > 1 and estimate_tokens(prompt) > budget:
+        count -= 1
+        prompt = build(count)
+    if estimate_tokens(prompt) > budget:
+        fields["products"] = "\n".join(lines[:count])
+        fields["posts_wanted"] = min(posts_wanted, count)
+        prompt = _fit(FORMAT_TEMPLATE, fields, ["analysis", "filters"], budget)
+    _record("format", prompt, baseline, products=count, dropped=len(products) - count)
+    return prompt, products[:count]
@@ -0,0 +1,244 @@
+"""
+عملاء المزودين الخارجيين (Gemini و SerpApi) طويلة العمر بدلاً من إنشائها في كل استدعاء.
+
+- Gemini: genai.configure يُستدعى مرة واحدة لكل عملية، ونماذج GenerativeModel محفوظة
+  حسب اسم النموذج. عميل gRPC غير المتزامن مرتبط بحلقة الأحداث التي أنشأته، لذلك النماذج
+  غير المتزامنة محفوظة لكل حلقة أحداث مع عميل خاص بها.
+- SerpApi: جلسة requests واحدة لكل عملية بمجمع اتصالات keep-alive (مجمع urllib3 آمن
+  للاستخدام من عدة خيوط)، وعميل httpx.AsyncClient لكل حلقة أحداث.
+
+كل شيء مرتبط بمعرف العملية: بعد تفرع gunicorn (--preload) يبدأ العامل بعملاء جدد ولا
+يستخدم اتصالات العملية الأم. stats() يعيد عدد الاتصالات الجديدة مقابل الطلبات التي
+أعادت استخدام اتصال مفتوح.
+
+عند تفعيل البدائل المحلية (fake_providers.py) تعيد هذه الدوال البدائل بدلاً من العملاء الحقيقيين.
+"""
+import asyncio
+import os
+import threading
+import weakref
+
+import google.generativeai as genai
+import httpx
+import requests
+from django.conf import settings
+from google.generativeai import client as genai_client
+from requests.adapters import HTTPAdapter
+
+from . import fake_providers
+
+GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
+SERPAPI_API_KEY = os.environ.get("SERPAPI_API_KEY")
+
+# عنوان SerpApi (نفس ما تستخدمه مكتبة serpapi داخليًا)
+SERPAPI_SEARCH_URL = "https://serpapi.com/search.json"
+
+# حجم مجمع الاتصالات: عدد الاتصالات المفتوحة التي يحتفظ بها كل عميل HTTP
+HTTP_POOL_SIZE = getattr(settings, "PROVIDER_HTTP_POOL_SIZE", getattr(settings, "AI_PIPELINE_MAX_WORKERS", 16))
+
+
+class ProviderThrottled(Exception):
+    """المزود رد بـ 429؛ retry_after بالثواني من ترويسة Retry-After إن وُجدت."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _retry_after(headers):
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+_lock = threading.Lock()
+_pid = None
+_models = {}
+_session = None
+_async_models = weakref.WeakKeyDictionary()
+_async_clients = weakref.WeakKeyDictionary()
+
+_counters = {
+    "gemini_configured": 0,
+    "models_created": 0,
+    "model_reuses": 0,
+    "http_sessions_created": 0,
+    "async_http_clients_created": 0,
+    "async_http_requests": 0,
+    "async_http_connections": 0,
+}
+
+
+def _ensure_process():
+    """
+    يعيد تهيئة العملاء عند أول استخدام في كل عملية (بما فيها العمال بعد التفرع).
+    يُستدعى مع الإمساك بالقفل.
+    """
+    global _pid, _session
+    if _pid == os.getpid():
+        return
+    _models.clear()
+    _async_models.clear()
+    _async_clients.clear()
+    # جلسة العملية الأم قد تحمل اتصالات مشتركة مع العامل؛ لا تُغلق هنا حتى لا تتأثر الأم
+    _session = None
+    if GEMINI_API_KEY:
+        try:
+            # configure يفرغ أيضًا عملاء gRPC المحفوظة داخل genai
+            genai.configure(api_key=GEMINI_API_KEY)
+            _counters["gemini_configured"] += 1
+        except Exception as e:
+            print(f"خطأ في تهيئة Gemini: {e}")
+    else:
+        print("تحذير: لم يتم العثور على GEMINI_API_KEY في البيئة.")
+    _pid = os.getpid()
+
+
+def gemini_model(model_name):
+    """
+    نموذج Gemini محفوظ للاستدعاءات المتزامنة (آمن للاستخدام من عدة خيوط).
+    """
+    if fake_providers.enabled():
+        return fake_providers.FakeGenerativeModel(model_name)
+    with _lock:
+        _ensure_process()
+        model = _models.get(model_name)
+        if model is None:
+            model = genai.GenerativeModel(model_name=model_name)
+            _models[model_name] = model
+            _counters["models_created"] += 1
+        else:
+            _counters["model_reuses"] += 1
+        return model
+
+
+def agemini_model(model_name):
+    """
+    نموذج Gemini للاستدعاءات غير المتزامنة، محفوظ لكل حلقة أحداث مع عميل gRPC خاص بها.
+    """
+    if fake_providers.enabled():
+        return fake_providers.FakeGenerativeModel(model_name)
+    loop = asyncio.get_running_loop()
+    with _lock:
+        _ensure_process()
+        models = _async_models.setdefault(loop, {})
+        model = models.get(model_name)
+        if model is None:
+            model = genai.GenerativeModel(model_name=model_name)
+            # العميل غير المتزامن الافتراضي في genai مشترك بين كل الحلقات، وهذا لا يصلح
+            # عندما يشغل Django كل طلب غير متزامن في حلقة خاصة (تحت WSGI)
+            try:
+                model._async_client = genai_client._client_manager.make_client("generative_async")
+            except Exception as e:
+                # بدون مفتاح صالح يظهر الخطأ عند الاستدعاء نفسه، حيث يعالجه المستدعي
+                print(f"خطأ في إنشاء عميل Gemini غير المتزامن: {e}")
+                return model
+            models[model_name] = model
+            _counters["models_created"] += 1
+        else:
+            _counters["model_reuses"] += 1
+        return model
+
+
+def http_session():
+    """
+    جلسة requests مشتركة في العملية بمجمع اتصالات keep-alive.
+    """
+    global _session
+    with _lock:
+        _ensure_process()
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+            _counters["http_sessions_created"] += 1
+        return _session
+
+
+def async_http_client():
+    """
+    عميل httpx غير متزامن لحلقة الأحداث الحالية، يعيد استخدام الاتصالات بين الطلبات.
+    """
+    loop = asyncio.get_running_loop()
+    with _lock:
+        _ensure_process()
+        client = _async_clients.get(loop)
+        if client is None:
+            limits = httpx.Limits(max_connections=HTTP_POOL_SIZE, max_keepalive_connections=HTTP_POOL_SIZE)
+            client = httpx.AsyncClient(limits=limits)
+            _async_clients[loop] = client
+            _counters["async_http_clients_created"] += 1
+        return client
+
+
+def _trace_connections(event_name, info):
+    # httpcore يرسل هذا الحدث فقط عند فتح اتصال TCP جديد
+    if event_name == "connection.connect_tcp.complete":
+        _counters["async_http_connections"] += 1
+
+
+async def _atrace_connections(event_name, info):
+    _trace_connections(event_name, info)
+
+
+def serpapi_search(params, timeout):
+    """
+    بحث SerpApi عبر الجلسة المشتركة. يعيد (النتائج كقاموس، رمز حالة HTTP).
+    """
+    if fake_providers.enabled():
+        return fake_providers.serpapi_search(params, timeout)
+    response = http_session().get(
+        SERPAPI_SEARCH_URL,
+        params={**params, "source": "python", "output": "json"},
+        timeout=timeout,
+    )
+    if response.status_code == 429:
+        raise ProviderThrottled("SerpApi rate limit exceeded.", _retry_after(response.headers))
+    return response.json(), response.status_code
+
+
+async def aserpapi_search(params, timeout):
+    if fake_providers.enabled():
+        return await fake_providers.aserpapi_search(params, timeout)
+    _counters["async_http_requests"] += 1
+    response = await async_http_client().get(
+        SERPAPI_SEARCH_URL,
+        params={**params, "source": "python", "output": "json"},
+        timeout=timeout,
+        extensions={"trace": _atrace_connections},
+    )
+    if response.status_code == 429:
+        raise ProviderThrottled("SerpApi rate limit exceeded.", _retry_after(response.headers))
+    return response.json(), response.status_code
+
+
+def _session_pool_stats():
+    # عدادات مجمعات urllib3: num_connections اتصالات جديدة، num_requests كل الطلبات
+    connections = requests_count = 0
+    if _session is not None:
+        # نفس المحول مركب على http و https
+        for adapter in {id(a): a for a in _session.adapters.values()}.values():
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is not None:
+                    connections += pool.num_connections
+                    requests_count += pool.num_requests
+    return connections, requests_count
+
+
+def stats():
+    with _lock:
+        connections, requests_count = _session_pool_stats()
+        async_connections = _counters["async_http_connections"]
+        async_requests = _counters["async_http_requests"]
+        return {
+            **_counters,
+            "http_connections": connections,
+            "http_requests": requests_count,
+            "http_connection_reuses": max(0, requests_count - connections),
+            "async_http_connection_reuses": max(0, async_requests - async_connections),
+            "fake_providers": fake_providers.stats(),
+        }
@@ -0,0 +1,213 @@
+"""
+دمج نتائج Google Lens من كل الصور المولدة، وإزالة المكرر، وترتيبها قبل التنسيق.
+
+المنتج مكرر إذا تطابق رابطه بعد التوحيد (بدون www وبدون معاملات التتبع)، أو تطابق
+المتجر والعنوان بعد التوحيد. الترتيب حسب:
+- عدد الصور المولدة التي ظهر فيها المنتج (كلما زاد كان أقرب لما يناسب المستخدم).
+- ملاءمة السعر لميزانية المستخدم (CustomUser.budget أو فلتر الميزانية).
+- وجود سعر مفهوم.
+عند التساوي يبقى ترتيب الظهور الأول، ولا يمر إلى التنسيق إلا أفضل TOP_N منتج.
+"""
+import re
+import threading
+import unicodedata
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from django.conf import settings
+
+_options = getattr(settings, "PRODUCT_RANKING", {})
+RANKING_TOP_N = _options.get("TOP_N", 20)
+MATCH_WEIGHT = _options.get("MATCH_WEIGHT", 1.0)
+BUDGET_WEIGHT = _options.get("BUDGET_WEIGHT", 1.5)
+PRICE_KNOWN_WEIGHT = _options.get("PRICE_KNOWN_WEIGHT", 0.25)
+
+_TRACKING_PARAMS = {"gclid", "fbclid", "srsltid", "ref", "ref_", "tag", "spm", "_pos", "_sid", "_ss"}
+_whitespace_re = re.compile(r"\s+")
+_punctuation_re = re.compile(r"[^\w\s]")
+_number_re = re.compile(r"\d+(?:[.,]\d+)*")
+_arabic_digits = str.maketrans("٠١٢٣٤٥٦٧٨٩٫٬", "0123456789.,")
+
+
+def normalize_text(text):
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    text = _punctuation_re.sub(" ", text)
+    return _whitespace_re.sub(" ", text).strip()
+
+
+def normalize_link(link):
+    """
+    يوحد الرابط: مخطط ونطاق بأحرف صغيرة، بدون www، بدون معاملات التتبع أو المقطع (#).
+    """
+    if not link:
+        return ""
+    parts = urlsplit(link.strip())
+    host = parts.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    query = [
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key.lower() not in _TRACKING_PARAMS and not key.lower().startswith("utm_")
+    ]
+    path = parts.path.rstrip("/")
+    return urlunsplit(("https", host, path, urlencode(sorted(query)), ""))
+
+
+def _parse_number(text):
+    # "1,299.00" و "1.299,00" و "1299" كلها 1299
+    if "," in text and "." in text:
+        if text.rfind(",") > text.rfind("."):
+            text = text.replace(".", "").replace(",", ".")
+        else:
+            text = text.replace(",", "")
+    elif "," in text:
+        head, _, tail = text.rpartition(",")
+        text = f"{head.replace(',', '')}.{tail}" if len(tail) in (1, 2) else text.replace(",", "")
+    elif text.count(".") > 1:
+        text = text.replace(".", "")
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def parse_price(price):
+    """
+    يستخرج قيمة السعر من حقل price في نتائج SerpApi (نص، رقم، أو قاموس فيه extracted_value).
+    """
+    if price is None:
+        return None
+    if isinstance(price, dict):
+        if isinstance(price.get("extracted_value"), (int, float)):
+            return float(price["extracted_value"])
+        price = price.get("value")
+    if isinstance(price, (int, float)):
+        return float(price)
+    if not isinstance(price, str):
+        return None
+    match = _number_re.search(price.translate(_arabic_digits))
+    return _parse_number(match.group()) if match else None
+
+
+def parse_budget(budget):
+    """
+    يحول الميزانية النصية إلى (أدنى، أعلى). "200-500" ← (200، 500)، "300" ← (0، 300).
+    الميزانيات الوصفية مثل "متوسطة" تعيد None لأنه لا يمكن مقارنتها بالأسعار.
+    """
+    if budget is None:
+        return None
+    if isinstance(budget, (int, float)):
+        return 0.0, float(budget)
+    numbers = [_parse_number(n) for n in _number_re.findall(str(budget).translate(_arabic_digits))]
+    numbers = [n for n in numbers if n is not None]
+    if not numbers:
+        return None
+    if len(numbers) == 1:
+        return 0.0, numbers[0]
+    return min(numbers[:2]), max(numbers[:2])
+
+
+def budget_fit(price, budget_range):
+    """
+    1 داخل الميزانية، وتتناقص حتى 0 كلما ابتعد السعر عنها. 0.5 إذا كان السعر أو الميزانية غير معروف.
+    """
+    if price is None or budget_range is None:
+        return 0.5
+    low, high = budget_range
+    if low <= price <= high:
+        return 1.0
+    if price > high:
+        return max(0.0, 1.0 - (price - high) / max(high, 1.0))
+    return max(0.0, 1.0 - (low - price) / max(low, 1.0)) * 0.8
+
+
+def _identity_keys(product):
+    keys = []
+    link = normalize_link(product.get("link"))
+    if link:
+        keys.append(("link", link))
+    title = normalize_text(product.get("title"))
+    if title:
+        keys.append(("title", normalize_text(product.get("source")), title))
+    return keys
+
+
+class _Group:
+    __slots__ = ("product", "positions", "order")
+
+    def __init__(self, product, order):
+        self.product = dict(product)
+        self.positions = set()
+        self.order = order
+
+    def absorb(self, product):
+        # إكمال الحقول الناقصة من النسخ المكررة
+        for key, value in product.items():
+            if value and not self.product.get(key):
+                self.product[key] = value
+
+
+def rank_products(chain_results, budget=None, top_n=None):
+    """
+    chain_results: قائمة من (الوصف، نتائج التسوق أو استثناء) بترتيب ثابت.
+    يعيد أفضل top_n منتج بعد إزالة المكرر، مرتبة تنازليًا حسب النتيجة.
+    """
+    top_n = RANKING_TOP_N if top_n is None else top_n
+    budget_range = parse_budget(budget)
+    groups = []
+    by_key = {}
+    for position, (_, shopping_results) in enumerate(chain_results):
+        if not isinstance(shopping_results, list):
+            continue
+        for product in shopping_results:
+            keys = _identity_keys(product)
+            if not keys:
+                continue
+            group = next((by_key[key] for key in keys if key in by_key), None)
+            if group is None:
+                group = _Group(product, len(groups))
+                groups.append(group)
+            else:
+                group.absorb(product)
+            group.positions.add(position)
+            for key in keys:
+                by_key.setdefault(key, group)
+
+    def score(group):
+        price = parse_price(group.product.get("price"))
+        return (
+            MATCH_WEIGHT * len(group.positions)
+            + BUDGET_WEIGHT * budget_fit(price, budget_range)
+            + (PRICE_KNOWN_WEIGHT if price is not None else 0.0)
+        )
+
+    ranked = sorted(groups, key=lambda group: (-score(group), group.order))
+    if top_n:
+        ranked = ranked[:top_n]
+    return [group.product for group in ranked]
+
+
+class ProductDeduper:
+    """
+    يمنع تكرار المنتجات بين سلاسل تعمل بالتوازي (مسار البث حيث تُنسق كل صورة وحدها)
+    أو بين صفحات تُولد على مراحل (يمكن حفظ seen واستعادته).
+    """
+
+    def __init__(self, seen=None):
+        self._seen = set(seen or ())
+        self._lock = threading.Lock()
+
+    @property
+    def seen(self):
+        with self._lock:
+            return list(self._seen)
+
+    def filter(self, products):
+        unique = []
+        with self._lock:
+            for product in products:
+                keys = _identity_keys(product)
+                if not keys or any(key in self._seen for key in keys):
+                    continue
+                self._seen.update(keys)
+                unique.append(product)
+        return unique
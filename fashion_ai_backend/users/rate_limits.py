@@ -0,0 +1,453 @@
+"""
+محدد معدل مشترك لكل الاستدعاءات الصادرة إلى Gemini و SerpApi.
+
+الحالة محفوظة في ملف SQLite محلي يتشاركه كل عمال gunicorn على نفس الجهاز، وكل تعديل
+يتم داخل معاملة BEGIN IMMEDIATE، لذلك يرى كل العمال نفس الرصيد:
+- دلو رموز (token bucket) لكل مزود: RATE رمز في الثانية حتى BURST، وكل استدعاء يستهلك رمزًا.
+- دلو اختياري لكل (مزود، مستخدم) عبر PER_USER_RATE و PER_USER_BURST.
+- حد للاستدعاءات المتزامنة لكل مزود (CONCURRENCY) عبر عقود (leases) لها مدة صلاحية،
+  حتى لا يبقى مكان محجوزًا إذا توقف العامل فجأة.
+- طابور عادل: كل منتظر يسجل تذكرة، والدور يُعطى بالتناوب بين المستخدمين: أول تذكرة لكل
+  مستخدم، والأولوية بينها للمستخدم الذي مضى أطول وقت على آخر استدعاء له، فلا يحجز طلب
+  كبير المزود عن الآخرين.
+- عند 429 يُوقف المزود لكل العمال حتى Retry-After (أو تراجع أُسّي إن لم يُحدد)، ثم يعاد
+  الاستدعاء ما دام موعد الطلب يسمح.
+
+الانتظار لا يتجاوز موعد الطلب (deadlines.py) ولا MAX_WAIT.
+"""
+import asyncio
+import contextvars
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from google.api_core import exceptions as google_exceptions
+
+from . import metrics
+from .deadlines import DeadlineExceeded, current_deadline
+from .providers import ProviderThrottled
+
+_options = getattr(settings, "PROVIDER_RATE_LIMITS", {})
+RATE_LIMITS_ENABLED = _options.get("ENABLED", True)
+RATE_LIMITS_PATH = str(_options.get("PATH", os.path.join(settings.BASE_DIR, "cache", "rate_limits.sqlite3")))
+MAX_WAIT = _options.get("MAX_WAIT", 30)
+MAX_RETRIES = _options.get("MAX_RETRIES", 2)
+DEFAULT_BACKOFF = _options.get("DEFAULT_BACKOFF", 2)
+LEASE_TTL = _options.get("LEASE_TTL", 120)
+POLL_INTERVAL = _options.get("POLL_INTERVAL", 0.25)
+
+PROVIDER_LIMITS = {
+    "gemini": {"RATE": 2.0, "BURST": 10, "CONCURRENCY": 8, "PER_USER_RATE": 1.0, "PER_USER_BURST": 6},
+    "gemini_image": {"RATE": 0.5, "BURST": 4, "CONCURRENCY": 4, "PER_USER_RATE": 0.25, "PER_USER_BURST": 3},
+    "serpapi": {"RATE": 1.0, "BURST": 6, "CONCURRENCY": 6, "PER_USER_RATE": 0.5, "PER_USER_BURST": 4},
+}
+for _provider, _limits in _options.get("PROVIDERS", {}).items():
+    PROVIDER_LIMITS[_provider] = {**PROVIDER_LIMITS.get(_provider, {}), **_limits}
+
+
+class RateLimitTimeout(Exception):
+    """انتهت MAX_WAIT قبل أن يأتي دور الاستدعاء."""
+
+
+_stats_lock = threading.Lock()
+_stats = {}
+
+
+def _record(provider, **values):
+    with _stats_lock:
+        counters = _stats.setdefault(provider, {
+            "granted": 0, "waited": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0,
+            "throttled": 0, "retries": 0, "timeouts": 0,
+        })
+        for name, value in values.items():
+            if name == "max_wait_seconds":
+                counters[name] = max(counters[name], value)
+            else:
+                counters[name] += value
+
+
+_current_user = contextvars.ContextVar("rate_limit_user", default="")
+
+
+@contextmanager
+def user_scope(user_id):
+    """
+    يربط الاستدعاءات داخل النطاق بالمستخدم لتطبيق الحدود الخاصة به.
+    """
+    token = _current_user.set(str(user_id or ""))
+    try:
+        yield
+    finally:
+        _current_user.reset(token)
+
+
+_local = threading.local()
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, blocked_until REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS tickets (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, provider TEXT NOT NULL, user_key TEXT NOT NULL, expires REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tickets_provider ON tickets (provider, id);
+CREATE TABLE IF NOT EXISTS leases (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, provider TEXT NOT NULL, expires REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS leases_provider ON leases (provider, expires);
+CREATE TABLE IF NOT EXISTS served (
+    provider TEXT NOT NULL, user_key TEXT NOT NULL, last REAL NOT NULL, PRIMARY KEY (provider, user_key)
+);
+"""
+
+
+def _connection():
+    # اتصال لكل خيط ولكل عملية؛ اتصالات SQLite لا تنتقل بين الخيوط ولا بعد التفرع
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "pid", None) != os.getpid():
+        os.makedirs(os.path.dirname(RATE_LIMITS_PATH), exist_ok=True)
+        conn = sqlite3.connect(RATE_LIMITS_PATH, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        _local.conn = conn
+        _local.pid = os.getpid()
+    return conn
+
+
+@contextmanager
+def _transaction():
+    conn = _connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def _bucket(conn, key, rate, burst, now):
+    """
+    يعيد (الرصيد بعد إعادة التعبئة، موعد انتهاء الإيقاف).
+    """
+    row = conn.execute("SELECT tokens, updated, blocked_until FROM buckets WHERE key = ?", (key,)).fetchone()
+    if row is None:
+        return float(burst), 0.0
+    tokens, updated, blocked_until = row
+    return min(float(burst), tokens + max(0.0, now - updated) * rate), blocked_until
+
+
+def _save_bucket(conn, key, tokens, now, blocked_until=0.0):
+    conn.execute(
+        "INSERT INTO buckets (key, tokens, updated, blocked_until) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT (key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated, "
+        "blocked_until = MAX(buckets.blocked_until, excluded.blocked_until)",
+        (key, tokens, now, blocked_until),
+    )
+
+
+def _user_bucket_key(provider, user_key):
+    return f"{provider}:user:{user_key}"
+
+
+def _try_acquire(provider, ticket_id, user_key):
+    """
+    يحاول منح الدور للتذكرة. يعيد (معرف العقد أو None، مدة الانتظار المقترحة).
+    """
+    limits = PROVIDER_LIMITS[provider]
+    rate, burst = limits["RATE"], limits["BURST"]
+    user_rate, user_burst = limits.get("PER_USER_RATE"), limits.get("PER_USER_BURST")
+    now = time.time()
+    with _transaction() as conn:
+        conn.execute("DELETE FROM leases WHERE expires < ?", (now,))
+        conn.execute("DELETE FROM tickets WHERE expires < ?", (now,))
+        conn.execute("DELETE FROM served WHERE last < ?", (now - LEASE_TTL,))
+
+        tokens, blocked_until = _bucket(conn, provider, rate, burst, now)
+        if blocked_until > now:
+            return None, blocked_until - now
+        if tokens < 1:
+            return None, (1 - tokens) / rate
+
+        active = conn.execute(
+            "SELECT COUNT(*) FROM leases WHERE provider = ? AND expires >= ?", (provider, now)
+        ).fetchone()[0]
+        if active >= limits["CONCURRENCY"]:
+            return None, POLL_INTERVAL
+
+        # أول تذكرة في الترتيب العادل يملك مستخدمها رصيدًا: التذكرة الأقدم لكل مستخدم،
+        # مرتبة حسب آخر استدعاء مُنح للمستخدم
+        last_served = dict(conn.execute("SELECT user_key, last FROM served WHERE provider = ?", (provider,)))
+        rank = {}
+        order = []
+        for other_id, other_user in conn.execute(
+            "SELECT id, user_key FROM tickets WHERE provider = ? ORDER BY id", (provider,)
+        ):
+            order.append((rank.get(other_user, 0), last_served.get(other_user, 0.0), other_id, other_user))
+            rank[other_user] = rank.get(other_user, 0) + 1
+        user_tokens = {}
+        for _, _, other_id, other_user in sorted(order):
+            if user_rate and other_user:
+                if other_user not in user_tokens:
+                    user_tokens[other_user] = _bucket(
+                        conn, _user_bucket_key(provider, other_user), user_rate, user_burst, now
+                    )[0]
+                if user_tokens[other_user] < 1:
+                    continue
+            if other_id != ticket_id:
+                return None, POLL_INTERVAL
+            break
+        else:
+            # رصيد هذا المستخدم نفد؛ ننتظر حتى يتوفر رمز له
+            return None, (1 - user_tokens.get(user_key, 0)) / user_rate if user_rate else POLL_INTERVAL
+
+        _save_bucket(conn, provider, tokens - 1, now)
+        if user_rate and user_key:
+            _save_bucket(conn, _user_bucket_key(provider, user_key), user_tokens[user_key] - 1, now)
+        conn.execute("DELETE FROM tickets WHERE id = ?", (ticket_id,))
+        conn.execute(
+            "INSERT INTO served (provider, user_key, last) VALUES (?, ?, ?) "
+            "ON CONFLICT (provider, user_key) DO UPDATE SET last = excluded.last",
+            (provider, user_key, now),
+        )
+        cursor = conn.execute("INSERT INTO leases (provider, expires) VALUES (?, ?)", (provider, now + LEASE_TTL))
+        return cursor.lastrowid, 0.0
+
+
+def _enqueue(provider, user_key, max_wait):
+    with _transaction() as conn:
+        cursor = conn.execute(
+            "INSERT INTO tickets (provider, user_key, expires) VALUES (?, ?, ?)",
+            (provider, user_key, time.time() + max_wait + LEASE_TTL),
+        )
+        return cursor.lastrowid
+
+
+def _dequeue(ticket_id):
+    with _transaction() as conn:
+        conn.execute("DELETE FROM tickets WHERE id = ?", (ticket_id,))
+
+
+def _release(lease_id):
+    with _transaction() as conn:
+        conn.execute("DELETE FROM leases WHERE id = ?", (lease_id,))
+
+
+def _max_wait():
+    deadline = current_deadline()
+    if deadline is None:
+        return MAX_WAIT
+    return max(0.0, min(MAX_WAIT, deadline.remaining()))
+
+
+def _give_up(provider, waited):
+    _record(provider, timeouts=1)
+    deadline = current_deadline()
+    if deadline is not None and deadline.remaining() <= MAX_WAIT:
+        deadline.mark_partial()
+        raise DeadlineExceeded(f"Request deadline exceeded waiting for {provider} rate limit.")
+    raise RateLimitTimeout(f"Waited {waited:.1f}s for {provider} rate limit.")
+
+
+def _granted(provider, waited):
+    _record(provider, granted=1, waited=1 if waited > 0.001 else 0, wait_seconds=waited, max_wait_seconds=waited)
+
+
+def acquire(provider):
+    """
+    ينتظر دور الاستدعاء ويعيد معرف العقد. يجب تحريره بـ release().
+    """
+    max_wait = _max_wait()
+    started = time.monotonic()
+    ticket_id = _enqueue(provider, _current_user.get(), max_wait)
+    try:
+        while True:
+            lease_id, delay = _try_acquire(provider, ticket_id, _current_user.get())
+            waited = time.monotonic() - started
+            if lease_id is not None:
+                _granted(provider, waited)
+                return lease_id
+            if waited + delay > max_wait:
+                _give_up(provider, waited)
+            time.sleep(min(max(delay, 0.01), POLL_INTERVAL))
+    except BaseException:
+        _dequeue(ticket_id)
+        raise
+
+
+async def aacquire(provider):
+    """
+    النسخة غير المتزامنة من acquire(). معاملات SQLite قد تنتظر القفل حتى مهلة الاتصال،
+    لذلك تعمل في خيط وليس في حلقة الأحداث.
+    """
+    max_wait = _max_wait()
+    started = time.monotonic()
+    user_key = _current_user.get()
+    enqueue = asyncio.ensure_future(asyncio.to_thread(_enqueue, provider, user_key, max_wait))
+    try:
+        ticket_id = await asyncio.shield(enqueue)
+    except asyncio.CancelledError:
+        enqueue.add_done_callback(_dequeue_late_ticket)
+        raise
+    try:
+        while True:
+            attempt = asyncio.ensure_future(asyncio.to_thread(_try_acquire, provider, ticket_id, user_key))
+            try:
+                lease_id, delay = await asyncio.shield(attempt)
+            except asyncio.CancelledError:
+                # الخيط قد يمنح العقد بعد الإلغاء؛ يُحرر عند انتهائه بدلاً من بقائه حتى LEASE_TTL
+                attempt.add_done_callback(_release_late_lease)
+                raise
+            waited = time.monotonic() - started
+            if lease_id is not None:
+                _granted(provider, waited)
+                return lease_id
+            if waited + delay > max_wait:
+                _give_up(provider, waited)
+            await asyncio.sleep(min(max(delay, 0.01), POLL_INTERVAL))
+    except BaseException:
+        await asyncio.shield(asyncio.to_thread(_dequeue, ticket_id))
+        raise
+
+
+def _dequeue_late_ticket(enqueue):
+    if not enqueue.cancelled() and enqueue.exception() is None:
+        asyncio.ensure_future(asyncio.to_thread(_dequeue, enqueue.result()))
+
+
+def _release_late_lease(attempt):
+    if not attempt.cancelled() and attempt.exception() is None and attempt.result()[0] is not None:
+        asyncio.ensure_future(asyncio.to_thread(_release, attempt.result()[0]))
+
+
+async def arelease(lease_id):
+    await asyncio.shield(asyncio.to_thread(_release, lease_id))
+
+
+async def apenalize(provider, retry_after):
+    await asyncio.to_thread(penalize, provider, retry_after)
+
+
+def release(lease_id):
+    _release(lease_id)
+
+
+def penalize(provider, retry_after):
+    """
+    يوقف المزود لكل العمال حتى تنقضي retry_after ثانية، ويفرغ رصيده.
+    """
+    now = time.time()
+    with _transaction() as conn:
+        _save_bucket(conn, provider, 0.0, now, now + retry_after)
+    _record(provider, throttled=1)
+
+
+def retry_after_from(error, attempt):
+    """
+    مدة الانتظار المطلوبة إذا كان الخطأ بسبب تجاوز الحصة (429)، وإلا None.
+    """
+    if isinstance(error, ProviderThrottled):
+        return error.retry_after or DEFAULT_BACKOFF * 2 ** attempt
+    if isinstance(error, google_exceptions.TooManyRequests):
+        for detail in getattr(error, "details", None) or ():
+            delay = getattr(detail, "retry_delay", None)
+            if delay is not None and (delay.seconds or delay.nanos):
+                return delay.seconds + delay.nanos / 1e9
+        return DEFAULT_BACKOFF * 2 ** attempt
+    return None
+
+
+def _can_retry(retry_after, attempt):
+    if attempt >= MAX_RETRIES:
+        return False
+    deadline = current_deadline()
+    return deadline is None or retry_after < deadline.remaining()
+
+
+def _record_call(provider, started, outcome):
+    metrics.inc("fashion_provider_calls_total", provider=provider, outcome=outcome)
+    metrics.observe("fashion_provider_call_duration_seconds", time.perf_counter() - started, provider=provider)
+
+
+def call(provider, fn):
+    """
+    ينفذ fn() عند حلول دورها ويعيد نتيجتها، مع إعادة المحاولة بعد 429.
+    """
+    attempt = 0
+    while True:
+        lease_id = acquire(provider) if RATE_LIMITS_ENABLED else None
+        started = time.perf_counter()
+        try:
+            result = fn()
+        except Exception as e:
+            retry_after = retry_after_from(e, attempt)
+            _record_call(provider, started, "error" if retry_after is None else "throttled")
+            if retry_after is None or not RATE_LIMITS_ENABLED:
+                raise
+            penalize(provider, retry_after)
+            if not _can_retry(retry_after, attempt):
+                raise
+        else:
+            _record_call(provider, started, "ok")
+            return result
+        finally:
+            if lease_id is not None:
+                release(lease_id)
+        attempt += 1
+        _record(provider, retries=1)
+
+
+async def acall(provider, coroutine_fn):
+    """
+    النسخة غير المتزامنة من call(): coroutine_fn دالة تعيد coroutine جديدة عند كل محاولة.
+    """
+    attempt = 0
+    while True:
+        lease_id = await aacquire(provider) if RATE_LIMITS_ENABLED else None
+        started = time.perf_counter()
+        try:
+            result = await coroutine_fn()
+        except Exception as e:
+            retry_after = retry_after_from(e, attempt)
+            _record_call(provider, started, "error" if retry_after is None else "throttled")
+            if retry_after is None or not RATE_LIMITS_ENABLED:
+                raise
+            await apenalize(provider, retry_after)
+            if not _can_retry(retry_after, attempt):
+                raise
+        else:
+            _record_call(provider, started, "ok")
+            return result
+        finally:
+            if lease_id is not None:
+                await arelease(lease_id)
+        attempt += 1
+        _record(provider, retries=1)
+
+
+def stats():
+    """
+    عدادات هذه العملية لكل مزود، مع عمق الطابور والاستدعاءات الجارية المشتركة بين العمال.
+    """
+    with _stats_lock:
+        result = {provider: dict(counters) for provider, counters in _stats.items()}
+    if not RATE_LIMITS_ENABLED:
+        return result
+    now = time.time()
+    conn = _connection()
+    for provider, depth in conn.execute(
+        "SELECT provider, COUNT(*) FROM tickets WHERE expires >= ? GROUP BY provider", (now,)
+    ):
+        result.setdefault(provider, {})["queue_depth"] = depth
+    for provider, active in conn.execute(
+        "SELECT provider, COUNT(*) FROM leases WHERE expires >= ? GROUP BY provider", (now,)
+    ):
+        result.setdefault(provider, {})["in_flight"] = active
+    for key, blocked_until in conn.execute("SELECT key, blocked_until FROM buckets WHERE blocked_until > ?", (now,)):
+        if key in PROVIDER_LIMITS:
+            result.setdefault(key, {})["blocked_for_seconds"] = round(blocked_until - now, 1)
+    return result
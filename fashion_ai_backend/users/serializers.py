@@ -6,8 +6,9 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = CustomUser
+        # id للقراءة فقط، ويحتاجه العميل لاستدعاء بقية الواجهات
         fields = (
-            'username', 'email', 'password', 'height', 'weight', 'skin_color', 'profile_picture',
+            'id', 'username', 'email', 'password', 'height', 'weight', 'skin_color', 'profile_picture',
             'age', 'gender', 'body_type', 'style_preference', 'budget', 'phone'
         )
 
@@ -0,0 +1,35 @@
+from django.db import transaction
+from django.db.models.signals import post_init, post_save
+from django.dispatch import receiver
+
+from .models import CustomUser
+from .profile_analysis import clear_picture_analysis, schedule_picture_analysis
+
+
+@receiver(post_init, sender=CustomUser)
+def remember_profile_picture(sender, instance, **kwargs):
+    instance._original_picture_name = instance.profile_picture.name if instance.profile_picture else ""
+
+
+@receiver(post_save, sender=CustomUser)
+def analyze_profile_picture_on_change(sender, instance, created, raw=False, **kwargs):
+    """
+    عند رفع صورة جديدة أو تغييرها: يمسح التحليل القديم ويجدول تحليل الصورة الجديدة
+    بعد تأكيد المعاملة، خارج مسار الطلب.
+    """
+    if raw:
+        return
+    picture_name = instance.profile_picture.name if instance.profile_picture else ""
+    # post_init يرى الصورة الممررة عند الإنشاء، لذلك الإنشاء بصورة يعد تغييرًا
+    changed = created or picture_name != getattr(instance, "_original_picture_name", "")
+    instance._original_picture_name = picture_name
+
+    if changed and not created:
+        clear_picture_analysis(instance.id)
+        instance.picture_analysis = None
+        instance.picture_digest = None
+        instance.picture_analyzed_at = None
+    # الحفظ الذي لا يغير الصورة لا يعيد التحليل؛ التحليل الناقص يُحسب عند طلبه (AnalyzeProfilePictureView)
+    if picture_name and changed:
+        user_id = instance.id
+        transaction.on_commit(lambda: schedule_picture_analysis(user_id))
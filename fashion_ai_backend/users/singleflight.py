@@ -0,0 +1,234 @@
+"""
+دمج الطلبات المتطابقة المتزامنة (single-flight).
+
+عندما يصل طلبان متطابقان (نفس المستخدم والموقع والفلاتر) في الوقت نفسه، ينفذ الأول فقط
+خط المعالجة وينتظر الآخر نتيجته:
+- داخل العملية: عبر Event مشترك لكل مفتاح.
+- بين العمليات: عبر قفل في المخزن المشترك (cache.add ذري)، وتُنشر النتيجة في المخزن
+  لمدة قصيرة حتى يقرأها المنتظرون في العمليات الأخرى.
+إذا اختفى القفل دون نتيجة (فشل المنفذ)، ينفذ المنتظر العملية بنفسه.
+"""
+import asyncio
+import hashlib
+import json
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+def request_signature(user_id, location_info, search_filters=None):
+    """
+    مفتاح ثابت للطلب (لا يعتمد على hash() العشوائي لكل عملية).
+    """
+    payload = json.dumps(
+        {"user": str(user_id), "location": location_info, "filters": search_filters},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.completed = False
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    KEY_PREFIX = "singleflight"
+
+    def __init__(self, shared_alias="recommendations", lock_ttl=600, result_ttl=60, poll_interval=0.5):
+        self.shared_alias = shared_alias
+        self.lock_ttl = lock_ttl
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+        self._calls = {}
+        self._async_calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.local_waiters = 0
+        self.shared_waiters = 0
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias] if self.shared_alias else None
+
+    def _lock_key(self, key):
+        return f"{self.KEY_PREFIX}:lock:{key}"
+
+    def _result_key(self, key):
+        return f"{self.KEY_PREFIX}:result:{key}"
+
+    def do(self, key, fn):
+        """
+        ينفذ fn مرة واحدة لكل مجموعة من الطلبات المتزامنة بنفس المفتاح ويعيد نتيجتها للجميع.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+            else:
+                self.local_waiters += 1
+
+        if not leader:
+            finished = call.event.wait(self.lock_ttl)
+            if call.error is not None:
+                raise call.error
+            if finished and call.completed:
+                return call.result
+            # المنفذ لم ينتهِ خلال lock_ttl أو توقف دون نتيجة ولا خطأ: ينفذ المنتظر بنفسه
+            self.leaders += 1
+            return fn()
+
+        try:
+            call.result = self._do_shared(key, fn)
+            call.completed = True
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+    def _do_shared(self, key, fn):
+        shared = self.shared
+        if shared is None:
+            self.leaders += 1
+            return fn()
+
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.lock_ttl
+        while not shared.add(self._lock_key(key), token, self.lock_ttl):
+            # عملية أخرى تنفذ نفس الطلب: ننتظر نشر النتيجة أو تحرير القفل
+            self.shared_waiters += 1
+            result = self._wait_shared(shared, key, deadline)
+            if result is not None:
+                return result
+            if time.monotonic() >= deadline:
+                break
+
+        self.leaders += 1
+        # حذف نتيجة جولة سابقة حتى لا يقرأها منتظرو هذه الجولة
+        shared.delete(self._result_key(key))
+        try:
+            result = fn()
+            if result is not None:
+                shared.set(self._result_key(key), result, self.result_ttl)
+            return result
+        finally:
+            if shared.get(self._lock_key(key)) == token:
+                shared.delete(self._lock_key(key))
+
+    def _wait_shared(self, shared, key, deadline):
+        while time.monotonic() < deadline:
+            result = shared.get(self._result_key(key))
+            if result is not None:
+                return result
+            if shared.get(self._lock_key(key)) is None:
+                return shared.get(self._result_key(key))
+            time.sleep(self.poll_interval)
+        return None
+
+    async def ado(self, key, coro_fn):
+        """
+        النسخة غير المتزامنة من do؛ الانتظار لا يحجز حلقة الأحداث.
+        """
+        loop = asyncio.get_running_loop()
+        calls = self._async_calls.setdefault(loop, {})
+        future = calls.get(key)
+        if future is not None:
+            self.local_waiters += 1
+        while future is not None:
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # أُلغي المنفذ (مثل انقطاع عميله) وليس هذا الطلب: يصبح أحد المنتظرين المنفذ
+                if not future.cancelled() or asyncio.current_task().cancelling():
+                    raise
+            calls = self._async_calls.setdefault(loop, {})
+            future = calls.get(key)
+
+        future = loop.create_future()
+        calls[key] = future
+        try:
+            result = await self._ado_shared(key, coro_fn)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            # تجنب تحذير "exception was never retrieved" إذا لم يكن هناك منتظرون
+            future.exception()
+            raise
+        finally:
+            # CancelledError ليست Exception: بدون هذا يبقى المنتظرون على future لا تكتمل أبدًا
+            if not future.done():
+                future.cancel()
+            if calls.get(key) is future:
+                del calls[key]
+            if not calls and self._async_calls.get(loop) is calls:
+                self._async_calls.pop(loop, None)
+
+    async def _ado_shared(self, key, coro_fn):
+        shared = self.shared
+        if shared is None:
+            self.leaders += 1
+            return await coro_fn()
+
+        # عمليات المخزن غير المتزامنة: المخزن الملفي أو مخزن قاعدة البيانات لا يعملان داخل حلقة الأحداث
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.lock_ttl
+        while not await shared.aadd(self._lock_key(key), token, self.lock_ttl):
+            self.shared_waiters += 1
+            while time.monotonic() < deadline:
+                result = await shared.aget(self._result_key(key))
+                if result is not None:
+                    return result
+                if await shared.aget(self._lock_key(key)) is None:
+                    break
+                await asyncio.sleep(self.poll_interval)
+            result = await shared.aget(self._result_key(key))
+            if result is not None:
+                return result
+            if time.monotonic() >= deadline:
+                break
+
+        self.leaders += 1
+        await shared.adelete(self._result_key(key))
+        try:
+            result = await coro_fn()
+            if result is not None:
+                await shared.aset(self._result_key(key), result, self.result_ttl)
+            return result
+        finally:
+            if await shared.aget(self._lock_key(key)) == token:
+                await shared.adelete(self._lock_key(key))
+
+    def stats(self):
+        return {
+            "in_flight": len(self._calls) + sum(len(calls) for calls in self._async_calls.values()),
+            "leaders": self.leaders,
+            "local_waiters": self.local_waiters,
+            "shared_waiters": self.shared_waiters,
+        }
+
+
+def build_single_flight():
+    options = getattr(settings, "RECOMMENDATIONS_SINGLE_FLIGHT", {})
+    return SingleFlight(
+        shared_alias=options.get("SHARED_ALIAS", "recommendations"),
+        lock_ttl=options.get("LOCK_TTL", 600),
+        result_ttl=options.get("RESULT_TTL", 60),
+        poll_interval=options.get("POLL_INTERVAL", 0.5),
+    )
+
+
+recommendation_flights = build_single_flight()
@@ -0,0 +1,100 @@
+import json
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from users import ai_services, analysis_cache, metrics
+from users.models import AnalysisCacheEntry
+
+
+def _user(height=172, weight=68, skin_color="قمحي", picture_analysis=None):
+    return SimpleNamespace(height=height, weight=weight, skin_color=skin_color, picture_analysis=picture_analysis)
+
+
+def _response(index):
+    return json.dumps({"analysis": f"تحليل {index}", "prompts": [f"وصف {index}"]}, ensure_ascii=False)
+
+
+class BucketTests(SimpleTestCase):
+    def test_close_profiles_share_a_bucket(self):
+        first = analysis_cache.profile_bucket(_user(171, 66, "قمحيّة"), "Riyadh")
+        second = analysis_cache.profile_bucket(_user(174.5, 69, "حنطي"), "  riyadh ")
+        self.assertEqual(first, second)
+        self.assertEqual(first["height"], "170-175")
+        self.assertEqual(first["skin_color"], "medium")
+        self.assertEqual(analysis_cache.bucket_key("basic", first), analysis_cache.bucket_key("basic", second))
+        self.assertNotEqual(analysis_cache.bucket_key("basic", first), analysis_cache.bucket_key("advanced", first))
+
+    def test_distinct_profiles_do_not(self):
+        base = analysis_cache.profile_bucket(_user(), "Riyadh")
+        self.assertNotEqual(base, analysis_cache.profile_bucket(_user(height=180), "Riyadh"))
+        self.assertNotEqual(base, analysis_cache.profile_bucket(_user(), "Jeddah"))
+        self.assertNotEqual(base, analysis_cache.profile_bucket(
+            _user(picture_analysis={"skin_tone": {"category": "tan"}}), "Riyadh"
+        ))
+
+    def test_skin_colors_and_filters_are_canonical(self):
+        self.assertEqual(analysis_cache.canonical_skin_color("فاتح جدًا"), "very_light")
+        self.assertEqual(analysis_cache.canonical_skin_color("Fair"), "light")
+        self.assertEqual(analysis_cache.canonical_skin_color("أسمر"), "brown")
+        self.assertEqual(analysis_cache.canonical_location("Not provided"), "")
+        self.assertEqual(
+            analysis_cache.canonical_filters({"Color": ["Red", "blue"], "style": " Casual ", "size": ""}),
+            analysis_cache.canonical_filters({"style": "casual", "color": ["BLUE", "red"]}),
+        )
+
+    def test_prompt_uses_bucket_values_not_the_users(self):
+        profile = analysis_cache.bucket_profile(analysis_cache.profile_bucket(_user(171.3, 66.2), "Riyadh"))
+        self.assertEqual((profile.height, profile.weight, profile.skin_color), ("170-175", "65-70", "medium"))
+
+
+class AnalysisCacheTests(TestCase):
+    def setUp(self):
+        self.enterContext(mock.patch.object(metrics, "METRICS_ENABLED", False))
+        self.enterContext(mock.patch.object(analysis_cache, "ANALYSIS_CACHE_VARIANTS", 2))
+        self.bucket = analysis_cache.profile_bucket(_user(), "Riyadh")
+        self.key = analysis_cache.bucket_key("basic", self.bucket)
+
+    def test_variants_fill_then_rotate(self):
+        self.assertIsNone(analysis_cache.lookup(self.key))
+        analysis_cache.store(self.key, "basic", self.bucket, _response(0))
+        self.assertIsNone(analysis_cache.lookup(self.key))
+        analysis_cache.store(self.key, "basic", self.bucket, _response(1))
+        # كل النسخ ممتلئة؛ لا تُحفظ نسخة ثالثة
+        analysis_cache.store(self.key, "basic", self.bucket, _response(2))
+        self.assertEqual(AnalysisCacheEntry.objects.filter(bucket_key=self.key).count(), 2)
+
+        served = [analysis_cache.lookup(self.key) for _ in range(4)]
+        self.assertEqual(sorted(served), sorted([_response(0), _response(1)] * 2))
+
+    def test_invalid_and_expired_responses(self):
+        analysis_cache.store(self.key, "basic", self.bucket, "not json")
+        analysis_cache.store(self.key, "basic", self.bucket, json.dumps({"analysis": "", "prompts": []}))
+        self.assertFalse(AnalysisCacheEntry.objects.exists())
+
+        for index in range(2):
+            analysis_cache.store(self.key, "basic", self.bucket, _response(index))
+        AnalysisCacheEntry.objects.filter(variant=0).update(
+            created_at=timezone.now() - timedelta(seconds=analysis_cache.ANALYSIS_CACHE_TTL + 60)
+        )
+        self.assertIsNone(analysis_cache.lookup(self.key))
+        # النسخة المنتهية يعاد توليدها في مكانها
+        analysis_cache.store(self.key, "basic", self.bucket, _response(5))
+        self.assertEqual(AnalysisCacheEntry.objects.get(variant=0).response, _response(5))
+        self.assertIsNotNone(analysis_cache.lookup(self.key))
+
+    def test_users_in_the_same_bucket_share_gemini_calls(self):
+        calls = []
+
+        def generate(prompt_text):
+            calls.append(prompt_text)
+            return _response(len(calls))
+
+        with mock.patch.object(ai_services, "_generate_analysis", side_effect=generate):
+            for height in (170, 171, 172, 173):
+                ai_services.analyze_user_and_generate_prompts(_user(height=height), "Riyadh")
+        self.assertEqual(len(calls), 2)
+        self.assertIn("170-175", calls[0])
@@ -0,0 +1,72 @@
+import asyncio
+import json
+from unittest import mock
+
+from django.test import TestCase
+
+from users import async_views, metrics, rate_limits
+from users.models import CustomUser, RecommendationRun
+from users.pipeline import RESULTS_PER_PAGE
+from users.singleflight import SingleFlight
+
+AI_RESPONSE = json.dumps({"analysis": "تحليل", "prompts": ["قميص أزرق", "بنطال أسود"]})
+
+
+def _entries(count):
+    return [{"product_link": f"https://shop.example.com/{index}", "text": "منتج"} for index in range(count)]
+
+
+class AsyncRecommendationsViewTests(TestCase):
+    def setUp(self):
+        self.enterContext(mock.patch.object(metrics, "METRICS_ENABLED", False))
+        self.enterContext(mock.patch.object(rate_limits, "RATE_LIMITS_ENABLED", False))
+        self.enterContext(mock.patch.object(async_views, "recommendation_flights", SingleFlight(shared_alias=None)))
+        self.analyze = self.enterContext(mock.patch.object(
+            async_views, "aanalyze_user_and_generate_prompts", mock.AsyncMock(return_value=AI_RESPONSE)
+        ))
+        self.chains = self.enterContext(mock.patch.object(
+            async_views, "arun_prompt_chains", mock.AsyncMock(return_value=_entries(RESULTS_PER_PAGE + 2))
+        ))
+        self.user = CustomUser.objects.create(username="async-user")
+        self.url = "/api/recommendations/async/"
+
+    async def _post(self, **data):
+        return await self.async_client.post(self.url, {"user_id": self.user.id, "location": "جدة", **data},
+                                            content_type="application/json")
+
+    async def test_post_generates_stores_and_pages(self):
+        response = await self._post()
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body["user_analysis"], "تحليل")
+        self.assertEqual(len(body["recommendations"]), RESULTS_PER_PAGE)
+        self.assertEqual(body["total_pages"], 2)
+
+        # الصفحة الثانية من النتيجة المحفوظة دون استدعاء النموذج مجددًا
+        second = await self._post(page=2)
+        self.assertEqual(len(second.json()["recommendations"]), 2)
+        self.assertEqual(self.analyze.await_count, 1)
+        self.assertEqual(self.chains.await_count, 1)
+
+        cached = await self.async_client.get(self.url, {"user_id": self.user.id, "page": 1})
+        self.assertEqual(cached.status_code, 200)
+
+    async def test_concurrent_identical_posts_share_one_generation(self):
+        responses = await asyncio.gather(*(self._post() for _ in range(3)))
+        self.assertEqual([response.status_code for response in responses], [200, 200, 200])
+        self.assertEqual(self.analyze.await_count, 1)
+
+    async def test_errors(self):
+        self.assertEqual((await self.async_client.post(
+            self.url, {"user_id": 0}, content_type="application/json"
+        )).status_code, 404)
+        self.assertEqual((await self.async_client.get(self.url, {"user_id": self.user.id})).status_code, 404)
+        self.assertEqual((await self.async_client.get(
+            self.url, {"user_id": self.user.id, "cursor": "bad"}
+        )).status_code, 400)
+
+        self.analyze.return_value = "not json"
+        response = await self._post(location="دبي")
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.json()["raw_response"], "not json")
+        self.assertEqual(await RecommendationRun.objects.acount(), 0)
@@ -0,0 +1,66 @@
+import time
+
+from django.core.cache import caches
+from django.test import SimpleTestCase
+
+from users.cache import LRUTTLCache, RecommendationCache
+
+
+class LRUTTLCacheTests(SimpleTestCase):
+    def test_least_recently_used_is_evicted(self):
+        cache = LRUTTLCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(cache.stats()["evictions"], 1)
+        self.assertEqual(len(cache), 2)
+
+    def test_entries_expire(self):
+        cache = LRUTTLCache(maxsize=10, ttl=60)
+        cache.set("short", 1, ttl=0.01)
+        cache.set("long", 2)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get("short"))
+        self.assertEqual(cache.get("long"), 2)
+        self.assertEqual(cache.stats()["expirations"], 1)
+
+
+class RecommendationCacheTests(SimpleTestCase):
+    def setUp(self):
+        caches["default"].clear()
+        self.addCleanup(caches["default"].clear)
+
+    def test_pages_are_shared_between_processes(self):
+        writer = RecommendationCache(shared_alias="default", ttl=60)
+        # نسخة ثانية بذاكرة محلية فارغة تمثل عاملًا آخر
+        reader = RecommendationCache(shared_alias="default", ttl=60)
+        writer.set(7, "state:1", {"current_page": 1})
+
+        self.assertEqual(reader.get(7, "state:1"), {"current_page": 1})
+        self.assertEqual(reader.stats()["shared"]["hits"], 1)
+        # القراءة التالية من المستوى المحلي
+        self.assertEqual(reader.get(7, "state:1"), {"current_page": 1})
+        self.assertEqual(reader.stats()["shared"]["hits"], 1)
+        self.assertEqual(reader.stats()["local"]["hits"], 1)
+
+        self.assertIsNone(reader.get(7, "state:2"))
+        self.assertEqual(reader.stats()["shared"]["misses"], 1)
+
+    def test_only_page_keys_are_written(self):
+        cache = RecommendationCache(shared_alias="default", ttl=60)
+        for page in range(3):
+            cache.set(7, f"state:{page}", {"current_page": page})
+        # لا فهرس مفاتيح لكل مستخدم في المخزن المشترك
+        self.assertEqual(sorted(caches["default"]._cache), sorted(
+            caches["default"].make_key(f"recs:7:state:{page}") for page in range(3)
+        ))
+
+    def test_local_only(self):
+        cache = RecommendationCache(shared_alias=None, local_ttl=60, ttl=60)
+        cache.set(1, "p", [1])
+        self.assertEqual(cache.get(1, "p"), [1])
+        self.assertIsNone(cache.get(2, "p"))
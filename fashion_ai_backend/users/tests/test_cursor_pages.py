@@ -0,0 +1,113 @@
+import json
+from unittest import mock
+
+from django.core.cache import caches
+from django.test import TestCase
+
+from users import cursor_pages, metrics
+from users.ai_services import recommendations_cache
+from users.cache import LRUTTLCache
+from users.deadlines import DeadlineExceeded
+from users.models import CustomUser
+from users.pipeline import IMAGES_PER_PROMPT, RESULTS_PER_PAGE
+
+PROMPTS = ["قميص", "بنطال", "جاكيت"]
+
+
+def _chain_products(image_url):
+    return [{"title": f"{image_url} {index}", "link": f"https://shop.example.com/{image_url}/{index}"} for index in range(2)]
+
+
+class CursorPagesTests(TestCase):
+    def setUp(self):
+        self.enterContext(mock.patch.object(metrics, "METRICS_ENABLED", False))
+        # ذاكرة توصيات جديدة لكل اختبار، بمخزن مشترك في الذاكرة بدل cache/recommendations
+        caches["default"].clear()
+        self.addCleanup(caches["default"].clear)
+        self.enterContext(mock.patch.object(recommendations_cache, "shared_alias", "default"))
+        self.enterContext(mock.patch.object(recommendations_cache, "local", LRUTTLCache(ttl=60)))
+
+        self.user = CustomUser.objects.create(username="cursor-user")
+        self.other = CustomUser.objects.create(username="cursor-other")
+        self.analyze = self.enterContext(mock.patch.object(
+            cursor_pages, "analyze_user_and_generate_prompts",
+            return_value=json.dumps({"analysis": "تحليل", "prompts": PROMPTS}),
+        ))
+        self.generate = self.enterContext(mock.patch.object(
+            cursor_pages, "generate_prompt_images",
+            side_effect=lambda prompts, request: [
+                [f"{prompt}-{index}" for index in range(IMAGES_PER_PROMPT)] for prompt in prompts
+            ],
+        ))
+        self.searched = []
+        self.enterContext(mock.patch.object(cursor_pages, "search_image_chains", side_effect=self._search))
+        self.enterContext(mock.patch.object(
+            cursor_pages, "format_products",
+            side_effect=lambda analysis, products, wanted: [{"product_link": product["link"]} for product in products],
+        ))
+
+    def _search(self, chains, location_info):
+        self.searched.extend(image_url for _, image_url in chains)
+        return [(prompt, _chain_products(image_url)) for prompt, image_url in chains]
+
+    def _links(self, page):
+        return [entry["product_link"] for entry in page["recommendations"]]
+
+    def test_pages_run_only_the_chains_they_need(self):
+        first = cursor_pages.first_page(self.user, "جدة", None)
+        self.assertEqual(len(first["recommendations"]), RESULTS_PER_PAGE)
+        self.assertIsNone(first["total_pages"])
+        self.assertTrue(first["has_next_page"])
+        self.assertFalse(first["partial"])
+        # صفحة من 5 منتجات تحتاج 3 سلاسل (منتجان لكل صورة)، وصور الوصف الأول فقط
+        self.assertEqual(len(self.searched), 3)
+        self.generate.assert_called_once()
+
+        second = cursor_pages.next_page(self.user, first["next_cursor"], None)
+        self.assertEqual(second["current_page"], 2)
+        self.assertFalse(set(self._links(first)) & set(self._links(second)))
+
+        pages = [first, second]
+        while pages[-1]["has_next_page"]:
+            pages.append(cursor_pages.next_page(self.user, pages[-1]["next_cursor"], None))
+        links = [link for page in pages for link in self._links(page)]
+        self.assertEqual(len(links), len(set(links)))
+        self.assertEqual(len(links), len(PROMPTS) * IMAGES_PER_PROMPT * 2)
+        self.assertIsNone(pages[-1]["next_cursor"])
+        self.analyze.assert_called_once()
+
+    def test_same_cursor_returns_the_stored_page(self):
+        first = cursor_pages.first_page(self.user, "جدة", None)
+        second = cursor_pages.next_page(self.user, first["next_cursor"], None)
+        searched = len(self.searched)
+        self.assertEqual(cursor_pages.next_page(self.user, first["next_cursor"], None), second)
+        self.assertEqual(cursor_pages.first_page(self.user, "جدة", None), first)
+        self.assertEqual(len(self.searched), searched)
+
+    def test_invalid_and_foreign_cursors_are_rejected(self):
+        first = cursor_pages.first_page(self.user, "جدة", None)
+        state_id, _ = cursor_pages.parse_cursor(first["next_cursor"])
+        for cursor in ("", "abc", f"{state_id}.0", f"{state_id}.x"):
+            with self.subTest(cursor=cursor), self.assertRaises(cursor_pages.CursorError):
+                cursor_pages.next_page(self.user, cursor, None)
+        with self.assertRaises(cursor_pages.CursorError):
+            cursor_pages.next_page(self.other, first["next_cursor"], None)
+        # لا يمكن القفز إلى صفحة لم تولد التي قبلها
+        with self.assertRaises(cursor_pages.CursorError):
+            cursor_pages.next_page(self.user, cursor_pages.make_cursor(state_id, 3), None)
+
+    def test_chains_cut_by_the_deadline_run_first_on_the_next_page(self):
+        def cut_last(chains, location_info):
+            results = self._search(chains, location_info)
+            results[-1] = (results[-1][0], DeadlineExceeded("deadline"))
+            return results
+
+        with mock.patch.object(cursor_pages, "search_image_chains", side_effect=cut_last):
+            first = cursor_pages.first_page(self.user, "جدة", None)
+        state = cursor_pages.load_state(cursor_pages.parse_cursor(first["next_cursor"])[0])
+        self.assertTrue(state["deferred"])
+        deferred_image = state["deferred"][0][1]
+
+        self.searched.clear()
+        cursor_pages.next_page(self.user, first["next_cursor"], None)
+        self.assertEqual(self.searched[0], deferred_image)
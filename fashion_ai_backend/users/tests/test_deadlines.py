@@ -0,0 +1,64 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from users import deadlines, metrics
+
+
+class DeadlineTests(SimpleTestCase):
+    def setUp(self):
+        self.enterContext(mock.patch.object(metrics, "METRICS_ENABLED", False))
+        self.enterContext(mock.patch.dict(deadlines.STAGE_TIMEOUTS, {"image": 15, "lens": 12}))
+
+    def test_stage_timeout_without_scope_is_the_stage_cap(self):
+        self.assertIsNone(deadlines.current_deadline())
+        self.assertEqual(deadlines.stage_timeout("image"), 15)
+        self.assertIsNone(deadlines.wait_timeout())
+
+    def test_stage_timeout_is_capped_by_remaining_budget(self):
+        with deadlines.deadline_scope(5) as deadline:
+            self.assertIs(deadlines.current_deadline(), deadline)
+            self.assertLessEqual(deadlines.stage_timeout("image"), 5)
+            self.assertGreater(deadlines.stage_timeout("image"), 4)
+        with deadlines.deadline_scope(60):
+            self.assertEqual(deadlines.stage_timeout("lens"), 12)
+        self.assertIsNone(deadlines.current_deadline())
+
+    def test_expired_budget_raises_and_marks_partial(self):
+        with deadlines.deadline_scope(0.01) as deadline:
+            time.sleep(0.02)
+            self.assertTrue(deadline.expired)
+            self.assertEqual(deadlines.wait_timeout(), 0.0)
+            with self.assertRaises(deadlines.DeadlineExceeded):
+                deadlines.stage_timeout("lens")
+        self.assertTrue(deadline.partial)
+
+    def test_submit_carries_the_deadline_into_pool_threads(self):
+        with ThreadPoolExecutor(max_workers=1) as executor, deadlines.deadline_scope(30) as deadline:
+            seen = deadlines.submit(executor, deadlines.current_deadline).result()
+            unscoped = executor.submit(deadlines.current_deadline).result()
+        self.assertIs(seen, deadline)
+        self.assertIsNone(unscoped)
+
+    def test_cancel_pending_cancels_unstarted_work(self):
+        release = threading.Event()
+        with ThreadPoolExecutor(max_workers=1) as executor, deadlines.deadline_scope(30) as deadline:
+            running = executor.submit(release.wait, 5)
+            queued = [executor.submit(time.sleep, 0) for _ in range(3)]
+            self.assertEqual(deadlines.cancel_pending([running, *queued]), 3)
+            release.set()
+        self.assertTrue(deadline.partial)
+        self.assertTrue(all(future.cancelled() for future in queued))
+
+    def test_background_continuation_runs_without_the_deadline(self):
+        with deadlines.deadline_scope(0.01):
+            time.sleep(0.02)
+            result = {}
+            future = deadlines.continue_in_background(
+                lambda: result.update(deadline=deadlines.current_deadline(), timeout=deadlines.stage_timeout("lens"))
+            )
+            future.result(5)
+        self.assertEqual(result, {"deadline": None, "timeout": 12})
@@ -0,0 +1,79 @@
+from unittest import mock
+
+from django.test import TestCase
+
+from users import feed, metrics
+from users.models import CustomUser
+from users.pipeline import RESULTS_PER_PAGE
+
+
+def _entries(run_name, count):
+    return [{"product_link": f"https://shop.example.com/{run_name}/{index}", "text": run_name} for index in range(count)]
+
+
+class FeedPaginationTests(TestCase):
+    def setUp(self):
+        # لا تُكتب لقطات مقاييس الاختبارات في cache/metrics الحقيقي
+        self.enterContext(mock.patch.object(metrics, "METRICS_ENABLED", False))
+        self.user = CustomUser.objects.create_user(username="feed-user", password="x")
+        self.other_user = CustomUser.objects.create_user(username="feed-other", password="x")
+        self.signature = "sig-a"
+        self.older = feed.store_run(self.user.id, feed.KIND_RECOMMENDATIONS, self.signature, "جدة", "تحليل 1",
+                                    _entries("older", 7))
+        self.newer = feed.store_run(self.user.id, feed.KIND_RECOMMENDATIONS, self.signature, "جدة", "تحليل 2",
+                                    _entries("newer", 7))
+        # نفس المستخدم ببصمة أخرى، ومستخدم آخر بنفس البصمة: لا يظهران في التمرير
+        feed.store_run(self.user.id, feed.KIND_RECOMMENDATIONS, "sig-b", "دبي", "", _entries("other-signature", 3))
+        feed.store_run(self.other_user.id, feed.KIND_RECOMMENDATIONS, self.signature, "جدة", "", _entries("other-user", 3))
+
+    def test_numbered_pages_come_from_latest_run(self):
+        first = feed.get_page(self.user.id, 1, signature=self.signature)
+        self.assertEqual([entry["product_link"] for entry in first["recommendations"]],
+                         [entry["product_link"] for entry in _entries("newer", RESULTS_PER_PAGE)])
+        self.assertEqual(first["user_analysis"], "تحليل 2")
+        self.assertEqual(first["total_pages"], 2)
+        self.assertTrue(first["has_next_page"])
+
+        second = feed.get_page(self.user.id, 2, signature=self.signature)
+        self.assertEqual(len(second["recommendations"]), 7 - RESULTS_PER_PAGE)
+        self.assertFalse(second["has_next_page"])
+
+        beyond = feed.get_page(self.user.id, 3, signature=self.signature)
+        self.assertEqual(beyond["recommendations"], [])
+        self.assertIsNone(beyond["next_cursor"])
+
+    def test_no_run_returns_none(self):
+        self.assertIsNone(feed.get_page(self.user.id, 1, signature="missing"))
+        self.assertIsNone(feed.get_page(self.user.id, 1, kind=feed.KIND_ADVANCED))
+
+    def test_cursor_walks_every_run_of_the_signature_in_order(self):
+        page = feed.get_page(self.user.id, 1, signature=self.signature)
+        links = [entry["product_link"] for entry in page["recommendations"]]
+        cursor = page["next_cursor"]
+        while cursor:
+            page = feed.get_page_after(self.user.id, cursor)
+            self.assertLessEqual(len(page["recommendations"]), RESULTS_PER_PAGE)
+            links.extend(entry["product_link"] for entry in page["recommendations"])
+            cursor = page["next_cursor"]
+
+        expected = [entry["product_link"] for entry in _entries("newer", 7) + _entries("older", 7)]
+        self.assertEqual(links, expected)
+        self.assertFalse(page["has_next_page"])
+
+    def test_cursor_is_scoped_to_the_user(self):
+        cursor = feed.get_page(self.user.id, 1, signature=self.signature)["next_cursor"]
+        page = feed.get_page_after(self.other_user.id, cursor)
+        self.assertTrue(all(entry["text"] == "other-user" for entry in page["recommendations"]))
+
+    def test_invalid_cursor(self):
+        for cursor in ("not-base64!", "", feed.encode_cursor("sig", 1, 0)[:-4]):
+            with self.subTest(cursor=cursor), self.assertRaises(feed.InvalidCursor):
+                feed.get_page_after(self.user.id, cursor)
+
+    def test_old_runs_are_trimmed(self):
+        with mock.patch.object(feed, "FEED_MAX_RUNS_PER_USER", 2):
+            latest = feed.store_run(self.user.id, feed.KIND_RECOMMENDATIONS, self.signature, "جدة", "", _entries("latest", 1))
+        runs = list(feed._runs(self.user.id, feed.KIND_RECOMMENDATIONS).values_list("id", flat=True))
+        self.assertEqual(len(runs), 2)
+        self.assertEqual(runs[0], latest.id)
+        self.assertNotIn(self.older.id, runs)
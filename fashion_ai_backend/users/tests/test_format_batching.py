@@ -0,0 +1,83 @@
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from users import fake_providers, metrics, pipeline, rate_limits
+from users.prompts import product_tokens
+
+
+def _products(count):
+    return [
+        {"title": f"منتج {index}", "link": f"https://shop.example.com/{index}", "thumbnail": f"https://img/{index}.jpg"}
+        for index in range(count)
+    ]
+
+
+class PlanFormatChunksTests(SimpleTestCase):
+    def test_small_lists_fit_one_call(self):
+        planned = pipeline.plan_format_chunks(_products(12), 10)
+        self.assertEqual(len(planned), 1)
+        chunk, wanted = planned[0]
+        self.assertEqual([product["id"] for product in chunk], [f"p{index}" for index in range(1, 13)])
+        self.assertEqual(wanted, 10)
+
+    def test_budget_splits_into_capped_calls(self):
+        products = _products(40)
+        per_product = product_tokens(pipeline._with_ids(products)[0])
+        with mock.patch.object(pipeline, "FORMAT_TOKEN_BUDGET", per_product * 10), \
+                mock.patch.object(pipeline, "FORMAT_MAX_CALLS", 3):
+            planned = pipeline.plan_format_chunks(products, 25)
+        self.assertEqual(len(planned), 3)
+        # المعرفات فريدة بين الدفعات، والمنتجات الزائدة في آخر القائمة تُهمل
+        ids = [product["id"] for chunk, _ in planned for product in chunk]
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertLess(len(ids), len(products))
+        self.assertEqual(sum(wanted for _, wanted in planned), 25)
+        self.assertTrue(all(wanted <= len(chunk) for chunk, wanted in planned))
+
+
+class ParseFormattedPostsTests(SimpleTestCase):
+    def setUp(self):
+        self.enterContext(mock.patch.object(metrics, "METRICS_ENABLED", False))
+        self.products = pipeline._with_ids(_products(3))
+
+    def test_posts_are_joined_to_products_by_id(self):
+        response = SimpleNamespace(text='```json\n{"posts": [{"product_id": "p2", "text": "يناسبك"}, '
+                                        '{"product_id": "p9", "text": "مجهول"}]}\n```')
+        self.assertEqual(pipeline._parse_formatted_posts(response, self.products), [
+            {"text": "يناسبك", "product_link": "https://shop.example.com/1", "image_url": "https://img/1.jpg"},
+        ])
+
+    def test_invalid_json_falls_back_to_raw_products(self):
+        with mock.patch("builtins.print"):
+            posts = pipeline._parse_formatted_posts(SimpleNamespace(text="ليس JSON"), self.products)
+        self.assertEqual(posts[0]["error"], "Failed to format posts")
+        self.assertEqual(posts[0]["raw_results"], _products(3))
+
+
+class FormatBatchTests(SimpleTestCase):
+    def setUp(self):
+        self.enterContext(mock.patch.object(metrics, "METRICS_ENABLED", False))
+        self.enterContext(mock.patch.object(rate_limits, "RATE_LIMITS_ENABLED", False))
+        self.enterContext(mock.patch.dict(fake_providers.config, {
+            "ENABLED": True, "LATENCY": {"gemini": 0.0}, "JITTER": 0.0, "ERROR_RATE": 0.0, "THROTTLE_RATE": 0.0,
+        }))
+        self.enterContext(mock.patch.dict(fake_providers.calls, {"gemini": 0}))
+
+    def test_all_images_are_formatted_in_one_gemini_call(self):
+        chain_results = [
+            ("قميص", _products(4)),
+            ("قميص", _products(6)),
+            ("بنطال", RuntimeError("lens down")),
+        ]
+        recommendations = pipeline.format_products_batch("تحليل", chain_results)
+        self.assertEqual(fake_providers.calls["gemini"], 1)
+        # المكرر يُدمج: 6 منتجات فريدة، وبحد أقصى منشور لكل منتج
+        self.assertEqual([post["product_link"] for post in recommendations],
+                         [f"https://shop.example.com/{index}" for index in range(6)])
+
+    def test_no_products_gives_one_entry_per_image(self):
+        entries = pipeline.format_products_batch("تحليل", [("قميص", []), ("بنطال", RuntimeError("x"))])
+        self.assertEqual(fake_providers.calls["gemini"], 0)
+        self.assertEqual([entry.get("error") for entry in entries], [None, "Failed to search products"])
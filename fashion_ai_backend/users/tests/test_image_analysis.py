@@ -0,0 +1,66 @@
+import os
+import tempfile
+
+import numpy as np
+from django.test import SimpleTestCase
+from PIL import Image
+
+from users import image_analysis
+
+# ألوان BGR
+SKIN = (120, 160, 215)
+NAVY = (90, 30, 20)
+
+
+class PaletteTests(SimpleTestCase):
+    def test_palette_is_sorted_by_share_and_merges_close_colors(self):
+        pixels = np.array([NAVY] * 600 + [(92, 31, 22)] * 100 + [SKIN] * 300, dtype=np.uint8)
+        palette = image_analysis.extract_palette(pixels)
+        self.assertEqual(len(palette), 2)
+        (first_rgb, first_share), (second_rgb, second_share) = palette
+        self.assertAlmostEqual(first_share, 0.7)
+        self.assertAlmostEqual(second_share, 0.3)
+        self.assertLess(np.abs(np.array(first_rgb) - np.array(NAVY[::-1])).max(), 3)
+        self.assertEqual(second_rgb, list(SKIN[::-1]))
+
+    def test_palette_is_capped_at_k_colors(self):
+        rng = np.random.default_rng(0)
+        pixels = rng.integers(0, 256, size=(5000, 3), dtype=np.uint8)
+        palette = image_analysis.extract_palette(pixels, k=3)
+        self.assertEqual(len(palette), 3)
+        self.assertEqual(image_analysis.extract_palette(np.zeros((0, 3), dtype=np.uint8)), [])
+
+    def test_skin_tone_categories(self):
+        self.assertEqual(image_analysis.skin_tone_category(60), "very_light")
+        self.assertEqual(image_analysis.skin_tone_category(30), "intermediate")
+        self.assertEqual(image_analysis.skin_tone_category(-40), "dark")
+
+
+class AnalyzeImageTests(SimpleTestCase):
+    def _portrait(self):
+        img = np.full((400, 300, 3), NAVY, dtype=np.uint8)
+        img[100:300, 75:225] = SKIN
+        return img
+
+    def test_center_region_palette_and_skin_tone(self):
+        result = image_analysis.analyze_image(self._portrait())
+        self.assertEqual(result["region"], "center")
+        self.assertEqual(result["dominant_color_rgb"], list(SKIN[::-1]))
+        self.assertEqual(result["skin_tone"]["rgb"], list(SKIN[::-1]))
+        self.assertEqual(result["skin_tone"]["hex"], "#d7a078")
+        self.assertEqual(result["skin_tone"]["coverage"], 1.0)
+
+    def test_no_skin_pixels_gives_no_skin_tone(self):
+        result = image_analysis.analyze_image(np.full((64, 64, 3), NAVY, dtype=np.uint8))
+        self.assertIsNone(result["skin_tone"])
+        self.assertEqual(len(result["palette"]), 1)
+
+    def test_large_pictures_are_decoded_reduced(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "portrait.jpg")
+            Image.fromarray(np.repeat(np.repeat(self._portrait()[..., ::-1], 8, axis=0), 8, axis=1)).save(path)
+            img = image_analysis.load_reduced(path)
+            self.assertLessEqual(max(img.shape[:2]), image_analysis.ANALYSIS_MAX_SIDE)
+            result = image_analysis.analyze_profile_picture(path)
+            self.assertEqual(result["skin_tone"]["category"],
+                             image_analysis.analyze_image(self._portrait())["skin_tone"]["category"])
@@ -0,0 +1,84 @@
+import asyncio
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import SimpleTestCase
+from google.api_core import exceptions as google_exceptions
+
+from users import ai_services, metrics, rate_limits
+
+
+class FakeImageModel:
+    def __init__(self, per_call=None, reject_candidates=False):
+        # per_call: عدد الصور التي يعيدها كل استدعاء بغض النظر عن candidate_count
+        self.per_call = per_call
+        self.reject_candidates = reject_candidates
+        self.calls = []
+
+    def _response(self, prompt, generation_config):
+        candidates = (generation_config or {}).get("candidate_count", 1)
+        self.calls.append(candidates)
+        if candidates > 1 and self.reject_candidates:
+            raise google_exceptions.InvalidArgument("candidate_count is not supported")
+        count = self.per_call or candidates
+        return SimpleNamespace(images=[f"{prompt}-{len(self.calls)}-{i}" for i in range(count)])
+
+    def generate_content(self, prompt, generation_config=None, request_options=None):
+        return self._response(prompt, generation_config)
+
+    async def generate_content_async(self, prompt, generation_config=None, request_options=None):
+        return self._response(prompt, generation_config)
+
+
+class BatchedImageGenerationTests(SimpleTestCase):
+    def setUp(self):
+        self.enterContext(mock.patch.object(metrics, "METRICS_ENABLED", False))
+        self.enterContext(mock.patch.object(rate_limits, "RATE_LIMITS_ENABLED", False))
+        self.enterContext(mock.patch.object(ai_services, "_image_candidates_supported", True))
+        self.enterContext(mock.patch("builtins.print"))
+
+    def test_one_call_with_candidates(self):
+        model = FakeImageModel()
+        images, error = ai_services._generate_images(model, "shirt", 3)
+        self.assertIsNone(error)
+        self.assertEqual(len(images), 3)
+        self.assertEqual(model.calls, [3])
+
+    def test_model_ignoring_candidates_falls_back_to_parallel_calls(self):
+        model = FakeImageModel(per_call=1)
+        images, error = ai_services._generate_images(model, "shirt", 3)
+        self.assertIsNone(error)
+        self.assertEqual(len(images), 3)
+        self.assertEqual(model.calls, [3, 1, 1])
+        self.assertFalse(ai_services._image_candidates_supported)
+
+        # الطلبات التالية لا تطلب عدة مرشحين
+        model.calls.clear()
+        ai_services._generate_images(model, "shirt", 2)
+        self.assertEqual(model.calls, [1, 1])
+
+    def test_rejected_candidates_fall_back_to_parallel_calls(self):
+        model = FakeImageModel(reject_candidates=True)
+        images, error = ai_services._generate_images(model, "shirt", 2)
+        self.assertIsNone(error)
+        self.assertEqual(len(images), 2)
+        self.assertEqual(model.calls, [2, 1, 1])
+        self.assertFalse(ai_services._image_candidates_supported)
+
+    def test_single_image_needs_no_candidates(self):
+        model = FakeImageModel()
+        images, _ = ai_services._generate_images(model, "shirt", 1)
+        self.assertEqual(len(images), 1)
+        self.assertEqual(model.calls, [1])
+
+    def test_async_generation_batches_too(self):
+        model = FakeImageModel()
+        images, error = asyncio.run(ai_services._agenerate_images(model, "shirt", 3))
+        self.assertIsNone(error)
+        self.assertEqual(len(images), 3)
+        self.assertEqual(model.calls, [3])
+
+        model = FakeImageModel(per_call=1)
+        images, _ = asyncio.run(ai_services._agenerate_images(model, "shirt", 3))
+        self.assertEqual(len(images), 3)
+        self.assertEqual(model.calls, [3, 1, 1])
@@ -0,0 +1,85 @@
+import os
+import tempfile
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase
+from PIL import Image
+
+from users import image_store, metrics
+from users.image_store import GeneratedImageStore, prompt_digest
+
+
+class ImageStoreTests(SimpleTestCase):
+    def setUp(self):
+        self.enterContext(mock.patch.object(metrics, "METRICS_ENABLED", False))
+        self.root = self.enterContext(tempfile.TemporaryDirectory())
+        self.store = GeneratedImageStore(self.root, "model-a", variants=3, max_prompts=2, evict_interval=0,
+                                         protect_for=0)
+
+    def _save(self, prompt, count=1, age=0):
+        digest = self.store.digest(prompt)
+        paths = [self.store.save_variant(digest, index, Image.new("RGB", (4, 4))) for index in range(count)]
+        if age:
+            past = time.time() - age
+            for path in paths:
+                os.utime(os.path.join(self.root, path), (past, past))
+        return digest, paths
+
+    def test_digest_is_stable_and_normalized(self):
+        self.assertEqual(prompt_digest("  Blue   Shirt ", "model-a"), prompt_digest("blue shirt", "model-a"))
+        self.assertNotEqual(prompt_digest("blue shirt", "model-a"), prompt_digest("blue shirt", "model-b"))
+        digest = self.store.digest("blue shirt")
+        self.assertEqual(self.store.relative_path(digest, 1),
+                         os.path.join("generated_images", digest[:2], f"{digest}_1.jpg"))
+
+    def test_lookup_reports_existing_and_missing_variants(self):
+        digest, paths = self._save("blue shirt", count=2)
+        self.assertEqual(self.store.lookup("Blue Shirt", 3), (digest, paths, [2]))
+        self.assertEqual(self.store.lookup("blue shirt", 2), (digest, paths, []))
+        # لا يُطلب أكثر من عدد النسخ المسموح
+        self.assertEqual(self.store.lookup("blue shirt", 10)[2], [2])
+        self.assertEqual((self.store.hits, self.store.misses), (1, 2))
+
+    def test_background_write_counts_as_existing_until_done(self):
+        digest = self.store.digest("red dress")
+        relative_path = self.store.save_variant_in_background(digest, 0, Image.new("RGB", (4, 4)))
+        absolute_path = os.path.join(self.root, relative_path)
+        self.assertEqual(self.store.lookup("red dress", 1, record=False)[1], [relative_path])
+        image_store.wait_for_write(absolute_path)
+        self.assertTrue(os.path.exists(absolute_path))
+        self.assertFalse(image_store.is_pending(absolute_path))
+
+    def test_least_recently_used_prompts_are_evicted(self):
+        old, _ = self._save("old", age=300)
+        used, _ = self._save("used", age=200)
+        self._save("new", age=100)
+        # إعادة الاستخدام تحدّث ترتيب LRU
+        self.store.lookup("used", 1)
+
+        self.assertEqual(self.store.evict_if_needed(force=True), 1)
+        self.assertEqual(self.store.lookup("old", 1, record=False)[2], [0])
+        self.assertEqual(self.store.lookup("used", 1, record=False)[2], [])
+        self.assertEqual(self.store.disk_usage()["prompts"], 2)
+
+    def test_recently_used_and_placeholder_are_protected(self):
+        self.store.protect_for = 3600
+        self.store.max_age = 1
+        self.store.placeholder()
+        for prompt in ("a", "b", "c"):
+            self._save(prompt)
+        self.assertEqual(self.store.evict_if_needed(force=True), 0)
+        self.assertTrue(os.path.exists(os.path.join(self.root, image_store.PLACEHOLDER_PATH)))
+
+    def test_size_limit_and_age(self):
+        self.store.max_prompts = None
+        self.store.max_age = 1000
+        self._save("expired", age=2000)
+        self._save("big", count=3, age=500)
+        self._save("small", age=100)
+        self.store.max_bytes = self.store.disk_usage()["bytes"] // 2
+
+        self.store.evict_if_needed(force=True)
+        self.assertEqual(self.store.lookup("expired", 1, record=False)[2], [0])
+        self.assertEqual(self.store.lookup("big", 1, record=False)[2], [0])
+        self.assertEqual(self.store.lookup("small", 1, record=False)[2], [])
@@ -0,0 +1,88 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from users import jobs, metrics
+from users.models import CustomUser, RecommendationJob
+
+
+class ClaimJobTests(TestCase):
+    def setUp(self):
+        self.enterContext(mock.patch.object(metrics, "METRICS_ENABLED", False))
+        self.user = CustomUser.objects.create_user(username="job-user", password="x")
+
+    def _running_job(self, heartbeat_age, attempts=1):
+        beat = timezone.now() - timedelta(seconds=heartbeat_age)
+        return RecommendationJob.objects.create(
+            user=self.user, location="جدة", status=RecommendationJob.STATUS_RUNNING, worker="dead-worker",
+            started_at=beat - timedelta(hours=1), updated_at=beat, attempts=attempts,
+        )
+
+    def test_claim_marks_running_and_counts_attempt(self):
+        job = RecommendationJob.objects.create(user=self.user, location="جدة")
+        claimed = jobs.claim_next_job("worker-1")
+        self.assertEqual(claimed.id, job.id)
+        self.assertEqual(claimed.status, RecommendationJob.STATUS_RUNNING)
+        self.assertEqual(claimed.worker, "worker-1")
+        self.assertEqual(claimed.attempts, 1)
+        self.assertIsNotNone(claimed.updated_at)
+        self.assertIsNone(jobs.claim_next_job("worker-2"))
+
+    def test_long_running_job_with_recent_heartbeat_is_not_reclaimed(self):
+        # بدأت قبل أكثر من ساعة لكن نبضها حديث: عاملها ما زال يعمل
+        job = self._running_job(heartbeat_age=1)
+        self.assertIsNone(jobs.claim_next_job("worker-2"))
+        job.refresh_from_db()
+        self.assertEqual(job.worker, "dead-worker")
+
+    def test_job_without_heartbeat_is_reclaimed(self):
+        job = self._running_job(heartbeat_age=jobs.JOB_STALE_AFTER + 60)
+        claimed = jobs.claim_next_job("worker-2")
+        self.assertEqual(claimed.id, job.id)
+        self.assertEqual(claimed.worker, "worker-2")
+        self.assertEqual(claimed.attempts, 2)
+
+    def test_job_fails_after_max_attempts(self):
+        job = self._running_job(heartbeat_age=jobs.JOB_STALE_AFTER + 60, attempts=jobs.JOB_MAX_ATTEMPTS)
+        self.assertIsNone(jobs.claim_next_job("worker-2"))
+        job.refresh_from_db()
+        self.assertEqual(job.status, RecommendationJob.STATUS_FAILED)
+        self.assertTrue(job.error)
+        self.assertIsNotNone(job.finished_at)
+
+    def test_progress_bumps_heartbeat(self):
+        job = self._running_job(heartbeat_age=120)
+        before = job.updated_at
+        job.completed_chains = 1
+        jobs._save_progress(job, "completed_chains")
+        job.refresh_from_db()
+        self.assertEqual(job.completed_chains, 1)
+        self.assertGreater(job.updated_at, before)
+
+
+class JobLookupTests(TestCase):
+    def setUp(self):
+        self.enterContext(mock.patch.object(metrics, "METRICS_ENABLED", False))
+        self.enterContext(mock.patch.object(jobs, "ensure_local_workers"))
+        self.owner = CustomUser.objects.create_user(username="job-owner", password="x")
+        self.other = CustomUser.objects.create_user(username="job-other", password="x")
+        self.job = RecommendationJob.objects.create(user=self.owner, location="جدة")
+
+    def test_get_job_is_scoped_to_owner(self):
+        self.assertEqual(jobs.get_job(self.job.id, self.owner.id), self.job)
+        self.assertIsNone(jobs.get_job(self.job.id, self.other.id))
+        self.assertIsNone(jobs.get_job(self.job.id, None))
+        self.assertIsNone(jobs.get_job("not-a-number", self.owner.id))
+
+    def test_status_endpoint_hides_other_users_jobs(self):
+        with mock.patch("users.views.ensure_local_workers"):
+            url = "/api/recommendations/"
+            response = self.client.get(url, {"user_id": self.other.id, "job_id": self.job.id})
+            self.assertEqual(response.status_code, 404)
+            response = self.client.get(url, {"job_id": self.job.id})
+            self.assertEqual(response.status_code, 404)
+            response = self.client.get(url, {"user_id": self.owner.id, "job_id": self.job.id})
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(response.json()["status"], RecommendationJob.STATUS_PENDING)
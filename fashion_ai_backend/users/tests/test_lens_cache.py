@@ -0,0 +1,91 @@
+import os
+import tempfile
+import threading
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+
+from users import lens_cache, metrics, near_duplicates
+from users.models import LensResultCache
+
+PRODUCTS = [{"title": "قميص", "link": "https://shop.example.com/1"}]
+
+
+class LensCacheTests(TestCase):
+    def setUp(self):
+        self.enterContext(mock.patch.object(metrics, "METRICS_ENABLED", False))
+        self.enterContext(mock.patch.object(lens_cache.product_index, "index_products"))
+        self.enterContext(mock.patch.object(near_duplicates, "_indexes", {}))
+        self.enterContext(mock.patch.object(near_duplicates, "_loaded_id", 0))
+        self.enterContext(mock.patch.object(near_duplicates, "_loaded_at", None))
+
+    def _store_aged(self, digest, age_seconds, **fields):
+        LensResultCache.objects.create(
+            image_digest=digest, hl="ar", gl="sa", shopping_results=PRODUCTS,
+            fetched_at=timezone.now() - timedelta(seconds=age_seconds), **fields,
+        )
+
+    def test_fresh_stale_and_expired_entries(self):
+        self._store_aged("fresh", 60)
+        self._store_aged("stale", lens_cache.LENS_CACHE_TTL + 60)
+        self._store_aged("expired", lens_cache.LENS_CACHE_TTL + lens_cache.LENS_CACHE_STALE_TTL + 60)
+
+        self.assertEqual(lens_cache.lookup("fresh", "ar", "sa"), (lens_cache.FRESH, PRODUCTS))
+        self.assertEqual(lens_cache.lookup("stale", "ar", "sa"), (lens_cache.STALE, PRODUCTS))
+        self.assertEqual(lens_cache.lookup("expired", "ar", "sa"), (lens_cache.MISS, None))
+        # المفتاح يشمل اللغة والمنطقة
+        self.assertEqual(lens_cache.lookup("fresh", "en", "us"), (lens_cache.MISS, None))
+
+        with mock.patch.object(lens_cache, "LENS_CACHE_STALE_WHILE_REVALIDATE", False):
+            self.assertEqual(lens_cache.lookup("stale", "ar", "sa"), (lens_cache.MISS, None))
+
+        self.assertEqual(lens_cache.purge_expired(), 1)
+        self.assertFalse(LensResultCache.objects.filter(image_digest="expired").exists())
+
+    def test_store_overwrites_and_feeds_near_duplicates(self):
+        signature = (0b1010, 0x808080)
+        lens_cache.store("image", "ar", "sa", [], signature)
+        lens_cache.store("image", "ar", "sa", PRODUCTS, signature)
+        self.assertEqual(LensResultCache.objects.filter(image_digest="image").count(), 1)
+        self.assertEqual(lens_cache.lookup("image", "ar", "sa"), (lens_cache.FRESH, PRODUCTS))
+
+        # صورة أخرى ببصمة قريبة تحصل على نفس النتائج، والصورة نفسها لا تعد جارة لنفسها
+        self.assertEqual(lens_cache.lookup_similar("other", "ar", "sa", (0b1011, 0x808080)), PRODUCTS)
+        self.assertIsNone(lens_cache.lookup_similar("image", "ar", "sa", signature))
+
+    def test_similar_results_must_be_fresh(self):
+        self._store_aged("old", lens_cache.LENS_CACHE_TTL + 60, phash=5, color=0)
+        self.assertIsNone(lens_cache.lookup_similar("new", "ar", "sa", (5, 0)))
+
+    def test_local_images_are_keyed_by_content(self):
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root, MEDIA_URL="/media/"):
+            os.makedirs(os.path.join(media_root, "generated_images"))
+            for name in ("a.jpg", "b.jpg"):
+                Image.new("RGB", (8, 8), (10, 20, 30)).save(os.path.join(media_root, "generated_images", name))
+
+            first = lens_cache.image_digest_for_url("http://host/media/generated_images/a.jpg")
+            second = lens_cache.image_digest_for_url("https://other/media/generated_images/b.jpg")
+            self.assertEqual(first, second)
+            self.assertNotEqual(first, lens_cache.image_digest_for_url("https://cdn.example.com/a.jpg"))
+            self.assertIsNone(lens_cache.local_media_path("http://host/media/../settings.py"))
+
+    def test_background_refresh_runs_once_per_image(self):
+        release = threading.Event()
+        done = threading.Event()
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            release.wait(5)
+            return PRODUCTS, True
+
+        with mock.patch.object(lens_cache, "store", side_effect=lambda *args, **kwargs: done.set()) as store:
+            lens_cache.refresh_in_background("image", "ar", "sa", fetch)
+            lens_cache.refresh_in_background("image", "ar", "sa", fetch)
+            release.set()
+            self.assertTrue(done.wait(5))
+        self.assertEqual(len(calls), 1)
+        store.assert_called_once_with("image", "ar", "sa", PRODUCTS)
@@ -0,0 +1,88 @@
+import os
+import tempfile
+from unittest import mock
+
+from django.http import Http404
+from django.test import SimpleTestCase, override_settings
+
+from users import metrics
+from users.media import parse_range, serve_media
+
+
+class ParseRangeTests(SimpleTestCase):
+    def test_single_ranges(self):
+        cases = {
+            "bytes=0-99": (0, 99),
+            "bytes=100-": (100, 999),
+            "bytes=-100": (900, 999),
+            "bytes=-5000": (0, 999),
+            "bytes=990-5000": (990, 999),
+            " bytes=0-0 ": (0, 0),
+        }
+        for header, expected in cases.items():
+            with self.subTest(header=header):
+                self.assertEqual(parse_range(header, 1000), expected)
+
+    def test_ignored_ranges_send_the_whole_file(self):
+        for header in (None, "", "bytes=", "bytes=-", "bytes=10-5", "bytes=0-10,20-30", "items=0-10", "bytes=a-b"):
+            with self.subTest(header=header):
+                self.assertIsNone(parse_range(header, 1000))
+
+    def test_unsatisfiable_ranges(self):
+        for header, size in (("bytes=1000-", 1000), ("bytes=1000-2000", 1000), ("bytes=-0", 1000), ("bytes=-10", 0)):
+            with self.subTest(header=header, size=size), self.assertRaises(ValueError):
+                parse_range(header, size)
+
+
+class ServeMediaTests(SimpleTestCase):
+    def setUp(self):
+        self.enterContext(mock.patch.object(metrics, "METRICS_ENABLED", False))
+        media_root = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        self.content = bytes(range(256)) * 4
+        os.makedirs(os.path.join(media_root, "generated_images", "ab"))
+        os.makedirs(os.path.join(media_root, "profile_pics"))
+        with open(os.path.join(media_root, "generated_images", "ab", "abc_0.jpg"), "wb") as f:
+            f.write(self.content)
+        with open(os.path.join(media_root, "profile_pics", "user.jpg"), "wb") as f:
+            f.write(b"private")
+        self.url = "/media/generated_images/ab/abc_0.jpg"
+
+    def test_full_response_with_validators(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), self.content)
+        self.assertTrue(response["ETag"].startswith('"'))
+        self.assertIn("max-age=", response["Cache-Control"])
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+
+    def test_conditional_requests(self):
+        etag = self.client.get(self.url)["ETag"]
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_range_requests(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=10-19")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], f"bytes 10-19/{len(self.content)}")
+        self.assertEqual(b"".join(response.streaming_content), self.content[10:20])
+
+        response = self.client.get(self.url, HTTP_RANGE=f"bytes={len(self.content)}-")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], f"bytes */{len(self.content)}")
+
+        # If-Range بوسم قديم: الملف كاملًا
+        response = self.client.get(self.url, HTTP_RANGE="bytes=10-19", HTTP_IF_RANGE='"old"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_only_generated_images_are_public(self):
+        self.assertEqual(self.client.get("/media/profile_pics/user.jpg").status_code, 404)
+        self.assertEqual(self.client.get("/media/generated_images/../profile_pics/user.jpg").status_code, 404)
+        self.assertEqual(self.client.get("/media/generated_images/missing.jpg").status_code, 404)
+        self.assertEqual(self.client.post(self.url).status_code, 405)
+
+    def test_view_rejects_other_prefixes(self):
+        request = self.client.get(self.url).wsgi_request
+        for path in ("profile_pics/user.jpg", "generated_images/../profile_pics/user.jpg", "../etc/passwd"):
+            with self.subTest(path=path), self.assertRaises(Http404):
+                serve_media(request, path)
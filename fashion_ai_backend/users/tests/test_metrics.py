@@ -0,0 +1,99 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from users import metrics
+
+
+def _dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+class MetricsTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(mock.patch.object(metrics, "METRICS_ENABLED", True))
+        self.enterContext(mock.patch.object(metrics, "METRICS_DIR", self.directory))
+        self.enterContext(mock.patch.object(metrics, "FLUSH_INTERVAL", 3600))
+        self.enterContext(mock.patch.object(metrics, "PRUNE_INTERVAL", 3600))
+        self.enterContext(mock.patch.object(metrics, "_counters", {}))
+        self.enterContext(mock.patch.object(metrics, "_histograms", {}))
+        self.enterContext(mock.patch.object(metrics, "_gauges", {}))
+        self.enterContext(mock.patch.object(metrics, "_last_flush", float("inf")))
+        self.enterContext(mock.patch.object(metrics, "_last_prune", float("inf")))
+        self.enterContext(mock.patch.object(metrics, "_worker", (None, None)))
+
+    def _write_snapshot(self, filename, count):
+        with open(os.path.join(self.directory, filename), "w") as f:
+            json.dump({"counters": [["fashion_fallbacks_total", [["kind", "dummy_image"]], count]],
+                       "histograms": []}, f)
+
+    def _line(self, prefix):
+        return [line for line in metrics.render().splitlines() if line.startswith(prefix)]
+
+    def test_counters_and_histograms_render_as_prometheus_text(self):
+        metrics.inc("fashion_provider_calls_total", provider="serpapi", outcome="ok")
+        metrics.inc("fashion_provider_calls_total", 2, provider="serpapi", outcome="ok")
+        metrics.observe("fashion_stage_duration_seconds", 0.3, stage="lens")
+        metrics.observe("fashion_stage_duration_seconds", 100, stage="lens")
+        metrics.register_gauge("fashion_media_files", lambda: 7)
+
+        text = metrics.render()
+        self.assertIn('fashion_provider_calls_total{outcome="ok",provider="serpapi"} 3', text)
+        self.assertIn('fashion_stage_duration_seconds_bucket{stage="lens",le="0.25"} 0', text)
+        self.assertIn('fashion_stage_duration_seconds_bucket{stage="lens",le="0.5"} 1', text)
+        self.assertIn('fashion_stage_duration_seconds_bucket{stage="lens",le="+Inf"} 2', text)
+        self.assertIn('fashion_stage_duration_seconds_sum{stage="lens"} 100.3', text)
+        self.assertIn('fashion_stage_duration_seconds_count{stage="lens"} 2', text)
+        self.assertIn("fashion_media_files 7", text)
+        self.assertIn("# TYPE fashion_partial_responses_total counter", text)
+
+    def test_timed_counts_errors(self):
+        with self.assertRaises(ValueError), metrics.timed("format"):
+            raise ValueError("bad")
+        self.assertEqual(self._line('fashion_stage_errors_total{stage="format"}'),
+                         ['fashion_stage_errors_total{stage="format"} 1'])
+        self.assertEqual(self._line('fashion_stage_duration_seconds_count{stage="format"}'),
+                         ['fashion_stage_duration_seconds_count{stage="format"} 1'])
+
+    def test_snapshots_of_all_workers_are_summed(self):
+        metrics.fallback("dummy_image")
+        self._write_snapshot(f"{os.getppid()}-1.json", 4)
+        self.assertEqual(self._line("fashion_fallbacks_total"), ['fashion_fallbacks_total{kind="dummy_image"} 5'])
+
+    def test_dead_workers_are_folded_into_the_archive_once(self):
+        metrics.fallback("dummy_image")
+        dead = f"{_dead_pid()}-1.json"
+        self._write_snapshot(dead, 4)
+        metrics.flush()
+        # العامل الحالي بوقت بدء سابق (pid أعيد استخدامه) يعد متوقفًا أيضًا
+        stale_self = f"{os.getpid()}-1.json"
+        self._write_snapshot(stale_self, 2)
+
+        self.assertEqual(metrics.prune(), 2)
+        self.assertFalse(os.path.exists(os.path.join(self.directory, dead)))
+        self.assertFalse(os.path.exists(os.path.join(self.directory, stale_self)))
+        self.assertEqual(self._line("fashion_fallbacks_total"), ['fashion_fallbacks_total{kind="dummy_image"} 7'])
+
+        self.assertEqual(metrics.prune(), 0)
+        self.assertEqual(self._line("fashion_fallbacks_total"), ['fashion_fallbacks_total{kind="dummy_image"} 7'])
+
+    def test_disabled_metrics_write_nothing(self):
+        with mock.patch.object(metrics, "METRICS_ENABLED", False):
+            metrics.inc("fashion_partial_responses_total")
+            metrics.render()
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_endpoint(self):
+        metrics.inc("fashion_partial_responses_total")
+        response = self.client.get("/api/metrics/")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        self.assertIn(b"fashion_partial_responses_total 1", response.content)
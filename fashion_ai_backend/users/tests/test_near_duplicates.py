@@ -0,0 +1,109 @@
+import io
+from unittest import mock
+
+import numpy as np
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from PIL import Image, ImageDraw
+
+from users import near_duplicates
+from users.models import LensResultCache
+
+
+def _garment(fill, size=(256, 256), width=80):
+    # قطعة ملابس مبسطة على خلفية استوديو رمادية
+    image = Image.new("RGB", size, (200, 200, 200))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((size[0] // 2 - width // 2, 40, size[0] // 2 + width // 2, 220), fill=fill)
+    draw.rectangle((20, 60, 60, 120), fill=(90, 90, 90))
+    return image
+
+
+def _jpeg(image, quality):
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=quality)
+    buffer.seek(0)
+    return Image.open(buffer)
+
+
+def _distance(first, second):
+    return bin(first ^ second).count("1")
+
+
+def _color_distance(first, second):
+    a = np.array(((first >> 16) & 0xFF, (first >> 8) & 0xFF, first & 0xFF))
+    b = np.array(((second >> 16) & 0xFF, (second >> 8) & 0xFF, second & 0xFF))
+    return float(np.sqrt(((a - b) ** 2).sum()))
+
+
+class SignatureTests(SimpleTestCase):
+    def test_recompressed_image_is_a_near_duplicate(self):
+        original = near_duplicates.compute_signature(_garment((30, 60, 150)))
+        recompressed = near_duplicates.compute_signature(_jpeg(_garment((30, 60, 150)), quality=60))
+        self.assertLessEqual(_distance(original[0], recompressed[0]), near_duplicates.MAX_DISTANCE)
+        self.assertLessEqual(_color_distance(original[1], recompressed[1]), near_duplicates.MAX_COLOR_DISTANCE)
+
+    def test_same_shape_in_another_color_is_told_apart_by_color(self):
+        blue = near_duplicates.compute_signature(_garment((30, 60, 150)))
+        red = near_duplicates.compute_signature(_garment((160, 30, 30)))
+        self.assertGreater(_color_distance(blue[1], red[1]), near_duplicates.MAX_COLOR_DISTANCE)
+
+    def test_different_garment_is_far(self):
+        narrow = near_duplicates.compute_signature(_garment((30, 60, 150), width=40))
+        wide = near_duplicates.compute_signature(_garment((30, 60, 150), width=200))
+        self.assertGreater(_distance(narrow[0], wide[0]), near_duplicates.MAX_DISTANCE)
+
+    def test_signed_storage_keeps_bits(self):
+        value = (1 << 64) - 5
+        signed = near_duplicates.to_signed(value)
+        self.assertLess(signed, 0)
+        self.assertEqual(signed & 0xFFFFFFFFFFFFFFFF, value)
+
+
+class HashIndexTests(SimpleTestCase):
+    def test_nearest_orders_by_distance_and_applies_limits(self):
+        index = near_duplicates.HashIndex(capacity=2)
+        color = 0x808080
+        index.add("exact", 0b1111, color)
+        index.add("two-bits", 0b0011, color)
+        index.add("one-bit", 0b0111, color)
+        index.add("far", (1 << 64) - 1, color)
+        index.add("other-color", 0b1111, 0xFF0000)
+        self.assertEqual(len(index), 5)
+
+        self.assertEqual(index.nearest(0b1111, color, 4, 30, 10), ["exact", "one-bit", "two-bits"])
+        self.assertEqual(index.nearest(0b1111, color, 4, 30, 2), ["exact", "one-bit"])
+        self.assertEqual(index.nearest(0b1111, color, 0, 30, 10), ["exact"])
+
+    def test_readding_a_digest_updates_it(self):
+        index = near_duplicates.HashIndex()
+        index.add("image", 0, 0)
+        index.add("image", (1 << 64) - 1, 0)
+        self.assertEqual(len(index), 1)
+        self.assertEqual(index.nearest(0, 0, 4, 30, 5), [])
+        self.assertEqual(index.nearest((1 << 64) - 1, 0, 4, 30, 5), ["image"])
+
+
+class NeighborsTests(TestCase):
+    def setUp(self):
+        self.enterContext(mock.patch.object(near_duplicates, "_indexes", {}))
+        self.enterContext(mock.patch.object(near_duplicates, "_loaded_id", 0))
+        self.enterContext(mock.patch.object(near_duplicates, "_loaded_at", None))
+
+    def test_neighbors_are_loaded_from_saved_results_per_locale(self):
+        signature = near_duplicates.compute_signature(_garment((30, 60, 150)))
+        for digest, gl in (("saved-sa", "sa"), ("saved-us", "us")):
+            LensResultCache.objects.create(
+                image_digest=digest, hl="ar", gl=gl, shopping_results=[], fetched_at=timezone.now(),
+                phash=near_duplicates.to_signed(signature[0]), color=signature[1],
+            )
+        similar = near_duplicates.compute_signature(_jpeg(_garment((30, 60, 150)), quality=60))
+        self.assertEqual(near_duplicates.neighbors(similar, "ar", "sa"), ["saved-sa"])
+        self.assertEqual(near_duplicates.neighbors(similar, "ar", "eg"), [])
+        self.assertEqual(near_duplicates.neighbors(None, "ar", "sa"), [])
+
+    def test_remembered_images_are_found_before_refresh(self):
+        signature = near_duplicates.compute_signature(_garment((30, 60, 150)))
+        near_duplicates.neighbors(signature, "ar", "sa")
+        near_duplicates.remember("fresh", "ar", "sa", signature)
+        self.assertEqual(near_duplicates.neighbors(signature, "ar", "sa"), ["fresh"])
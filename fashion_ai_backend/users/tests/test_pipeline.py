@@ -0,0 +1,123 @@
+import threading
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from users import metrics, pipeline
+from users.deadlines import deadline_scope
+
+PROMPTS = ["قميص", "بنطال", "جاكيت"]
+STEP = 0.1
+
+
+class _Provider:
+    """مولد صور وبحث Lens وهميان بزمن ثابت، يسجلان أقصى تزامن لكل مرحلة."""
+
+    def __init__(self, slow=(), failing_prompts=(), failing_images=()):
+        self.slow = set(slow)
+        self.failing_prompts = set(failing_prompts)
+        self.failing_images = set(failing_images)
+        self._lock = threading.Lock()
+        self.active = {"image": 0, "lens": 0}
+        self.peak = {"image": 0, "lens": 0}
+
+    def _enter(self, stage):
+        with self._lock:
+            self.active[stage] += 1
+            self.peak[stage] = max(self.peak[stage], self.active[stage])
+
+    def _leave(self, stage):
+        with self._lock:
+            self.active[stage] -= 1
+
+    def generate(self, prompt, request, count):
+        self._enter("image")
+        try:
+            time.sleep(STEP)
+            if prompt in self.failing_prompts:
+                raise RuntimeError("image model down")
+            return [f"{prompt}/{index}.jpg" for index in range(count)]
+        finally:
+            self._leave("image")
+
+    def search(self, image_url, location_info):
+        self._enter("lens")
+        try:
+            time.sleep(2 if image_url in self.slow else STEP)
+            if image_url in self.failing_images:
+                raise RuntimeError("lens down")
+            # منتج خاص بالصورة ومنتج مشترك بين كل صور نفس الوصف
+            prompt = image_url.split("/")[0]
+            return [
+                {"title": f"منتج {image_url}", "link": f"https://shop.example.com/{image_url}", "price": "100"},
+                {"title": f"مشترك {prompt}", "link": f"https://shop.example.com/{prompt}", "price": "100"},
+            ]
+        finally:
+            self._leave("lens")
+
+
+def _format_chunk(user_analysis_text, products, posts_wanted, search_filters):
+    return [{"text": product["title"], "product_link": product["link"]} for product in products[:posts_wanted]]
+
+
+class PipelineFanOutTests(SimpleTestCase):
+    def setUp(self):
+        self.enterContext(mock.patch.object(metrics, "METRICS_ENABLED", False))
+        self.enterContext(mock.patch.object(pipeline, "FORMAT_RESERVE", 0))
+        self.format_chunk = self.enterContext(mock.patch.object(pipeline, "_format_chunk", side_effect=_format_chunk))
+
+    def _use(self, provider):
+        self.enterContext(mock.patch.object(pipeline, "generate_image_from_prompt", side_effect=provider.generate))
+        self.enterContext(mock.patch.object(pipeline, "search_products_by_image", side_effect=provider.search))
+        return provider
+
+    def test_chains_run_in_parallel_and_keep_a_stable_order(self):
+        provider = self._use(_Provider())
+        started = time.perf_counter()
+        chain_results = pipeline.collect_products(PROMPTS, None, "جدة")
+        elapsed = time.perf_counter() - started
+
+        # 3 أوصاف × 3 صور بالتتابع تحتاج 12 خطوة؛ بالتوازي خطوتان أو ثلاث
+        self.assertLess(elapsed, 6 * STEP)
+        self.assertEqual([prompt for prompt, _ in chain_results],
+                         [prompt for prompt in PROMPTS for _ in range(pipeline.IMAGES_PER_PROMPT)])
+        self.assertEqual(chain_results[1][1][0]["link"], "https://shop.example.com/قميص/1.jpg")
+        self.assertLessEqual(provider.peak["image"], pipeline.PIPELINE_STAGE_LIMITS["image"])
+        self.assertLessEqual(provider.peak["lens"], pipeline.PIPELINE_STAGE_LIMITS["lens"])
+        self.assertGreater(provider.peak["lens"], 1)
+
+    def test_failures_stay_inside_their_chain(self):
+        self._use(_Provider(failing_prompts={"بنطال"}, failing_images={"قميص/0.jpg"}))
+        self.enterContext(mock.patch("builtins.print"))
+        done = []
+        chain_results = pipeline.collect_products(PROMPTS, None, "جدة", on_chain_done=done.append)
+        results = dict(zip(sorted(done), (result for _, result in chain_results)))
+        self.assertIsInstance(results[(0, 0)], RuntimeError)
+        self.assertIsInstance(results[(1, 0)], pipeline.ImageGenerationError)
+        self.assertEqual(len(results[(2, 2)]), 2)
+        # فشل توليد صور الوصف عنصر واحد بدلًا من ثلاث سلاسل
+        self.assertEqual(len(chain_results), 3 + 1 + 3)
+
+        entries = pipeline.empty_result_entries(chain_results[:2])
+        self.assertEqual(entries[0], {"error": "Failed to search products", "prompt": "قميص"})
+
+    def test_products_are_merged_and_formatted_in_one_call(self):
+        self._use(_Provider())
+        recommendations = pipeline.run_prompt_chains(PROMPTS, None, "جدة", "تحليل")
+        links = [entry["product_link"] for entry in recommendations]
+        self.assertEqual(len(links), len(set(links)))
+        # 9 منتجات خاصة بالصور و3 مشتركة بين صور كل وصف
+        self.assertEqual(len(links), 12)
+        # المنتج الذي ظهر في كل صور الوصف يتقدم الترتيب
+        self.assertEqual(links[0], "https://shop.example.com/قميص")
+        self.format_chunk.assert_called_once()
+
+    def test_deadline_returns_what_finished(self):
+        self._use(_Provider(slow={"جاكيت/2.jpg"}))
+        started = time.perf_counter()
+        with deadline_scope(8 * STEP) as deadline:
+            chain_results = pipeline.collect_products(PROMPTS, None, "جدة")
+        self.assertLess(time.perf_counter() - started, 15 * STEP)
+        self.assertTrue(deadline.partial)
+        self.assertEqual(len(chain_results), 8)
@@ -0,0 +1,86 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from users import metrics, pipeline, product_index
+from users.models import IndexedProduct
+
+
+def _catalog():
+    products = []
+    for index in range(4):
+        products.append({"title": f"قميص كتان أبيض {index}", "link": f"https://shop.example.com/w/{index}",
+                         "price": f"{100 + index * 50} ر.س", "source": "Zara"})
+        products.append({"title": f"Navy cotton shirt {index}", "link": f"https://shop.example.com/n/{index}",
+                         "price": "$80", "source": "H&M"})
+        products.append({"title": f"فستان حرير أحمر {index}", "link": f"https://shop.example.com/d/{index}",
+                         "price": "300", "source": "Namshi"})
+    return products
+
+
+class AttributeTests(SimpleTestCase):
+    def test_titles_are_tagged_in_arabic_and_english(self):
+        self.assertEqual(product_index.extract_attributes({"title": "تي شيرت قطني أسود", "price": "٩٩ ر.س"}),
+                         {"garment": "tshirt", "color": "black", "fabric": "cotton", "price": 99.0, "source": ""})
+        self.assertEqual(product_index.extract_attribute("garment", "Slim Chinos"), "trousers")
+        # "tee" ككلمة كاملة فقط
+        self.assertEqual(product_index.extract_attribute("garment", "Steel watch"), "")
+
+    def test_filters(self):
+        self.assertEqual(product_index.parse_filters({"type": "قميص", "color": ["أبيض", "navy"], "budget": "50-200"}),
+                         {"garment": {"shirt"}, "color": {"white", "navy"}, "price": (50.0, 200.0)})
+        # صفة لا يمكن تقييمها تعطل الفهرس
+        self.assertIsNone(product_index.parse_filters({"color": "لون غريب"}))
+        # مفتاح غير معروف يقيّد فقط بما يذكره من صفات
+        self.assertEqual(product_index.parse_filters({"style": "كاجوال كتان"}), {"fabric": {"linen"}})
+        self.assertEqual(product_index.parse_filters({"occasion": "عرس"}), {})
+
+
+class FindProductsTests(TestCase):
+    def setUp(self):
+        self.enterContext(mock.patch.object(metrics, "METRICS_ENABLED", False))
+        self.enterContext(mock.patch.object(product_index, "MIN_CANDIDATES", 3))
+        product_index.index_products(_catalog(), "ar", "sa")
+
+    def test_matching_filters_are_served_from_the_index(self):
+        found = product_index.find_products({"type": "قميص", "color": "أبيض"}, "ar", "sa")
+        self.assertEqual(len(found), 4)
+        self.assertTrue(all("أبيض" in product["title"] for product in found))
+
+        within_budget = product_index.find_products({"type": "shirt", "budget": "50-160"}, "ar", "sa")
+        self.assertEqual({product["link"] for product in within_budget},
+                         {f"https://shop.example.com/n/{index}" for index in range(4)}
+                         | {"https://shop.example.com/w/0", "https://shop.example.com/w/1"})
+
+        by_store = product_index.find_products({"store": "zara"}, "ar", "sa")
+        self.assertEqual(len(by_store), 4)
+
+    def test_too_few_unfilterable_or_other_locale_falls_through(self):
+        self.assertIsNone(product_index.find_products({"type": "معطف"}, "ar", "sa"))
+        self.assertIsNone(product_index.find_products({"occasion": "عرس"}, "ar", "sa"))
+        self.assertIsNone(product_index.find_products({"type": "قميص"}, "en", "us"))
+
+    def test_reindexing_counts_sightings_and_old_products_expire(self):
+        product_index.index_products(_catalog()[:1], "ar", "sa")
+        self.assertEqual(IndexedProduct.objects.count(), 12)
+        self.assertEqual(
+            IndexedProduct.objects.get(product_key=product_index.product_key(_catalog()[0])).seen_count, 2
+        )
+
+        IndexedProduct.objects.exclude(garment="dress").update(
+            last_seen_at=timezone.now() - timedelta(seconds=product_index.MAX_AGE + 60)
+        )
+        self.assertIsNone(product_index.find_products({"type": "قميص"}, "ar", "sa"))
+        self.assertEqual(product_index.purge_expired(), 8)
+
+    def test_advanced_search_skips_generation_when_the_index_is_enough(self):
+        with mock.patch.object(pipeline, "collect_products") as collect, \
+                mock.patch.object(pipeline, "LENS_HL", "ar"), mock.patch.object(pipeline, "LENS_GL", "sa"), \
+                mock.patch.object(pipeline, "_format_chunk", side_effect=lambda analysis, products, wanted, filters: [
+                    {"product_link": product["link"]} for product in products[:wanted]
+                ]):
+            recommendations = pipeline.run_prompt_chains(["وصف"], None, "جدة", "تحليل", {"type": "فستان"})
+        collect.assert_not_called()
+        self.assertEqual(len(recommendations), 4)
@@ -0,0 +1,77 @@
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from users import metrics, prompts
+
+
+def _products(count, title="قميص قطني أزرق بقصة مستقيمة"):
+    return [
+        {
+            "id": f"p{index + 1}",
+            "title": f"{title} {index}",
+            "source": "متجر",
+            "price": "120 ر.س",
+            "link": f"https://shop.example.com/item/{index}?utm_source=google&ref=shopping",
+            "thumbnail": f"https://encrypted-tbn0.gstatic.com/images?q=tbn:{index}",
+        }
+        for index in range(count)
+    ]
+
+
+class PromptBudgetTests(SimpleTestCase):
+    def setUp(self):
+        self.enterContext(mock.patch.object(metrics, "METRICS_ENABLED", False))
+        self.recent = self.enterContext(mock.patch.object(prompts, "_recent", prompts.deque(maxlen=10)))
+        self.enterContext(mock.patch.object(prompts, "_totals", {}))
+
+    def test_format_prompt_drops_lowest_ranked_products_first(self):
+        products = _products(40)
+        budget = prompts.estimate_tokens(prompts.format_prompt("تحليل", products[:10], 5)[0])
+        with mock.patch.dict(prompts.PROMPT_BUDGETS, {"format": budget}):
+            prompt, sent = prompts.format_prompt("تحليل", products, 5)
+        self.assertLessEqual(prompts.estimate_tokens(prompt), budget)
+        self.assertEqual(sent, products[:len(sent)])
+        self.assertLess(len(sent), len(products))
+        self.assertNotIn("https://", prompt)
+        self.assertEqual(self.recent[-1]["dropped"], len(products) - len(sent))
+
+    def test_format_prompt_truncates_analysis_and_filters_when_one_product_is_too_much(self):
+        with mock.patch.dict(prompts.PROMPT_BUDGETS, {"format": 200}):
+            prompt, sent = prompts.format_prompt("تحليل طويل " * 500, _products(3), 3, {"style": "x" * 3000})
+        self.assertLessEqual(prompts.estimate_tokens(prompt), 200)
+        self.assertEqual(len(sent), 1)
+        self.assertIn("p1 | ", prompt)
+
+    def test_format_savings_are_measured_against_the_verbose_prompt(self):
+        # حتى بدون منتجات يبقى القالب المطول أطول من المختصر
+        prompt, _ = prompts.format_prompt("تحليل", [], 3)
+        self.assertGreater(self.recent[-1]["saved"], 0)
+
+        products = _products(10)
+        prompt, _ = prompts.format_prompt("تحليل", products, 5, {"color": "أزرق"})
+        verbose = prompts._VERBOSE_FORMAT_TEMPLATE.format(
+            analysis="تحليل", filters='وفلاتر البحث المحددة: {"color": "أزرق"}',
+            products=prompts.json.dumps(products, ensure_ascii=False), posts_wanted=5,
+            filters_hint=" والفلاتر التي اختارها",
+        )
+        self.assertEqual(
+            self.recent[-1]["saved"], prompts.estimate_tokens(verbose) - prompts.estimate_tokens(prompt)
+        )
+
+    def test_analysis_prompt_stays_within_budget(self):
+        user = SimpleNamespace(height=175, weight=70, skin_color="قمحي", picture_analysis=None)
+        with mock.patch.dict(prompts.PROMPT_BUDGETS, {"advanced_analysis": 400}):
+            prompt = prompts.analysis_prompt(user, "الرياض", {"notes": "طويل " * 2000})
+        self.assertLessEqual(prompts.estimate_tokens(prompt), 400)
+        self.assertIn("175", prompt)
+        self.assertGreater(self.recent[-1]["saved"], 0)
+
+    def test_encode_product_caps_title_and_escapes_separators(self):
+        line = prompts.encode_product({"id": "p1", "title": "a|b " + "x" * 500, "price": {"value": "$10"}})
+        fields = line.split(" | ")
+        self.assertEqual(fields[0], "p1")
+        self.assertEqual(len(fields[1]), prompts.MAX_TITLE_CHARS)
+        self.assertTrue(fields[1].startswith("a/b"))
+        self.assertEqual(fields[2:], ["-", "$10", "-"])
@@ -0,0 +1,93 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from users import fake_providers, providers
+
+
+class _SearchHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.connections.add(self.client_address)
+        status = 429 if "throttle" in self.path else 200
+        body = json.dumps({"visual_matches": []}).encode()
+        self.send_response(status)
+        if status == 429:
+            self.send_header("Retry-After", "3")
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ProviderClientTests(SimpleTestCase):
+    def setUp(self):
+        self.enterContext(mock.patch("builtins.print"))
+        self.enterContext(mock.patch.dict(fake_providers.config, {"ENABLED": False}))
+        # حالة العملية من جديد، كأنها عامل بدأ للتو
+        self.enterContext(mock.patch.object(providers, "_pid", None))
+        self.enterContext(mock.patch.object(providers, "_models", {}))
+        self.enterContext(mock.patch.object(providers, "_session", None))
+        self.enterContext(mock.patch.object(providers, "_async_models", providers.weakref.WeakKeyDictionary()))
+        self.enterContext(mock.patch.object(providers, "_async_clients", providers.weakref.WeakKeyDictionary()))
+        self.enterContext(mock.patch.dict(providers._counters, {key: 0 for key in providers._counters}))
+        self.enterContext(mock.patch.object(providers, "GEMINI_API_KEY", None))
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), _SearchHandler)
+        server.connections = set()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.server = server
+        self.enterContext(mock.patch.object(
+            providers, "SERPAPI_SEARCH_URL", f"http://127.0.0.1:{server.server_address[1]}/search.json"
+        ))
+
+    def test_gemini_models_are_reused_per_process(self):
+        with mock.patch.object(providers.genai, "GenerativeModel", side_effect=lambda model_name: object()) as create:
+            first = providers.gemini_model("gemini-1.5-flash")
+            self.assertIs(providers.gemini_model("gemini-1.5-flash"), first)
+            self.assertIsNot(providers.gemini_model("gemini-pro"), first)
+            self.assertEqual(create.call_count, 2)
+
+            # بعد التفرع يبدأ العامل بنماذج جديدة
+            with mock.patch.object(providers.os, "getpid", return_value=-1):
+                self.assertIsNot(providers.gemini_model("gemini-1.5-flash"), first)
+        self.assertEqual(providers._counters["model_reuses"], 1)
+
+    def test_fake_providers_replace_real_clients(self):
+        with mock.patch.dict(fake_providers.config, {"ENABLED": True}):
+            self.assertIsInstance(providers.gemini_model("gemini-1.5-flash"), fake_providers.FakeGenerativeModel)
+
+    def test_serpapi_requests_share_one_connection(self):
+        for _ in range(5):
+            self.assertEqual(providers.serpapi_search({"q": "x"}, timeout=5), ({"visual_matches": []}, 200))
+        self.assertEqual(len(self.server.connections), 1)
+        self.assertEqual(providers._counters["http_sessions_created"], 1)
+
+    def test_throttling_is_raised_with_retry_after(self):
+        with self.assertRaises(providers.ProviderThrottled) as raised:
+            providers.serpapi_search({"throttle": "1"}, timeout=5)
+        self.assertEqual(raised.exception.retry_after, 3.0)
+
+    def test_async_client_per_event_loop_reuses_connections(self):
+        async def search_three_times():
+            client = providers.async_http_client()
+            for _ in range(3):
+                await providers.aserpapi_search({"q": "x"}, timeout=5)
+            self.assertIs(providers.async_http_client(), client)
+            await client.aclose()
+
+        asyncio.run(search_three_times())
+        asyncio.run(search_three_times())
+        self.assertEqual(providers._counters["async_http_clients_created"], 2)
+        self.assertEqual(providers._counters["async_http_requests"], 6)
+        self.assertEqual(providers._counters["async_http_connections"], 2)
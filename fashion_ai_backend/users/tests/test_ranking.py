@@ -0,0 +1,84 @@
+from django.test import SimpleTestCase
+
+from users.ranking import (
+    ProductDeduper, budget_fit, normalize_link, parse_budget, parse_price, rank_products,
+)
+
+
+def _product(title, link, price=None, source="متجر"):
+    return {"title": title, "link": link, "price": price, "source": source}
+
+
+class NormalizationTests(SimpleTestCase):
+    def test_links_ignore_tracking_and_www(self):
+        self.assertEqual(
+            normalize_link("http://WWW.Shop.com/item/1/?utm_source=g&gclid=x&color=red#top"),
+            normalize_link("https://shop.com/item/1?color=red"),
+        )
+        self.assertNotEqual(normalize_link("https://shop.com/item/1"), normalize_link("https://shop.com/item/2"))
+
+    def test_prices(self):
+        cases = {
+            "1,299.00 ر.س": 1299.0,
+            "1.299,00 €": 1299.0,
+            "١٥٠ ر.س": 150.0,
+            "$49.99": 49.99,
+            "بدون سعر": None,
+        }
+        for price, expected in cases.items():
+            with self.subTest(price=price):
+                self.assertEqual(parse_price(price), expected)
+        self.assertEqual(parse_price({"extracted_value": 20, "value": "$20"}), 20.0)
+        self.assertEqual(parse_price(None), None)
+
+    def test_budgets(self):
+        self.assertEqual(parse_budget("200-500"), (200.0, 500.0))
+        self.assertEqual(parse_budget("300"), (0.0, 300.0))
+        self.assertIsNone(parse_budget("متوسطة"))
+        self.assertEqual(budget_fit(250, (200.0, 500.0)), 1.0)
+        self.assertLess(budget_fit(900, (200.0, 500.0)), budget_fit(600, (200.0, 500.0)))
+        self.assertEqual(budget_fit(None, (200.0, 500.0)), 0.5)
+
+
+class RankProductsTests(SimpleTestCase):
+    def test_duplicates_are_merged_across_chains(self):
+        chain_results = [
+            ("a", [_product("Blue Shirt", "https://www.shop.com/shirt?utm_source=x"), _product("Hat", "https://shop.com/hat")]),
+            ("b", [_product("blue  shirt!", "https://other.com/shirt", price="$30")]),
+            ("c", RuntimeError("lens failed")),
+        ]
+        ranked = rank_products(chain_results)
+        self.assertEqual([product["title"] for product in ranked], ["Blue Shirt", "Hat"])
+        # السعر الناقص يُكمل من النسخة المكررة
+        self.assertEqual(ranked[0]["price"], "$30")
+
+    def test_products_in_more_images_and_within_budget_rank_first(self):
+        chain_results = [
+            ("a", [_product("Expensive", "https://shop.com/1", "$900"), _product("Cheap", "https://shop.com/2", "$100")]),
+            ("b", [_product("Popular", "https://shop.com/3"), _product("Expensive", "https://shop.com/1", "$900")]),
+            ("c", [_product("Popular", "https://shop.com/3")]),
+            ("d", [_product("Popular", "https://shop.com/3")]),
+        ]
+        ranked = rank_products(chain_results, budget="50-200")
+        # ثلاث صور ترجح على الميزانية، والميزانية ترجح على صورة إضافية خارجها
+        self.assertEqual([product["title"] for product in ranked], ["Popular", "Cheap", "Expensive"])
+
+        ranked = rank_products(chain_results, budget="50-200", top_n=2)
+        self.assertEqual(len(ranked), 2)
+
+    def test_ties_keep_first_seen_order(self):
+        chain_results = [("a", [_product(f"Item {index}", f"https://shop.com/{index}") for index in range(5)])]
+        self.assertEqual(
+            [product["title"] for product in rank_products(chain_results)], [f"Item {index}" for index in range(5)]
+        )
+
+
+class ProductDeduperTests(SimpleTestCase):
+    def test_filters_repeats_across_calls_and_restored_state(self):
+        deduper = ProductDeduper()
+        first = deduper.filter([_product("Shirt", "https://shop.com/1"), _product("Shirt", "https://www.shop.com/1/")])
+        self.assertEqual(len(first), 1)
+
+        restored = ProductDeduper(deduper.seen)
+        self.assertEqual(restored.filter([_product("Other title", "https://shop.com/1")]), [])
+        self.assertEqual(len(restored.filter([_product("Pants", "https://shop.com/2")])), 1)
@@ -0,0 +1,121 @@
+import asyncio
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from users import fake_providers, metrics, rate_limits
+from users.providers import ProviderThrottled
+
+PARAMS = {"engine": "google_lens", "url": "https://example.com/image.jpg", "hl": "ar", "gl": "sa"}
+GENEROUS = {"RATE": 1000.0, "BURST": 1000, "CONCURRENCY": 2, "PER_USER_RATE": 1000.0, "PER_USER_BURST": 1000}
+
+
+class RateLimiterTests(SimpleTestCase):
+    def setUp(self):
+        scratch = self.enterContext(tempfile.TemporaryDirectory())
+        # حالة المحدد في ملف مؤقت، واتصالات جديدة لكل خيط
+        self.enterContext(mock.patch.object(rate_limits, "RATE_LIMITS_PATH", os.path.join(scratch, "limits.sqlite3")))
+        self.enterContext(mock.patch.object(rate_limits, "_local", threading.local()))
+        self.enterContext(mock.patch.object(rate_limits, "RATE_LIMITS_ENABLED", True))
+        self.enterContext(mock.patch.object(rate_limits, "POLL_INTERVAL", 0.01))
+        self.enterContext(mock.patch.dict(rate_limits.PROVIDER_LIMITS, {"serpapi": dict(GENEROUS)}))
+        self.enterContext(mock.patch.object(metrics, "METRICS_ENABLED", False))
+        self.enterContext(mock.patch.dict(fake_providers.config, {
+            "ENABLED": True,
+            "LATENCY": {"serpapi": 0.05},
+            "JITTER": 0.0,
+            "ERROR_RATE": 0.0,
+            "THROTTLE_RATE": 0.0,
+            "SHOPPING_RESULTS": 2,
+        }))
+        self.active = 0
+        self.peak = 0
+        self.counter_lock = threading.Lock()
+
+    def _rows(self, table):
+        return rate_limits._connection().execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def _track(self, delta):
+        with self.counter_lock:
+            self.active += delta
+            self.peak = max(self.peak, self.active)
+
+    def _search(self):
+        self._track(1)
+        try:
+            return fake_providers.serpapi_search(PARAMS, timeout=5)
+        finally:
+            self._track(-1)
+
+    async def _asearch(self):
+        self._track(1)
+        try:
+            return await fake_providers.aserpapi_search(PARAMS, timeout=5)
+        finally:
+            self._track(-1)
+
+    def test_call_respects_concurrency(self):
+        with ThreadPoolExecutor(max_workers=6) as executor:
+            results = list(executor.map(lambda _: rate_limits.call("serpapi", self._search), range(6)))
+        self.assertTrue(all(status == 200 for _, status in results))
+        self.assertEqual(self.peak, 2)
+        self.assertEqual(self._rows("leases"), 0)
+        self.assertEqual(self._rows("tickets"), 0)
+
+    def test_acall_respects_concurrency(self):
+        async def main():
+            return await asyncio.gather(*(rate_limits.acall("serpapi", self._asearch) for _ in range(6)))
+
+        results = asyncio.run(main())
+        self.assertTrue(all(status == 200 for _, status in results))
+        self.assertEqual(self.peak, 2)
+        self.assertEqual(self._rows("leases"), 0)
+        self.assertEqual(self._rows("tickets"), 0)
+
+    def test_cancelled_acall_leaves_no_lease_or_ticket(self):
+        fake_providers.config["LATENCY"] = {"serpapi": 1.0}
+        rate_limits.PROVIDER_LIMITS["serpapi"]["CONCURRENCY"] = 1
+
+        async def main():
+            running = asyncio.create_task(rate_limits.acall("serpapi", self._asearch))
+            await asyncio.sleep(0.1)
+            queued = asyncio.create_task(rate_limits.acall("serpapi", self._asearch))
+            await asyncio.sleep(0.1)
+            for task in (running, queued):
+                task.cancel()
+            await asyncio.gather(running, queued, return_exceptions=True)
+            # تحرير العقد وحذف التذكرة يتمان في خيوط بعد الإلغاء
+            for _ in range(100):
+                if not await asyncio.to_thread(self._rows, "leases") and not await asyncio.to_thread(self._rows, "tickets"):
+                    break
+                await asyncio.sleep(0.01)
+
+        asyncio.run(main())
+        self.assertEqual(self._rows("leases"), 0)
+        self.assertEqual(self._rows("tickets"), 0)
+
+    def test_throttled_provider_is_blocked_for_every_worker(self):
+        fake_providers.config["THROTTLE_RATE"] = 1.0
+        with mock.patch.object(rate_limits, "MAX_RETRIES", 0):
+            with self.assertRaises(ProviderThrottled):
+                rate_limits.call("serpapi", self._search)
+        self.assertGreater(rate_limits.stats()["serpapi"]["blocked_for_seconds"], 0)
+        self.assertEqual(self._rows("leases"), 0)
+
+    def test_per_user_burst(self):
+        rate_limits.PROVIDER_LIMITS["serpapi"].update({"PER_USER_RATE": 0.001, "PER_USER_BURST": 2})
+        with mock.patch.object(rate_limits, "MAX_WAIT", 0.2):
+            with rate_limits.user_scope(1):
+                rate_limits.call("serpapi", self._search)
+                rate_limits.call("serpapi", self._search)
+                with self.assertRaises(rate_limits.RateLimitTimeout):
+                    rate_limits.call("serpapi", self._search)
+            # حد المستخدم لا يمس غيره
+            with rate_limits.user_scope(2):
+                _, status = rate_limits.call("serpapi", self._search)
+        self.assertEqual(status, 200)
+        self.assertEqual(self._rows("tickets"), 0)
@@ -0,0 +1,59 @@
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from users import metrics
+from users.models import CustomUser
+
+ANALYSIS = {"skin_tone": {"category": "medium"}, "palette": []}
+
+
+class ProfilePictureSignalTests(TestCase):
+    def setUp(self):
+        self.enterContext(mock.patch.object(metrics, "METRICS_ENABLED", False))
+        self.schedule = self.enterContext(mock.patch("users.signals.schedule_picture_analysis"))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user = CustomUser.objects.create_user(
+                username="picture-user", password="x", profile_picture="profile_pics/a.jpg"
+            )
+        self.schedule.assert_called_once_with(self.user.id)
+        self.schedule.reset_mock()
+
+    def _store_analysis(self):
+        # كما يفعل خيط الخلفية (profile_analysis.analyze_user_picture)
+        CustomUser.objects.filter(id=self.user.id).update(
+            picture_analysis=ANALYSIS, picture_digest="d" * 64, picture_analyzed_at=timezone.now()
+        )
+
+    def test_unrelated_save_keeps_background_analysis(self):
+        stale = CustomUser.objects.get(id=self.user.id)
+        self._store_analysis()
+        stale.height = 180
+        with self.captureOnCommitCallbacks(execute=True):
+            stale.save()
+
+        self.schedule.assert_not_called()
+        fresh = CustomUser.objects.get(id=self.user.id)
+        self.assertEqual(fresh.height, 180)
+        self.assertEqual(fresh.picture_analysis, ANALYSIS)
+        self.assertEqual(fresh.picture_digest, "d" * 64)
+
+    def test_save_without_analysis_does_not_reschedule(self):
+        self.user.skin_color = "قمحي"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.schedule.assert_not_called()
+
+    def test_picture_change_clears_and_reschedules(self):
+        self._store_analysis()
+        user = CustomUser.objects.get(id=self.user.id)
+        user.profile_picture = "profile_pics/b.jpg"
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+
+        self.schedule.assert_called_once_with(user.id)
+        fresh = CustomUser.objects.get(id=user.id)
+        self.assertEqual(fresh.profile_picture.name, "profile_pics/b.jpg")
+        self.assertIsNone(fresh.picture_analysis)
+        self.assertIsNone(fresh.picture_digest)
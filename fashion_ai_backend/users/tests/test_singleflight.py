@@ -0,0 +1,138 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.cache import caches
+from django.test import SimpleTestCase
+
+from users.singleflight import SingleFlight
+
+
+class SingleFlightTests(SimpleTestCase):
+    def test_concurrent_calls_share_one_execution(self):
+        flights = SingleFlight(shared_alias=None)
+        release = threading.Event()
+        calls = []
+
+        def fn():
+            calls.append(1)
+            release.wait(5)
+            return {"posts": 3}
+
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            futures = [executor.submit(flights.do, "key", fn) for _ in range(5)]
+            # كل المنتظرين ينضمون قبل انتهاء المنفذ
+            while flights.local_waiters < 4:
+                time.sleep(0.01)
+            release.set()
+            results = [future.result(5) for future in futures]
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{"posts": 3}] * 5)
+        self.assertEqual(flights.stats()["in_flight"], 0)
+
+    def test_leader_error_reaches_waiters(self):
+        flights = SingleFlight(shared_alias=None)
+        started = threading.Event()
+
+        def fn():
+            started.set()
+            time.sleep(0.1)
+            raise ValueError("boom")
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            leader = executor.submit(flights.do, "key", fn)
+            started.wait(5)
+            waiter = executor.submit(flights.do, "key", lambda: "unused")
+            for future in (leader, waiter):
+                with self.assertRaises(ValueError):
+                    future.result(5)
+
+    def test_waiter_runs_fn_itself_after_lock_ttl(self):
+        flights = SingleFlight(shared_alias=None, lock_ttl=0.1)
+        release = threading.Event()
+        started = threading.Event()
+
+        def slow():
+            started.set()
+            release.wait(5)
+            return "leader"
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            leader = executor.submit(flights.do, "key", slow)
+            started.wait(5)
+            # لا يعيد None أبدًا: المنتظر الذي انتهت مهلته ينفذ بنفسه
+            self.assertEqual(flights.do("key", lambda: "waiter"), "waiter")
+            release.set()
+            self.assertEqual(leader.result(5), "leader")
+        self.assertEqual(flights.leaders, 2)
+
+    def test_result_published_by_another_process(self):
+        flights = SingleFlight(shared_alias="default", poll_interval=0.01)
+        shared = caches["default"]
+        # عملية أخرى تحمل القفل ثم تنشر النتيجة
+        shared.set(flights._lock_key("key"), "other-process", 60)
+        threading.Timer(0.05, shared.set, args=(flights._result_key("key"), "from-other", 60)).start()
+        try:
+            self.assertEqual(flights.do("key", lambda: "local"), "from-other")
+        finally:
+            shared.delete(flights._lock_key("key"))
+            shared.delete(flights._result_key("key"))
+        self.assertEqual(flights.leaders, 0)
+
+    def test_async_calls_share_one_execution(self):
+        flights = SingleFlight(shared_alias=None)
+        calls = []
+
+        async def fn():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "result"
+
+        async def main():
+            return await asyncio.gather(*(flights.ado("key", fn) for _ in range(5)))
+
+        self.assertEqual(asyncio.run(main()), ["result"] * 5)
+        self.assertEqual(len(calls), 1)
+
+    def test_async_waiter_takes_over_when_leader_is_cancelled(self):
+        flights = SingleFlight(shared_alias=None)
+
+        async def fn():
+            await asyncio.sleep(0.2)
+            return "result"
+
+        async def main():
+            leader = asyncio.create_task(flights.ado("key", fn))
+            await asyncio.sleep(0.01)
+            waiter = asyncio.create_task(flights.ado("key", fn))
+            await asyncio.sleep(0.01)
+            # انقطاع عميل المنفذ لا يترك المنتظر معلقًا
+            leader.cancel()
+            result = await asyncio.wait_for(waiter, 5)
+            with self.assertRaises(asyncio.CancelledError):
+                await leader
+            return result
+
+        self.assertEqual(asyncio.run(main()), "result")
+        self.assertEqual(flights.leaders, 2)
+        self.assertEqual(flights.stats()["in_flight"], 0)
+
+    def test_async_result_published_by_another_process(self):
+        flights = SingleFlight(shared_alias="default", poll_interval=0.01)
+        shared = caches["default"]
+
+        async def main():
+            await shared.aset(flights._lock_key("key"), "other-process", 60)
+            publish = asyncio.get_running_loop().call_later(
+                0.05, shared.set, flights._result_key("key"), "from-other", 60
+            )
+            try:
+                return await flights.ado("key", lambda: asyncio.sleep(0, "local"))
+            finally:
+                publish.cancel()
+                await shared.adelete(flights._lock_key("key"))
+                await shared.adelete(flights._result_key("key"))
+
+        self.assertEqual(asyncio.run(main()), "from-other")
@@ -0,0 +1,103 @@
+import asyncio
+import json
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+
+from users import deadlines, metrics, views
+from users.models import CustomUser
+from users.pipeline import RESULTS_PER_PAGE
+
+URL = "/api/recommendations/stream/"
+
+
+def _parse(chunk):
+    text = chunk.decode() if isinstance(chunk, bytes) else chunk
+    event, data = text.strip().split("\n")
+    return event[len("event: "):], json.loads(data[len("data: "):])
+
+
+class StreamRecommendationsTests(TestCase):
+    def setUp(self):
+        self.enterContext(mock.patch.object(metrics, "METRICS_ENABLED", False))
+        self.analyze = self.enterContext(mock.patch.object(
+            views, "analyze_user_and_generate_prompts",
+            return_value=json.dumps({"analysis": "تحليل", "prompts": ["قميص", "بنطال"]}),
+        ))
+        self.enqueue = self.enterContext(mock.patch.object(views, "enqueue_recommendation_job"))
+        self.user = CustomUser.objects.create(username="stream-user")
+        self.finished = False
+
+    def _chains(self, chain_count=4, posts_per_chain=2, partial=False):
+        def iter_prompt_chains(prompts, request, location_info, user_analysis_text, budget=None):
+            for chain in range(chain_count):
+                yield (chain // 3, chain % 3), [
+                    {"text": f"منشور {chain}-{index}", "product_link": f"https://shop.example.com/{chain}/{index}"}
+                    for index in range(posts_per_chain)
+                ]
+            if partial:
+                deadlines.current_deadline().mark_partial()
+            self.finished = True
+
+        self.enterContext(mock.patch.object(views, "iter_prompt_chains", side_effect=iter_prompt_chains))
+
+    def test_posts_are_sent_as_each_chain_finishes(self):
+        self._chains()
+        response = self.client.get(URL, {"user_id": self.user.id, "location": "جدة"})
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        stream = iter(response.streaming_content)
+
+        self.assertEqual(_parse(next(stream)), ("analysis", {"user_analysis": "تحليل"}))
+        event, post = _parse(next(stream))
+        self.assertEqual(event, "post")
+        self.assertEqual(post["text"], "منشور 0-0")
+        # أول منشور يصل قبل انتهاء باقي السلاسل
+        self.assertFalse(self.finished)
+
+        events = [_parse(chunk) for chunk in stream]
+        self.assertEqual([event for event, _ in events].count("post"), 7)
+        self.assertEqual(events[-1], ("done", {"total_pages": 2, "cached": False, "partial": False}))
+
+    def test_page_mode_sends_full_pages_then_the_last_one(self):
+        self._chains()
+        response = self.client.get(URL, {"user_id": self.user.id, "location": "جدة", "mode": "page"})
+        events = [_parse(chunk) for chunk in response.streaming_content]
+        pages = [data for event, data in events if event == "page"]
+        self.assertEqual([page["current_page"] for page in pages], [1, 2])
+        self.assertEqual(len(pages[0]["recommendations"]), RESULTS_PER_PAGE)
+        self.assertEqual(len(pages[1]["recommendations"]), 8 - RESULTS_PER_PAGE)
+
+    def test_stored_run_is_replayed_without_generation(self):
+        self._chains()
+        b"".join(self.client.get(URL, {"user_id": self.user.id, "location": "جدة"}).streaming_content)
+        self.analyze.reset_mock()
+
+        events = [_parse(chunk) for chunk in self.client.get(
+            URL, {"user_id": self.user.id, "location": "جدة"}
+        ).streaming_content]
+        self.analyze.assert_not_called()
+        self.assertEqual([event for event, _ in events].count("post"), 8)
+        self.assertEqual(events[-1], ("done", {"total_pages": 2, "cached": True}))
+
+    def test_partial_stream_is_completed_by_a_background_job(self):
+        self._chains(chain_count=1, partial=True)
+        events = [_parse(chunk) for chunk in self.client.get(
+            URL, {"user_id": self.user.id, "location": "جدة"}
+        ).streaming_content]
+        self.assertEqual(events[-1], ("done", {"total_pages": 1, "cached": False, "partial": True}))
+        self.enqueue.assert_called_once()
+
+    def test_unknown_user(self):
+        self.assertEqual(self.client.get(URL, {"user_id": 0}).status_code, 404)
+
+
+class AsyncEventsTests(SimpleTestCase):
+    def test_events_are_forwarded_in_order_from_a_thread(self):
+        def events():
+            for index in range(3):
+                yield f"event {index}"
+
+        async def consume():
+            return [event async for event in views._async_events(events())]
+
+        self.assertEqual(asyncio.run(consume()), ["event 0", "event 1", "event 2"])
@@ -1,10 +1,17 @@
 from django.urls import path
-from .views import UserRegistrationView, AnalyzeProfilePictureView, GetAIRecommendationsView, AdvancedSearchView
+from .views import UserRegistrationView, AnalyzeProfilePictureView, GetAIRecommendationsView, AdvancedSearchView, StreamRecommendationsView, CursorRecommendationsView, PipelineStatsView, MetricsView
+from .async_views import AsyncRecommendationsView, AsyncAdvancedSearchView
 
 urlpatterns = [
     path("register/", UserRegistrationView.as_view(), name="register"),
     path("analyze-profile-picture/", AnalyzeProfilePictureView.as_view(), name="analyze_profile_picture"),
     path("recommendations/", GetAIRecommendationsView.as_view(), name="get_recommendations"),
+    path("recommendations/stream/", StreamRecommendationsView.as_view(), name="stream_recommendations"),
+    path("recommendations/cursor/", CursorRecommendationsView.as_view(), name="cursor_recommendations"),
     path("advanced-search/", AdvancedSearchView.as_view(), name="advanced_search"),
+    path("stats/", PipelineStatsView.as_view(), name="pipeline_stats"),
+    path("metrics/", MetricsView.as_view(), name="pipeline_metrics"),
+    path("recommendations/async/", AsyncRecommendationsView.as_view(), name="get_recommendations_async"),
+    path("advanced-search/async/", AsyncAdvancedSearchView.as_view(), name="advanced_search_async"),
 ]
 
@@ -2,34 +2,36 @@ from rest_framework import generics, status
 from rest_framework.response import Response
 from .serializers import UserRegistrationSerializer
 from .models import CustomUser
-import cv2
-import numpy as np
 from django.core.files.storage import default_storage
 from django.core.files.base import ContentFile
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views import View
+import asyncio
+import contextvars
 import os
 import json
+import threading
 from .ai_services import (
+    recommendations_cache_stats,
+    generated_image_store,
     analyze_user_and_generate_prompts,
-    generate_image_from_prompt,
-    search_products_by_image,
-    get_cached_recommendations,
-    set_cached_recommendations,
-    clear_user_cache,
-    GEMINI_API_KEY
 )
-import google.generativeai as genai
-
-# تهيئة Gemini باستخدام المفتاح القادم من البيئة إن توفر
-try:
-    if GEMINI_API_KEY:
-        genai.configure(api_key=GEMINI_API_KEY)
-    else:
-        print("تحذير: GEMINI_API_KEY غير مضبوط في البيئة؛ بعض وظائف الذكاء قد تتعطل.")
-except Exception as e:
-    print(f"خطأ في تهيئة Gemini في views: {e}")
-
-# عدد النتائج في كل صفحة
-RESULTS_PER_PAGE = 5
+from .models import RecommendationJob
+from .singleflight import recommendation_flights, request_signature
+from . import lens_cache, cursor_pages, analysis_cache, deadlines, feed, metrics, near_duplicates, product_index, providers, rate_limits
+from .prompts import report as prompt_tokens_report
+from .profile_analysis import analyze_user_picture
+from .jobs import enqueue_recommendation_job, ensure_local_workers, get_active_job, get_job, job_status_payload
+from .pipeline import (
+    RESULTS_PER_PAGE,
+    iter_prompt_chains,
+    run_prompt_chains,
+    paginate_recommendations,
+    complete_in_background,
+    empty_page,
+)
 
 class UserRegistrationView(generics.CreateAPIView):
     queryset = CustomUser.objects.all()
@@ -53,38 +55,59 @@ class AnalyzeProfilePictureView(generics.GenericAPIView):
         if not user.profile_picture:
             return Response({"error": "Profile picture not found for this user"}, status=status.HTTP_400_BAD_REQUEST)
 
-        image_path = user.profile_picture.path
-        img = cv2.imread(image_path)
+        # التحليل يُحسب في الخلفية عند رفع الصورة ويُقدم من قاعدة البيانات؛
+        # إذا لم يكتمل بعد (أو لمستخدم قديم) يُحسب الآن ويُحفظ
+        analysis_results = user.picture_analysis or analyze_user_picture(user.id)
 
-        if img is None:
+        if analysis_results is None:
             return Response({"error": "Could not load image"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        pixels = np.float32(img.reshape(-1, 3))
-        n_colors = 1
-        criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 200, 0.1)
-        flags = cv2.KMEANS_RANDOM_CENTERS
-        _, labels, palette = cv2.kmeans(pixels, n_colors, None, criteria, 10, flags)
-        dominant_color_bgr = palette[0].astype(int)
-        dominant_color_rgb = dominant_color_bgr[::-1]
-
-        analysis_results = {
-            "dominant_color_rgb": dominant_color_rgb.tolist(),
-            "message": "Basic image analysis performed. More advanced AI analysis will be integrated later."
-        }
+        analysis_results = dict(analysis_results)
+        analysis_results["message"] = "Color palette and skin tone estimated from the profile picture."
 
         return Response(analysis_results, status=status.HTTP_200_OK)
 
 class GetAIRecommendationsView(generics.GenericAPIView):
     def get(self, request, *args, **kwargs):
         user_id = request.query_params.get("user_id")
+        job_id = request.query_params.get("job_id")
+        cursor = request.query_params.get("cursor")
         page = int(request.query_params.get("page", 1))
 
-        cached_data = get_cached_recommendations(user_id, page)
+        # متابعة تقدم مهمة توليد معينة
+        if job_id:
+            job = get_job(job_id, user_id)
+            if job is None:
+                return Response({"error": "Job not found"}, status=status.HTTP_404_NOT_FOUND)
+            payload = job_status_payload(job, page)
+            if payload["page_ready"]:
+                return Response(payload, status=status.HTTP_200_OK)
+            if job.status == RecommendationJob.STATUS_FAILED:
+                return Response(payload, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            ensure_local_workers()
+            return Response(payload, status=status.HTTP_202_ACCEPTED)
+
+        # التمرير عبر كل التوصيات المحفوظة (next_cursor من الصفحة السابقة)
+        if cursor:
+            try:
+                return Response(feed.get_page_after(user_id, cursor), status=status.HTTP_200_OK)
+            except ValueError:
+                return Response({"error": "Invalid cursor"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # أي صفحة من آخر تشغيل محفوظ، مهما كان قديمًا؛ القراءة لا تعيد التوليد
+        cached_data = feed.get_page(user_id, page)
         if cached_data:
             return Response(cached_data, status=status.HTTP_200_OK)
-        
-        # إذا لم يكن هناك بيانات مخزنة مؤقتًا، يمكننا إعادة توجيه الطلب إلى post() لإنشاء البيانات
-        # ولكن لتجنب التعقيد، سنعيد رسالة خطأ أو سنسمح للواجهة الأمامية بإرسال POST إذا لم تجد بيانات
+
+        # إذا كانت هناك مهمة جارية لهذا المستخدم نعيد حالتها بدلاً من 404
+        active_job = get_active_job(user_id) if user_id else None
+        if active_job:
+            payload = job_status_payload(active_job, page)
+            if payload["page_ready"]:
+                return Response(payload, status=status.HTTP_200_OK)
+            ensure_local_workers()
+            return Response(payload, status=status.HTTP_202_ACCEPTED)
+
         return Response({"error": "No cached recommendations found. Please trigger generation via POST request."}, status=status.HTTP_404_NOT_FOUND)
 
     def post(self, request, *args, **kwargs):
@@ -97,94 +120,160 @@ class GetAIRecommendationsView(generics.GenericAPIView):
         except CustomUser.DoesNotExist:
             return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
 
-        cached_data = get_cached_recommendations(user_id, page)
+        cached_data = feed.get_page(
+            user.id, page, signature=request_signature(user.id, location_info), fresh_for=feed.FEED_FRESH_FOR
+        )
         if cached_data:
             return Response(cached_data, status=status.HTTP_200_OK)
 
-        ai_response_str = analyze_user_and_generate_prompts(user, location_info)
-        if not ai_response_str:
-            return Response({"error": "Failed to get analysis from AI model."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        # التوليد يتم في الخلفية؛ الواجهة الأمامية تتابع التقدم عبر GET مع job_id
+        # الطلبات المتطابقة المتزامنة (إعادة المحاولة أو النقر المزدوج) تحصل على نفس المهمة
+        job_id = recommendation_flights.do(
+            request_signature(user.id, location_info),
+            lambda: enqueue_recommendation_job(user, location_info, request.build_absolute_uri("/")).id,
+        )
+        job = RecommendationJob.objects.get(id=job_id)
+        payload = job_status_payload(job, page)
+        payload["status_url"] = request.build_absolute_uri(f"?user_id={user.id}&job_id={job.id}&page={page}")
+        return Response(payload, status=status.HTTP_202_ACCEPTED)
+
+
+def _sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+_STREAM_END = object()
+
+
+async def _async_events(events):
+    """
+    يشغل مولد الأحداث المتزامن في خيط خاص ويعيده مولدًا غير متزامن. تحت ASGI يستهلك Django
+    المولد المتزامن بـ list() في خيط، فلا يصل أي حدث قبل انتهاء خط المعالجة كله؛ هنا يُرسل كل
+    حدث فور جاهزيته. المولد كله في خيط واحد لأن نطاقات الموعد والمستخدم (contextvars) تُفتح
+    وتُغلق داخله.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    stopped = threading.Event()
 
+    def put(item):
         try:
-            ai_response_json = json.loads(ai_response_str)
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+        except RuntimeError:
+            stopped.set() # حلقة الأحداث أُغلقت
+
+    def produce():
+        try:
+            for event in events:
+                if stopped.is_set():
+                    break
+                put(event)
+        except Exception as e:
+            print(f"خطأ في بث التوصيات: {e}")
+        finally:
+            events.close()
+            close_old_connections()
+            put(_STREAM_END)
+
+    context = contextvars.copy_context()
+    threading.Thread(target=context.run, args=(produce,), name="sse-stream", daemon=True).start()
+    try:
+        while (event := await queue.get()) is not _STREAM_END:
+            yield event
+    finally:
+        # انقطاع العميل: يتوقف الخيط عند الحدث التالي
+        stopped.set()
+
+
+class StreamRecommendationsView(View):
+    """
+    يبث التوصيات عبر Server-Sent Events فور انتهاء كل سلسلة (صورة ← Lens ← تنسيق).
+
+    GET فقط لأن EventSource في المتصفح لا يدعم غيره. المعامل mode يحدد وحدة البث:
+    post (افتراضي) لكل منشور على حدة، أو page لكل صفحة مكتملة من RESULTS_PER_PAGE منشورات.
+    View من Django وليس DRF لأن تفاوض المحتوى في DRF يرفض Accept: text/event-stream.
+    """
+
+    def get(self, request, *args, **kwargs):
+        user_id = request.GET.get("user_id")
+        location_info = request.GET.get("location", "Not provided")
+        mode = request.GET.get("mode", "post")
+
+        try:
+            user = CustomUser.objects.get(id=user_id)
+        except (CustomUser.DoesNotExist, ValueError):
+            return JsonResponse({"error": "User not found"}, status=404)
+
+        events = self._stream(request, user, location_info, mode)
+        if isinstance(request, ASGIRequest):
+            events = _async_events(events)
+        response = StreamingHttpResponse(events, content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no" # منع nginx من تجميع الاستجابة
+        return response
+
+    def _stream(self, request, user, location_info, mode):
+        # إذا كانت الصفحات محفوظة مسبقًا نبثها مباشرة دون إعادة التوليد
+        run = feed.latest_run(
+            user.id, signature=request_signature(user.id, location_info), fresh_for=feed.FEED_FRESH_FOR
+        )
+        if run:
+            pages = feed.run_pages(run)
+            yield _sse_event("analysis", {"user_analysis": run.user_analysis})
+            for page_data in pages:
+                if mode == "page":
+                    yield _sse_event("page", page_data)
+                else:
+                    for post in page_data["recommendations"]:
+                        yield _sse_event("post", post)
+            yield _sse_event("done", {"total_pages": len(pages), "cached": True})
+            return
+
+        with deadlines.deadline_scope() as deadline, rate_limits.user_scope(user.id):
+            yield from self._generate(request, user, location_info, mode, deadline)
+
+    def _generate(self, request, user, location_info, mode, deadline):
+        ai_response_str = analyze_user_and_generate_prompts(user, location_info)
+        try:
+            ai_response_json = json.loads(ai_response_str or "")
             user_analysis_text = ai_response_json.get("analysis", "")
             prompts = ai_response_json.get("prompts", [])
         except json.JSONDecodeError:
-            return Response({"error": "Failed to parse AI model response.", "raw_response": ai_response_str}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            yield _sse_event("error", {"error": "Failed to get analysis from AI model.", "raw_response": ai_response_str})
+            return
 
-        all_recommendations = []
+        yield _sse_event("analysis", {"user_analysis": user_analysis_text})
 
-        for prompt in prompts:
-            generated_image_urls = generate_image_from_prompt(prompt, request, count=3) # توليد 3 صور لكل وصف
-            
-            for generated_image_url in generated_image_urls:
-                # generated_image_url هو الآن الرابط العام الذي يمكن لـ SerpAPI الوصول إليه
-                shopping_results = search_products_by_image(generated_image_url, location_info)
-
-                if shopping_results:
-                    format_prompt = f"""
-                بناءً على تحليل المستخدم التالي: {user_analysis_text}
-                وهذه قائمة بمنتجات التسوق التي تم العثور عليها: {json.dumps(shopping_results, ensure_ascii=False)}
-                
-                قم بصياغة {RESULTS_PER_PAGE} منشورات جذابة على طراز انستغرام. لكل منشور:
-                - اختر منتجًا واحدًا من القائمة.
-                - اكتب تعليقًا قصيرًا ومقنعًا يوضح لماذا هذا المنتج مناسب للمستخدم، مع الإشارة إلى صفاته الشخصية (مثل لون البشرة، نوع الجسم، الأسلوب المفضل).
-                - يجب أن يتضمن المنشور رابط المنتج الأصلي (link) وصورة المنتج المصغرة (thumbnail).
-                - يجب أن تكون المخرجات بتنسيق JSON.
-                
-                مثال على المخرجات المطلوبة:
-                {{
-                    "posts": [
-                        {{
-                            "text": "وجدنا لك هذا! قميص أزرق أنيق من متجر X. قصته الضيقة ستبرز بنيتك الرياضية، ولونه يتناغم مع بشرتك. مثالي لإطلالة صيفية.",
-                            "product_link": "https://example.com/product1",
-                            "image_url": "https://example.com/thumb1.jpg"
-                        }}
-                    ]
-                }}
-                """
-                
-                format_model = genai.GenerativeModel("gemini-1.5-flash")
-                formatted_response = format_model.generate_content(format_prompt)
-                
-                try:
-                    cleaned_formatted_response = formatted_response.text.replace("```json", "").replace("```", "").strip()
-                    formatted_posts = json.loads(cleaned_formatted_response).get("posts", [])
-                    all_recommendations.extend(formatted_posts)
-                except json.JSONDecodeError as e:
-                    print(f"خطأ في تحليل استجابة Gemini لتنسيق المنشورات: {e}")
-                    all_recommendations.append({"error": "Failed to format posts", "raw_results": shopping_results})
-            else:
-                all_recommendations.append({"message": "No shopping results found for this image.", "prompt": prompt})
-
-        total_results = len(all_recommendations)
-        total_pages = (total_results + RESULTS_PER_PAGE - 1) // RESULTS_PER_PAGE
-
-        paginated_results = []
-        for i in range(total_pages):
-            start_index = i * RESULTS_PER_PAGE
-            end_index = min((i + 1) * RESULTS_PER_PAGE, total_results)
-            page_data = {
-                "user_analysis": user_analysis_text,
-                "recommendations": all_recommendations[start_index:end_index],
-                "current_page": i + 1,
-                "total_pages": total_pages,
-                "has_next_page": (i + 1) < total_pages
-            }
-            set_cached_recommendations(user_id, i + 1, page_data)
-            if (i + 1) == page:
-                paginated_results = page_data
-
-        if not paginated_results and page > total_pages:
-            return Response({
-                "user_analysis": user_analysis_text,
-                "recommendations": [],
-                "current_page": page,
-                "total_pages": total_pages,
-                "has_next_page": False
-            }, status=status.HTTP_200_OK)
-
-        return Response(paginated_results, status=status.HTTP_200_OK)
+        all_recommendations = []
+        next_page = 1
+        for _, entries in iter_prompt_chains(prompts, request, location_info, user_analysis_text, budget=user.budget):
+            for entry in entries:
+                all_recommendations.append(entry)
+                if mode != "page":
+                    yield _sse_event("post", entry)
+            while mode == "page" and len(all_recommendations) >= next_page * RESULTS_PER_PAGE:
+                start_index = (next_page - 1) * RESULTS_PER_PAGE
+                yield _sse_event("page", {
+                    "user_analysis": user_analysis_text,
+                    "recommendations": all_recommendations[start_index:start_index + RESULTS_PER_PAGE],
+                    "current_page": next_page,
+                })
+                next_page += 1
+
+        if deadline.partial:
+            # الصفحات الجزئية لا تُحفظ؛ مهمة خلفية تكمل التوليد وتحفظ النتائج الكاملة
+            pages = paginate_recommendations(user_analysis_text, all_recommendations, partial=True)
+            enqueue_recommendation_job(user, location_info, request.build_absolute_uri("/"))
+        else:
+            run = feed.store_run(
+                user.id, feed.KIND_RECOMMENDATIONS, request_signature(user.id, location_info),
+                location_info, user_analysis_text, all_recommendations,
+            )
+            pages = feed.paginate_run(run, all_recommendations)
+        if mode == "page" and next_page <= len(pages):
+            yield _sse_event("page", pages[next_page - 1])
+
+        yield _sse_event("done", {"total_pages": len(pages), "cached": False, "partial": deadline.partial})
 
 
 class AdvancedSearchView(generics.GenericAPIView):
@@ -199,95 +288,118 @@ class AdvancedSearchView(generics.GenericAPIView):
         except CustomUser.DoesNotExist:
             return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
 
-        cache_key_suffix = f"advanced_search_{hash(json.dumps(search_filters, sort_keys=True))}"
-        cached_data = get_cached_recommendations(user_id, f"{cache_key_suffix}_{page}")
+        signature = request_signature(user.id, location_info, search_filters)
+        cached_data = feed.get_page(
+            user.id, page, kind=feed.KIND_ADVANCED, signature=signature, fresh_for=feed.FEED_FRESH_FOR
+        )
         if cached_data:
             return Response(cached_data, status=status.HTTP_200_OK)
 
-        from .ai_services import analyze_user_and_generate_advanced_prompts
-        ai_response_str = analyze_user_and_generate_advanced_prompts(user, location_info, search_filters)
-        if not ai_response_str:
-            return Response({"error": "Failed to get analysis from AI model for advanced search."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        def generate():
+            with deadlines.deadline_scope() as deadline, rate_limits.user_scope(user.id):
+                return generate_within(deadline)
+
+        def generate_within(deadline):
+            from .ai_services import analyze_user_and_generate_advanced_prompts
+            ai_response_str = analyze_user_and_generate_advanced_prompts(user, location_info, search_filters)
+            if not ai_response_str:
+                return {"body": {"error": "Failed to get analysis from AI model for advanced search."}, "status": status.HTTP_500_INTERNAL_SERVER_ERROR}
+
+            try:
+                ai_response_json = json.loads(ai_response_str)
+                user_analysis_text = ai_response_json.get("analysis", "")
+                prompts = ai_response_json.get("prompts", [])
+            except json.JSONDecodeError:
+                return {"body": {"error": "Failed to parse AI model response for advanced search.", "raw_response": ai_response_str}, "status": status.HTTP_500_INTERNAL_SERVER_ERROR}
+
+            # تنفيذ سلاسل (صورة ← Lens) بالتوازي، ثم ترتيب المنتجات وتنسيقها دفعة واحدة
+            budget = search_filters.get("budget") or user.budget
+            all_recommendations = run_prompt_chains(prompts, request, location_info, user_analysis_text, search_filters, budget)
+
+            def store_results(recommendations):
+                return feed.store_run(
+                    user.id, feed.KIND_ADVANCED, signature, location_info, user_analysis_text,
+                    recommendations, search_filters,
+                )
+
+            if deadline.partial:
+                # النتائج الجزئية لا تُحفظ؛ تكتمل السلاسل في الخلفية وتُحفظ النتائج الكاملة
+                pages = paginate_recommendations(user_analysis_text, all_recommendations, partial=True)
+                complete_in_background(
+                    prompts, request.build_absolute_uri("/"), location_info, user_analysis_text,
+                    store_results, search_filters, budget,
+                )
+            else:
+                pages = feed.paginate_run(store_results(all_recommendations), all_recommendations)
+            return {"user_analysis": user_analysis_text, "pages": pages}
 
-        try:
-            ai_response_json = json.loads(ai_response_str)
-            user_analysis_text = ai_response_json.get("analysis", "")
-            prompts = ai_response_json.get("prompts", [])
-        except json.JSONDecodeError:
-            return Response({"error": "Failed to parse AI model response for advanced search.", "raw_response": ai_response_str}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        # الطلبات المتطابقة المتزامنة تنتظر نفس التنفيذ بدلاً من تكرار استدعاءات Gemini و SerpApi
+        result = recommendation_flights.do(signature, generate)
+        if "body" in result:
+            return Response(result["body"], status=result["status"])
 
-        all_recommendations = []
+        pages = result["pages"]
+        if page > len(pages) or page < 1:
+            return Response(empty_page(result["user_analysis"], page, len(pages)), status=status.HTTP_200_OK)
+
+        return Response(pages[page - 1], status=status.HTTP_200_OK)
+
+
+class CursorRecommendationsView(generics.GenericAPIView):
+    """
+    توليد التوصيات صفحة بصفحة: بدون cursor تُعاد الصفحة الأولى، ومع cursor (من next_cursor
+    في الاستجابة السابقة) تُولد الصفحة التالية فقط.
+    """
+
+    def post(self, request, *args, **kwargs):
+        user_id = request.data.get("user_id")
+        location_info = request.data.get("location", "Not provided")
+        cursor = request.data.get("cursor")
 
-        for prompt in prompts:
-            generated_image_urls = generate_image_from_prompt(prompt, request, count=3) # توليد 3 صور لكل وصف
-            
-            for generated_image_url in generated_image_urls:
-                # generated_image_url هو الآن الرابط العام الذي يمكن لـ SerpAPI الوصول إليه
-                shopping_results = search_products_by_image(generated_image_url, location_info)
-
-                if shopping_results:
-                    format_prompt = f"""
-                بناءً على تحليل المستخدم التالي: {user_analysis_text}
-                وفلاتر البحث المحددة: {json.dumps(search_filters, ensure_ascii=False)}
-                وهذه قائمة بمنتجات التسوق التي تم العثور عليها: {json.dumps(shopping_results, ensure_ascii=False)}
-                
-                قم بصياغة {RESULTS_PER_PAGE} منشورات جذابة على طراز انستغرام. لكل منشور:
-                - اختر منتجًا واحدًا من القائمة.
-                - اكتب تعليقًا قصيرًا ومقنعًا يوضح لماذا هذا المنتج مناسب للمستخدم، مع الإشارة إلى صفاته الشخصية (مثل لون البشرة، نوع الجسم، الأسلوب المفضل) والفلاتر التي اختارها.
-                - يجب أن يتضمن المنشور رابط المنتج الأصلي (link) وصورة المنتج المصغرة (thumbnail).
-                - يجب أن تكون المخرجات بتنسيق JSON.
-                
-                مثال على المخرجات المطلوبة:
-                {{
-                    "posts": [
-                        {{
-                            "text": "وجدنا لك هذا! قميص أزرق أنيق من متجر X. قصته الضيقة ستبرز بنيتك الرياضية، ولونه يتناغم مع بشرتك. مثالي لإطلالة صيفية.",
-                            "product_link": "https://example.com/product1",
-                            "image_url": "https://example.com/thumb1.jpg"
-                        }}
-                    ]
-                }}
-                """
-                
-                format_model = genai.GenerativeModel("gemini-1.5-flash")
-                formatted_response = format_model.generate_content(format_prompt)
-                
-                try:
-                    cleaned_formatted_response = formatted_response.text.replace("```json", "").replace("```", "").strip()
-                    formatted_posts = json.loads(cleaned_formatted_response).get("posts", [])
-                    all_recommendations.extend(formatted_posts)
-                except json.JSONDecodeError as e:
-                    print(f"خطأ في تحليل استجابة Gemini لتنسيق المنشورات للبحث المتقدم: {e}")
-                    all_recommendations.append({"error": "Failed to format posts", "raw_results": shopping_results})
+        try:
+            user = CustomUser.objects.get(id=user_id)
+        except CustomUser.DoesNotExist:
+            return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            if cursor:
+                result = cursor_pages.next_page(user, cursor, request)
             else:
-                all_recommendations.append({"message": "No shopping results found for this image.", "prompt": prompt})
-
-        total_results = len(all_recommendations)
-        total_pages = (total_results + RESULTS_PER_PAGE - 1) // RESULTS_PER_PAGE
-
-        paginated_results = []
-        for i in range(total_pages):
-            start_index = i * RESULTS_PER_PAGE
-            end_index = min((i + 1) * RESULTS_PER_PAGE, total_results)
-            page_data = {
-                "user_analysis": user_analysis_text,
-                "recommendations": all_recommendations[start_index:end_index],
-                "current_page": i + 1,
-                "total_pages": total_pages,
-                "has_next_page": (i + 1) < total_pages
-            }
-            set_cached_recommendations(user_id, f"{cache_key_suffix}_{i + 1}", page_data)
-            if (i + 1) == page:
-                paginated_results = page_data
-
-        if not paginated_results and page > total_pages:
-            return Response({
-                "user_analysis": user_analysis_text,
-                "recommendations": [],
-                "current_page": page,
-                "total_pages": total_pages,
-                "has_next_page": False
-            }, status=status.HTTP_200_OK)
-
-        return Response(paginated_results, status=status.HTTP_200_OK)
+                result = cursor_pages.first_page(user, location_info, request)
+        except cursor_pages.CursorError as e:
+            return Response({"error": str(e)}, status=status.HTTP_410_GONE)
 
+        if "body" in result:
+            return Response(result["body"], status=result["status"])
+        return Response(result, status=status.HTTP_200_OK)
+
+
+class PipelineStatsView(generics.GenericAPIView):
+    """
+    عدادات داخلية لعملية الخادم الحالية (كل عامل gunicorn له عداداته الخاصة).
+    """
+
+    def get(self, request, *args, **kwargs):
+        return Response({
+            "recommendations_cache": recommendations_cache_stats(),
+            "single_flight": recommendation_flights.stats(),
+            "generated_images": generated_image_store.stats(),
+            "lens_cache": dict(lens_cache.stats),
+            "near_duplicates": near_duplicates.index_stats(),
+            "product_index": dict(product_index.stats),
+            "prompt_tokens": prompt_tokens_report(),
+            "analysis_cache": dict(analysis_cache.stats),
+            "deadlines": dict(deadlines.stats),
+            "providers": providers.stats(),
+            "rate_limits": rate_limits.stats(),
+        }, status=status.HTTP_200_OK)
+
+
+class MetricsView(View):
+    """
+    مقاييس خط المعالجة بصيغة Prometheus النصية، مجمعة من كل العمال (انظر metrics.py).
+    View من Django وليس DRF لأن الاستجابة نص وليست JSON.
+    """
+
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")